@@ -7,109 +7,234 @@ import re
 import numpy as np
 
 from distdrop.client.client_api import ClientCNNAutoSplitter
+from distdrop.client.messages import INIT_DISTRIBUTION_ZERO, INIT_DISTRIBUTION_UNIFORM, INIT_DISTRIBUTION_FANIN_NORMAL
+from distdrop.client.param_digest import compute_param_digest, param_digests_match
 
 def usage():
-    print "python auto_init_server_params.py --server=127.0.0.1 --port=8200 --W_range=0.1 --b_range=0.1 --want_zero_momentum --use_fanin"
+    print "python auto_init_server_params.py --server=127.0.0.1 --port=8200 --W_range=0.1 --b_range=0.1 --want_zero_momentum --use_fanin [--seed=1234]"
+    print ""
+    print "The server generates the values itself from the seed (see MSG_TYPE_INIT_PARAM),"
+    print "so only one small message goes out for every parameter."
+    print "Without `seed`, we pick one at random and print it."
+    print ""
+    print "With --client_side_init, we generate the values with numpy instead and push them,"
+    print "like before. Add --streams=4 to spread that over 4 connections."
+    print "--streams only goes with --client_side_init."
+    print ""
+    print "Either way, we check the parameters with MSG_TYPE_PARAM_DIGEST afterwards,"
+    print "instead of pulling them back : that they have no NaN and the right number"
+    print "of elements, and with --client_side_init, that they have the md5 of what we pushed."
+
+
+def get_init_distribution(param, W_range, b_range, want_zero_momentum, use_fanin):
+
+    # Returns (distribution, scale) for MSG_TYPE_INIT_PARAM.
+
+    name = param['name']
+
+    if param['kind'] in ['CONV_FILTER_WEIGHTS', 'FULLY_CONNECTED_WEIGHTS']:
+        scale = W_range
+    elif param['kind'] in ['CONV_FILTER_BIASES', 'FULLY_CONNECTED_BIASES']:
+        scale = b_range
+    else:
+        raise Exception("You got a parameter %s with an invalid kind : %s" % (name, param['kind']))
+
+    if (re.match(r".*momentum", name) or 
+        re.match(r".*decay", name) or 
+        re.match(r".*ssq", name) or 
+        re.match(r".*mean", name) or 
+        re.match(r".*var", name) or 
+        re.match(r".*tm1", name) or 
+        re.match(r".*xtm1", name)) and want_zero_momentum:
+        #print "momentum detected %s and want zero momentum" % name
+        return (INIT_DISTRIBUTION_ZERO, 0.0)
+
+    if use_fanin and param['kind'] in ['CONV_FILTER_WEIGHTS', 'FULLY_CONNECTED_WEIGHTS']:
+        return (INIT_DISTRIBUTION_FANIN_NORMAL, scale)
+    else:
+        return (INIT_DISTRIBUTION_UNIFORM, scale)
+
+
+def make_initial_value(param, W_range, b_range, want_zero_momentum, use_fanin):
+
+    # The same distributions as `get_init_distribution`, with `np.random`.
+
+    (distribution, scale) = get_init_distribution(param, W_range, b_range, want_zero_momentum, use_fanin)
+
+    shape = param['shape']
+    assert len(shape) == 4
+
+    if distribution == INIT_DISTRIBUTION_ZERO:
+        # and not `0.0 * rand`, which has some -0.0 that the server turns into 0.0
+        updated_value = np.zeros(shape, dtype=np.float32)
+
+    elif distribution == INIT_DISTRIBUTION_FANIN_NORMAL:
 
+        # in this particular case, we override only if we're dealing with a weight (not a bias)
+        # and we use a normal distribution instead of a uniform(-1,1)
 
-def run(server, port, W_range, b_range, want_zero_momentum, use_fanin):
+        if param['kind'] == 'CONV_FILTER_WEIGHTS':
+            std = np.sqrt(2.0/shape[1])
+        elif param['kind'] == 'FULLY_CONNECTED_WEIGHTS':
+            std = np.sqrt(2.0/shape[0])
+        else:
+            raise Exception("BUG !? % s" % param['kind'])
+
+        updated_value = (scale * std * (np.random.randn(*shape))).astype(np.float32)
+
+    else:
+        updated_value = (scale * (np.random.rand(*shape)*2.0 - 1.0)).astype(np.float32)
+
+    return updated_value
+
+
+def run_striped(client, L_params, W_range, b_range, want_zero_momentum, use_fanin):
+
+    # Everything goes out at once, spread over the streams of the client.
+    # We need to hold all the parameters in memory for that.
+
+    D_updated_values = dict((param['name'], make_initial_value(param, W_range, b_range, want_zero_momentum, use_fanin))
+                            for param in L_params)
+
+    tic = time.time()
+    client.push_entire_params(D_updated_values, 0.0, 1.0)
+    toc = time.time()
+    total_time_push = toc - tic
+
+    tic = time.time()
+    D_digests = client.get_param_digests(D_updated_values.keys())
+    toc = time.time()
+    total_time_digest = toc - tic
+
+    for (name, updated_value) in D_updated_values.items():
+        assert D_digests[name]['nbr_nan'] == 0, "The server parameter %s contains NaN values." % name
+        assert param_digests_match(compute_param_digest(updated_value), D_digests[name]), "This is a very bad sign, but it can also happen purely because of a race condition so it's not necessarily bad. Re-run the command again."
+
+    print "================================"
+    print ""
+    print "total time spent : %d msec push, %d msec digest" % (int(total_time_push * 1000),
+                                                               int(total_time_digest * 1000))
+    print ""
+    for (i, stream_stats) in enumerate(client.get_stream_stats()):
+        print "stream %d : %d bytes pushed, %d bytes pulled, %0.2f MB/s" % (i,
+                                                                           stream_stats['nbr_bytes_pushed'],
+                                                                           stream_stats['nbr_bytes_pulled'],
+                                                                           stream_stats['MB_per_sec'])
+    print ""
+
+
+def run_server_side(server, port, W_range, b_range, want_zero_momentum, use_fanin, seed=None):
+
+    if seed is None:
+        seed = np.random.randint(0, 2**31 - 1)
+        print "Using seed %d." % seed
 
     client = ClientCNNAutoSplitter.new_basic_alpha_beta(server, port, 0.0, 1.0)
 
     client.connect()
     L_params = client.read_param_desc_from_server()
 
-    # and then you proceed to reset all the parameters to some
-    # random initial values
+    total_time = 0.0
+    total_bytes = 0
 
-    total_time_push = 0.0
-    total_time_pull = 0.0
+    for (k, param) in enumerate(L_params):
+
+        name = param['name']
+        (distribution, scale) = get_init_distribution(param, W_range, b_range, want_zero_momentum, use_fanin)
 
-    total_bytes_pull = 0
+        # One seed per parameter, so that the same `seed` gives the
+        # same values no matter what the other parameters are doing.
+        tic = time.time()
+        client.init_param_seeded(name, distribution, scale, seed + k)
+        toc = time.time()
+
+        current_bytes = 4 * np.prod(param['shape'])
+        total_time = total_time + toc - tic
+        total_bytes = total_bytes + current_bytes
+
+        print "param %s initialized. %d bytes, %d msec" % (name, current_bytes, int((toc - tic) * 1000))
 
+    # We don't have the values to compare the md5 with,
+    # so this only catches the NaN and the wrong sizes.
+    D_digests = client.get_param_digests([param['name'] for param in L_params])
     for param in L_params:
+        digest = D_digests[param['name']]
+        assert digest['nbr_nan'] == 0, "The server parameter %s contains NaN values." % param['name']
+        assert digest['nbr_elements'] == np.prod(param['shape'])
 
-        current_time_push = 0.0
-        current_time_pull = 0.0
+    print "================================"
+    print ""
+    print "total time spent : %d msec for %d bytes" % (int(total_time * 1000), total_bytes)
+    print ""
 
-        name = param['name']
+    client.quit()
+    client.close()
 
-        if param['kind'] in ['CONV_FILTER_WEIGHTS', 'FULLY_CONNECTED_WEIGHTS']:
-            scale = W_range
-        elif param['kind'] in ['CONV_FILTER_BIASES', 'FULLY_CONNECTED_BIASES']:
-            scale = b_range
-        else:
-            raise Exception("You got a parameter %s with an invalid kind : %s" % (name, param['kind']))
 
-        if (re.match(r".*momentum", name) or 
-            re.match(r".*decay", name) or 
-            re.match(r".*ssq", name) or 
-            re.match(r".*mean", name) or 
-            re.match(r".*var", name) or 
-            re.match(r".*tm1", name) or 
-            re.match(r".*xtm1", name)) and want_zero_momentum:
-            #print "momentum detected %s and want zero momentum" % name
-            scale = 0.0
-        
-        shape = param['shape']
-        assert len(shape) == 4
+def run(server, port, W_range, b_range, want_zero_momentum, use_fanin, nbr_streams=1):
+
+    # The values are made here and pushed. Then we check that the server
+    # has their md5, with MSG_TYPE_PARAM_DIGEST, instead of pulling them back.
 
+    client = ClientCNNAutoSplitter.new_basic_alpha_beta(server, port, 0.0, 1.0, nbr_streams=nbr_streams)
 
+    client.connect()
+    L_params = client.read_param_desc_from_server()
 
-        if use_fanin and param['kind'] in ['CONV_FILTER_WEIGHTS', 'FULLY_CONNECTED_WEIGHTS']:
+    if 1 < nbr_streams:
+        run_striped(client, L_params, W_range, b_range, want_zero_momentum, use_fanin)
+        client.quit()
+        client.close()
+        return
 
-            # in this particular case, we override only if we're dealing with a weight (not a bias)
-            # and we use a normal distribution instead of a uniform(-1,1)
+    # and then you proceed to reset all the parameters to some
+    # random initial values
 
-            if param['kind'] == 'CONV_FILTER_WEIGHTS':
-                std = np.sqrt(2.0/shape[1])
-            elif param['kind'] == 'FULLY_CONNECTED_WEIGHTS':
-                std = np.sqrt(2.0/shape[0])
-            else:
-                raise Exception("BUG !? % s" % param['kind'])
+    total_time_push = 0.0
+    total_time_digest = 0.0
 
-            updated_value = (scale * std * (np.random.randn(*shape))).astype(np.float32)
+    total_bytes_push = 0
 
-        else:
-            updated_value = (scale * (np.random.rand(*shape)*2.0 - 1.0)).astype(np.float32)
+    for param in L_params:
 
+        name = param['name']
 
+        updated_value = make_initial_value(param, W_range, b_range, want_zero_momentum, use_fanin)
 
         tic = time.time()
         client.push_entire_param(name, updated_value, 0.0, 1.0)
         toc = time.time()
-        current_time_push = current_time_push + toc - tic
+        current_time_push = toc - tic
 
         #print "updating %s" % name
         #time.sleep(1)
 
+        # The server only sends back the md5 and a few statistics of what it has.
         tic = time.time()
-        read_value = client.pull_entire_param(name)
+        digest = client.get_param_digests([name])[name]
         toc = time.time()
-        current_time_pull = current_time_pull + toc - tic
+        current_time_digest = toc - tic
 
-        assert not np.any(np.isnan(read_value)), "The server parameter %s contains NaN values. Unfortunately, it won't recognize your attempt at updating its value with (alpha=0.0,beta=1.0) and you will still have NaN after the arithmetic operation on NaNs." % name
+        assert digest['nbr_nan'] == 0, "The server parameter %s contains NaN values. Unfortunately, it won't recognize your attempt at updating its value with (alpha=0.0,beta=1.0) and you will still have NaN after the arithmetic operation on NaNs." % name
 
-        assert np.max(np.abs(read_value - updated_value)) < 1e-8, "This is a very bad sign, but it can also happen purely because of a race condition so it's not necessarily bad. Re-run the command again."
+        assert param_digests_match(compute_param_digest(updated_value), digest), "This is a very bad sign, but it can also happen purely because of a race condition so it's not necessarily bad. Re-run the command again."
 
-        current_bytes_pull = 4 * np.prod(updated_value.shape)
+        current_bytes_push = 4 * np.prod(updated_value.shape)
 
         total_time_push = total_time_push + current_time_push
-        total_time_pull = total_time_pull + current_time_pull
+        total_time_digest = total_time_digest + current_time_digest
 
-        total_bytes_pull = total_bytes_pull + current_bytes_pull
+        total_bytes_push = total_bytes_push + current_bytes_push
 
-        print "param %s updated. %d bytes, %d msec push, %d msec pull" % (name,
-                                                                          current_bytes_pull,
-                                                                          int(current_time_push * 1000),
-                                                                          int(current_time_pull * 1000))
+        print "param %s updated. %d bytes, %d msec push, %d msec digest" % (name,
+                                                                            current_bytes_push,
+                                                                            int(current_time_push * 1000),
+                                                                            int(current_time_digest * 1000))
 
     print "================================"
     print ""
-    print "total time spent : %d msec push, %d msec pull" % (int(total_time_push * 1000),
-                                                             int(total_time_pull * 1000))
-    print ""
-    print "average %0.2f MB/s pull" % ((1.0 * total_bytes_pull / 1000 / 1000) / total_time_pull,)
+    print "total time spent : %d msec push, %d msec digest" % (int(total_time_push * 1000),
+                                                               int(total_time_digest * 1000))
     print ""
 
     client.quit()
@@ -123,7 +248,8 @@ def main(argv):
     try:
         opts, args = getopt.getopt(sys.argv[1:], "hv", ["server=", "port=",
                                                         "W_range=", "b_range=",
-                                                        "want_zero_momentum", "use_fanin"])
+                                                        "want_zero_momentum", "use_fanin",
+                                                        "streams=", "seed=", "client_side_init"])
     except getopt.GetoptError as err:
         # print help information and exit:
         print str(err) # will print something like "option -a not recognized"
@@ -136,6 +262,9 @@ def main(argv):
     b_range = 1.0
     want_zero_momentum = False
     use_fanin = False
+    nbr_streams = 1
+    seed = None
+    client_side_init = False
 
     verbose = False
     for o, a in opts:
@@ -156,12 +285,28 @@ def main(argv):
             want_zero_momentum = True
         elif o in ("--use_fanin"):
             use_fanin = True
+        elif o in ("--streams"):
+            nbr_streams = int(a)
+        elif o in ("--seed"):
+            seed = int(a)
+        elif o in ("--client_side_init"):
+            client_side_init = True
         else:
             assert False, "unhandled option"
 
     assert port
 
-    run(server, port, W_range, b_range, want_zero_momentum, use_fanin)
+    if 1 < nbr_streams and not client_side_init:
+        # The server initializes the parameters itself, from messages too small
+        # to gain anything from more connections.
+        print "--streams only goes with --client_side_init."
+        usage()
+        sys.exit(2)
+
+    if client_side_init:
+        run(server, port, W_range, b_range, want_zero_momentum, use_fanin, nbr_streams)
+    else:
+        run_server_side(server, port, W_range, b_range, want_zero_momentum, use_fanin, seed)
 
 
 if __name__ == "__main__":
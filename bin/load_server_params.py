@@ -1,27 +1,73 @@
-
 import sys, os
 import getopt
-import pickle
-import sets
+import time
 
 import numpy as np
 
-from distdrop.client.client_api import ClientCNNAutoSplitter
+from distdrop.client.client_api import Client
+from distdrop.client.messages import DTYPE_FLOAT32
+from distdrop.client.checkpoint import open_saved_params, get_row_blocks
+from distdrop.client.checkpoint import run_block_jobs, get_slice_args
+from distdrop.client.param_digest import ParamDigestAccumulator, param_digests_match
 
 def usage():
-    print "python load_server_params.py --server=127.0.0.1 --port=8200 --load_path='D_params.pkl'"
+    print "python load_server_params.py --server=127.0.0.1 --port=8200 --load_path='D_params.pkl' [--format=pkl] [--streams=4] [--max_block_bytes=67108864] [--no_verify]"
+    print ""
+    print "The `load_path` can be anything written by save_server_params.py :"
+    print "a directory of .npy files, a .npz, a .h5/.hdf5 or a .pkl."
+    print "Except for the .pkl, the files are memory-mapped (or read by blocks for hdf5),"
+    print "and pushed in blocks of rows of at most `max_block_bytes`, over `streams` connections at once."
+    print ""
+    print "Afterwards, we compare the md5 of every parameter on the server (MSG_TYPE_PARAM_DIGEST)"
+    print "with the one of the file, unless --no_verify. Only the digests go over the network."
+
+
+def without_negative_zeros(value):
+    # We push with (alpha, beta) = (0.0, 1.0), so the server stores `0.0*old + value`,
+    # where -0.0 stays -0.0 only if the old value was negative. With +0.0 instead,
+    # the server stores exactly what we push, and we know what md5 to expect.
+    # Only the blocks that have a -0.0 get copied.
+    if np.any(np.signbit(value[value == 0.0])):
+        return value + np.float32(0.0)
+    return value
+
+
+def verify(server, port, D_params, L_param_desc, max_block_bytes):
+
+    # We go through the file again block by block, so that we never hold
+    # more than one block, like when we pushed.
+    D_expected = {}
+    for param_desc in L_param_desc:
+        name = param_desc['name']
+        accumulator = ParamDigestAccumulator()
+        for (row_start, row_stop) in get_row_blocks(param_desc['shape'], max_block_bytes):
+            # what we pushed
+            accumulator.update(without_negative_zeros(np.asarray(D_params.read_rows(name, row_start, row_stop), dtype=np.float32)))
+        D_expected[name] = accumulator.digest()
+
+    client = Client(server, port)
+    client.connect()
+    D_digests = client.get_param_digests(D_expected.keys())
+    client.quit()
+    client.close()
 
+    L_mismatched = [name for (name, expected) in D_expected.items()
+                    if not param_digests_match(expected, D_digests[name])]
+    for name in L_mismatched:
+        print "The server does not have the values of the file for parameter %s." % name
+    assert len(L_mismatched) == 0, "Failed to verify %d parameters. Maybe some client was training at the same time ?" % len(L_mismatched)
+    print "Verified the md5 of %d parameters." % len(D_expected)
 
-def run(server, port, load_path):
 
-    client = ClientCNNAutoSplitter.new_basic_alpha_beta(server, port, 0.0, 1.0)
+def run(server, port, load_path, format=None, nbr_streams=4, max_block_bytes=64*1024*1024, want_verify=True):
 
+    client = Client(server, port)
     client.connect()
     L_param_desc = client.read_param_desc_from_server()
+    client.quit()
+    client.close()
 
-    # late on we might want to add support for hdf5,
-    # but currently we'll work only with pickle files
-    D_params = pickle.load(open(load_path, "r"))
+    D_params = open_saved_params(load_path, format)
     print "Loaded %s." % load_path
 
     # Before we commit stuff to the server, we'll make pretty damn sure
@@ -34,24 +80,48 @@ def run(server, port, load_path):
         print "The server has parameter %s that D_params does not have." % e
     assert A == B
 
-
     for param_desc in L_param_desc:
-
         name = param_desc['name']
         shape = param_desc['shape']
-        assert D_params.has_key(name), "Server has parameter %s but the load_path %s does not contain a value for this parameter." % (name, load_path)
-        assert tuple(D_params[name].shape) == tuple(shape), "Loaded parameter %s from file. It has shape %s, but the server says that it should have shape %s." % (name, D_params[name].shape, shape)
+        assert tuple(D_params.get_shape(name)) == tuple(shape), "Loaded parameter %s from file. It has shape %s, but the server says that it should have shape %s." % (name, D_params.get_shape(name), shape)
+
+    D_param_desc = dict((param_desc['name'], param_desc) for param_desc in L_param_desc)
+
+    def push_block(client, name, row_start, row_stop):
+        shape = D_param_desc[name]['shape']
+        (S, D, indices) = get_slice_args(shape, row_start, row_stop)
+
+        # No copy when the file already has contiguous float32 values,
+        # and then `value` is read from the disk while it's being sent.
+        value = np.ascontiguousarray(D_params.read_rows(name, row_start, row_stop), dtype=np.float32)
+
+        assert not np.any(np.isnan(value)), "The saved parameter %s contains NaN values." % name
+        value = without_negative_zeros(value)
 
-        assert not np.any(np.isnan(D_params[name])), "The saved parameter %s contains NaN values." % name
+        client.update_param_slice_to_server(value, 0.0, 1.0, name, S, D, indices, DTYPE_FLOAT32)
+        return value.nbytes
 
-        client.push_entire_param(name, D_params[name], 0.0, 1.0)
+    def param_done(name):
+        # one write per line, so the lines of the streams don't get mixed
+        sys.stdout.write("Pushed %s of shape %s.\n" % (name, str(D_param_desc[name]['shape'])))
 
-        print "Pushed %s of shape %s." % (name, str(param_desc['shape']))
+    L_blocks = []
+    for param_desc in sorted(L_param_desc, key=lambda e: -np.prod(e['shape'])):
+        for (row_start, row_stop) in get_row_blocks(param_desc['shape'], max_block_bytes):
+            L_blocks.append((param_desc['name'], row_start, row_stop))
+
+    tic = time.time()
+    total_bytes = run_block_jobs(server, port, nbr_streams, L_blocks, push_block, param_done)
+    toc = time.time()
 
     print "================================"
+    print "Pushed %d bytes in %d msec, %0.2f MB/s." % (total_bytes, int((toc - tic) * 1000),
+                                                       (1.0 * total_bytes / 1000 / 1000) / max(toc - tic, 1e-6))
 
-    client.quit()
-    client.close()
+    # `run_block_jobs` waits for the server to be done with the pushes of every stream.
+    if want_verify:
+        verify(server, port, D_params, L_param_desc, max_block_bytes)
+    D_params.close()
 
 
 def main(argv):
@@ -59,7 +129,9 @@ def main(argv):
     """
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hv", ["server=", "port=", "load_path="])
+        opts, args = getopt.getopt(sys.argv[1:], "hv", ["server=", "port=", "load_path=",
+                                                        "format=", "streams=", "max_block_bytes=",
+                                                        "no_verify"])
                                                         
     except getopt.GetoptError as err:
         # print help information and exit:
@@ -70,6 +142,10 @@ def main(argv):
     server = "127.0.0.1"
     port = None
     load_path = None
+    format = None
+    nbr_streams = 4
+    max_block_bytes = 64*1024*1024
+    want_verify = True
 
     verbose = False
     for o, a in opts:
@@ -84,14 +160,21 @@ def main(argv):
             port = int(a)
         elif o in ("--load_path"):
             load_path = a
+        elif o in ("--format"):
+            format = a
+        elif o in ("--streams"):
+            nbr_streams = int(a)
+        elif o in ("--max_block_bytes"):
+            max_block_bytes = int(a)
+        elif o in ("--no_verify"):
+            want_verify = False
         else:
             assert False, "unhandled option"
 
     assert port
 
-    run(server, port, load_path)
+    run(server, port, load_path, format, nbr_streams, max_block_bytes, want_verify)
 
 
 if __name__ == "__main__":
     main(sys.argv)
-
@@ -0,0 +1,71 @@
+import sys
+import getopt
+
+from distdrop.server.param_server import ParamServer
+
+def usage():
+    print "python run_python_server.py --port=5000 --model_params_desc=server/config_examples/simple_params_desc.json [--model_params_data_input=params.hdf5] [--max_nbr_clients=300] [-v]"
+    print ""
+    print "Same options as the C server, for when it's not built."
+
+
+def main(argv):
+    """
+    """
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hvi:d:", ["port=", "max_nbr_clients=",
+                                                            "model_params_data_input=",
+                                                            "model_params_desc="])
+    except getopt.GetoptError as err:
+        # print help information and exit:
+        print str(err) # will print something like "option -a not recognized"
+        usage()
+        sys.exit(2)
+
+    port = None
+    max_nbr_clients = 300
+    model_params_data_input = None
+    model_params_desc = None
+
+    verbose = False
+    for o, a in opts:
+        if o == "-v":
+            verbose = True
+        elif o in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif o == "--port":
+            port = int(a)
+        elif o == "--max_nbr_clients":
+            max_nbr_clients = int(a)
+        elif o in ("-i", "--model_params_data_input"):
+            model_params_data_input = a
+        elif o in ("-d", "--model_params_desc"):
+            model_params_desc = a
+        else:
+            assert False, "unhandled option"
+
+    if model_params_desc is None:
+        print "Fatal error : Missing `model_params_desc` argument."
+        print "              We cannot start the server without a JSON file describing the model parameters."
+        sys.exit(1)
+
+    if port is None or port < 1024 or 65535 <= port:
+        print "Fatal error : Requires a port number between 1024 and 65535."
+        sys.exit(1)
+
+    if model_params_data_input is None:
+        print "Notice : Missing `model_params_data_input` argument."
+        print "         Will initialize the server parameters with zeros."
+
+    server = ParamServer.from_json_file(model_params_desc, port,
+                                        model_params_data_input=model_params_data_input,
+                                        max_nbr_clients=max_nbr_clients,
+                                        verbose=verbose)
+    print "Listening on port %d." % server.port
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
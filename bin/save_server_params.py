@@ -1,43 +1,83 @@
 
 import sys, os
 import getopt
-import pickle
+import time
 
 import numpy as np
 
-from distdrop.client.client_api import ClientCNNAutoSplitter
+from distdrop.client.client_api import Client
+from distdrop.client.messages import DTYPE_FLOAT32
+from distdrop.client.checkpoint import writer_class_dict, get_format_from_path, get_row_blocks
+from distdrop.client.checkpoint import run_block_jobs, get_slice_args
 
 def usage():
-    print "python save_server_params.py --server=127.0.0.1 --port=8200 --save_path='D_params.pkl'"
-
-
-def run(server, port, save_path):
-
-    client = ClientCNNAutoSplitter.new_basic_alpha_beta(server, port, 0.0, 1.0)
-
+    print "python save_server_params.py --server=127.0.0.1 --port=8200 --save_path=params_dir [--format=npy] [--streams=4] [--max_block_bytes=67108864]"
+    print ""
+    print "The formats are"
+    print "    npy  : a directory with one .npy file per parameter, and params_desc.json"
+    print "    npz  : the same files in a single .npz archive, for np.load"
+    print "    hdf5 : one dataset per parameter in the group \"model_params\", like the server"
+    print "    pkl  : the pickled dict of all the values, like before (everything in memory)"
+    print "Without `format`, we go by the extension of `save_path` (.npz, .h5, .hdf5, .pkl),"
+    print "and a `save_path` without any of those is a directory for npy."
+    print ""
+    print "The parameters are pulled over `streams` connections at once, in blocks"
+    print "of rows of at most `max_block_bytes`, and every block is written as soon as it"
+    print "arrives. The blocks of a parameter are not pulled at the same time, so when"
+    print "clients are training, use --max_block_bytes=0 to pull every parameter whole."
+
+
+def run(server, port, save_path, format=None, nbr_streams=4, max_block_bytes=64*1024*1024):
+
+    if format is None:
+        format = get_format_from_path(save_path)
+
+    client = Client(server, port)
     client.connect()
     L_param_desc = client.read_param_desc_from_server()
+    client.quit()
+    client.close()
+
+    D_param_desc = dict((param_desc['name'], param_desc) for param_desc in L_param_desc)
 
-    D_param_values = {}
+    writer = writer_class_dict[format](save_path)
+    writer.open(L_param_desc)
 
-    for param_desc in L_param_desc:
+    def pull_block(client, name, row_start, row_stop):
+        shape = D_param_desc[name]['shape']
+        (S, D, indices) = get_slice_args(shape, row_start, row_stop)
 
-        name = param_desc['name']
-        value = client.pull_entire_param(name)
+        out = writer.get_out(name, row_start, row_stop)
+        value = client.get_param_slice_from_server(name, S, D, indices, DTYPE_FLOAT32, out)
+        value = value.reshape((S[0],) + tuple(shape[1:]))
 
         assert not np.any(np.isnan(value)), "The server parameter %s contains NaN values" % name
 
-        D_param_values[name] = value
+        writer.write(name, row_start, row_stop, value)
+        return value.nbytes
 
-        print "Read %s of shape %s." % (name, str(param_desc['shape']))
+    def param_done(name):
+        writer.done(name)
+        # one write per line, so the lines of the streams don't get mixed
+        sys.stdout.write("Read %s of shape %s.\n" % (name, str(D_param_desc[name]['shape'])))
+
+    # The largest parameters go first, so that the streams finish at about the same time.
+    L_blocks = []
+    for param_desc in sorted(L_param_desc, key=lambda e: -np.prod(e['shape'])):
+        for (row_start, row_stop) in get_row_blocks(param_desc['shape'], max_block_bytes):
+            L_blocks.append((param_desc['name'], row_start, row_stop))
+
+    tic = time.time()
+    total_bytes = run_block_jobs(server, port, nbr_streams, L_blocks, pull_block, param_done)
+    toc = time.time()
 
     print "================================"
 
-    pickle.dump(D_param_values, open(save_path, "w"))
+    writer.close()
     print "Wrote %s." % save_path
 
-    client.quit()
-    client.close()
+    print "Pulled %d bytes in %d msec, %0.2f MB/s." % (total_bytes, int((toc - tic) * 1000),
+                                                       (1.0 * total_bytes / 1000 / 1000) / max(toc - tic, 1e-6))
 
 
 def main(argv):
@@ -45,8 +85,9 @@ def main(argv):
     """
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hv", ["server=", "port=", "save_path="])
-                                                        
+        opts, args = getopt.getopt(sys.argv[1:], "hv", ["server=", "port=", "save_path=",
+                                                        "format=", "streams=", "max_block_bytes="])
+
     except getopt.GetoptError as err:
         # print help information and exit:
         print str(err) # will print something like "option -a not recognized"
@@ -56,6 +97,9 @@ def main(argv):
     server = "127.0.0.1"
     port = None
     save_path = None
+    format = None
+    nbr_streams = 4
+    max_block_bytes = 64*1024*1024
 
     verbose = False
     for o, a in opts:
@@ -70,14 +114,21 @@ def main(argv):
             port = int(a)
         elif o in ("--save_path"):
             save_path = a
+        elif o in ("--format"):
+            format = a
+        elif o in ("--streams"):
+            nbr_streams = int(a)
+        elif o in ("--max_block_bytes"):
+            max_block_bytes = int(a)
         else:
             assert False, "unhandled option"
 
     assert port
+    assert save_path
+    assert format is None or writer_class_dict.has_key(format), "Unknown format %s." % format
 
-    run(server, port, save_path)
+    run(server, port, save_path, format, nbr_streams, max_block_bytes)
 
 
 if __name__ == "__main__":
     main(sys.argv)
-
@@ -0,0 +1,110 @@
+
+import sys
+import json
+import getopt
+
+import numpy as np
+
+from distdrop.client.sharded_client import placement_function_dict, get_shard_path, partition_param_desc
+from distdrop.server.params import new_param_from_json_desc
+
+def usage():
+    print "python shard_params_desc.py --model_params_desc=server/config_examples/simple_params_desc.json --nbr_shards=3 [--placement=size] [--partition=layer_3_W:3,layer_3_W_momentum:3] [--first_port=5000]"
+    print ""
+    print "Writes one json file per server, with the parameters that it gets,"
+    print "next to `model_params_desc` and named like params_desc_shard_0_of_3.json."
+    print ""
+    print "The placements are"
+    print "    size : the largest parameters first, each to the server with the fewest values so far"
+    print "    hash : consistent hashing of the names, so that adding a server moves few parameters"
+    print ""
+    print "With `partition`, the parameters listed are cut into that many pieces along"
+    print "their first dimension, and the pieces are placed like any other parameter."
+    print ""
+    print "Then start one server per file, and give all of them to `ShardedClient`."
+
+
+def run(model_params_desc, nbr_shards, placement="size", D_nbr_pieces=None, first_port=5000):
+
+    # we remove the parameters from it as we find them
+    D_nbr_pieces = dict(D_nbr_pieces or {})
+
+    L_param_desc = []
+    for e in json.load(open(model_params_desc, "r")):
+        if D_nbr_pieces.has_key(e['name']):
+            # the rows are the first dimension of the full shape, which isn't
+            # always the first one given in the file
+            param = new_param_from_json_desc(e)
+            L_param_desc.extend(partition_param_desc({'name' : e['name'], 'kind' : e['kind'], 'shape' : list(param.shape)},
+                                                     D_nbr_pieces.pop(e['name'])))
+        else:
+            L_param_desc.append(e)
+    assert len(D_nbr_pieces) == 0, "There is no parameter %s to partition." % ", ".join(D_nbr_pieces.keys())
+
+    D_placement = placement_function_dict[placement](L_param_desc, nbr_shards)
+
+    for shard in range(nbr_shards):
+        # in the order of the original file
+        L_shard_param_desc = [e for e in L_param_desc if D_placement[e['name']] == shard]
+        shard_path = get_shard_path(model_params_desc, shard, nbr_shards)
+        json.dump(L_shard_param_desc, open(shard_path, "w"), indent=4)
+
+        nbr_values = sum(int(np.prod(e['shape'])) for e in L_shard_param_desc)
+        print "Wrote %s with %d parameters, %d values." % (shard_path, len(L_shard_param_desc), nbr_values)
+
+    print ""
+    for shard in range(nbr_shards):
+        print "PYTHONPATH=. python bin/run_python_server.py --port=%d --model_params_desc=%s" % (first_port + shard, get_shard_path(model_params_desc, shard, nbr_shards))
+
+
+def main(argv):
+    """
+    """
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hv", ["model_params_desc=", "nbr_shards=",
+                                                        "placement=", "partition=", "first_port="])
+
+    except getopt.GetoptError as err:
+        # print help information and exit:
+        print str(err) # will print something like "option -a not recognized"
+        usage()
+        sys.exit(2)
+
+    model_params_desc = None
+    nbr_shards = None
+    placement = "size"
+    D_nbr_pieces = {}
+    first_port = 5000
+
+    verbose = False
+    for o, a in opts:
+        if o == "-v":
+            verbose = True
+        elif o in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif o in ("--model_params_desc"):
+            model_params_desc = a
+        elif o in ("--nbr_shards"):
+            nbr_shards = int(a)
+        elif o in ("--placement"):
+            placement = a
+        elif o in ("--partition"):
+            for e in a.split(","):
+                (name, nbr_pieces) = e.split(":")
+                D_nbr_pieces[name] = int(nbr_pieces)
+        elif o in ("--first_port"):
+            first_port = int(a)
+        else:
+            assert False, "unhandled option"
+
+    assert model_params_desc
+    assert nbr_shards is not None and 1 <= nbr_shards
+    assert placement_function_dict.has_key(placement), "Unknown placement %s." % placement
+
+    run(model_params_desc, nbr_shards, placement, D_nbr_pieces, first_port)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
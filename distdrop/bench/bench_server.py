@@ -0,0 +1,312 @@
+import sys
+import getopt
+import time
+import json
+import itertools
+import multiprocessing
+
+import numpy as np
+
+from distdrop.client.client_api import ClientCNNAutoSplitter
+from distdrop.server.param_server import ParamServer
+
+
+# Throughput and latency of the parameter server, for the splits that
+# the clients really ask for.
+#
+# For every combination of
+#    params_desc   : a json file like those in server/config_examples
+#    dropout_prob  : how much of every layer we drop
+#    nbr_clients   : how many client processes hit the server at once
+#    pull_fraction : the fraction of the operations that are pulls (the rest are pushes)
+# we have every client perform splits and do one operation per split.
+# We report the throughput, the latency percentiles per message type,
+# and the scaling with the number of clients.
+#
+# By default we start a `ParamServer` (python) in this process for every
+# `params_desc`. With --port, we use the server already listening there
+# instead, and the --params_desc are ignored because it has its own.
+# The pushes write back the values just pulled, but other clients can push
+# in between, so don't point --port at a server that is training a model.
+#
+# The latency of a MSG_TYPE_PUSH_PARAMS_BATCH is the time to send it,
+# because the server doesn't respond to pushes.
+#
+#    python distdrop/bench/bench_server.py --nbr_clients=1,2,4 --dropout_prob=0.0,0.5 --output=bench.json
+#    python distdrop/bench/bench_server.py ... --output=bench_new.json --compare=bench.json
+
+def usage():
+    print "python bench_server.py [--server=127.0.0.1 --port=5000] [--params_desc=server/config_examples/simple_params_desc.json]"
+    print "                       [--dropout_prob=0.0,0.5] [--nbr_clients=1,2,4] [--pull_fraction=0.5]"
+    print "                       [--nbr_ops=50] [--nbr_warmup_ops=5] [--output=bench.json] [--compare=old_bench.json]"
+
+
+def get_dropout_prob_pairs(split_plan, dropout_prob):
+    # Every unit is dropped with `dropout_prob`, except for the inputs
+    # of the first layer and the outputs of the last layer.
+    L_layers = sorted(split_plan.L_layers, key=lambda layer: layer[1])
+    D_dropout_prob_pairs = {}
+    for (layer_name, _, _, _, _) in L_layers:
+        D_dropout_prob_pairs[layer_name] = [dropout_prob, dropout_prob]
+    D_dropout_prob_pairs[L_layers[0][0]][0] = 0.0
+    D_dropout_prob_pairs[L_layers[-1][0]][1] = 0.0
+    return D_dropout_prob_pairs
+
+
+def run_client(server_host, port, dropout_prob, pull_fraction, nbr_ops, nbr_warmup_ops, client_index, results):
+
+    # Runs in its own process and puts a dict in `results` with the
+    # latencies in seconds indexed by message type, the bytes moved,
+    # and when the operations after the warmup started and ended.
+
+    try:
+        np.random.seed(client_index)
+        # With alpha=0.0, beta=1.0 the server stores what we push, and we push
+        # back the values that it had, so the parameters stay as they are.
+        # Don't use alpha=1.0, beta=0.0 for this : the C server copies the pushed
+        # values as they are when a slice covers the whole parameter.
+        client = ClientCNNAutoSplitter.new_basic_alpha_beta(server_host, port, 0.0, 1.0)
+        client.connect()
+        client.read_param_desc_from_server()
+        D_dropout_prob_pairs = get_dropout_prob_pairs(client.get_split_plan(), dropout_prob)
+        names = [param_desc['name'] for param_desc in client.L_param_desc]
+        # Every client pushes back these values, so they don't change.
+        D_entire_values = dict((name, client.pull_entire_param(name)) for name in names)
+
+        D_latencies = {'MSG_TYPE_PULL_PARAMS_BATCH' : [], 'MSG_TYPE_PUSH_PARAMS_BATCH' : []}
+        nbr_bytes = 0
+        for k in range(nbr_warmup_ops + nbr_ops):
+            if k == nbr_warmup_ops:
+                time_start = time.time()
+            client.perform_split(D_dropout_prob_pairs)
+
+            if np.random.rand() < pull_fraction:
+                msg_type = 'MSG_TYPE_PULL_PARAMS_BATCH'
+                tic = time.time()
+                D_values = client.pull_split_params(names)
+                toc = time.time()
+            else:
+                msg_type = 'MSG_TYPE_PUSH_PARAMS_BATCH'
+                D_values = {}
+                for name in names:
+                    indices = client.splits_indices[name]
+                    D_values[name] = D_entire_values[name][np.ix_(indices[0], indices[1])]
+                tic = time.time()
+                client.push_split_params(D_values)
+                toc = time.time()
+
+            if nbr_warmup_ops <= k:
+                D_latencies[msg_type].append(toc - tic)
+                nbr_bytes = nbr_bytes + sum(value.nbytes for value in D_values.values())
+
+        time_end = time.time()
+
+        client.quit()
+        client.close()
+        results.put({'latencies' : D_latencies, 'nbr_bytes' : nbr_bytes,
+                     'time_start' : time_start, 'time_end' : time_end})
+
+    except Exception as e:
+        results.put({'error' : "client %d : %s" % (client_index, str(e))})
+
+
+def summarize_latencies(L_latencies):
+    # in milliseconds
+    if len(L_latencies) == 0:
+        return {'count' : 0}
+    A = 1000.0 * np.array(L_latencies)
+    return {'count' : len(L_latencies),
+            'mean' : float(np.mean(A)),
+            'p50' : float(np.percentile(A, 50)),
+            'p95' : float(np.percentile(A, 95)),
+            'p99' : float(np.percentile(A, 99)),
+            'max' : float(np.max(A))}
+
+
+def run_one(server_host, port, dropout_prob, nbr_clients, pull_fraction, nbr_ops, nbr_warmup_ops):
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_client,
+                                         args=(server_host, port, dropout_prob, pull_fraction,
+                                               nbr_ops, nbr_warmup_ops, client_index, results))
+                 for client_index in range(nbr_clients)]
+
+    for process in processes:
+        process.start()
+    L_results = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    L_errors = [res['error'] for res in L_results if 'error' in res]
+    if L_errors:
+        raise Exception("Some clients failed :\n%s" % "\n".join(L_errors))
+
+    D_latencies = {}
+    for res in L_results:
+        for (msg_type, L_latencies) in res['latencies'].items():
+            D_latencies.setdefault(msg_type, []).extend(L_latencies)
+    nbr_bytes = sum(res['nbr_bytes'] for res in L_results)
+    # from the first client done with its warmup to the last client done
+    wall_time = max(res['time_end'] for res in L_results) - min(res['time_start'] for res in L_results)
+
+    return {'dropout_prob' : dropout_prob,
+            'nbr_clients' : nbr_clients,
+            'pull_fraction' : pull_fraction,
+            'nbr_ops' : nbr_clients * nbr_ops,
+            'nbr_bytes' : nbr_bytes,
+            'wall_time' : wall_time,
+            'MB_per_sec' : 1.0 * nbr_bytes / 1000 / 1000 / wall_time,
+            'ops_per_sec' : nbr_clients * nbr_ops / wall_time,
+            'latency_ms' : dict((msg_type, summarize_latencies(L_latencies))
+                                for (msg_type, L_latencies) in D_latencies.items())}
+
+
+def get_scaling_curves(L_runs):
+    # The throughput as a function of the number of clients,
+    # for every combination of the other settings.
+    D_curves = {}
+    for run in sorted(L_runs, key=lambda run: run['nbr_clients']):
+        key = (run['params_desc'], run['dropout_prob'], run['pull_fraction'])
+        curve = D_curves.setdefault(key, {'params_desc' : key[0], 'dropout_prob' : key[1], 'pull_fraction' : key[2],
+                                          'nbr_clients' : [], 'MB_per_sec' : [], 'ops_per_sec' : []})
+        curve['nbr_clients'].append(run['nbr_clients'])
+        curve['MB_per_sec'].append(run['MB_per_sec'])
+        curve['ops_per_sec'].append(run['ops_per_sec'])
+    return [D_curves[key] for key in sorted(D_curves.keys())]
+
+
+def get_run_key(run):
+    return (run['params_desc'], run['dropout_prob'], run['nbr_clients'], run['pull_fraction'])
+
+
+def print_runs(L_runs, L_old_runs=None):
+    # With `L_old_runs`, every line also has the ratios new/old
+    # of the throughput and of the p95 latencies.
+    D_old_runs = dict((get_run_key(run), run) for run in (L_old_runs or []))
+
+    for run in L_runs:
+        line = "%s  p=%0.2f  clients=%d  pulls=%0.2f  :  %8.2f MB/s  %8.2f ops/s" % (
+                    run['params_desc'], run['dropout_prob'], run['nbr_clients'], run['pull_fraction'],
+                    run['MB_per_sec'], run['ops_per_sec'])
+        old_run = D_old_runs.get(get_run_key(run), None)
+        if old_run is not None:
+            line = line + "  (x%0.2f)" % (run['MB_per_sec'] / old_run['MB_per_sec'])
+        print line
+
+        for (msg_type, stats) in sorted(run['latency_ms'].items()):
+            if stats['count'] == 0:
+                continue
+            line = "        %-28s p50 %8.2f ms   p95 %8.2f ms   p99 %8.2f ms" % (msg_type, stats['p50'], stats['p95'], stats['p99'])
+            if old_run is not None and old_run['latency_ms'].get(msg_type, {}).get('count', 0):
+                line = line + "  (p95 x%0.2f)" % (stats['p95'] / old_run['latency_ms'][msg_type]['p95'])
+            print line
+
+
+def run(server_host, port, L_params_desc, L_dropout_prob, L_nbr_clients, L_pull_fraction, nbr_ops, nbr_warmup_ops):
+
+    L_runs = []
+    for params_desc in L_params_desc:
+
+        if port is None:
+            server = ParamServer.from_json_file(params_desc, 0, server_host="127.0.0.1")
+            server.start()
+            (run_host, run_port) = ("127.0.0.1", server.port)
+        else:
+            server = None
+            (run_host, run_port) = (server_host, port)
+
+        for (dropout_prob, nbr_clients, pull_fraction) in itertools.product(L_dropout_prob, L_nbr_clients, L_pull_fraction):
+            res = run_one(run_host, run_port, dropout_prob, nbr_clients, pull_fraction, nbr_ops, nbr_warmup_ops)
+            res['params_desc'] = params_desc
+            print_runs([res])
+            L_runs.append(res)
+
+        if server is not None:
+            server.stop()
+
+    return L_runs
+
+
+def main(argv):
+    """
+    """
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hv", ["server=", "port=", "params_desc=",
+                                                        "dropout_prob=", "nbr_clients=", "pull_fraction=",
+                                                        "nbr_ops=", "nbr_warmup_ops=",
+                                                        "output=", "compare="])
+    except getopt.GetoptError as err:
+        # print help information and exit:
+        print str(err) # will print something like "option -a not recognized"
+        usage()
+        sys.exit(2)
+
+    server_host = "127.0.0.1"
+    port = None
+    L_params_desc = ["server/config_examples/simple_params_desc.json"]
+    L_dropout_prob = [0.0, 0.5]
+    L_nbr_clients = [1, 2, 4]
+    L_pull_fraction = [0.5]
+    nbr_ops = 50
+    nbr_warmup_ops = 5
+    output = None
+    compare = None
+
+    verbose = False
+    for o, a in opts:
+        if o == "-v":
+            verbose = True
+        elif o in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif o == "--server":
+            server_host = a
+        elif o == "--port":
+            port = int(a)
+        elif o == "--params_desc":
+            L_params_desc = a.split(",")
+        elif o == "--dropout_prob":
+            L_dropout_prob = [float(e) for e in a.split(",")]
+        elif o == "--nbr_clients":
+            L_nbr_clients = [int(e) for e in a.split(",")]
+        elif o == "--pull_fraction":
+            L_pull_fraction = [float(e) for e in a.split(",")]
+        elif o == "--nbr_ops":
+            nbr_ops = int(a)
+        elif o == "--nbr_warmup_ops":
+            nbr_warmup_ops = int(a)
+        elif o == "--output":
+            output = a
+        elif o == "--compare":
+            compare = a
+        else:
+            assert False, "unhandled option"
+
+    if port is not None:
+        # the server has its own parameters
+        L_params_desc = ["%s:%d" % (server_host, port)]
+
+    L_runs = run(server_host, port, L_params_desc, L_dropout_prob, L_nbr_clients, L_pull_fraction, nbr_ops, nbr_warmup_ops)
+
+    print ""
+    print "================================"
+    print ""
+    L_old_runs = None
+    if compare is not None:
+        L_old_runs = json.load(open(compare, "r"))['runs']
+    print_runs(L_runs, L_old_runs)
+
+    if output is not None:
+        results = {'settings' : {'server' : server_host, 'port' : port,
+                                 'nbr_ops' : nbr_ops, 'nbr_warmup_ops' : nbr_warmup_ops,
+                                 'time' : time.time()},
+                   'runs' : L_runs,
+                   'scaling' : get_scaling_curves(L_runs)}
+        json.dump(results, open(output, "w"), indent=4, sort_keys=True)
+        print ""
+        print "Wrote the results to %s." % output
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,515 @@
+
+import struct
+import socket
+import time
+
+import numpy as np
+
+# The rest of the client is python 2, so we use `trollius`,
+# which is the backport of asyncio to python 2.
+import trollius as asyncio
+from trollius import From, Return
+
+from distdrop.client.messages import *
+from distdrop.client.client_api import Client, ClientCNNAutoSplitter
+from distdrop.client.client_stats import buffers_nbr_bytes
+
+
+# This is the same thing as `Client`, but all the methods that
+# talk to the server are coroutines to be used with asyncio.
+#
+#    client = AsyncClientCNNAutoSplitter.new_basic_alpha_beta(server_host, port, alpha, beta)
+#    yield From(client.connect())
+#    yield From(client.read_param_desc_from_server())
+#    client.perform_split(D_dropout_probs)
+#    value = yield From(client.pull_split_param(name))
+#    yield From(client.push_split_param(name, updated_value))
+#    yield From(client.quit())
+#    client.close()
+#
+# Many coroutines can use the same client at the same time.
+# The server answers the requests of a connection in the order
+# in which they were written, so we write every request entirely
+# before giving control back to the loop, and we have a single task
+# reading the responses and handing them to the coroutines waiting for them.
+# This keeps as many transfers in flight as there are coroutines.
+#
+# To talk to many servers at once, use one client per server.
+#
+# In `client.stats()`, the 'wait' of a request includes the time spent
+# behind the requests of the other coroutines written before it.
+
+class AsyncClient(Client):
+
+    def __init__(self, server_host, port, loop=None):
+        super(AsyncClient, self).__init__(server_host, port)
+        self.init_async(loop)
+
+    def init_async(self, loop=None):
+        # We don't use the blocking socket made by `Client`.
+        self.conn.close()
+        self.conn = None
+        self.L_param_desc = None
+
+        self.loop = loop
+        self.reader = None
+        self.writer = None
+
+        # Contains pairs (future, read_response) for the requests whose
+        # response hasn't been read yet, in the order in which they were written.
+        # `read_response` is a coroutine function reading that response.
+        self.pending_responses = None
+        self.response_reader_task = None
+        # Only one coroutine at a time can wait on `self.writer.drain()`.
+        self.drain_lock = None
+        # Once a response fails to be read, we can't find where
+        # the next one starts, so everything fails after that.
+        self.broken = None
+
+    @asyncio.coroutine
+    def connect(self):
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        (self.reader, self.writer) = yield From(asyncio.open_connection(self.server_host, self.port, loop=self.loop))
+        # see `Client.connect`
+        self.writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.pending_responses = asyncio.Queue(loop=self.loop)
+        self.drain_lock = asyncio.Lock(loop=self.loop)
+        self.response_reader_task = asyncio.ensure_future(self.read_responses(), loop=self.loop)
+
+    def close(self):
+        if self.response_reader_task is not None:
+            self.response_reader_task.cancel()
+            self.response_reader_task = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    @asyncio.coroutine
+    def quit(self):
+        # call this before calling `close`
+        yield From(self.send_request([MsgHeader('MSG_TYPE_CLIENT_QUITS').encode()]))
+
+    @asyncio.coroutine
+    def read_responses(self):
+        while True:
+            (future, read_response) = yield From(self.pending_responses.get())
+            try:
+                value = yield From(read_response(self.reader))
+            except Exception as e:
+                self.broken = e
+                if not future.cancelled():
+                    future.set_exception(e)
+                while not self.pending_responses.empty():
+                    (future, _) = self.pending_responses.get_nowait()
+                    if not future.cancelled():
+                        future.set_exception(e)
+                return
+            # The coroutine might have been cancelled while waiting,
+            # but we still had to read its response.
+            if not future.cancelled():
+                future.set_result(value)
+
+    @asyncio.coroutine
+    def send_request(self, buffers, read_response=None):
+        # Writes all the `buffers` and returns the response read
+        # by `read_response`, or None when there is no response.
+
+        if self.broken is not None:
+            raise RuntimeError("Connection to the server is broken : %s" % self.broken)
+
+        # Nothing in here gives control back to the loop, so the order
+        # of the requests on the wire is the order of the calls.
+        # The transport copies what it can't send right away.
+        for buf in buffers:
+            if 0 < len(buf):
+                self.writer.write(buf)
+        future = None
+        if read_response is not None:
+            future = asyncio.Future(loop=self.loop)
+            self.pending_responses.put_nowait((future, read_response))
+
+        with (yield From(self.drain_lock)):
+            yield From(self.writer.drain())
+
+        if future is None:
+            raise Return(None)
+        value = yield From(future)
+        raise Return(value)
+
+    @asyncio.coroutine
+    def read_param_desc_from_server(self):
+        timer = self.msg_stats.start_timer('MSG_TYPE_LIST_ALL_PARAMS_DESC')
+        header = MsgHeader('MSG_TYPE_LIST_ALL_PARAMS_DESC')
+        msg = MsgListAllParamsDesc()
+
+        @asyncio.coroutine
+        def read_response(reader):
+            response_nbr_bytes = yield From(read_response_nbr_bytes(reader))
+            msg.response_nbr_bytes = response_nbr_bytes
+            contents = yield From(reader.readexactly(response_nbr_bytes))
+            raise Return(msg.decode_response_contents(contents))
+
+        resp = yield From(self.send_request([header.encode()], read_response))
+        timer.lap('wait')
+        timer.done(MSG_HEADER_LENGTH, 4 + msg.response_nbr_bytes)
+
+        self.L_param_desc = resp
+        raise Return(resp)
+
+    @asyncio.coroutine
+    def register_split_indices(self, handle, L_indices_and_D):
+        timer = self.msg_stats.start_timer('MSG_TYPE_REGISTER_SPLIT')
+        header = MsgHeader('MSG_TYPE_REGISTER_SPLIT')
+        msg = MsgRegisterSplit(handle, L_indices_and_D)
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+
+        @asyncio.coroutine
+        def read_response(reader):
+            contents = yield From(reader.readexactly(4))
+            (handle,) = struct.unpack("<i", contents)
+            assert handle == msg.handle, "Failed to register the split with handle %d." % msg.handle
+            raise Return(handle)
+
+        handle = yield From(self.send_request(buffers, read_response))
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), 4)
+        raise Return(handle)
+
+    @asyncio.coroutine
+    def register_seeded_split_indices(self, handle, seed, L_prob_pairs):
+        timer = self.msg_stats.start_timer('MSG_TYPE_REGISTER_SEEDED_SPLIT')
+        header = MsgHeader('MSG_TYPE_REGISTER_SEEDED_SPLIT')
+        msg = MsgRegisterSeededSplit(handle, seed, L_prob_pairs)
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+
+        @asyncio.coroutine
+        def read_response(reader):
+            contents = yield From(reader.readexactly(4))
+            (handle,) = struct.unpack("<i", contents)
+            assert handle == msg.handle, "Failed to register the seeded split with handle %d." % msg.handle
+            raise Return(handle)
+
+        handle = yield From(self.send_request(buffers, read_response))
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), 4)
+        raise Return(handle)
+
+    @asyncio.coroutine
+    def init_param_seeded(self, name, distribution, scale, seed):
+        timer = self.msg_stats.start_timer('MSG_TYPE_INIT_PARAM')
+        header = MsgHeader('MSG_TYPE_INIT_PARAM')
+        msg = MsgInitParam(name, distribution, scale, seed)
+        buffers = [header.encode(), msg.encode()]
+        timer.lap('encode')
+
+        @asyncio.coroutine
+        def read_response(reader):
+            contents = yield From(reader.readexactly(4))
+            (status,) = struct.unpack("<i", contents)
+            assert status == 0, "Failed to initialize the parameter %s on the server." % msg.name
+            raise Return(status)
+
+        status = yield From(self.send_request(buffers, read_response))
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), 4)
+        raise Return(status)
+
+    @asyncio.coroutine
+    def get_param_digests(self, names):
+        timer = self.msg_stats.start_timer('MSG_TYPE_PARAM_DIGEST')
+        header = MsgHeader('MSG_TYPE_PARAM_DIGEST')
+        msg = MsgParamDigest(names)
+        buffers = [header.encode(), msg.encode()]
+        timer.lap('encode')
+
+        @asyncio.coroutine
+        def read_response(reader):
+            contents = yield From(reader.readexactly(msg.get_response_nbr_bytes()))
+            raise Return(msg.decode_response(contents))
+
+        D_digests = yield From(self.send_request(buffers, read_response))
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), msg.get_response_nbr_bytes())
+        raise Return(D_digests)
+
+    def get_param_desc(self, name):
+        # We can't read the descriptions from here because this isn't a coroutine.
+        assert self.L_param_desc is not None, "You need to call `read_param_desc_from_server` first."
+        return super(AsyncClient, self).get_param_desc(name)
+
+    @asyncio.coroutine
+    def get_param_slice_from_server(self, name, S, D, indices, dtype_for_client, out=None):
+        timer = self.msg_stats.start_timer('MSG_TYPE_PULL_PARAM')
+        header = MsgHeader('MSG_TYPE_PULL_PARAM')
+        msg = MsgPullParams(name, S, D, indices, dtype_for_client, self.want_compact_indices)
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+
+        @asyncio.coroutine
+        def read_response(reader):
+            value = yield From(read_pull_response(reader, msg, out))
+            raise Return(value)
+
+        value = yield From(self.send_request(buffers, read_response))
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), 4 + value.nbytes, L_pulled=[(name, value.nbytes)])
+        raise Return(value)
+
+    @asyncio.coroutine
+    def update_param_slice_to_server(self, value, alpha, beta, name, S, D, indices, dtype_for_client):
+        timer = self.msg_stats.start_timer('MSG_TYPE_PUSH_PARAM')
+        header = MsgHeader('MSG_TYPE_PUSH_PARAM')
+        msg = MsgPushParams(value, alpha, beta, name, S, D, indices, dtype_for_client, self.want_compact_indices)
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+
+        yield From(self.send_request(buffers))
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), 0, L_pushed=[(name, len(buffers[-1]))])
+
+    @asyncio.coroutine
+    def exchange_param_slice_with_server(self, value, alpha, beta, name, S, D, indices, dtype_for_client, out=None):
+        timer = self.msg_stats.start_timer('MSG_TYPE_EXCHANGE_PARAM')
+        header = MsgHeader('MSG_TYPE_EXCHANGE_PARAM')
+        msg = MsgExchangeParams(value, alpha, beta, name, S, D, indices, dtype_for_client, self.want_compact_indices)
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+
+        @asyncio.coroutine
+        def read_response(reader):
+            res = yield From(read_pull_response(reader, msg, out))
+            raise Return(res)
+
+        res = yield From(self.send_request(buffers, read_response))
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), 4 + res.nbytes,
+                   L_pulled=[(name, res.nbytes)], L_pushed=[(name, len(buffers[-1]))])
+        raise Return(res)
+
+    @asyncio.coroutine
+    def get_param_slices_from_server(self, L_slice_args, L_out=None):
+        timer = self.msg_stats.start_timer('MSG_TYPE_PULL_PARAMS_BATCH')
+        header = MsgHeader('MSG_TYPE_PULL_PARAMS_BATCH')
+        msg = MsgPullParamsBatch([MsgPullParams(*slice_args, want_compact_indices=self.want_compact_indices)
+                                  for slice_args in L_slice_args])
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+        if L_out is None:
+            L_out = [None] * len(msg.L_msg)
+
+        @asyncio.coroutine
+        def read_response(reader):
+            contents = yield From(reader.readexactly(4))
+            (nbr_entries,) = struct.unpack("<i", contents)
+            assert nbr_entries == len(msg.L_msg)
+            L_values = []
+            for (e, out) in zip(msg.L_msg, L_out):
+                value = yield From(read_pull_response(reader, e, out))
+                L_values.append(value)
+            raise Return(L_values)
+
+        L_values = yield From(self.send_request(buffers, read_response))
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers),
+                   4 + sum(4 + value.nbytes for value in L_values),
+                   L_pulled=[(e.name, value.nbytes) for (e, value) in zip(msg.L_msg, L_values)])
+        raise Return(L_values)
+
+    @asyncio.coroutine
+    def update_param_slices_to_server(self, L_update_args):
+        timer = self.msg_stats.start_timer('MSG_TYPE_PUSH_PARAMS_BATCH')
+        header = MsgHeader('MSG_TYPE_PUSH_PARAMS_BATCH')
+        msg = MsgPushParamsBatch([MsgPushParams(*update_args, want_compact_indices=self.want_compact_indices)
+                                  for update_args in L_update_args])
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+
+        yield From(self.send_request(buffers))
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), 0,
+                   L_pushed=[(update_args[3], update_args[0].nbytes) for update_args in L_update_args])
+
+    @asyncio.coroutine
+    def save_all_to_hdf5(self, path):
+        header = MsgHeader('MSG_TYPE_SAVE_ALL_TO_HDF5')
+        msg = MsgSaveAllToHDF5(path)
+        yield From(self.send_request([header.encode(), msg.encode()]))
+        raise Return(True)
+
+    @asyncio.coroutine
+    def load_all_from_hdf5(self, pathHDF5, pathJSON):
+        header = MsgHeader('MSG_TYPE_LOAD_ALL_FROM_HDF5')
+        msg = MsgLoadAllFromHDF5(pathJSON, pathHDF5)
+        yield From(self.send_request([header.encode(), msg.encode()]))
+        raise Return(True)
+
+
+# The coroutine versions of the methods of `ClientCNNAutoSplitter`
+# that talk to the server. Everything else (the splits, the dtypes,
+# the delta updates and the error feedback) is inherited as is.
+
+class AsyncClientCNNAutoSplitter(AsyncClient, ClientCNNAutoSplitter):
+
+    def __init__(self, *args, **kwargs):
+        # The class methods of `ClientCNNAutoSplitter`, such as
+        # `new_basic_alpha_beta`, work for this class too.
+        loop = kwargs.pop('loop', None)
+        ClientCNNAutoSplitter.__init__(self, *args, **kwargs)
+        # Use many coroutines instead of many streams.
+        assert self.pool is None
+        self.init_async(loop)
+
+    def perform_split(self, D_dropout_prob_pairs, seed=None):
+        # With `want_registered_splits`, you have to follow this
+        # with `yield From(client.register_split())` yourself,
+        # or `yield From(client.register_seeded_split(seed, D_dropout_prob_pairs))`.
+        assert self.L_param_desc is not None, "You need to call `read_param_desc_from_server` first."
+        self.split_seed = seed
+        if seed is None:
+            self.splits_indices = self.get_split_plan().sample(D_dropout_prob_pairs)
+        else:
+            self.splits_indices = self.get_split_plan().sample_seeded(seed, D_dropout_prob_pairs)
+
+    @asyncio.coroutine
+    def register_split(self, splits_indices=None):
+        want_replace = splits_indices is None
+        if want_replace:
+            splits_indices = self.splits_indices
+
+        (handle, L_indices_and_D, registered_splits_indices) = self.prepare_registered_split(splits_indices)
+        yield From(self.register_split_indices(handle, L_indices_and_D))
+
+        if want_replace:
+            self.splits_indices = registered_splits_indices
+        raise Return(registered_splits_indices)
+
+    @asyncio.coroutine
+    def register_seeded_split(self, seed, D_dropout_prob_pairs, splits_indices=None):
+        want_replace = splits_indices is None
+        if want_replace:
+            splits_indices = self.splits_indices
+
+        (handle, L_prob_pairs, registered_splits_indices) = self.prepare_registered_seeded_split(seed, D_dropout_prob_pairs, splits_indices)
+        yield From(self.register_seeded_split_indices(handle, seed, L_prob_pairs))
+
+        if want_replace:
+            self.splits_indices = registered_splits_indices
+        raise Return(registered_splits_indices)
+
+    @asyncio.coroutine
+    def pull_entire_param(self, name, out=None):
+        param_desc = self.get_param_desc(name)
+        assert param_desc is not None
+
+        D = (param_desc['shape'][0], param_desc['shape'][1])
+        indices = (np.arange(0, D[0], dtype=np.intc), np.arange(0, D[1], dtype=np.intc))
+
+        value = yield From(self.get_param_slice_from_server(name, D, D, indices,
+                                                            self.get_dtype_for_client(name),
+                                                            self.get_out_for_wire(name, out)))
+        raise Return(self.decode_pulled_value(value, param_desc['shape'], out))
+
+    @asyncio.coroutine
+    def push_entire_param(self, name, updated_value, alpha, beta):
+        param_desc = self.get_param_desc(name)
+        assert param_desc is not None
+
+        D = (param_desc['shape'][0], param_desc['shape'][1])
+        indices = (np.arange(0, D[0], dtype=np.intc), np.arange(0, D[1], dtype=np.intc))
+
+        updated_value = self.encode_pushed_value(name, updated_value, indices)
+        yield From(self.update_param_slice_to_server(updated_value,
+                                                     self.alpha, self.beta,
+                                                     name,
+                                                     D, D, indices,
+                                                     self.get_dtype_for_client(name)))
+
+    @asyncio.coroutine
+    def pull_split_param(self, name, out=None):
+        (param_desc, S, D, indices) = self.get_split_slice_args(name)
+
+        value = yield From(self.get_param_slice_from_server(name, S, D, indices,
+                                                            self.get_dtype_for_client(name),
+                                                            self.get_out_for_wire(name, out)))
+
+        raise Return(self.decode_split_value(name, value, 'MSG_TYPE_PULL_PARAM', out))
+
+    @asyncio.coroutine
+    def push_split_param(self, name, updated_value):
+        update_args = self.get_split_push_args(name, updated_value)
+
+        if update_args is not None:
+            yield From(self.update_param_slice_to_server(*update_args))
+
+    @asyncio.coroutine
+    def exchange_split_param(self, name, updated_value, out=None):
+        # Same as `ClientCNNAutoSplitter.exchange_split_param`.
+        (param_desc, S, D, indices) = self.get_split_slice_args(name)
+        update_args = self.get_split_push_args(name, updated_value)
+
+        if update_args is None or update_args[4] != S:
+            if update_args is not None:
+                yield From(self.update_param_slice_to_server(*update_args))
+            value = yield From(self.pull_split_param(name, out))
+            raise Return(value)
+
+        value = yield From(self.exchange_param_slice_with_server(*update_args, out=self.get_out_for_wire(name, out)))
+        raise Return(self.decode_split_value(name, value, 'MSG_TYPE_EXCHANGE_PARAM', out))
+
+    @asyncio.coroutine
+    def pull_split_params(self, names, D_out=None):
+        # Same as `ClientCNNAutoSplitter.pull_split_params`, in one MSG_TYPE_PULL_PARAMS_BATCH.
+        # There is no `want_pipelined` here. Use `asyncio.gather` on
+        # many `pull_split_param` to get the same effect.
+
+        if D_out is None:
+            D_out = {}
+        L_out = [self.get_out_for_wire(name, D_out.get(name)) for name in names]
+
+        L_slice_args = []
+        L_original_shapes = []
+        for name in names:
+            (param_desc, S, D, indices) = self.get_split_slice_args(name)
+            L_slice_args.append((name, S, D, indices, self.get_dtype_for_client(name)))
+            L_original_shapes.append((S[0], S[1], param_desc['shape'][2], param_desc['shape'][3]))
+
+        L_values = yield From(self.get_param_slices_from_server(L_slice_args, L_out))
+
+        tic = time.time()
+        D_values = {}
+        for (name, value, original_shape) in zip(names, L_values, L_original_shapes):
+            D_values[name] = self.decode_pulled_value(value, original_shape, D_out.get(name))
+            if self.want_delta_updates:
+                self.cache_split_value(name, D_values[name])
+
+        self.msg_stats.record_decode('MSG_TYPE_PULL_PARAMS_BATCH', names, time.time() - tic)
+        raise Return(D_values)
+
+    @asyncio.coroutine
+    def push_split_params(self, D_updated_values):
+        L_update_args = []
+        for (name, updated_value) in D_updated_values.items():
+            update_args = self.get_split_push_args(name, updated_value)
+            if update_args is not None:
+                L_update_args.append(update_args)
+
+        yield From(self.update_param_slices_to_server(L_update_args))
+
+
+@asyncio.coroutine
+def read_response_nbr_bytes(reader):
+    contents = yield From(reader.readexactly(4))
+    (response_nbr_bytes,) = struct.unpack("<i", contents)
+    raise Return(response_nbr_bytes)
+
+@asyncio.coroutine
+def read_pull_response(reader, msg, out=None):
+    # Same as `msg.read_decode_response`, but from a StreamReader.
+    response_nbr_bytes = yield From(read_response_nbr_bytes(reader))
+    numpy_array_decoded = msg.allocate_response(response_nbr_bytes, out)
+    contents = yield From(reader.readexactly(response_nbr_bytes))
+    numpy_array_decoded.view(np.uint8)[:] = np.frombuffer(contents, dtype=np.uint8)
+    raise Return(numpy_array_decoded)
@@ -0,0 +1,382 @@
+import os
+import json
+import pickle
+import shutil
+import socket
+import threading
+import Queue
+import zipfile
+
+import numpy as np
+
+from distdrop.client.client_api import Client
+
+
+# The files written by bin/save_server_params.py and read by bin/load_server_params.py.
+#
+# The parameters travel in blocks of rows (along the first axis), over
+# many connections at once, and never have to be held whole in memory
+# except with the old pickle format. See `run_block_jobs`.
+
+def get_format_from_path(path):
+    # A `path` without any of those extensions is a directory of .npy files.
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npz":
+        return "npz"
+    elif ext in [".h5", ".hdf5"]:
+        return "hdf5"
+    elif ext == ".pkl":
+        return "pkl"
+    else:
+        return "npy"
+
+
+def get_row_blocks(shape, max_block_bytes):
+    # Returns the list of (row_start, row_stop) covering the first axis
+    # with blocks of at most `max_block_bytes`, but at least one row each.
+    row_nbr_bytes = 4 * int(np.prod(shape[1:]))
+    if max_block_bytes <= 0:
+        nbr_rows_per_block = shape[0]
+    else:
+        nbr_rows_per_block = max(1, max_block_bytes // row_nbr_bytes)
+    return [(row_start, min(row_start + nbr_rows_per_block, shape[0]))
+            for row_start in range(0, shape[0], nbr_rows_per_block)]
+
+
+# The writers receive the blocks of rows from many threads at once.
+#
+#    writer.open(L_param_desc)
+#    out = writer.get_out(name, row_start, row_stop)     # where to pull the block
+#    writer.write(name, row_start, row_stop, out)        # once it's there
+#    writer.done(name)                                   # after the last block
+#    writer.close()
+
+class NpyDirWriter(object):
+
+    # The blocks are pulled directly into a memmap of the .npy file,
+    # so nothing but the page cache ever holds a whole parameter.
+
+    def __init__(self, save_path):
+        self.save_path = save_path
+        self.lock = threading.Lock()
+        self.D_memmaps = {}
+
+    def get_npy_path(self, name):
+        return os.path.join(self.save_path, name + ".npy")
+
+    def open(self, L_param_desc):
+        if not os.path.exists(self.save_path):
+            os.makedirs(self.save_path)
+        with open(os.path.join(self.save_path, "params_desc.json"), "w") as f:
+            json.dump(L_param_desc, f, indent=4)
+        for param_desc in L_param_desc:
+            self.D_memmaps[param_desc['name']] = np.lib.format.open_memmap(self.get_npy_path(param_desc['name']),
+                                                                           mode="w+", dtype=np.float32,
+                                                                           shape=tuple(param_desc['shape']))
+
+    def get_out(self, name, row_start, row_stop):
+        with self.lock:
+            return self.D_memmaps[name][row_start:row_stop]
+
+    def write(self, name, row_start, row_stop, value):
+        # `value` is already in the file
+        pass
+
+    def done(self, name):
+        with self.lock:
+            memmap = self.D_memmaps.pop(name)
+        memmap.flush()
+
+    def close(self):
+        pass
+
+
+class NpzWriter(NpyDirWriter):
+
+    # We write the .npy files to a temporary directory like NpyDirWriter,
+    # and then store them in the archive one by one, from the disk.
+
+    def __init__(self, save_path):
+        super(NpzWriter, self).__init__(save_path + ".tmp")
+        self.npz_path = save_path
+        self.L_names = []
+
+    def open(self, L_param_desc):
+        super(NpzWriter, self).open(L_param_desc)
+        self.L_names = [param_desc['name'] for param_desc in L_param_desc]
+
+    def close(self):
+        # ZIP_STORED because the float values barely compress,
+        # and `allowZip64` for the archives above 2GB.
+        with zipfile.ZipFile(self.npz_path, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for name in self.L_names:
+                archive.write(self.get_npy_path(name), name + ".npy")
+        shutil.rmtree(self.save_path)
+
+
+class HDF5Writer(object):
+
+    # h5py can't write from many threads at once, so the blocks
+    # are pulled into their own arrays and written under `self.lock`.
+
+    def __init__(self, save_path):
+        self.save_path = save_path
+        self.lock = threading.Lock()
+        self.f = None
+
+    def open(self, L_param_desc):
+        import h5py
+        self.f = h5py.File(self.save_path, "w")
+        grp = self.f.create_group("model_params")
+        for param_desc in L_param_desc:
+            grp.create_dataset(param_desc['name'], tuple(param_desc['shape']), dtype=np.float32)
+
+    def get_out(self, name, row_start, row_stop):
+        return None
+
+    def write(self, name, row_start, row_stop, value):
+        with self.lock:
+            self.f["model_params"][name][row_start:row_stop] = value
+
+    def done(self, name):
+        pass
+
+    def close(self):
+        self.f.close()
+
+
+class PickleWriter(object):
+
+    # The old format. We have to hold everything until the end.
+
+    def __init__(self, save_path):
+        self.save_path = save_path
+        self.D_param_values = {}
+
+    def open(self, L_param_desc):
+        for param_desc in L_param_desc:
+            self.D_param_values[param_desc['name']] = np.empty(tuple(param_desc['shape']), dtype=np.float32)
+
+    def get_out(self, name, row_start, row_stop):
+        return self.D_param_values[name][row_start:row_stop]
+
+    def write(self, name, row_start, row_stop, value):
+        pass
+
+    def done(self, name):
+        pass
+
+    def close(self):
+        pickle.dump(self.D_param_values, open(self.save_path, "w"))
+
+
+writer_class_dict = {'npy' : NpyDirWriter,
+                     'npz' : NpzWriter,
+                     'hdf5' : HDF5Writer,
+                     'pkl' : PickleWriter}
+
+
+# The readers hand out blocks of rows without reading the rest of the parameter.
+#
+#    reader = open_saved_params(load_path)
+#    reader.keys()
+#    reader.get_shape(name)
+#    value = reader.read_rows(name, row_start, row_stop)
+#    reader.close()
+
+class NpyDirReader(object):
+
+    def __init__(self, load_path):
+        self.load_path = load_path
+        self.D_memmaps = {}
+        for e in os.listdir(load_path):
+            if e.endswith(".npy"):
+                self.D_memmaps[e[:-len(".npy")]] = np.load(os.path.join(load_path, e), mmap_mode="r")
+
+    def keys(self):
+        return self.D_memmaps.keys()
+
+    def get_shape(self, name):
+        return self.D_memmaps[name].shape
+
+    def read_rows(self, name, row_start, row_stop):
+        return self.D_memmaps[name][row_start:row_stop]
+
+    def close(self):
+        self.D_memmaps = {}
+
+
+class NpzReader(NpyDirReader):
+
+    # The archives written by NpzWriter are not compressed, so we can
+    # memmap every .npy right where it is in the archive.
+    # The compressed ones (from np.savez_compressed) get read whole.
+
+    def __init__(self, load_path):
+        self.load_path = load_path
+        self.D_memmaps = {}
+        with zipfile.ZipFile(load_path, "r") as archive:
+            L_infos = [info for info in archive.infolist() if info.filename.endswith(".npy")]
+        for info in L_infos:
+            name = info.filename[:-len(".npy")]
+            if info.compress_type == zipfile.ZIP_STORED:
+                self.D_memmaps[name] = memmap_stored_npy(load_path, info)
+            else:
+                self.D_memmaps[name] = np.load(load_path)[name]
+
+
+def memmap_stored_npy(load_path, info):
+    # `info` is the ZipInfo of a .npy stored without compression.
+    with open(load_path, "rb") as f:
+        # the local header has a fixed size of 30 bytes, followed by
+        # the file name and an extra field that can differ from `info.extra`
+        f.seek(info.header_offset + 26)
+        (filename_length, extra_length) = np.frombuffer(f.read(4), dtype="<u2")
+        f.seek(info.header_offset + 30 + filename_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            (shape, fortran_order, dtype) = np.lib.format.read_array_header_1_0(f)
+        else:
+            (shape, fortran_order, dtype) = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    return np.memmap(load_path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                     order="F" if fortran_order else "C")
+
+
+class HDF5Reader(object):
+
+    def __init__(self, load_path):
+        import h5py
+        self.f = h5py.File(load_path, "r")
+        # h5py reads from one thread at a time anyway
+        self.lock = threading.Lock()
+
+    def keys(self):
+        return self.f["model_params"].keys()
+
+    def get_shape(self, name):
+        return self.f["model_params"][name].shape
+
+    def read_rows(self, name, row_start, row_stop):
+        with self.lock:
+            return self.f["model_params"][name][row_start:row_stop]
+
+    def close(self):
+        self.f.close()
+
+
+class PickleReader(object):
+
+    def __init__(self, load_path):
+        self.D_params = pickle.load(open(load_path, "r"))
+
+    def keys(self):
+        return self.D_params.keys()
+
+    def get_shape(self, name):
+        return self.D_params[name].shape
+
+    def read_rows(self, name, row_start, row_stop):
+        return self.D_params[name][row_start:row_stop]
+
+    def close(self):
+        self.D_params = {}
+
+
+reader_class_dict = {'npy' : NpyDirReader,
+                     'npz' : NpzReader,
+                     'hdf5' : HDF5Reader,
+                     'pkl' : PickleReader}
+
+def open_saved_params(load_path, format=None):
+    if format is None:
+        format = get_format_from_path(load_path)
+    return reader_class_dict[format](load_path)
+
+
+def run_block_jobs(server, port, nbr_streams, L_blocks, process_block, param_done=None):
+
+    # Calls `process_block(client, name, row_start, row_stop)` for every
+    # entry of `L_blocks`, on `nbr_streams` threads with a connection each.
+    # `process_block` returns the number of bytes that it transferred.
+    # After the last block of a parameter, we call `param_done(name)`.
+    # Returns the total number of bytes, or raises the first exception
+    # that stopped a stream (once all of them are done).
+
+    jobs = Queue.Queue()
+    D_nbr_blocks_left = {}
+    for (name, row_start, row_stop) in L_blocks:
+        jobs.put((name, row_start, row_stop))
+        D_nbr_blocks_left[name] = D_nbr_blocks_left.get(name, 0) + 1
+    nbr_blocks_left_lock = threading.Lock()
+
+    results = []
+
+    def run_stream():
+        client = Client(server, port)
+        is_connected = False
+
+        nbr_bytes = 0
+        try:
+            # inside the `try`, so that a stream that can't connect reports it
+            client.connect()
+            is_connected = True
+
+            while True:
+                try:
+                    (name, row_start, row_stop) = jobs.get_nowait()
+                except Queue.Empty:
+                    break
+
+                nbr_bytes = nbr_bytes + process_block(client, name, row_start, row_stop)
+
+                with nbr_blocks_left_lock:
+                    D_nbr_blocks_left[name] = D_nbr_blocks_left[name] - 1
+                    is_last_block = (D_nbr_blocks_left[name] == 0)
+                if is_last_block and param_done is not None:
+                    param_done(name)
+
+            # The pushes get no response. The server handles the messages of
+            # a connection in order, so once it answers this, it's done with them.
+            client.read_param_desc_from_server()
+        except Exception as e:
+            # the other streams stop too
+            while not jobs.empty():
+                try:
+                    jobs.get_nowait()
+                except Queue.Empty:
+                    pass
+            results.append(e)
+        else:
+            results.append(nbr_bytes)
+        finally:
+            if is_connected:
+                try:
+                    client.quit()
+                except socket.error:
+                    # the server closed the connection on an error
+                    pass
+                client.close()
+
+    threads = [threading.Thread(target=run_stream) for _ in range(max(1, nbr_streams))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for res in results:
+        if isinstance(res, Exception):
+            raise res
+    # every stream reports something, so nothing can go missing silently
+    assert len(results) == len(threads)
+    L_names_left = [name for (name, nbr_blocks_left) in D_nbr_blocks_left.items() if nbr_blocks_left != 0]
+    assert len(L_names_left) == 0, "Blocks of %s were never processed." % (", ".join(sorted(L_names_left)),)
+    return sum(results)
+
+
+def get_slice_args(shape, row_start, row_stop):
+    # Returns (S, D, indices) for the rows [row_start, row_stop) of a parameter.
+    S = (row_stop - row_start, shape[1])
+    D = (shape[0], shape[1])
+    indices = (np.arange(row_start, row_stop, dtype=np.intc), np.arange(0, shape[1], dtype=np.intc))
+    return (S, D, indices)
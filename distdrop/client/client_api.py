@@ -2,11 +2,15 @@
 import socket
 import time
 import re
+import collections
+import threading
+import Queue
 
 #from distdrop.client.client_api import ClientCNNAutoSplitter
 from distdrop.client.messages import *
 
-from distdrop.client.sample_dropout_indices import sample_dropout_indices
+from distdrop.client.sample_dropout_indices import SplitPlan
+from distdrop.client.client_stats import ClientStats, buffers_nbr_bytes
 
 class Client(object):
 
@@ -22,18 +26,48 @@ class Client(object):
     def __setstate__(self):
         return None
 
-    def __init__(self, server_host, port):
+    def __init__(self, server_host, port, msg_stats=None):
         super(Client, self).__init__()
 
         self.port = port
         self.server_host = server_host
         self.conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+        # Counts, bytes and latencies of every message exchanged with the server.
+        # Many clients can share the same `ClientStats`. See `client_stats.py`.
+        if msg_stats is None:
+            msg_stats = ClientStats()
+        self.msg_stats = msg_stats
+
          # `self.param_desc` will be a list when populated.
          #  its entries will be dict with keys "name", "shape", "kind".
         self.param_desc = None
+        self.L_param_desc = None
+
+        # Used by `get_param_slices_pipelined`. We never have more than
+        # `pipeline_max_in_flight` requests waiting for their response,
+        # and never more than `pipeline_max_in_flight_bytes` of requests
+        # written to the socket without having been answered.
+        # The byte limit is what prevents a deadlock where the server is
+        # blocked writing a large response that we are not reading because
+        # we are blocked writing requests that the server is not reading.
+        # It should stay well below the size of the kernel socket buffers.
+        self.pipeline_max_in_flight = 16
+        self.pipeline_max_in_flight_bytes = 64*1024
+
+        # Whether the slices send their indices in the smallest encoding
+        # (INDEX_ENCODING_ALL, RANGES or BITMASK) instead of as lists.
+        # The servers that predate those encodings reject them, so turn this
+        # on only with a server that has them. `get_param_slices_pipelined`
+        # always sends lists, so it works with any server.
+        self.want_compact_indices = False
 
     def connect(self):
         self.conn.connect((self.server_host, self.port))
+        # We send a message in a few writes and then wait for the response.
+        # With Nagle's algorithm, the last write waits for the delayed ACK
+        # of the server, which adds about 40ms to every round trip.
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
     def close(self):
         self.conn.close()
@@ -43,12 +77,27 @@ class Client(object):
         header = MsgHeader('MSG_TYPE_CLIENT_QUITS')
         header.send(self.conn)
 
+    def stats(self):
+        # A snapshot of `self.msg_stats`. See `ClientStats.snapshot`.
+        return self.msg_stats.snapshot()
+
+    def reset_stats(self):
+        self.msg_stats.reset()
+
+    def set_stats_callback(self, callback):
+        # `callback(event)` gets called after every message.
+        # See `client_stats.py` for what's in `event`.
+        self.msg_stats.set_callback(callback)
+
     def read_param_desc_from_server(self):
+        timer = self.msg_stats.start_timer('MSG_TYPE_LIST_ALL_PARAMS_DESC')
         header = MsgHeader('MSG_TYPE_LIST_ALL_PARAMS_DESC')
         header.send(self.conn)
 
         msg = MsgListAllParamsDesc()
         resp = msg.read_decode_response(self.conn)
+        timer.lap('wait')
+        timer.done(MSG_HEADER_LENGTH, 4 + msg.response_nbr_bytes)
 
         # populate self.L_param_desc to help with a lot of things
         self.L_param_desc = resp
@@ -57,24 +106,271 @@ class Client(object):
         # by just returning that structure
         return resp
         
-    def get_param_slice_from_server(self, name, S, D, indices, dtype_for_client):
+    def get_param_slice_from_server(self, name, S, D, indices, dtype_for_client, out=None):
+        # `out` is an optional preallocated contiguous array where
+        # the data received will be written directly.
 
+        timer = self.msg_stats.start_timer('MSG_TYPE_PULL_PARAM')
         header = MsgHeader('MSG_TYPE_PULL_PARAM')
-        msg = MsgPullParams(name, S, D, indices, dtype_for_client)
-
-        header.send(self.conn)
-        msg.send(self.conn)
-        return msg.read_decode_response(self.conn)
+        msg = MsgPullParams(name, S, D, indices, dtype_for_client, self.want_compact_indices)
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+
+        write_buffers(self.conn, buffers)
+        value = msg.read_decode_response(self.conn, out)
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), 4 + value.nbytes, L_pulled=[(name, value.nbytes)])
+        return value
 
 
     def update_param_slice_to_server(self, value, alpha, beta, name, S, D, indices, dtype_for_client):
         # value contains a numpy array
+        timer = self.msg_stats.start_timer('MSG_TYPE_PUSH_PARAM')
         header = MsgHeader('MSG_TYPE_PUSH_PARAM')
-        msg = MsgPushParams(value, alpha, beta, name, S, D, indices, dtype_for_client)
-
-        header.send(self.conn)
-        msg.send(self.conn)
-        return msg.read_decode_response(self.conn)
+        msg = MsgPushParams(value, alpha, beta, name, S, D, indices, dtype_for_client, self.want_compact_indices)
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+
+        # header and message go out together in one scatter-gather write
+        write_buffers(self.conn, buffers)
+        res = msg.read_decode_response(self.conn)
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), 0, L_pushed=[(name, len(buffers[-1]))])
+        return res
+
+    def exchange_param_slice_with_server(self, value, alpha, beta, name, S, D, indices, dtype_for_client, out=None):
+        # Pushes `value` like `update_param_slice_to_server`, and returns the slice
+        # that the server has right after committing it, like `get_param_slice_from_server`.
+        # The server does both while holding the write locks of the rows of the slice.
+        timer = self.msg_stats.start_timer('MSG_TYPE_EXCHANGE_PARAM')
+        header = MsgHeader('MSG_TYPE_EXCHANGE_PARAM')
+        msg = MsgExchangeParams(value, alpha, beta, name, S, D, indices, dtype_for_client, self.want_compact_indices)
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+
+        write_buffers(self.conn, buffers)
+        res = msg.read_decode_response(self.conn, out)
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), 4 + res.nbytes,
+                   L_pulled=[(name, res.nbytes)], L_pushed=[(name, len(buffers[-1]))])
+        return res
+
+    def get_param_slices_from_server(self, L_slice_args, L_out=None):
+        # `L_slice_args` is a list of tuples (name, S, D, indices, dtype_for_client)
+        # with the same meaning as the arguments of `get_param_slice_from_server`.
+        # Everything goes out as one request and comes back as one response.
+        # Returns the list of values in the same order.
+        # `L_out` is an optional list of preallocated arrays (or None entries).
+
+        timer = self.msg_stats.start_timer('MSG_TYPE_PULL_PARAMS_BATCH')
+        header = MsgHeader('MSG_TYPE_PULL_PARAMS_BATCH')
+        msg = MsgPullParamsBatch([MsgPullParams(*slice_args, want_compact_indices=self.want_compact_indices)
+                                  for slice_args in L_slice_args])
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+
+        write_buffers(self.conn, buffers)
+        L_values = msg.read_decode_response(self.conn, L_out)
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers),
+                   4 + sum(4 + value.nbytes for value in L_values),
+                   L_pulled=[(e.name, value.nbytes) for (e, value) in zip(msg.L_msg, L_values)])
+        return L_values
+
+    def get_param_slice_if_modified(self, known_version, name, S, D, indices, dtype_for_client, out=None):
+        # Same as `get_param_slice_from_server`, except that we say which version
+        # of the parameter we have (-1 for none). Returns (version, value),
+        # where `value` is None when the server still has `known_version`.
+        # See `MsgPullParamsIfModified`.
+
+        timer = self.msg_stats.start_timer('MSG_TYPE_PULL_PARAM_IF_MODIFIED')
+        header = MsgHeader('MSG_TYPE_PULL_PARAM_IF_MODIFIED')
+        msg = MsgPullParamsIfModified(known_version, name, S, D, indices, dtype_for_client, self.want_compact_indices)
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+
+        write_buffers(self.conn, buffers)
+        (version, value) = msg.read_decode_response(self.conn, out)
+        timer.lap('wait')
+        if value is None:
+            timer.done(buffers_nbr_bytes(buffers), 12)
+        else:
+            timer.done(buffers_nbr_bytes(buffers), 12 + value.nbytes, L_pulled=[(name, value.nbytes)])
+        return (version, value)
+
+    def get_param_slices_if_modified(self, L_known_versions, L_slice_args, L_out=None):
+        # Same as `get_param_slice_if_modified` for every entry of `L_known_versions`
+        # and `L_slice_args`, in one MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED.
+        # Returns the list of (version, value) in the same order.
+
+        timer = self.msg_stats.start_timer('MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED')
+        header = MsgHeader('MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED')
+        msg = MsgPullParamsBatch([MsgPullParamsIfModified(known_version, *slice_args, want_compact_indices=self.want_compact_indices)
+                                  for (known_version, slice_args) in zip(L_known_versions, L_slice_args)])
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+
+        write_buffers(self.conn, buffers)
+        L_res = msg.read_decode_response(self.conn, L_out)
+        timer.lap('wait')
+        L_pulled = [(e.name, value.nbytes) for (e, (_, value)) in zip(msg.L_msg, L_res) if value is not None]
+        timer.done(buffers_nbr_bytes(buffers),
+                   4 + 12 * len(L_res) + sum(nbr_bytes for (_, nbr_bytes) in L_pulled),
+                   L_pulled=L_pulled)
+        return L_res
+
+    def get_param_slices_pipelined(self, L_slice_args, max_in_flight=None, max_in_flight_bytes=None, L_out=None):
+        # Same arguments and return value as `get_param_slices_from_server`,
+        # but this uses only regular MSG_TYPE_PULL_PARAM messages.
+        # We write requests back to back and read the responses in order,
+        # so the link doesn't sit idle for a full round trip per parameter.
+
+        if max_in_flight is None:
+            max_in_flight = self.pipeline_max_in_flight
+        if max_in_flight_bytes is None:
+            max_in_flight_bytes = self.pipeline_max_in_flight_bytes
+        assert 1 <= max_in_flight
+
+        header_str = MsgHeader('MSG_TYPE_PULL_PARAM').encode()
+        L_msg = [MsgPullParams(*slice_args) for slice_args in L_slice_args]
+        L_values = [None] * len(L_msg)
+        if L_out is None:
+            L_out = [None] * len(L_msg)
+
+        # contains tuples (index in L_msg, bytes written for that request, timer)
+        # where the 'wait' of every request goes from its writing to its response,
+        # so those overlap
+        in_flight = collections.deque()
+        bytes_in_flight = 0
+        next_to_send = 0
+        contents = None
+
+        while next_to_send < len(L_msg) or 0 < len(in_flight):
+
+            if next_to_send < len(L_msg):
+                if contents is None:
+                    timer = self.msg_stats.start_timer('MSG_TYPE_PULL_PARAM')
+                    contents = header_str + L_msg[next_to_send].encode()
+                    timer.lap('encode')
+                # We always allow at least one request to be in flight,
+                # otherwise a single large request would never get sent.
+                if (len(in_flight) == 0 or
+                    (len(in_flight) < max_in_flight and
+                     bytes_in_flight + len(contents) <= max_in_flight_bytes)):
+                    timer.skip()
+                    write_bytes(self.conn, contents)
+                    in_flight.append((next_to_send, len(contents), timer))
+                    bytes_in_flight = bytes_in_flight + len(contents)
+                    next_to_send = next_to_send + 1
+                    contents = None
+                    continue
+
+            # the window is full (or we have nothing left to send), so we drain one response
+            (i, nbr_bytes, done_timer) = in_flight.popleft()
+            L_values[i] = L_msg[i].read_decode_response(self.conn, L_out[i])
+            bytes_in_flight = bytes_in_flight - nbr_bytes
+            done_timer.lap('wait')
+            done_timer.done(nbr_bytes, 4 + L_values[i].nbytes, L_pulled=[(L_msg[i].name, L_values[i].nbytes)])
+
+        return L_values
+
+    def update_param_slices_to_server(self, L_update_args):
+        # `L_update_args` is a list of tuples (value, alpha, beta, name, S, D, indices, dtype_for_client)
+        # with the same meaning as the arguments of `update_param_slice_to_server`.
+        timer = self.msg_stats.start_timer('MSG_TYPE_PUSH_PARAMS_BATCH')
+        header = MsgHeader('MSG_TYPE_PUSH_PARAMS_BATCH')
+        msg = MsgPushParamsBatch([MsgPushParams(*update_args, want_compact_indices=self.want_compact_indices)
+                                  for update_args in L_update_args])
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+
+        write_buffers(self.conn, buffers)
+        res = msg.read_decode_response(self.conn)
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), 0,
+                   L_pushed=[(update_args[3], update_args[0].nbytes) for update_args in L_update_args])
+        return res
+
+    def register_split_indices(self, handle, L_indices_and_D):
+        # Sends the pairs of indices once, so that the following messages can
+        # refer to them as RegisteredIndices(indices, handle, entry) where `entry`
+        # is the position in `L_indices_and_D`. See `MsgRegisterSplit`.
+        timer = self.msg_stats.start_timer('MSG_TYPE_REGISTER_SPLIT')
+        header = MsgHeader('MSG_TYPE_REGISTER_SPLIT')
+        msg = MsgRegisterSplit(handle, L_indices_and_D)
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+
+        write_buffers(self.conn, buffers)
+        res = msg.read_decode_response(self.conn)
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), 4)
+        return res
+
+    def register_seeded_split_indices(self, handle, seed, L_prob_pairs):
+        # Same thing, but the server generates the indices from the seed.
+        # Entry `k` of the split is for the parameter `self.L_param_desc[k]`.
+        # See `MsgRegisterSeededSplit`.
+        timer = self.msg_stats.start_timer('MSG_TYPE_REGISTER_SEEDED_SPLIT')
+        header = MsgHeader('MSG_TYPE_REGISTER_SEEDED_SPLIT')
+        msg = MsgRegisterSeededSplit(handle, seed, L_prob_pairs)
+        buffers = [header.encode()] + msg.encode_buffers()
+        timer.lap('encode')
+
+        write_buffers(self.conn, buffers)
+        res = msg.read_decode_response(self.conn)
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), 4)
+        return res
+
+    def init_param_seeded(self, name, distribution, scale, seed):
+        # The server fills the parameter with random values generated from the seed,
+        # so nothing but this small message goes over the network.
+        # Returns once it's done. See `MsgInitParam`.
+        timer = self.msg_stats.start_timer('MSG_TYPE_INIT_PARAM')
+        header = MsgHeader('MSG_TYPE_INIT_PARAM')
+        msg = MsgInitParam(name, distribution, scale, seed)
+        buffers = [header.encode(), msg.encode()]
+        timer.lap('encode')
+
+        write_buffers(self.conn, buffers)
+        res = msg.read_decode_response(self.conn)
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), 4)
+        return res
+
+    def get_param_digests(self, names):
+        # Returns a dict indexed by name with what the server computed on
+        # the values of every parameter (see `param_digest.py`), or None
+        # for the names that it doesn't have. Only the digests go over the network.
+        timer = self.msg_stats.start_timer('MSG_TYPE_PARAM_DIGEST')
+        header = MsgHeader('MSG_TYPE_PARAM_DIGEST')
+        msg = MsgParamDigest(names)
+        buffers = [header.encode(), msg.encode()]
+        timer.lap('encode')
+
+        write_buffers(self.conn, buffers)
+        D_digests = msg.read_decode_response(self.conn)
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), msg.get_response_nbr_bytes())
+        return D_digests
+
+    def get_param_lock_stats(self, names):
+        # Returns a dict indexed by name with the counters of the locks of every
+        # parameter on the server (see MsgParamLockStats), or None for the
+        # names that it doesn't have. The counters only go up, so to see the
+        # contention during some work, look at the difference before and after.
+        timer = self.msg_stats.start_timer('MSG_TYPE_PARAM_LOCK_STATS')
+        header = MsgHeader('MSG_TYPE_PARAM_LOCK_STATS')
+        msg = MsgParamLockStats(names)
+        buffers = [header.encode(), msg.encode()]
+        timer.lap('encode')
+
+        write_buffers(self.conn, buffers)
+        D_stats = msg.read_decode_response(self.conn)
+        timer.lap('wait')
+        timer.done(buffers_nbr_bytes(buffers), msg.get_response_nbr_bytes())
+        return D_stats
 
     def get_param_desc(self, name):
         if self.L_param_desc is None:
@@ -101,8 +397,273 @@ class Client(object):
         print("RECEIVING STUFF FROM SERVER")
         return True
 
-# TODO : think about the possibility of having float16 
-#        be used to cache the values for `want_delta_updates`
+# The server has one thread per connection, so a single connection
+# handles the parameters one after the other even though each parameter
+# has its own mutex on the server. A `ClientPool` opens `nbr_streams`
+# connections to the same server and spreads the slices of a request
+# over all of them, so that different parameters are handled by
+# different server threads at the same time.
+#
+# Every connection has its own thread on our side too, because
+# the sockets are blocking. The parameters are assigned to the streams
+# so that they all get roughly the same number of bytes.
+
+class ClientPool(object):
+
+    def __init__(self, server_host, port, nbr_streams, msg_stats=None, want_compact_indices=False):
+        assert 1 <= nbr_streams
+
+        self.server_host = server_host
+        self.port = port
+        self.nbr_streams = nbr_streams
+
+        # All the streams record their messages in the same `ClientStats`.
+        if msg_stats is None:
+            msg_stats = ClientStats()
+        self.msg_stats = msg_stats
+
+        self.L_clients = [Client(server_host, port, msg_stats) for _ in range(nbr_streams)]
+        # see `Client.want_compact_indices`
+        for client in self.L_clients:
+            client.want_compact_indices = want_compact_indices
+        # The jobs for stream `i` are in `L_jobs[i]`.
+        # They are tuples (func, args, results, done) or None to stop.
+        self.L_jobs = [Queue.Queue() for _ in range(nbr_streams)]
+        self.L_threads = []
+
+        # Indexed by stream. Updated only by the thread of that stream.
+        self.L_stream_stats = [{'nbr_bytes_pulled' : 0,
+                                'nbr_bytes_pushed' : 0,
+                                'total_time_busy' : 0.0} for _ in range(nbr_streams)]
+
+        # Used by `assign_to_streams`.
+        self.D_stream_of_name = {}
+        self.L_stream_load = [0] * nbr_streams
+
+    def connect(self):
+        for client in self.L_clients:
+            client.connect()
+
+        for i in range(self.nbr_streams):
+            thread = threading.Thread(target=self.run_stream, args=(i,))
+            thread.daemon = True
+            thread.start()
+            self.L_threads.append(thread)
+
+    def close(self):
+        for jobs in self.L_jobs:
+            jobs.put(None)
+        for thread in self.L_threads:
+            thread.join()
+        self.L_threads = []
+
+        for client in self.L_clients:
+            client.close()
+
+    def quit(self):
+        # call this before calling `close`
+        for client in self.L_clients:
+            client.quit()
+
+    def run_stream(self, i):
+        while True:
+            job = self.L_jobs[i].get()
+            if job is None:
+                return
+
+            (func, args, results, done) = job
+            tic = time.time()
+            try:
+                results[i] = func(self.L_clients[i], self.L_stream_stats[i], *args)
+            except Exception as e:
+                results[i] = e
+            self.L_stream_stats[i]['total_time_busy'] = self.L_stream_stats[i]['total_time_busy'] + (time.time() - tic)
+            done.put(i)
+
+    def run_on_streams(self, L_jobs_args, func):
+        # Calls `func(client, stream_stats, *args)` on the thread of every stream
+        # for which `L_jobs_args` has args that are not None, and waits for all of them.
+        # Returns the list of results, indexed by stream.
+
+        results = [None] * self.nbr_streams
+        done = Queue.Queue()
+
+        nbr_jobs = 0
+        for (i, args) in enumerate(L_jobs_args):
+            if args is not None:
+                self.L_jobs[i].put((func, args, results, done))
+                nbr_jobs = nbr_jobs + 1
+
+        for _ in range(nbr_jobs):
+            done.get()
+
+        for res in results:
+            if isinstance(res, Exception):
+                raise res
+        return results
+
+    def assign_to_streams(self, L_names, L_nbr_bytes):
+        # Returns a list of lists of positions in `L_names`, one list for each stream.
+        #
+        # A parameter always goes through the same stream. The pushes don't get
+        # any response, so this is what guarantees that a pull following a push
+        # of the same parameter sees that push.
+        #
+        # The parameters that we see for the first time go to the stream with the
+        # fewest bytes so far, the largest ones first.
+
+        for k in sorted(range(len(L_names)), key=lambda k: -L_nbr_bytes[k]):
+            if not self.D_stream_of_name.has_key(L_names[k]):
+                i = self.L_stream_load.index(min(self.L_stream_load))
+                self.D_stream_of_name[L_names[k]] = i
+                self.L_stream_load[i] = self.L_stream_load[i] + L_nbr_bytes[k]
+
+        L_assigned = [[] for _ in range(self.nbr_streams)]
+        for (k, name) in enumerate(L_names):
+            L_assigned[self.D_stream_of_name[name]].append(k)
+        return L_assigned
+
+    def run_on_stream_of(self, name, nbr_bytes, func):
+        # Calls `func(client, stream_stats)` on the thread of the stream
+        # that handles `name` (see `assign_to_streams`), and returns its result.
+        L_assigned = self.assign_to_streams([name], [nbr_bytes])
+        i = self.D_stream_of_name[name]
+        return self.run_on_streams([() if assigned else None for assigned in L_assigned], func)[i]
+
+    def get_param_slice_from_server(self, name, S, D, indices, dtype_for_client, out=None):
+        # Same as `Client.get_param_slice_from_server`, on the stream of `name`.
+        def pull(client, stream_stats):
+            value = client.get_param_slice_from_server(name, S, D, indices, dtype_for_client, out)
+            stream_stats['nbr_bytes_pulled'] = stream_stats['nbr_bytes_pulled'] + value.nbytes
+            return value
+
+        return self.run_on_stream_of(name, S[0] * S[1], pull)
+
+    def update_param_slice_to_server(self, value, alpha, beta, name, S, D, indices, dtype_for_client):
+        # Same as `Client.update_param_slice_to_server`, on the stream of `name`.
+        def push(client, stream_stats):
+            res = client.update_param_slice_to_server(value, alpha, beta, name, S, D, indices, dtype_for_client)
+            stream_stats['nbr_bytes_pushed'] = stream_stats['nbr_bytes_pushed'] + value.nbytes
+            return res
+
+        return self.run_on_stream_of(name, value.nbytes, push)
+
+    def exchange_param_slice_with_server(self, value, alpha, beta, name, S, D, indices, dtype_for_client, out=None):
+        # Same as `Client.exchange_param_slice_with_server`, on the stream of `name`.
+        def exchange(client, stream_stats):
+            res = client.exchange_param_slice_with_server(value, alpha, beta, name, S, D, indices, dtype_for_client, out)
+            stream_stats['nbr_bytes_pushed'] = stream_stats['nbr_bytes_pushed'] + value.nbytes
+            stream_stats['nbr_bytes_pulled'] = stream_stats['nbr_bytes_pulled'] + res.nbytes
+            return res
+
+        return self.run_on_stream_of(name, value.nbytes, exchange)
+
+    def get_param_slices_from_server(self, L_slice_args, L_out=None, L_nbr_bytes=None):
+        # Same as `Client.get_param_slices_from_server`, with every stream
+        # pulling its share of the slices as one MSG_TYPE_PULL_PARAMS_BATCH.
+        # `L_nbr_bytes` is the expected size of every slice, used to balance
+        # the streams. Without it, we just count the entries of the slices.
+
+        if L_out is None:
+            L_out = [None] * len(L_slice_args)
+        if L_nbr_bytes is None:
+            L_nbr_bytes = [S[0] * S[1] for (_, S, _, _, _) in L_slice_args]
+
+        L_assigned = self.assign_to_streams([slice_args[0] for slice_args in L_slice_args], L_nbr_bytes)
+
+        def pull(client, stream_stats, assigned):
+            L_values = client.get_param_slices_from_server([L_slice_args[k] for k in assigned],
+                                                           [L_out[k] for k in assigned])
+            stream_stats['nbr_bytes_pulled'] = stream_stats['nbr_bytes_pulled'] + sum(value.nbytes for value in L_values)
+            return L_values
+
+        results = self.run_on_streams([(assigned,) if assigned else None for assigned in L_assigned], pull)
+
+        L_values = [None] * len(L_slice_args)
+        for (assigned, L_stream_values) in zip(L_assigned, results):
+            for (k, value) in zip(assigned, L_stream_values or []):
+                L_values[k] = value
+        return L_values
+
+    def get_param_slices_if_modified(self, L_known_versions, L_slice_args, L_out=None, L_nbr_bytes=None):
+        # Same as `Client.get_param_slices_if_modified`, spread over the streams
+        # like `get_param_slices_from_server`.
+
+        if L_out is None:
+            L_out = [None] * len(L_slice_args)
+        if L_nbr_bytes is None:
+            L_nbr_bytes = [S[0] * S[1] for (_, S, _, _, _) in L_slice_args]
+
+        L_assigned = self.assign_to_streams([slice_args[0] for slice_args in L_slice_args], L_nbr_bytes)
+
+        def pull(client, stream_stats, assigned):
+            L_res = client.get_param_slices_if_modified([L_known_versions[k] for k in assigned],
+                                                        [L_slice_args[k] for k in assigned],
+                                                        [L_out[k] for k in assigned])
+            stream_stats['nbr_bytes_pulled'] = stream_stats['nbr_bytes_pulled'] + sum(value.nbytes for (_, value) in L_res if value is not None)
+            return L_res
+
+        results = self.run_on_streams([(assigned,) if assigned else None for assigned in L_assigned], pull)
+
+        L_res = [None] * len(L_slice_args)
+        for (assigned, L_stream_res) in zip(L_assigned, results):
+            for (k, res) in zip(assigned, L_stream_res or []):
+                L_res[k] = res
+        return L_res
+
+    def update_param_slices_to_server(self, L_update_args):
+        # Same as `Client.update_param_slices_to_server`, with every stream
+        # pushing its share of the slices as one MSG_TYPE_PUSH_PARAMS_BATCH.
+
+        L_assigned = self.assign_to_streams([update_args[3] for update_args in L_update_args],
+                                            [update_args[0].nbytes for update_args in L_update_args])
+
+        def push(client, stream_stats, assigned):
+            client.update_param_slices_to_server([L_update_args[k] for k in assigned])
+            stream_stats['nbr_bytes_pushed'] = stream_stats['nbr_bytes_pushed'] + sum(L_update_args[k][0].nbytes for k in assigned)
+
+        self.run_on_streams([(assigned,) if assigned else None for assigned in L_assigned], push)
+
+    def register_split_indices(self, handle, L_indices_and_D):
+        # The splits are registered per connection, so we register on every stream.
+        def register(client, stream_stats):
+            return client.register_split_indices(handle, L_indices_and_D)
+
+        self.run_on_streams([()] * self.nbr_streams, register)
+
+    def register_seeded_split_indices(self, handle, seed, L_prob_pairs):
+        def register(client, stream_stats):
+            return client.register_seeded_split_indices(handle, seed, L_prob_pairs)
+
+        self.run_on_streams([()] * self.nbr_streams, register)
+
+    def get_param_digests(self, names):
+        # Asks for every digest on the stream that pushes that parameter,
+        # so that they include the pushes that we made before.
+        names = list(names)
+        L_assigned = self.assign_to_streams(names, [0] * len(names))
+
+        def digest(client, stream_stats, assigned):
+            return client.get_param_digests([names[k] for k in assigned])
+
+        D_digests = {}
+        for D_stream_digests in self.run_on_streams([(assigned,) if assigned else None for assigned in L_assigned], digest):
+            D_digests.update(D_stream_digests or {})
+        return D_digests
+
+    def get_stream_stats(self):
+        # Returns a list with the stats of every stream, including their throughput in MB/s.
+        L_res = []
+        for stream_stats in self.L_stream_stats:
+            res = dict(stream_stats)
+            nbr_bytes = res['nbr_bytes_pulled'] + res['nbr_bytes_pushed']
+            if 0.0 < res['total_time_busy']:
+                res['MB_per_sec'] = (1.0 * nbr_bytes / 1000 / 1000) / res['total_time_busy']
+            else:
+                res['MB_per_sec'] = 0.0
+            L_res.append(res)
+        return L_res
+
 
 # TODO : You might want to shuffle that the list of parameters in order
 #        to desynchronize the clients and speed up certain
@@ -123,27 +684,104 @@ class ClientCNNAutoSplitter(Client):
     # certain configurations make sense.
     def __init__(self,  server_host, port,
                         alpha, beta,
-                        want_delta_updates):
+                        want_delta_updates,
+                        dtype_for_client=DTYPE_FLOAT32,
+                        want_error_feedback=False,
+                        delta_threshold=None,
+                        delta_cache_dtype=np.float16,
+                        nbr_streams=1,
+                        want_registered_splits=False,
+                        want_versioned_cache=False,
+                        want_compact_indices=False,
+                        msg_stats=None):
+
+        super(ClientCNNAutoSplitter, self).__init__(server_host, port, msg_stats)
+        # see `Client.want_compact_indices`
+        self.want_compact_indices = want_compact_indices
+
+        # With more than one stream, the pulls and pushes go through a `ClientPool`
+        # with that many connections of its own, in batches or one parameter at
+        # a time. A parameter always goes through the same stream, so a pull sees
+        # the pushes made before it, whichever methods made them.
+        # Everything else still uses `self.conn`. The server handles the connections
+        # independently, so nothing orders those messages with the ones of the streams.
+        if 1 < nbr_streams:
+            self.pool = ClientPool(server_host, port, nbr_streams, self.msg_stats, want_compact_indices)
+        else:
+            self.pool = None
+
+        # Compiled by `get_split_plan` from `self.L_param_desc`.
+        self.split_plan = None
+        self.split_plan_L_param_desc = None
+
+        # With `want_registered_splits`, `perform_split` sends the indices of the
+        # new split to the server once (see `register_split`), and then the pulls
+        # and pushes send only a handle instead of the indices.
+        # The server keeps only the last few splits registered on a connection,
+        # so don't hold on to old splits with this.
+        self.want_registered_splits = want_registered_splits
+        self.next_split_handle = 0
 
-        super(ClientCNNAutoSplitter, self).__init__(server_host, port)
+        # The seed given to `perform_split`, if any, so that the split can be
+        # generated again with `get_split_plan().sample_seeded`.
+        self.split_seed = None
 
         # indexed by root_name, just like the splits themselves.
-        # The timestamps are for the duchi scaling (no longer supported).
         self.splits_indices = {}
 
-        self.splits_timestamp_pull = {}
-        self.splits_timestamp_push = {}
-        self.total_time_spent_pulling = 0.0
-        self.total_time_spent_pushing = 0.0
+        # With `want_versioned_cache`, we keep the last slice pulled of every
+        # parameter, as received, with the version that the server gave us.
+        # The pulls then send that version, and the server doesn't send the
+        # values again when nobody has changed the parameter since.
+        # This is for the clients that pull the same slices over and over,
+        # like evaluation workers calling `pull_entire_params`. With dropout,
+        # the split changes every time and the cache won't help much.
+        #
+        # Indexed by param name, with entries (version, slice_args, value)
+        # where `slice_args` are those of `get_param_slices_from_server`.
+        # It uses as much memory as the slices. The versions mean something
+        # only to the server that gave them, and we never connect to another one.
+        self.want_versioned_cache = want_versioned_cache
+        self.versioned_cache = {}
 
         # indexed by param name, optional.
         # Only used when `want_delta_updates` is True.
-        # Consumes a lot more memory because we cache the parameters.
+        # Consumes a lot more memory because we cache the parameters,
+        # which is why we store them as float16 by default.
+        #
+        # With `want_delta_updates`, we push `updated_value - cached_value`
+        # with alpha=1.0 so that the server adds our contribution to whatever
+        # the other clients have pushed in the meantime.
+        #
+        # The values that the pulls return are exactly the cached ones
+        # (rounded to float16 and back), so that pushing them back unchanged
+        # sends a delta of zero instead of the rounding error.
+        # After a push, we cache `updated_value` as float32 until the next pull,
+        # because that's exactly what the server got from us.
+        #
+        # With a `delta_threshold`, the rows of the delta (along the first
+        # dimension of the slice) whose largest absolute value is below the
+        # threshold are dropped from the push. What we drop isn't lost : it goes
+        # into `error_feedback_residuals` and gets added to the next push.
         self.splits_cached_values = {}
-
-        # Just leave this there for now. Maybe we'll change that dtype_for_client
-        # eventually to work with something other than float32
-        # self.dtype_for_client = DTYPE_FLOAT32
+        self.delta_threshold = delta_threshold
+        self.delta_cache_dtype = delta_cache_dtype
+
+        # The dtype used on the wire. The server always stores float32 and
+        # we always hand float32 arrays to the user, but DTYPE_FLOAT16
+        # halves the number of bytes sent in both directions.
+        # `D_dtype_for_client` overrides it for specific parameters
+        # (see `set_dtype_for_client`).
+        self.dtype_for_client = dtype_for_client
+        self.D_dtype_for_client = {}
+
+        # Only used with DTYPE_FLOAT16 when `want_error_feedback` is True.
+        # We remember the rounding error of every push and add it back
+        # to the next push touching the same entries, so that repeated
+        # float16 pushes don't drift. Indexed by param name, and every
+        # residual has the shape of the whole parameter.
+        self.want_error_feedback = want_error_feedback
+        self.error_feedback_residuals = {}
 
         # An ordered list of the layers by number.
         # Populated when you can `read_param_desc_from_server()`
@@ -154,15 +792,174 @@ class ClientCNNAutoSplitter(Client):
         self.alpha = alpha
         self.beta = beta
         self.want_delta_updates = want_delta_updates        
+        if self.want_delta_updates:
+            assert self.alpha == 1.0, "Delta updates only make sense with alpha=1.0, but we got alpha=%f." % self.alpha
+
+
+    @classmethod
+    def new_basic_alpha_beta(cls, server_host, port, alpha, beta, nbr_streams=1, want_registered_splits=False,
+                             want_versioned_cache=False, want_compact_indices=False):
+        assert alpha is not None
+        assert beta is not None
+        return cls( server_host, port,
+                    alpha=alpha, beta=beta,
+                    want_delta_updates=False,
+                    nbr_streams=nbr_streams,
+                    want_registered_splits=want_registered_splits,
+                    want_versioned_cache=want_versioned_cache,
+                    want_compact_indices=want_compact_indices)
+
+    def connect(self):
+        super(ClientCNNAutoSplitter, self).connect()
+        if self.pool is not None:
+            self.pool.connect()
+
+    def close(self):
+        super(ClientCNNAutoSplitter, self).close()
+        if self.pool is not None:
+            self.pool.close()
+
+    def quit(self):
+        super(ClientCNNAutoSplitter, self).quit()
+        if self.pool is not None:
+            self.pool.quit()
+
+    def get_param_digests(self, names):
+        # With streams, the pushes go through them and not
+        # through our own connection, so the digests have to as well.
+        if self.pool is not None:
+            return self.pool.get_param_digests(names)
+        return super(ClientCNNAutoSplitter, self).get_param_digests(names)
+
+    def get_param_slice_from_server(self, name, S, D, indices, dtype_for_client, out=None):
+        # With streams, the slices of a single parameter go through the stream of
+        # that parameter, like its batches, and not through our own connection.
+        if self.pool is not None:
+            return self.pool.get_param_slice_from_server(name, S, D, indices, dtype_for_client, out)
+        return super(ClientCNNAutoSplitter, self).get_param_slice_from_server(name, S, D, indices, dtype_for_client, out)
+
+    def update_param_slice_to_server(self, value, alpha, beta, name, S, D, indices, dtype_for_client):
+        if self.pool is not None:
+            return self.pool.update_param_slice_to_server(value, alpha, beta, name, S, D, indices, dtype_for_client)
+        return super(ClientCNNAutoSplitter, self).update_param_slice_to_server(value, alpha, beta, name, S, D, indices, dtype_for_client)
+
+    def exchange_param_slice_with_server(self, value, alpha, beta, name, S, D, indices, dtype_for_client, out=None):
+        if self.pool is not None:
+            return self.pool.exchange_param_slice_with_server(value, alpha, beta, name, S, D, indices, dtype_for_client, out)
+        return super(ClientCNNAutoSplitter, self).exchange_param_slice_with_server(value, alpha, beta, name, S, D, indices, dtype_for_client, out)
 
+    def get_stream_stats(self):
+        # Returns the stats of every stream of the pool, or [] without a pool.
+        if self.pool is None:
+            return []
+        return self.pool.get_stream_stats()
 
     @classmethod
-    def new_basic_alpha_beta(cls, server_host, port, alpha, beta):
+    def new_float16_alpha_beta(cls, server_host, port, alpha, beta, want_error_feedback=True):
+        # Same as `new_basic_alpha_beta`, but everything travels as float16.
         assert alpha is not None
         assert beta is not None
         return cls( server_host, port,
                     alpha=alpha, beta=beta,
-                    want_delta_updates=False)
+                    want_delta_updates=False,
+                    dtype_for_client=DTYPE_FLOAT16,
+                    want_error_feedback=want_error_feedback)
+
+
+    def set_dtype_for_client(self, dtype_for_client, names=None):
+        # Without `names`, this changes the default for all the parameters.
+        assert dtype_for_client in (DTYPE_FLOAT16, DTYPE_FLOAT32)
+        if names is None:
+            self.dtype_for_client = dtype_for_client
+        else:
+            for name in names:
+                self.D_dtype_for_client[name] = dtype_for_client
+
+    def get_dtype_for_client(self, name):
+        return self.D_dtype_for_client.get(name, self.dtype_for_client)
+
+    def get_out_for_wire(self, name, out):
+        # We can receive directly into `out` only when nothing
+        # has to be converted after the data arrives.
+        if self.get_dtype_for_client(name) == DTYPE_FLOAT32:
+            return out
+        else:
+            return None
+
+    def decode_pulled_value(self, value, original_shape, out=None):
+        # Returns float32 values with the `original_shape`,
+        # converting what we received if the wire dtype was not float32.
+        if value.dtype == np.float32:
+            return value.reshape(original_shape)
+        elif out is None:
+            return value.astype(np.float32).reshape(original_shape)
+        else:
+            out[...] = value.reshape(original_shape)
+            return out
+
+    def get_error_feedback_residual(self, name):
+        if not self.error_feedback_residuals.has_key(name):
+            param_desc = self.get_param_desc(name)
+            self.error_feedback_residuals[name] = np.zeros(param_desc['shape'], dtype=np.float32)
+        return self.error_feedback_residuals[name]
+
+    def encode_delta_value(self, name, updated_value, indices):
+        # Returns `(indices, delta)` to be pushed instead of `updated_value`.
+        # The `indices` returned can have fewer rows than the ones given
+        # when we have a `delta_threshold`.
+
+        assert self.splits_cached_values.has_key(name), "You need to pull %s before pushing it with delta updates." % name
+        cached_value = self.splits_cached_values[name]
+        assert cached_value.shape == updated_value.shape
+
+        delta = np.asarray(updated_value, dtype=np.float32) - cached_value
+        # If we push twice without pulling in between, the second push
+        # should be relative to the first one. Rounding it to float16
+        # would add the rounding error to the second push.
+        self.splits_cached_values[name] = np.array(updated_value, dtype=np.float32)
+
+        if self.delta_threshold is None:
+            return (indices, delta)
+
+        residual = self.get_error_feedback_residual(name)
+        ix = np.ix_(indices[0], indices[1])
+        delta = delta + residual[ix]
+
+        rows_magnitude = np.max(np.abs(delta.reshape((delta.shape[0], -1))), axis=1)
+        rows_kept = self.delta_threshold <= rows_magnitude
+
+        # everything that we don't send stays in the residual
+        residual[ix] = delta
+        kept_indices = (indices[0][rows_kept], indices[1])
+        residual[np.ix_(kept_indices[0], kept_indices[1])] = 0.0
+
+        return (kept_indices, delta[rows_kept])
+
+    def encode_pushed_value(self, name, updated_value, indices):
+        # Converts `updated_value` to the wire dtype for `name`.
+        # This doesn't copy anything if we already have contiguous values with that dtype.
+
+        dtype_for_client = self.get_dtype_for_client(name)
+        wire_dtype = dtype_int_to_numpy_dict[dtype_for_client]
+
+        if dtype_for_client == DTYPE_FLOAT32 or not self.want_error_feedback:
+            return np.ascontiguousarray(updated_value, dtype=wire_dtype)
+
+        residual = self.get_error_feedback_residual(name)
+        ix = np.ix_(indices[0], indices[1])
+        corrected_value = updated_value + residual[ix]
+        encoded_value = corrected_value.astype(wire_dtype)
+        residual[ix] = corrected_value - encoded_value
+        return encoded_value
+
+
+    @classmethod
+    def new_delta_updates(cls, server_host, port, beta=1.0, delta_threshold=None):
+        # The server does `param = 1.0 * param + beta * (updated_value - cached_value)`.
+        return cls( server_host, port,
+                    alpha=1.0, beta=beta,
+                    want_delta_updates=True,
+                    delta_threshold=delta_threshold)
 
 
     #@staticmethod
@@ -186,7 +983,7 @@ class ClientCNNAutoSplitter(Client):
             print "Failed to get layer number from %s." % name
             return None
 
-    def perform_split(self, D_dropout_prob_pairs):
+    def perform_split(self, D_dropout_prob_pairs, seed=None):
 
         # D_dropout_prob_pairs is a dict with keys being layer names (e.g. "layer_0" and "layer_17").
         # The values are pairs of real numbers in [0.0,1.0]
@@ -198,25 +995,124 @@ class ClientCNNAutoSplitter(Client):
         # the variables with names having suffixes too.
         #    ["layer_0_b_momentum", "layer_0_b_decay",
         #     "layer_0_W_momentum", "layer_0_W_decay"]
+        #
+        # With a `seed` (an integer in [0, 2**64)), the split depends only on
+        # the seed instead of `np.random`, and with `want_registered_splits`
+        # we send only the seed to the server, which generates the same split.
 
         if self.L_param_desc is None:
             self.read_param_desc_from_server()
             assert self.L_param_desc is not None
 
-        self.splits_indices = sample_dropout_indices(self.L_param_desc,
-                                                     D_dropout_prob_pairs)
-
-    def pull_entire_param(self, name):
+        self.split_seed = seed
+        if seed is None:
+            self.splits_indices = self.get_split_plan().sample(D_dropout_prob_pairs)
+            if self.want_registered_splits:
+                self.register_split()
+        else:
+            self.splits_indices = self.get_split_plan().sample_seeded(seed, D_dropout_prob_pairs)
+            if self.want_registered_splits:
+                self.register_seeded_split(seed, D_dropout_prob_pairs)
+
+    def prepare_registered_split(self, splits_indices):
+        # Returns (handle, L_indices_and_D, registered_splits_indices).
+        # The variables that share the same pair of indices
+        # (ex : "layer_0_W" and "layer_0_W_momentum") share the same entry.
+
+        handle = self.next_split_handle
+        self.next_split_handle = (self.next_split_handle + 1) % (2**31)
+
+        L_indices_and_D = []
+        D_registered = {}
+        registered_splits_indices = {}
+        for name in sorted(splits_indices.keys()):
+            indices = splits_indices[name]
+            param_desc = self.get_param_desc(name)
+            D = (param_desc['shape'][0], param_desc['shape'][1])
+            key = (id(indices), D)
+            if not D_registered.has_key(key):
+                D_registered[key] = RegisteredIndices(indices, handle, len(L_indices_and_D))
+                L_indices_and_D.append((indices, D))
+            registered_splits_indices[name] = D_registered[key]
+
+        return (handle, L_indices_and_D, registered_splits_indices)
+
+    def register_split(self, splits_indices=None):
+        # Registers the split on the server and returns it with every pair
+        # of indices replaced by its `RegisteredIndices`.
+        # Without `splits_indices`, this registers `self.splits_indices` and replaces it.
+
+        want_replace = splits_indices is None
+        if want_replace:
+            splits_indices = self.splits_indices
+
+        (handle, L_indices_and_D, registered_splits_indices) = self.prepare_registered_split(splits_indices)
+        self.register_split_indices(handle, L_indices_and_D)
+        if self.pool is not None:
+            self.pool.register_split_indices(handle, L_indices_and_D)
+
+        if want_replace:
+            self.splits_indices = registered_splits_indices
+        return registered_splits_indices
+
+    def prepare_registered_seeded_split(self, seed, D_dropout_prob_pairs, splits_indices):
+        # Returns (handle, L_prob_pairs, registered_splits_indices).
+        # The server makes one entry per parameter, in the order of `self.L_param_desc`.
+
+        handle = self.next_split_handle
+        self.next_split_handle = (self.next_split_handle + 1) % (2**31)
+
+        L_prob_pairs = self.get_split_plan().get_seeded_prob_pairs(D_dropout_prob_pairs)
+        registered_splits_indices = {}
+        for (entry, param_desc) in enumerate(self.L_param_desc):
+            name = param_desc['name']
+            registered_splits_indices[name] = RegisteredIndices(splits_indices[name], handle, entry)
+
+        return (handle, L_prob_pairs, registered_splits_indices)
+
+    def register_seeded_split(self, seed, D_dropout_prob_pairs, splits_indices=None):
+        # Like `register_split`, for a split that came from
+        # `get_split_plan().sample_seeded(seed, D_dropout_prob_pairs)`.
+        # Only the seed and the probabilities are sent.
+
+        want_replace = splits_indices is None
+        if want_replace:
+            splits_indices = self.splits_indices
+
+        (handle, L_prob_pairs, registered_splits_indices) = self.prepare_registered_seeded_split(seed, D_dropout_prob_pairs, splits_indices)
+        self.register_seeded_split_indices(handle, seed, L_prob_pairs)
+        if self.pool is not None:
+            self.pool.register_seeded_split_indices(handle, seed, L_prob_pairs)
+
+        if want_replace:
+            self.splits_indices = registered_splits_indices
+        return registered_splits_indices
+
+    def get_split_plan(self):
+        # The `SplitPlan` for `self.L_param_desc`, compiled
+        # again only when the descriptions are read again.
+        if self.split_plan is None or self.split_plan_L_param_desc is not self.L_param_desc:
+            self.split_plan = SplitPlan(self.L_param_desc)
+            self.split_plan_L_param_desc = self.L_param_desc
+        return self.split_plan
+
+    def pull_entire_param(self, name, out=None):
+        # `out` is an optional float32 array with the shape of the parameter.
+        # When it's given, the value is received directly into it.
+
+        if self.want_versioned_cache:
+            return self.pull_entire_params([name], {name : out} if out is not None else None)[name]
 
         param_desc = self.get_param_desc(name)
         assert param_desc is not None
 
         D = (param_desc['shape'][0], param_desc['shape'][1])
-        dtype_for_client = DTYPE_FLOAT32 # from messages.py
+        dtype_for_client = self.get_dtype_for_client(name)
         indices = (np.arange(0, D[0], dtype=np.intc), np.arange(0, D[1], dtype=np.intc))
 
-        value = self.get_param_slice_from_server(name, D, D, indices, dtype_for_client)
-        value = value.reshape(param_desc['shape'])
+        value = self.get_param_slice_from_server(name, D, D, indices, dtype_for_client,
+                                                 self.get_out_for_wire(name, out))
+        value = self.decode_pulled_value(value, param_desc['shape'], out)
 
         return value
 
@@ -229,10 +1125,10 @@ class ClientCNNAutoSplitter(Client):
         assert param_desc is not None
 
         D = (param_desc['shape'][0], param_desc['shape'][1])
-        dtype_for_client = DTYPE_FLOAT32 # from messages.py
+        dtype_for_client = self.get_dtype_for_client(name)
         indices = (np.arange(0, D[0], dtype=np.intc), np.arange(0, D[1], dtype=np.intc))
 
-        updated_value = updated_value.astype(np.float32)
+        updated_value = self.encode_pushed_value(name, updated_value, indices)
 
         self.update_param_slice_to_server(updated_value,
             self.alpha, self.beta,
@@ -241,67 +1137,285 @@ class ClientCNNAutoSplitter(Client):
             dtype_for_client)
 
 
-    def pull_split_param(self, name):
+    def get_split_slice_args(self, name):
+        # Returns (param_desc, S, D, indices) for the current split of `name`.
 
         indices = self.splits_indices[name]
         param_desc = self.get_param_desc(name)
         assert param_desc is not None
 
-
         S = (len(indices[0]), len(indices[1]))
         D = (param_desc['shape'][0], param_desc['shape'][1])
-        dtype_for_client = DTYPE_FLOAT32 # from messages.py
+        return (param_desc, S, D, indices)
 
-        self.splits_timestamp_pull[name] = time.time()
-        value = self.get_param_slice_from_server(name, S, D, indices, dtype_for_client)
+    def pull_split_param(self, name, out=None):
+        # `out` is an optional float32 array with the shape of the slice.
+        # When it's given, the value is received directly into it.
 
-        original_shape = (S[0], S[1], param_desc['shape'][2], param_desc['shape'][3])
-        value = value.reshape(original_shape)
+        if self.want_versioned_cache:
+            return self.pull_split_params([name], D_out={name : out} if out is not None else None)[name]
+
+        (param_desc, S, D, indices) = self.get_split_slice_args(name)
+        dtype_for_client = self.get_dtype_for_client(name)
+
+        value = self.get_param_slice_from_server(name, S, D, indices, dtype_for_client,
+                                                 self.get_out_for_wire(name, out))
 
         # debug
         #if name == "layer_7_b":
         #    print "pull_split_param layer_7_b :"
         #    print value.reshape((-1,))
 
+        return self.decode_split_value(name, value, 'MSG_TYPE_PULL_PARAM', out)
 
-        # TODO :
-        # if self.want_delta_updated  ... store the value in self.splits_cached_values[name]
+    def decode_split_value(self, name, value, msg_type_str, out=None):
+        # What we do with a slice of the current split of `name` that we just received.
+        tic = time.time()
+        (param_desc, S, D, indices) = self.get_split_slice_args(name)
+        original_shape = (S[0], S[1], param_desc['shape'][2], param_desc['shape'][3])
+        value = self.decode_pulled_value(value, original_shape, out)
+
+        if self.want_delta_updates:
+            self.cache_split_value(name, value)
 
-        self.total_time_spent_pulling = self.total_time_spent_pulling + (time.time() - self.splits_timestamp_pull[name])
+        self.msg_stats.record_decode(msg_type_str, [name], time.time() - tic)
         return value
 
+    def cache_split_value(self, name, value):
+        # For `want_delta_updates`. Caches the float32 `value` that we just pulled,
+        # and replaces it in place by what we cached, when that's float16.
+        cached_value = value.astype(self.delta_cache_dtype)
+        if cached_value.dtype != value.dtype:
+            value[...] = cached_value
+        self.splits_cached_values[name] = cached_value
+
     
+    def get_split_push_args(self, name, updated_value):
+        # Returns the arguments for `update_param_slice_to_server`
+        # to push `updated_value` for the current split of `name`,
+        # or None when there is nothing left to push.
+
+        (param_desc, S, D, indices) = self.get_split_slice_args(name)
+
+        if self.want_delta_updates:
+            (indices, updated_value) = self.encode_delta_value(name, updated_value, indices)
+            S = (len(indices[0]), len(indices[1]))
+            if S[0] == 0:
+                return None
+
+        return (self.encode_pushed_value(name, updated_value, indices),
+                self.alpha, self.beta,
+                name,
+                S, D, indices,
+                self.get_dtype_for_client(name))
+
     def push_split_param(self, name, updated_value):
         # `updated_value` has the same shape as the `value` from `pull_split_param`.
 
         # maybe have an assertion here concerning the contiguous memory allocation requirement
 
-        indices = self.splits_indices[name]
-        param_desc = self.get_param_desc(name)
-        assert param_desc is not None
+        update_args = self.get_split_push_args(name, updated_value)
 
+        # Then we sent the updates to the server here.
+        if update_args is not None:
+            self.update_param_slice_to_server(*update_args)
 
-        S = (len(indices[0]), len(indices[1]))
-        D = (param_desc['shape'][0], param_desc['shape'][1])
-        dtype_for_client = DTYPE_FLOAT32 # from messages.py
+        # We're done. Nothing to return.
+        return
 
-        updated_value = updated_value.astype(np.float32)
+    def exchange_split_param(self, name, updated_value, out=None):
+        # Same as `push_split_param` followed by `pull_split_param`, but in one
+        # MSG_TYPE_EXCHANGE_PARAM, so we pay for one round trip and send the indices once.
+        # The value returned has our update, and nothing that was pushed after it.
+        # `out` is the same as for `pull_split_param`.
+
+        (param_desc, S, D, indices) = self.get_split_slice_args(name)
+        update_args = self.get_split_push_args(name, updated_value)
+
+        if update_args is None or update_args[4] != S:
+            # With a `delta_threshold`, we push only some of the rows (or none),
+            # but we want all of them back.
+            if update_args is not None:
+                self.update_param_slice_to_server(*update_args)
+            return self.pull_split_param(name, out)
+
+        value = self.exchange_param_slice_with_server(*update_args, out=self.get_out_for_wire(name, out))
+        return self.decode_split_value(name, value, 'MSG_TYPE_EXCHANGE_PARAM', out)
+
+
+    def pull_split_params(self, names, want_pipelined=False, D_out=None):
+        # Same as calling `pull_split_param` for every name in `names`,
+        # but all the slices travel in a single MSG_TYPE_PULL_PARAMS_BATCH
+        # so we pay for only one round trip. Returns a dict indexed by name.
+        #
+        # With `want_pipelined`, we use `get_param_slices_pipelined` instead.
+        # This does not require MSG_TYPE_PULL_PARAMS_BATCH on the server.
+        # It is ignored when we have more than one stream.
+        #
+        # `D_out` is an optional dict of preallocated arrays indexed by name,
+        # just like the `out` argument of `pull_split_param`.
+
+        if D_out is None:
+            D_out = {}
+        L_out = [self.get_out_for_wire(name, D_out.get(name)) for name in names]
+
+        L_slice_args = []
+        L_original_shapes = []
+        for name in names:
+            (param_desc, S, D, indices) = self.get_split_slice_args(name)
+            L_slice_args.append((name, S, D, indices, self.get_dtype_for_client(name)))
+            L_original_shapes.append((S[0], S[1], param_desc['shape'][2], param_desc['shape'][3]))
+
+        L_values = self.get_param_slices_through_streams(L_slice_args, L_out, L_original_shapes, want_pipelined)
+
+        tic = time.time()
+        D_values = {}
+        for (name, value, original_shape) in zip(names, L_values, L_original_shapes):
+            D_values[name] = self.decode_pulled_value(value, original_shape, D_out.get(name))
+            if self.want_delta_updates:
+                self.cache_split_value(name, D_values[name])
+
+        if self.want_versioned_cache:
+            msg_type_str = 'MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED'
+        elif want_pipelined and self.pool is None:
+            msg_type_str = 'MSG_TYPE_PULL_PARAM'
+        else:
+            msg_type_str = 'MSG_TYPE_PULL_PARAMS_BATCH'
+        self.msg_stats.record_decode(msg_type_str, names, time.time() - tic)
+        return D_values
 
-        self.splits_timestamp_push[name] = time.time()
 
-        # Then we sent the updates to the server here.
-        self.update_param_slice_to_server(updated_value,
-            self.alpha, self.beta,
-            name,
-            S, D, indices,
-            dtype_for_client)
+    def pull_split_params_pipelined(self, names):
+        return self.pull_split_params(names, want_pipelined=True)
 
-        #self.total_time_spent_pushing = self.total_time_spent_pushing + (time.time() - self.splits_timestamp_push[name])
 
-        # We're done. Nothing to return.
+    def push_split_params(self, D_updated_values):
+        # Same as calling `push_split_param` for every (name, updated_value)
+        # in the dict `D_updated_values`, but in a single MSG_TYPE_PUSH_PARAMS_BATCH.
+
+        L_update_args = []
+        for (name, updated_value) in D_updated_values.items():
+            update_args = self.get_split_push_args(name, updated_value)
+            if update_args is not None:
+                L_update_args.append(update_args)
+
+        self.update_param_slices_through_streams(L_update_args)
+
         return
 
 
+    def get_param_slices_through_streams(self, L_slice_args, L_out, L_original_shapes, want_pipelined=False):
+        # Pulls the slices with the pool when we have one,
+        # and otherwise with `self.conn` (pipelined or in one batch).
+        # With `want_versioned_cache`, `want_pipelined` is ignored.
+        if self.want_versioned_cache:
+            return self.get_param_slices_versioned(L_slice_args, L_out, L_original_shapes)
+        elif self.pool is not None:
+            L_nbr_bytes = [int(np.prod(original_shape)) * dtype_int_to_size_dict[slice_args[4]]
+                           for (slice_args, original_shape) in zip(L_slice_args, L_original_shapes)]
+            return self.pool.get_param_slices_from_server(L_slice_args, L_out, L_nbr_bytes)
+        elif want_pipelined:
+            return self.get_param_slices_pipelined(L_slice_args, L_out=L_out)
+        else:
+            return self.get_param_slices_from_server(L_slice_args, L_out)
+
+    def get_versioned_cache_entry(self, slice_args):
+        # The entry of `self.versioned_cache` for exactly that slice, or None.
+        (name, S, D, indices, dtype_for_client) = slice_args
+        entry = self.versioned_cache.get(name)
+        if entry is None:
+            return None
+        (_, cached_S, cached_D, cached_indices, cached_dtype_for_client) = entry[1]
+        if (tuple(cached_S) != tuple(S) or tuple(cached_D) != tuple(D) or
+            cached_dtype_for_client != dtype_for_client or
+            not np.array_equal(cached_indices[0], indices[0]) or
+            not np.array_equal(cached_indices[1], indices[1])):
+            return None
+        return entry
+
+    def get_param_slices_versioned(self, L_slice_args, L_out, L_original_shapes):
+        # Same as `get_param_slices_through_streams`, but with conditional pulls.
+        # What the server doesn't send again comes from `self.versioned_cache`.
+
+        L_known_versions = []
+        for slice_args in L_slice_args:
+            entry = self.get_versioned_cache_entry(slice_args)
+            L_known_versions.append(-1 if entry is None else entry[0])
+
+        if self.pool is not None:
+            L_nbr_bytes = [int(np.prod(original_shape)) * dtype_int_to_size_dict[slice_args[4]]
+                           for (slice_args, original_shape) in zip(L_slice_args, L_original_shapes)]
+            L_res = self.pool.get_param_slices_if_modified(L_known_versions, L_slice_args, L_out, L_nbr_bytes)
+        else:
+            L_res = self.get_param_slices_if_modified(L_known_versions, L_slice_args, L_out)
+
+        L_values = []
+        for (slice_args, out, (version, value)) in zip(L_slice_args, L_out, L_res):
+            name = slice_args[0]
+            if value is None:
+                # The user can modify what we return, so we always hand out a copy.
+                cached_value = self.versioned_cache[name][2]
+                if out is None:
+                    value = cached_value.copy()
+                else:
+                    value = out.reshape((-1,))
+                    value[...] = cached_value
+            else:
+                self.versioned_cache[name] = (version, slice_args, value.copy())
+            L_values.append(value)
+        return L_values
+
+    def update_param_slices_through_streams(self, L_update_args):
+        if self.pool is not None:
+            self.pool.update_param_slices_to_server(L_update_args)
+        else:
+            self.update_param_slices_to_server(L_update_args)
+
+
+    def pull_entire_params(self, names, D_out=None):
+        # Same as calling `pull_entire_param` for every name in `names`,
+        # but in a single request (or one per stream). Returns a dict indexed by name.
+
+        if D_out is None:
+            D_out = {}
+        L_out = [self.get_out_for_wire(name, D_out.get(name)) for name in names]
+
+        L_slice_args = []
+        L_original_shapes = []
+        for name in names:
+            param_desc = self.get_param_desc(name)
+            assert param_desc is not None
+            D = (param_desc['shape'][0], param_desc['shape'][1])
+            indices = (np.arange(0, D[0], dtype=np.intc), np.arange(0, D[1], dtype=np.intc))
+            L_slice_args.append((name, D, D, indices, self.get_dtype_for_client(name)))
+            L_original_shapes.append(tuple(param_desc['shape']))
+
+        L_values = self.get_param_slices_through_streams(L_slice_args, L_out, L_original_shapes)
+
+        D_values = {}
+        for (name, value, original_shape) in zip(names, L_values, L_original_shapes):
+            D_values[name] = self.decode_pulled_value(value, original_shape, D_out.get(name))
+        return D_values
+
+    def push_entire_params(self, D_updated_values, alpha, beta):
+        # Same as calling `push_entire_param` for every (name, updated_value)
+        # in the dict `D_updated_values`, but in a single request (or one per stream).
+
+        L_update_args = []
+        for (name, updated_value) in D_updated_values.items():
+            param_desc = self.get_param_desc(name)
+            assert param_desc is not None
+            D = (param_desc['shape'][0], param_desc['shape'][1])
+            indices = (np.arange(0, D[0], dtype=np.intc), np.arange(0, D[1], dtype=np.intc))
+            L_update_args.append((self.encode_pushed_value(name, updated_value, indices),
+                                  alpha, beta,
+                                  name,
+                                  D, D, indices,
+                                  self.get_dtype_for_client(name)))
+
+        self.update_param_slices_through_streams(L_update_args)
+
+
 
 
 
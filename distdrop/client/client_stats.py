@@ -0,0 +1,224 @@
+import bisect
+import threading
+import time
+
+
+# What a client measures about the messages that it exchanges with the server.
+#
+#    stats = client.stats()
+#    stats['msg_types']['MSG_TYPE_PULL_PARAMS_BATCH']['wait']['p95']
+#    stats['params']['layer_0_W']['nbr_bytes_pulled']
+#
+# Every message type has its count, the bytes sent and received,
+# and one latency histogram for every phase of the exchange :
+#    'encode' : building the message (the index encodings, the dtype conversions),
+#    'wait'   : writing the message and reading the response from the socket.
+#               This is the network plus the time the server took,
+#               including waiting for the locks of the parameters.
+#               The pushes get no response, so for them this is only the writing.
+#    'decode' : turning what we received into the float32 arrays handed to the user
+#               (recorded by `ClientCNNAutoSplitter`, not by the plain `Client`).
+#
+# With `client.set_stats_callback(callback)`, we also call `callback(event)`
+# for every message (and every decoding), where `event` is a dict with
+# the keys 'msg_type', 'names', 'nbr_bytes_sent', 'nbr_bytes_received'
+# and the phases measured ('encode', 'wait' and/or 'decode') in seconds.
+# It's called from whatever thread did the work, so keep it short.
+
+# The upper bounds of the buckets of the latency histograms, in seconds.
+# From 10us to about 10s, each twice the previous one. Anything above
+# the last one goes in a last bucket of its own.
+LATENCY_BUCKETS = [1e-5 * 2**k for k in range(21)]
+
+PHASES = ['encode', 'wait', 'decode']
+
+
+class LatencyHistogram(object):
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count = self.count + 1
+        self.total = self.total + seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        # The upper bound of the bucket containing the `q` quantile,
+        # so this overestimates by at most a factor of 2.
+        if self.count == 0:
+            return 0.0
+        cumulative = 0
+        for (k, bucket_count) in enumerate(self.bucket_counts):
+            cumulative = cumulative + bucket_count
+            if q * self.count <= cumulative:
+                break
+        if k < len(LATENCY_BUCKETS):
+            return min(LATENCY_BUCKETS[k], self.max)
+        return self.max
+
+    def snapshot(self):
+        # The bound of the last bucket is None because it has none.
+        return {'count' : self.count,
+                'total' : self.total,
+                'mean' : self.total / self.count if 0 < self.count else 0.0,
+                'max' : self.max,
+                'p50' : self.percentile(0.50),
+                'p95' : self.percentile(0.95),
+                'p99' : self.percentile(0.99),
+                'buckets' : zip(LATENCY_BUCKETS + [None], self.bucket_counts)}
+
+
+class MsgTimer(object):
+
+    # Measures the phases of one message, one after the other.
+    #
+    #    timer = msg_stats.start_timer('MSG_TYPE_PULL_PARAM')
+    #    ... encode ...
+    #    timer.lap('encode')
+    #    ... send and read the response ...
+    #    timer.lap('wait')
+    #    timer.done(nbr_bytes_sent, nbr_bytes_received, L_pulled=[(name, nbr_bytes)])
+
+    def __init__(self, msg_stats, msg_type_str):
+        self.msg_stats = msg_stats
+        self.msg_type_str = msg_type_str
+        self.D_times = {}
+        self.tic = time.time()
+
+    def lap(self, phase):
+        # Everything since the last lap (or since the start) goes to `phase`.
+        toc = time.time()
+        self.D_times[phase] = self.D_times.get(phase, 0.0) + (toc - self.tic)
+        self.tic = toc
+
+    def skip(self):
+        # Drops the time since the last lap.
+        self.tic = time.time()
+
+    def done(self, nbr_bytes_sent=0, nbr_bytes_received=0, L_pulled=None, L_pushed=None):
+        self.msg_stats.record(self.msg_type_str, self.D_times,
+                              nbr_bytes_sent, nbr_bytes_received,
+                              L_pulled, L_pushed)
+
+
+class ClientStats(object):
+
+    # Many clients can share the same instance (the streams of a `ClientPool`),
+    # so everything goes through `self.lock`.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.callback = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # indexed by the name of the message type
+            self.D_msg_types = {}
+            # indexed by the name of the parameter
+            self.D_params = {}
+
+    def set_callback(self, callback):
+        # None to remove it
+        self.callback = callback
+
+    def start_timer(self, msg_type_str):
+        return MsgTimer(self, msg_type_str)
+
+    def get_msg_type_stats(self, msg_type_str):
+        # call this with `self.lock`
+        if not self.D_msg_types.has_key(msg_type_str):
+            msg_type_stats = {'count' : 0,
+                              'nbr_bytes_sent' : 0,
+                              'nbr_bytes_received' : 0}
+            for phase in PHASES:
+                msg_type_stats[phase] = LatencyHistogram()
+            self.D_msg_types[msg_type_str] = msg_type_stats
+        return self.D_msg_types[msg_type_str]
+
+    def get_param_stats(self, name):
+        # call this with `self.lock`
+        if not self.D_params.has_key(name):
+            self.D_params[name] = {'nbr_pulls' : 0,
+                                   'nbr_pushes' : 0,
+                                   'nbr_bytes_pulled' : 0,
+                                   'nbr_bytes_pushed' : 0}
+        return self.D_params[name]
+
+    def record(self, msg_type_str, D_times, nbr_bytes_sent=0, nbr_bytes_received=0,
+               L_pulled=None, L_pushed=None):
+        # `D_times` has the seconds spent in every phase measured.
+        # `L_pulled` and `L_pushed` are lists of (name, nbr_bytes) with
+        # the bytes of the values of every parameter in the message.
+
+        if L_pulled is None:
+            L_pulled = []
+        if L_pushed is None:
+            L_pushed = []
+
+        with self.lock:
+            msg_type_stats = self.get_msg_type_stats(msg_type_str)
+            msg_type_stats['count'] += 1
+            msg_type_stats['nbr_bytes_sent'] += nbr_bytes_sent
+            msg_type_stats['nbr_bytes_received'] += nbr_bytes_received
+            for (phase, seconds) in D_times.items():
+                msg_type_stats[phase].add(seconds)
+
+            for (name, nbr_bytes) in L_pulled:
+                param_stats = self.get_param_stats(name)
+                param_stats['nbr_pulls'] += 1
+                param_stats['nbr_bytes_pulled'] += nbr_bytes
+            for (name, nbr_bytes) in L_pushed:
+                param_stats = self.get_param_stats(name)
+                param_stats['nbr_pushes'] += 1
+                param_stats['nbr_bytes_pushed'] += nbr_bytes
+
+        callback = self.callback
+        if callback is not None:
+            event = {'msg_type' : msg_type_str,
+                     'names' : [name for (name, _) in L_pulled + L_pushed],
+                     'nbr_bytes_sent' : nbr_bytes_sent,
+                     'nbr_bytes_received' : nbr_bytes_received}
+            event.update(D_times)
+            callback(event)
+
+    def record_decode(self, msg_type_str, names, seconds):
+        # The decoding happens after the message is recorded,
+        # so it goes in the histogram without counting the message again.
+        with self.lock:
+            self.get_msg_type_stats(msg_type_str)['decode'].add(seconds)
+
+        callback = self.callback
+        if callback is not None:
+            callback({'msg_type' : msg_type_str,
+                      'names' : list(names),
+                      'nbr_bytes_sent' : 0,
+                      'nbr_bytes_received' : 0,
+                      'decode' : seconds})
+
+    def snapshot(self):
+        # A copy of everything, made of dicts, lists and numbers
+        # so that it can be dumped as json.
+        with self.lock:
+            D_msg_types = {}
+            for (msg_type_str, msg_type_stats) in self.D_msg_types.items():
+                res = {}
+                for (key, value) in msg_type_stats.items():
+                    if isinstance(value, LatencyHistogram):
+                        res[key] = value.snapshot()
+                    else:
+                        res[key] = value
+                D_msg_types[msg_type_str] = res
+            D_params = dict((name, dict(param_stats)) for (name, param_stats) in self.D_params.items())
+        return {'msg_types' : D_msg_types,
+                'params' : D_params}
+
+
+def buffers_nbr_bytes(buffers):
+    # The total length of a list of strings and memoryviews over bytes.
+    return sum(len(buf) for buf in buffers)
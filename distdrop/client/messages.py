@@ -3,6 +3,8 @@
 import struct
 import numpy as np
 
+from distdrop.client.param_digest import PARAM_DIGEST_RECORD_LENGTH, decode_param_digest_record
+
 MSG_TYPE_NULL = 0
 MSG_TYPE_PULL_PARAM = 1
 MSG_TYPE_PUSH_PARAM = 2
@@ -11,6 +13,16 @@ MSG_TYPE_DISCONNECT = 4
 MSG_TYPE_LIST_ALL_PARAMS_DESC = 5
 MSG_TYPE_SAVE_ALL_TO_HDF5 = 6
 MSG_TYPE_LOAD_ALL_FROM_HDF5 = 7
+MSG_TYPE_PULL_PARAMS_BATCH = 8
+MSG_TYPE_PUSH_PARAMS_BATCH = 9
+MSG_TYPE_REGISTER_SPLIT = 10
+MSG_TYPE_REGISTER_SEEDED_SPLIT = 11
+MSG_TYPE_INIT_PARAM = 12
+MSG_TYPE_PARAM_DIGEST = 13
+MSG_TYPE_EXCHANGE_PARAM = 14
+MSG_TYPE_PULL_PARAM_IF_MODIFIED = 15
+MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED = 16
+MSG_TYPE_PARAM_LOCK_STATS = 17
 
 
 msg_type_dict = {'MSG_TYPE_NULL' : MSG_TYPE_NULL,
@@ -20,7 +32,17 @@ msg_type_dict = {'MSG_TYPE_NULL' : MSG_TYPE_NULL,
                  'MSG_TYPE_DISCONNECT' : MSG_TYPE_DISCONNECT,
                  'MSG_TYPE_LIST_ALL_PARAMS_DESC' : MSG_TYPE_LIST_ALL_PARAMS_DESC,
                  'MSG_TYPE_SAVE_ALL_TO_HDF5':MSG_TYPE_SAVE_ALL_TO_HDF5,
-                 'MSG_TYPE_LOAD_ALL_FROM_HDF5':MSG_TYPE_LOAD_ALL_FROM_HDF5
+                 'MSG_TYPE_LOAD_ALL_FROM_HDF5':MSG_TYPE_LOAD_ALL_FROM_HDF5,
+                 'MSG_TYPE_PULL_PARAMS_BATCH':MSG_TYPE_PULL_PARAMS_BATCH,
+                 'MSG_TYPE_PUSH_PARAMS_BATCH':MSG_TYPE_PUSH_PARAMS_BATCH,
+                 'MSG_TYPE_REGISTER_SPLIT':MSG_TYPE_REGISTER_SPLIT,
+                 'MSG_TYPE_REGISTER_SEEDED_SPLIT':MSG_TYPE_REGISTER_SEEDED_SPLIT,
+                 'MSG_TYPE_INIT_PARAM':MSG_TYPE_INIT_PARAM,
+                 'MSG_TYPE_PARAM_DIGEST':MSG_TYPE_PARAM_DIGEST,
+                 'MSG_TYPE_EXCHANGE_PARAM':MSG_TYPE_EXCHANGE_PARAM,
+                 'MSG_TYPE_PULL_PARAM_IF_MODIFIED':MSG_TYPE_PULL_PARAM_IF_MODIFIED,
+                 'MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED':MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED,
+                 'MSG_TYPE_PARAM_LOCK_STATS':MSG_TYPE_PARAM_LOCK_STATS
                  }
 
 MSG_HEADER_LENGTH = 16
@@ -31,6 +53,22 @@ DTYPE_FLOAT16 = 16
 DTYPE_FLOAT32 = 32
 DTYPE_FLOAT64 = 64
 
+# How the indices of each axis of a slice are sent.
+# They are packed in the dtype of the message as
+#     dtype_for_client | (encoding[0] << 8) | (encoding[1] << 16)
+# See `encode_indices`.
+INDEX_ENCODING_LIST = 0
+INDEX_ENCODING_ALL = 1
+INDEX_ENCODING_BITMASK = 2
+INDEX_ENCODING_RANGES = 3
+# for both axes, (handle, entry) of a split sent with MSG_TYPE_REGISTER_SPLIT
+INDEX_ENCODING_REGISTERED = 4
+
+# The distributions of MSG_TYPE_INIT_PARAM. See `seeded_init.py`.
+INIT_DISTRIBUTION_ZERO = 0         # all zeros, `scale` is ignored
+INIT_DISTRIBUTION_UNIFORM = 1      # uniform in [-scale, scale)
+INIT_DISTRIBUTION_FANIN_NORMAL = 2 # normal with std scale*sqrt(2/fan_in), only for weights
+
 dtype_int_to_numpy_dict = {DTYPE_FLOAT16 : np.float16,
                            DTYPE_FLOAT32 : np.float32,
                            DTYPE_FLOAT64 : np.float64}
@@ -86,16 +124,39 @@ class MsgLoadAllFromHDF5(object):
     def send(self, conn):
         write_bytes(conn, self.encode())
 
+class RegisteredIndices(tuple):
+
+    # The pair of arrays of indices (I0, I1), which is still used
+    # as such everywhere, along with the `handle` of the split
+    # in which they were registered and their `entry` in that split.
+    # Messages given those send (handle, entry) instead of the indices.
+
+    def __new__(cls, indices, handle, entry):
+        res = super(RegisteredIndices, cls).__new__(cls, indices)
+        res.handle = handle
+        res.entry = entry
+        return res
+
+
 class MsgPullParams(object):
 
-    def __init__(self, name, N, D, indices, dtype_for_client):
+    def __init__(self, name, N, D, indices, dtype_for_client, want_compact_indices=False):
         # name : string
         # indices : (I0, I1) where I0 and I1 are numpy arrays of integers
         # N : (N0, N1) integers
         # D : (D0, D1) integers
+        # want_compact_indices : use the smallest encoding for the indices,
+        #                        instead of always sending them as lists.
+        #                        The servers that predate the index encodings
+        #                        reject those messages, so this is opt-in.
         
         self.name = name
 
+        if isinstance(indices, RegisteredIndices):
+            self.registered = (indices.handle, indices.entry)
+        else:
+            self.registered = None
+
         self.indices = [e if (e is not None) else np.zeros((0,), dtype=np.intc) for e in indices]
         assert len(self.indices) == 2
         assert self.indices[0].dtype == np.intc
@@ -109,15 +170,31 @@ class MsgPullParams(object):
         self.dtype_for_client = dtype_for_client
         assert self.dtype_for_client in (DTYPE_FLOAT16, DTYPE_FLOAT32, DTYPE_FLOAT64)
 
-    def encode(self):
+        self.want_compact_indices = want_compact_indices
+
+    def encode_buffers(self):
+
+        # Returns a list of buffers to be sent one after the other.
+        # We avoid concatenating them so that large arrays don't get
+        # copied just to be written to the socket.
 
         # add the null-termination for C-style strings
         contents = self.name + '\0'
         contents = contents + '\0' * (PARAM_NAME_LENGTH - len(contents))
         assert len(contents) == PARAM_NAME_LENGTH
 
+        if self.registered is not None:
+            (encoding0, buffer0) = (INDEX_ENCODING_REGISTERED, struct.pack("<ii", *self.registered))
+            (encoding1, buffer1) = (INDEX_ENCODING_REGISTERED, '')
+        elif self.want_compact_indices:
+            (encoding0, buffer0) = encode_indices(self.indices[0], self.D[0])
+            (encoding1, buffer1) = encode_indices(self.indices[1], self.D[1])
+        else:
+            (encoding0, buffer0) = (INDEX_ENCODING_LIST, array_as_buffer(self.indices[0]))
+            (encoding1, buffer1) = (INDEX_ENCODING_LIST, array_as_buffer(self.indices[1]))
+
         contents = contents + struct.pack("<iiiii",
-            np.int32(self.dtype_for_client),
+            np.int32(self.dtype_for_client | (encoding0 << 8) | (encoding1 << 16)),
             np.int32(self.N[0]),
             np.int32(self.N[1]),
             np.int32(self.D[0]),
@@ -126,43 +203,65 @@ class MsgPullParams(object):
         # note that arrays of size 0 are just concatenated as '',
         # so this is compatible with the notation of having N[1] = 0
         # when self.indices[1] is empty
-        contents = contents + self.indices[0].tostring() + self.indices[1].tostring()
-        return contents
+        return [contents, buffer0, buffer1]
+
+    def encode(self):
+        return join_buffers(self.encode_buffers())
 
     def send(self, conn):
-        write_bytes(conn, self.encode())
+        write_buffers(conn, self.encode_buffers())
 
-    def read_decode_response(self, conn):
+    def read_decode_response(self, conn, out=None):
 
         # read an int describing how many bytes will be sent next
         (response_nbr_bytes,) = struct.unpack("<i", read_bytes_as_string(conn, 4))
+
+        numpy_array_decoded = self.allocate_response(response_nbr_bytes, out)
+        read_bytes_into(conn, memoryview(numpy_array_decoded.view(np.uint8)))
+        return numpy_array_decoded
+
+    def allocate_response(self, response_nbr_bytes, out=None):
+
+        # Returns the flat array that will receive the `response_nbr_bytes`
+        # of data announced by the server.
         assert 0 < response_nbr_bytes
 
         dtype = dtype_int_to_numpy_dict[self.dtype_for_client]
         elemsize = dtype_int_to_size_dict[self.dtype_for_client]
         count = response_nbr_bytes / elemsize
-        
-        numpy_array_decoded = np.fromstring(read_bytes_as_string(conn, response_nbr_bytes),
-            dtype=dtype, count=count)
+
+        # If we are given a preallocated `out` array, the data lands
+        # directly in there. Otherwise we allocate a new array.
+        # Either way, `recv_into` writes into the array without
+        # going through intermediate strings.
+        if out is None:
+            numpy_array_decoded = np.empty((count,), dtype=dtype)
+        else:
+            assert out.dtype == dtype, "Expected `out` to have dtype %s, but it has dtype %s." % (np.dtype(dtype), out.dtype)
+            assert out.size == count, "Expected `out` to have %d elements, but it has %d elements." % (count, out.size)
+            assert out.flags['C_CONTIGUOUS'], "Expected `out` to be C-contiguous."
+            # this is a view of `out`, not a copy, because `out` is contiguous
+            numpy_array_decoded = out.reshape((-1,))
+
         return numpy_array_decoded
 
 
 
 class MsgPushParams(MsgPullParams):
 
-    def __init__(self, value, alpha, beta, name, N, D, indices, dtype_for_client):
+    def __init__(self, value, alpha, beta, name, N, D, indices, dtype_for_client, want_compact_indices=False):
         # value : numpy array (probably of np.float32)
         # alpha, beta : float
         # name : string
         # indices : (I0, I1) where I0 and I1 are numpy arrays of integers
         # N : (N0, N1) integers
         # D : (D0, D1) integers
-        super(MsgPushParams, self).__init__(name, N, D, indices, dtype_for_client)
+        super(MsgPushParams, self).__init__(name, N, D, indices, dtype_for_client, want_compact_indices)
         self.value = value
         self.alpha = alpha
         self.beta = beta
         
-    def encode(self):
+    def encode_buffers(self):
 
         # This method looks more convoluted than it should, but it's because we
         # have to compute how many bytes are going to be sent.
@@ -170,32 +269,300 @@ class MsgPushParams(MsgPullParams):
         # but will later double-check to make sure that it's correct
         # given the slice used.
 
-        # The conversion between a type and itself should be skipped by numpy (?).
-        data_str = self.value.astype(dtype_int_to_numpy_dict[self.dtype_for_client]).tostring()
+        # `np.ascontiguousarray` doesn't copy anything when the value
+        # already has the dtype that we want and is contiguous.
+        data = np.ascontiguousarray(self.value, dtype=dtype_int_to_numpy_dict[self.dtype_for_client])
 
         ##
-        ##    print "MsgPushParams wants to send %d bytes as data." % len(data_str)
+        ##    print "MsgPushParams wants to send %d bytes as data." % data.nbytes
         ##
 
         # same start as in the MsgPullParams
-        contents = super(MsgPushParams, self).encode()
+        buffers = super(MsgPushParams, self).encode_buffers()
         # followed by the alpha, beta, current_data_length_bytes
-        contents = contents + struct.pack("<ffi", self.alpha, self.beta, len(data_str))
+        buffers.append(struct.pack("<ffi", self.alpha, self.beta, data.nbytes))
         # and then the actual contents, converted to its declared type.
-        contents = contents + data_str
+        buffers.append(array_as_buffer(data))
+
+        return buffers
+
+    def read_decode_response(self, conn, out=None):
+        # not expecting a response from the server
+        pass
+
+
+class MsgExchangeParams(MsgPushParams):
+
+    # Sent exactly like a MsgPushParams, but the server responds like
+    # for a MsgPullParams of the same slice, with the values that it has
+    # right after committing ours (in the same dtype that we pushed).
+
+    def read_decode_response(self, conn, out=None):
+        return MsgPullParams.read_decode_response(self, conn, out)
+
+
+class MsgPullParamsIfModified(MsgPullParams):
+
+    # Every parameter on the server has a version that changes every time
+    # that its values change. This is a MsgPullParams preceded by the version
+    # that we have of the parameter, or -1 when we have none.
+    #
+    # The server responds with the version that it has (int64), followed by
+    #     -1 (int) when that's `known_version`, and nothing else,
+    #     or otherwise by the response of a MsgPullParams.
+    # The versions are not reused by the server, but they are only
+    # meaningful for as long as it runs.
+    #
+    # In a MsgPullParamsBatch, this goes with MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED.
+
+    def __init__(self, known_version, name, N, D, indices, dtype_for_client, want_compact_indices=False):
+        super(MsgPullParamsIfModified, self).__init__(name, N, D, indices, dtype_for_client, want_compact_indices)
+        self.known_version = known_version
+
+    def encode_buffers(self):
+        buffers = super(MsgPullParamsIfModified, self).encode_buffers()
+        return [struct.pack("<q", self.known_version)] + buffers
+
+    def read_decode_response(self, conn, out=None):
+        # Returns (version, value) where `value` is None when
+        # the server still has the `known_version`.
+        (version, response_nbr_bytes) = struct.unpack("<qi", read_bytes_as_string(conn, 12))
+        if response_nbr_bytes == -1:
+            return (version, None)
+
+        numpy_array_decoded = self.allocate_response(response_nbr_bytes, out)
+        read_bytes_into(conn, memoryview(numpy_array_decoded.view(np.uint8)))
+        return (version, numpy_array_decoded)
+
+
+class MsgPullParamsBatch(object):
+
+    def __init__(self, L_msg):
+        # L_msg : list of MsgPullParams
+        # This gets sent as the number of entries followed by
+        # the body of every MsgPullParams, one after the other.
+        # The server responds with the number of entries followed
+        # by one regular MsgPullParams response per entry.
+        self.L_msg = L_msg
+
+    def encode_buffers(self):
+        buffers = [struct.pack("<i", np.int32(len(self.L_msg)))]
+        for msg in self.L_msg:
+            buffers.extend(msg.encode_buffers())
+        return buffers
+
+    def encode(self):
+        return join_buffers(self.encode_buffers())
+
+    def send(self, conn):
+        write_buffers(conn, self.encode_buffers())
+
+    def read_decode_response(self, conn, L_out=None):
+        # `L_out` is an optional list of preallocated arrays (or None entries)
+        # to be used as `out` for the corresponding messages.
+        (nbr_entries,) = struct.unpack("<i", read_bytes_as_string(conn, 4))
+        assert nbr_entries == len(self.L_msg)
+
+        if L_out is None:
+            L_out = [None] * len(self.L_msg)
+
+        return [msg.read_decode_response(conn, out) for (msg, out) in zip(self.L_msg, L_out)]
+
+
+class MsgPushParamsBatch(MsgPullParamsBatch):
+
+    def __init__(self, L_msg):
+        # L_msg : list of MsgPushParams
+        super(MsgPushParamsBatch, self).__init__(L_msg)
+
+    def read_decode_response(self, conn, L_out=None):
+        # not expecting a response from the server
+        pass
+
+
+class MsgRegisterSplit(object):
+
+    def __init__(self, handle, L_indices_and_D):
+        # handle : a positive integer chosen by the client
+        # L_indices_and_D : list of pairs ((I0, I1), (D0, D1)),
+        #                   which become the entries 0, 1, 2, ... of the split
+        #
+        # The server keeps the last few splits registered on every connection.
+        # Registering a split with the handle of an old one replaces it.
+        assert 0 <= handle
+        self.handle = handle
+        self.L_indices_and_D = L_indices_and_D
+
+    def encode_buffers(self):
+        buffers = [struct.pack("<ii", np.int32(self.handle), np.int32(len(self.L_indices_and_D)))]
+        for (indices, D) in self.L_indices_and_D:
+            # Every entry is the end of a MsgPullParams, without the dtype.
+            (encoding0, buffer0) = encode_indices(indices[0], D[0])
+            (encoding1, buffer1) = encode_indices(indices[1], D[1])
+            buffers.append(struct.pack("<iiiii",
+                np.int32((encoding0 << 8) | (encoding1 << 16)),
+                np.int32(len(indices[0])),
+                np.int32(len(indices[1])),
+                np.int32(D[0]),
+                np.int32(D[1])))
+            buffers.append(buffer0)
+            buffers.append(buffer1)
+        return buffers
+
+    def encode(self):
+        return join_buffers(self.encode_buffers())
+
+    def send(self, conn):
+        write_buffers(conn, self.encode_buffers())
 
+    def read_decode_response(self, conn):
+        # the server repeats the handle, or sends -1 when it failed
+        (handle,) = struct.unpack("<i", read_bytes_as_string(conn, 4))
+        assert handle == self.handle, "Failed to register the split with handle %d." % self.handle
+        return handle
+
+
+class MsgRegisterSeededSplit(object):
+
+    def __init__(self, handle, seed, L_prob_pairs):
+        # handle : a positive integer chosen by the client
+        # seed : an integer in [0, 2**64)
+        # L_prob_pairs : list of (layer_number, p_in, p_out) for every layer
+        #
+        # The server generates the split of `SplitPlan.sample_seeded(seed, ...)`
+        # and registers it like MsgRegisterSplit would, with the parameters
+        # as entries in the order of MSG_TYPE_LIST_ALL_PARAMS_DESC.
+        assert 0 <= handle
+        assert 0 <= seed < 2**64
+        self.handle = handle
+        self.seed = seed
+        self.L_prob_pairs = L_prob_pairs
+
+    def encode_buffers(self):
+        buffers = [struct.pack("<iQi", np.int32(self.handle), self.seed, np.int32(len(self.L_prob_pairs)))]
+        for (layer_number, p_in, p_out) in self.L_prob_pairs:
+            buffers.append(struct.pack("<idd", np.int32(layer_number), float(p_in), float(p_out)))
+        return buffers
+
+    def encode(self):
+        return join_buffers(self.encode_buffers())
+
+    def send(self, conn):
+        write_buffers(conn, self.encode_buffers())
+
+    def read_decode_response(self, conn):
+        # the server repeats the handle, or sends -1 when it failed
+        (handle,) = struct.unpack("<i", read_bytes_as_string(conn, 4))
+        assert handle == self.handle, "Failed to register the seeded split with handle %d." % self.handle
+        return handle
+
+
+class MsgInitParam(object):
+
+    def __init__(self, name, distribution, scale, seed):
+        # name : string
+        # distribution : one of the INIT_DISTRIBUTION_*
+        # scale : float
+        # seed : an integer in [0, 2**64)
+        #
+        # The server fills the whole parameter with the values
+        # of `seeded_init.sample_seeded_init_values`.
+        assert distribution in (INIT_DISTRIBUTION_ZERO, INIT_DISTRIBUTION_UNIFORM, INIT_DISTRIBUTION_FANIN_NORMAL)
+        assert 0 <= seed < 2**64
+        self.name = name
+        self.distribution = distribution
+        self.scale = scale
+        self.seed = seed
+
+    def encode(self):
+        contents = self.name + '\0'
+        contents = contents + '\0' * (PARAM_NAME_LENGTH - len(contents))
+        assert len(contents) == PARAM_NAME_LENGTH
+        return contents + struct.pack("<iQd", np.int32(self.distribution), self.seed, float(self.scale))
+
+    def send(self, conn):
+        write_bytes(conn, self.encode())
+
+    def read_decode_response(self, conn):
+        # the server sends 0 when it's done, or -1 when it failed
+        (status,) = struct.unpack("<i", read_bytes_as_string(conn, 4))
+        assert status == 0, "Failed to initialize the parameter %s on the server." % self.name
+        return status
+
+
+class MsgParamDigest(object):
+
+    def __init__(self, names):
+        # names : list of strings
+        #
+        # The server responds with a record for every name, in the same order.
+        # See `param_digest.py` for what they contain.
+        self.names = list(names)
+
+    def encode(self):
+        contents = struct.pack("<i", np.int32(len(self.names)))
+        for name in self.names:
+            name_contents = name + '\0'
+            name_contents = name_contents + '\0' * (PARAM_NAME_LENGTH - len(name_contents))
+            assert len(name_contents) == PARAM_NAME_LENGTH
+            contents = contents + name_contents
         return contents
 
     def send(self, conn):
         write_bytes(conn, self.encode())
 
+    def get_response_nbr_bytes(self):
+        return PARAM_DIGEST_RECORD_LENGTH * len(self.names)
+
+    def decode_response(self, contents):
+        # Returns a dict indexed by name, with None for the
+        # parameters that the server doesn't have.
+        assert len(contents) == self.get_response_nbr_bytes()
+        D_digests = {}
+        for (k, name) in enumerate(self.names):
+            D_digests[name] = decode_param_digest_record(contents[k*PARAM_DIGEST_RECORD_LENGTH:(k+1)*PARAM_DIGEST_RECORD_LENGTH])
+        return D_digests
+
     def read_decode_response(self, conn):
-        # not expecting a response from the server
-        pass
+        return self.decode_response(read_bytes_as_string(conn, self.get_response_nbr_bytes()))
 
 
+# What MSG_TYPE_PARAM_LOCK_STATS sends for every parameter (see `param_lock_stats_t`
+# in server/param_locks.h) : a status that is 0, or -1 when the server has no parameter
+# with that name, then the stripes of rows that have their own lock, and the counters
+# of how often the stripes were taken, how often that meant waiting, and for how long.
+PARAM_LOCK_STATS_RECORD_FORMAT = "<iiiqqqqqq"
+PARAM_LOCK_STATS_RECORD_LENGTH = struct.calcsize(PARAM_LOCK_STATS_RECORD_FORMAT)
+PARAM_LOCK_STATS_KEYS = ['nbr_stripes', 'rows_per_stripe',
+                         'nbr_read_locks', 'nbr_read_waits', 'read_wait_ns',
+                         'nbr_write_locks', 'nbr_write_waits', 'write_wait_ns']
 
+def encode_param_lock_stats_record(stats):
+    # None for a parameter that we don't have
+    if stats is None:
+        return struct.pack(PARAM_LOCK_STATS_RECORD_FORMAT, -1, *([0] * len(PARAM_LOCK_STATS_KEYS)))
+    return struct.pack(PARAM_LOCK_STATS_RECORD_FORMAT, 0, *[stats[key] for key in PARAM_LOCK_STATS_KEYS])
 
+def decode_param_lock_stats_record(contents):
+    values = struct.unpack(PARAM_LOCK_STATS_RECORD_FORMAT, contents)
+    if values[0] != 0:
+        return None
+    return dict(zip(PARAM_LOCK_STATS_KEYS, values[1:]))
+
+
+class MsgParamLockStats(MsgParamDigest):
+
+    # Same message as MsgParamDigest, but the records are the counters of the locks.
+
+    def get_response_nbr_bytes(self):
+        return PARAM_LOCK_STATS_RECORD_LENGTH * len(self.names)
+
+    def decode_response(self, contents):
+        assert len(contents) == self.get_response_nbr_bytes()
+        D_stats = {}
+        for (k, name) in enumerate(self.names):
+            D_stats[name] = decode_param_lock_stats_record(contents[k*PARAM_LOCK_STATS_RECORD_LENGTH:(k+1)*PARAM_LOCK_STATS_RECORD_LENGTH])
+        return D_stats
 
 
 class MsgListAllParamsDesc(object):
@@ -209,15 +576,21 @@ class MsgListAllParamsDesc(object):
     def read_decode_response(self, conn):
         (response_nbr_bytes,) = struct.unpack("<i", read_bytes_as_string(conn, 4))
         assert 0 < response_nbr_bytes
+        # kept for the stats of the client
+        self.response_nbr_bytes = response_nbr_bytes
 
         ##
         ##    print "expecting %d byte to come from MsgListAllParamsDesc.read_decode_response" % response_nbr_bytes
         ##
 
+        return self.decode_response_contents(read_bytes_as_string(conn, response_nbr_bytes))
+
+    def decode_response_contents(self, contents):
+
         # this isn't the most exciting solution, but let's exchange data as json
         # because otherwise it'll be much more complicated and less flexible
         import json
-        S = json.loads(read_bytes_as_string(conn, response_nbr_bytes))
+        S = json.loads(contents)
 
         for s in S:
             # there is a slight hiccup in the msg encoding when we use unicode instead of ascii
@@ -229,39 +602,150 @@ class MsgListAllParamsDesc(object):
 
 
 
-def read_bytes_as_string(conn, nbr_bytes):
+def encode_indices(index, D):
 
-    # THINK : You might want to use another constant than 2048 because
-    # then you end up partitionning large numpy arrays into chunks of 2048 bytes.
-    # Maybe worth investigating.
+    # Returns (encoding, buffer) with the smallest encoding of the
+    # sorted array of indices `index` taken from range(D).
+    #    INDEX_ENCODING_LIST    : the indices as int32, 4*S bytes
+    #    INDEX_ENCODING_ALL     : nothing, when `index` is all of range(D)
+    #    INDEX_ENCODING_BITMASK : one bit per index of range(D), like np.packbits
+    #    INDEX_ENCODING_RANGES  : the number of ranges followed by pairs (start, stop)
+    # The bitmask and the ranges can't describe indices that aren't
+    # strictly increasing, so those always go as lists.
 
-    # boilerplate code from https://docs.python.org/2/howto/sockets.html
-    chunks = []
+    S = len(index)
+    if S == 0:
+        return (INDEX_ENCODING_LIST, '')
+
+    # The server rejects the bad indices, but only when it gets them as they are.
+    steps = np.diff(index)
+    if not np.all(0 < steps) or index[0] < 0 or D <= index[-1]:
+        return (INDEX_ENCODING_LIST, array_as_buffer(index))
+
+    if S == D:
+        return (INDEX_ENCODING_ALL, '')
+
+    # where a new range starts
+    breaks = np.nonzero(steps != 1)[0] + 1
+    nbr_ranges = len(breaks) + 1
+
+    list_nbr_bytes = 4 * S
+    bitmask_nbr_bytes = (D + 7) / 8 if D <= SLICE_MAX_INDEX else None
+    ranges_nbr_bytes = 4 + 8 * nbr_ranges
+
+    if ranges_nbr_bytes <= list_nbr_bytes and (bitmask_nbr_bytes is None or ranges_nbr_bytes <= bitmask_nbr_bytes):
+        starts = index[np.concatenate([[0], breaks])]
+        stops = index[np.concatenate([breaks - 1, [S - 1]])] + 1
+        ranges = np.empty((nbr_ranges, 2), dtype=np.int32)
+        ranges[:, 0] = starts
+        ranges[:, 1] = stops
+        return (INDEX_ENCODING_RANGES, struct.pack("<i", nbr_ranges) + ranges.tostring())
+
+    if bitmask_nbr_bytes is not None and bitmask_nbr_bytes < list_nbr_bytes:
+        mask = np.zeros((D,), dtype=np.bool_)
+        mask[index] = True
+        return (INDEX_ENCODING_BITMASK, np.packbits(mask).tostring())
+
+    return (INDEX_ENCODING_LIST, array_as_buffer(index))
+
+def read_bytes_into(conn, buffer_view):
+
+    # `buffer_view` is a writable memoryview over bytes (for example the
+    # memoryview of a numpy array viewed as np.uint8). We fill it completely
+    # with `recv_into`, which avoids allocating chunks and joining them.
+
+    nbr_bytes = len(buffer_view)
     bytes_recd = 0
     while bytes_recd < nbr_bytes:
-        chunk = conn.recv(min(nbr_bytes - bytes_recd, 2048))
-        if chunk == '':
+        nbr_bytes_in_chunk = conn.recv_into(buffer_view[bytes_recd:], nbr_bytes - bytes_recd)
+        if nbr_bytes_in_chunk == 0:
             raise RuntimeError("socket connection broken")
-        chunks.append(chunk)
-        bytes_recd = bytes_recd + len(chunk)
+        bytes_recd = bytes_recd + nbr_bytes_in_chunk
 
-    return ''.join(chunks)
+def read_bytes_as_string(conn, nbr_bytes):
+
+    # Only meant for small things like the integers announcing
+    # the length of a response. Large arrays should go through
+    # `read_bytes_into` directly.
+
+    contents = bytearray(nbr_bytes)
+    read_bytes_into(conn, memoryview(contents))
+    return str(contents)
+
+def array_as_buffer(A):
+    # A memoryview over the bytes of the numpy array `A`, without copying
+    # anything when `A` is already contiguous.
+    return memoryview(np.ascontiguousarray(A).reshape((-1,)).view(np.uint8))
+
+def join_buffers(buffers):
+    # Concatenates strings and memoryviews into a single string.
+    return ''.join((buf.tobytes() if isinstance(buf, memoryview) else buf) for buf in buffers)
+
+# Don't pass more than that many buffers in a single call to `sendmsg`.
+# The system has a limit (IOV_MAX) which is usually 1024.
+SENDMSG_MAX_BUFFERS = 512
+
+# Without `sendmsg`, the buffers smaller than that are joined with their
+# neighbours before being written, so that the header and the indices
+# of a message don't take a system call (and a TCP segment) each.
+WRITE_JOIN_MAX_BYTES = 64*1024
+
+def join_small_buffers(buffers):
+    # Returns the `buffers` with every run of small ones joined into a string.
+    # The large ones are left as they are, so that we never copy the values.
+    L_res = []
+    L_small = []
+    for buf in buffers:
+        if len(buf) < WRITE_JOIN_MAX_BYTES:
+            L_small.append(buf)
+            continue
+        if L_small:
+            L_res.append(join_buffers(L_small))
+            L_small = []
+        L_res.append(buf)
+    if L_small:
+        L_res.append(join_buffers(L_small))
+    return L_res
+
+def write_buffers(conn, buffers):
+
+    # Writes all the `buffers` (strings or memoryviews) one after the other.
+    # When `sendmsg` is available (python 3), we do scatter-gather writes
+    # so that the kernel collects the pieces itself. Otherwise we write
+    # the large buffers one by one, which still avoids copying them,
+    # and the small ones in between are joined.
+
+    buffers = [memoryview(buf) for buf in buffers if 0 < len(buf)]
+
+    if not hasattr(conn, 'sendmsg'):
+        for buf in join_small_buffers(buffers):
+            write_bytes(conn, buf)
+        return
+
+    while buffers:
+        sent = conn.sendmsg(buffers[:SENDMSG_MAX_BUFFERS])
+        if sent == 0:
+            raise RuntimeError("socket connection broken")
+        # drop what has been sent completely and trim what has been sent partially
+        while buffers and len(buffers[0]) <= sent:
+            sent = sent - len(buffers[0])
+            buffers.pop(0)
+        if 0 < sent:
+            buffers[0] = buffers[0][sent:]
 
 def write_bytes(conn, contents, nbr_bytes=None):
 
     if nbr_bytes is None:
         nbr_bytes = len(contents)
 
+    # Slicing a memoryview doesn't copy the contents, which is what
+    # we want when a large array gets sent in many partial writes.
+    view = memoryview(contents)
+
     # boilerplate code from https://docs.python.org/2/howto/sockets.html
     totalsent = 0
     while totalsent < nbr_bytes:
-        sent = conn.send(contents[totalsent:])
+        sent = conn.send(view[totalsent:nbr_bytes])
         if sent == 0:
             raise RuntimeError("socket connection broken")
         totalsent = totalsent + sent
-
-
-
-
-
-
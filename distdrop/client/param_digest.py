@@ -0,0 +1,108 @@
+import hashlib
+import struct
+
+import numpy as np
+
+# What MSG_TYPE_PARAM_DIGEST tells us about a parameter, without sending its values
+# (see `compute_param_digest` in server/param_digest.c, and the python server).
+#
+#    'md5'          : the md5 of the float32 values in little-endian, in C order, as 32 hex digits
+#    'sum'          : the sum of the values that are not NaN, in float64
+#    'min', 'max'   : the smallest and largest values that are not NaN (NaN if they are all NaN)
+#    'nbr_nan'      : how many values are NaN
+#    'nbr_elements' : how many values there are
+#
+# The md5 is what we compare to check a push. The `sum` is only there for
+# the humans : the C server adds the values one after the other and numpy
+# adds them pairwise, so they can differ in the last bits.
+#
+# On the wire, every parameter gets a record of PARAM_DIGEST_RECORD_FORMAT with
+# a status that is 0, or -1 when the server has no parameter with that name
+# (and then the rest of the record is zeros).
+
+PARAM_DIGEST_RECORD_FORMAT = "<i16sdffqq"
+PARAM_DIGEST_RECORD_LENGTH = struct.calcsize(PARAM_DIGEST_RECORD_FORMAT)
+
+
+class ParamDigestAccumulator(object):
+
+    # Computes the digest of a parameter from blocks of its values,
+    # given in C order, without holding all of them at once.
+    #
+    #    accumulator = ParamDigestAccumulator()
+    #    for (row_start, row_stop) in L_row_blocks:
+    #        accumulator.update(value[row_start:row_stop])
+    #    digest = accumulator.digest()
+
+    def __init__(self):
+        self.md5 = hashlib.md5()
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.nbr_nan = 0
+        self.nbr_elements = 0
+
+    def update(self, block):
+        # `block` is anything that turns into float32
+        block = np.ascontiguousarray(block, dtype=np.dtype('<f4'))
+        self.md5.update(block.data)
+        self.nbr_elements = self.nbr_elements + int(block.size)
+
+        is_nan = np.isnan(block)
+        nbr_nan = int(np.count_nonzero(is_nan))
+        if nbr_nan == 0:
+            finite_values = block
+        else:
+            finite_values = block[~is_nan]
+            self.nbr_nan = self.nbr_nan + nbr_nan
+
+        if 0 < finite_values.size:
+            self.sum = self.sum + float(np.sum(finite_values, dtype=np.float64))
+            (block_min, block_max) = (float(finite_values.min()), float(finite_values.max()))
+            self.min = block_min if self.min is None else min(self.min, block_min)
+            self.max = block_max if self.max is None else max(self.max, block_max)
+
+    def digest(self):
+        # Returns the dict described above.
+        return {'md5' : self.md5.hexdigest(),
+                'sum' : self.sum,
+                'min' : float('nan') if self.min is None else self.min,
+                'max' : float('nan') if self.max is None else self.max,
+                'nbr_nan' : self.nbr_nan,
+                'nbr_elements' : self.nbr_elements}
+
+
+def compute_param_digest(value):
+    # The digest of all the values at once.
+    accumulator = ParamDigestAccumulator()
+    accumulator.update(value)
+    return accumulator.digest()
+
+
+def encode_param_digest_record(digest):
+    # None for a parameter that we don't have
+    if digest is None:
+        return struct.pack(PARAM_DIGEST_RECORD_FORMAT, -1, '\0' * 16, 0.0, 0.0, 0.0, 0, 0)
+    return struct.pack(PARAM_DIGEST_RECORD_FORMAT, 0,
+                       digest['md5'].decode('hex'),
+                       digest['sum'], digest['min'], digest['max'],
+                       digest['nbr_nan'], digest['nbr_elements'])
+
+
+def decode_param_digest_record(contents):
+    (status, md5, sum_value, min_value, max_value, nbr_nan, nbr_elements) = struct.unpack(PARAM_DIGEST_RECORD_FORMAT, contents)
+    if status != 0:
+        return None
+    return {'md5' : md5.encode('hex'),
+            'sum' : sum_value,
+            'min' : min_value,
+            'max' : max_value,
+            'nbr_nan' : nbr_nan,
+            'nbr_elements' : nbr_elements}
+
+
+def param_digests_match(expected, digest):
+    # Whether the server has exactly the values of `expected`.
+    return (digest is not None and
+            digest['nbr_elements'] == expected['nbr_elements'] and
+            digest['md5'] == expected['md5'])
@@ -41,9 +41,11 @@ def get_single_dropout_indices(shape, dropout_prob_pair):
 
 
 
+# compiled once instead of at every call
+param_name_prog = re.compile(r"(layer_(\d+))_([^_]*)(_(.*)){0,1}")
+
 def analyze_param_name(name):
-    prog = re.compile(r"(layer_(\d+))_([^_]*)(_(.*)){0,1}")
-    m = prog.match(name)
+    m = param_name_prog.match(name)
     if m:
         layer_name = m.group(1)
         layer_number = int(m.group(2))
@@ -56,151 +58,259 @@ def analyze_param_name(name):
 
 
 def sample_dropout_indices(L_params_desc, D_dropout_prob_pairs):
-
-    # identify all the parameters that represent
-    # parameters instead of parameter+suffix
-
-    L_params_desc_root_variables_W = []
-    L_params_desc_root_variables_b = []
-
-    for e in L_params_desc:
-        (layer_name, layer_number, role, param_extra) = analyze_param_name(e['name'])
-        if param_extra is not None:
-            #L_params_desc_extra_variables.append(e)
-            pass
-        elif role == 'W':
-            L_params_desc_root_variables_W.append(e)
-        elif role == 'b':
-            L_params_desc_root_variables_b.append(e)
-        else:
-            raise Exception("bug !")
-
-    splits_for_W = {}
-    rough_kinds = {}
-    # splits_for_W is indexed by keys like r"layer_\d_W"
-    for e in L_params_desc_root_variables_W:
-        (layer_name, _, _, _) = analyze_param_name(e['name'])
-        rough_kinds[layer_name] = proj_rough_kind(e["kind"])
-        # this is because the `get_single_dropout_indices` does not
-        # want to know what kind of kind of parameter it's dealing with,
-        # but it needs to know which indices are the input and the output
-        if rough_kinds[layer_name] == "CONV_FILTER":
-            [index_col, index_row] = get_single_dropout_indices([e['shape'][1], e['shape'][0]], D_dropout_prob_pairs[layer_name])
-            splits_for_W[layer_name] = [index_row, index_col]
-        elif rough_kinds[layer_name] == "FULLY_CONNECTED":
-            splits_for_W[layer_name] = get_single_dropout_indices([e['shape'][0], e['shape'][1]], D_dropout_prob_pairs[layer_name])
-        else:
-            raise Exception("bug !")
-
-
-    # sort by layer_number, just in case that wasn't already the case
-    L_params_desc_root_variables_W.sort(key=lambda e: analyze_param_name(e['name'])[1])
-
-    
-    #print "BEFORE HARMONIZATION."
-    #for (k,v) in sorted(splits_for_W.items()):
-    #    print "splits_for_W[%s] has shapes : [%s, %s]" % (k, v[0].shape, v[1].shape)
-
-
-    # making two consecutive layers agree on the splits for "W"
-    for (e, e_next) in zip(L_params_desc_root_variables_W, L_params_desc_root_variables_W[1:]):
-        
-        (layer_name, _, _, _) = analyze_param_name(e['name'])
-        (layer_name_next, _, _, _) = analyze_param_name(e_next['name'])
-
-        # 1 FULLY_CONNECTED -> FULLY_CONNECTED
-        if (rough_kinds[layer_name_next] == "FULLY_CONNECTED" and 
-            rough_kinds[layer_name] == "FULLY_CONNECTED"):
-            splits_for_W[layer_name_next][0] = splits_for_W[layer_name][1]
-
-        # 2 CONV_FILTER -> CONV_FILTER
-        if (rough_kinds[layer_name_next] == "CONV_FILTER" and 
-            rough_kinds[layer_name] == "CONV_FILTER"):
-            splits_for_W[layer_name_next][1] = splits_for_W[layer_name][0]
-
-        # 3 CONV_FILTER -> FULLY_CONNECTED
-        if (rough_kinds[layer_name_next] == "FULLY_CONNECTED" and 
-            rough_kinds[layer_name] == "CONV_FILTER"):
-
-            
-            # Be VERY careful about this section.
-            # The convolution layers have shape (OUT, IN, H, W).
-            # The fully-connected layers have shape (IN, OUT, 1, 1).
-            # This means that you want e['shape'][0] to match with e_next['shape'][0].
-            # You are matching OUT -> IN.
-            #
-            # Older versions of this section had
-            # #shape_input = e['shape'][1]
-            # but this is not correct.
-            # Also, older versions used 
-            # # np.concatenate([np.arange(int(index*c), int((index+1)*c))
-            #                            for index in splits_for_W[layer_name][1]],
-            #                            axis=0).astype(np.intc)
-            # which is also wrong.
-
-            shape_input = e['shape'][0]
-            shape_output = e_next['shape'][0]
-            c = shape_output/shape_input
-
-            if c * shape_input != shape_output:
-                print "You have a problem with your configuration of dropout at the junction of the convolution and fully-connected layers."
-                print "You have %d filters (%d, %d) coming out of the convolution," % (shape_input, e['shape'][2], e['shape'][3])
-                print "but you then have %d units at the entrance to the fully-connected section." % shape_output
-                print ""
-                print "e['shape'] : %s" % str(e['shape'])
-                print "e_next['shape'] : %s" % str(e_next['shape'])
-                print ""
-                raise Exception("Setup for split indices at CONV_FILTER -> FULLY_CONNECTED cannot proceed.")
-
-            # Basically, here we're taking chunks of indices [0,1,2,3] and [8,9,10,11]
-            # that correspond to filters of size (2,2), for example.
-            # This is a bit tricky, and there are multiple ways that we could implement this.
-
-            splits_for_W[layer_name_next][0] = np.concatenate(
-                                        [np.arange(int(index*c), int((index+1)*c))
-                                            for index in splits_for_W[layer_name][0]],
-                                        axis=0).astype(np.intc)
-
-            #import pdb; pdb.set_trace()
-
-        if (rough_kinds[layer_name_next] == "CONV_FILTER" and 
-            rough_kinds[layer_name] == "FULLY_CONNECTED"):
-
-            raise Exception("FULLY_CONNECTED -> CONV_FILTER not implemented")
-
-
-    #print "AFTER HARMONIZATION."
-    #for (k,v) in sorted(splits_for_W.items()):
-    #    print "splits_for_W[%s] has shapes : [%s, %s]" % (k, v[0].shape, v[1].shape)
-
-
-    # assign the matching splits for "b" corresponding to the splits on "W"
-
-    splits_for_b = {}
-    just_the_zero_index = np.array([0], dtype=np.intc)
-    for eb in L_params_desc_root_variables_b:
-        (layer_name, _, _, _) = analyze_param_name(eb['name'])
-
-        if rough_kinds[layer_name] == "FULLY_CONNECTED":
-            splits_for_b[layer_name] = [just_the_zero_index, splits_for_W[layer_name][1]]
-        elif rough_kinds[layer_name] == "CONV_FILTER":
-            splits_for_b[layer_name] = [splits_for_W[layer_name][0], just_the_zero_index]
-        else:
-            raise Exception("bug !")
-
-    # and now we take care of everything by generating a list of splits
-    # that's indexed by the full names (ex : "layer_0_b_momentum") instead
-    # of by the layer_name (ex : "layer_0")
-    splits_indices = {}
-    for e in L_params_desc:
-        (layer_name, _, role, _) = analyze_param_name(e['name'])
-        if role == "W":
-            splits_indices[e['name']] = splits_for_W[layer_name]
-        elif role == "b":
-            splits_indices[e['name']] = splits_for_b[layer_name]
-        else:
-            raise Exception("bug !")
-
-    return splits_indices
-
-
+    # If you sample many splits for the same parameters,
+    # compile a `SplitPlan` once and use it instead.
+    return SplitPlan(L_params_desc).sample(D_dropout_prob_pairs)
+
+
+def sample_kept_indices(N, p):
+    # Same thing as one of the two halves of `get_single_dropout_indices`.
+    if p == 0.0:
+        return np.arange(N, dtype=np.intc)
+    N_kept = N-int(N*p)
+    return np.sort(np.random.permutation(N)[:N_kept]).astype(np.intc)
+
+
+def sample_many_kept_indices(N, p, nbr_splits):
+    # Returns an array of shape (nbr_splits, N_kept) with sorted rows.
+    # This doesn't use the random numbers in the same way as
+    # `sample_kept_indices`, so the splits are different for the same seed.
+    if p == 0.0:
+        return np.tile(np.arange(N, dtype=np.intc), (nbr_splits, 1))
+    N_kept = N-int(N*p)
+    if N_kept == 0:
+        return np.zeros((nbr_splits, 0), dtype=np.intc)
+    kept = np.argpartition(np.random.rand(nbr_splits, N), N_kept-1, axis=1)[:, :N_kept]
+    return np.sort(kept, axis=1).astype(np.intc)
+
+
+# The seeded splits use their own random numbers instead of `np.random`,
+# so that the server can generate the same splits from the seed alone
+# (see `generate_seeded_split` in server/seeded_split.c).
+# This has to stay bit-identical with the C implementation.
+#
+# Every (seed, layer_number, axis) has its own stream, with axis 0 for IN
+# and axis 1 for OUT. Every unit `i` of that axis gets a 64-bit key
+#    key_i = splitmix64(stream + (i+1)*SPLITMIX64_GAMMA)
+# and we keep the N_kept units with the smallest keys (ties going to the
+# smallest `i`), which is a uniform sample without replacement.
+
+SPLITMIX64_GAMMA = 0x9e3779b97f4a7c15
+UINT64_MASK = 0xffffffffffffffff
+
+def splitmix64(z):
+    # works on python ints (taken modulo 2**64) and on arrays of np.uint64
+    if isinstance(z, np.ndarray):
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return z ^ (z >> np.uint64(31))
+    else:
+        z = z & UINT64_MASK
+        z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & UINT64_MASK
+        z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & UINT64_MASK
+        return z ^ (z >> 31)
+
+
+def seeded_stream(seed, layer_number, axis):
+    return splitmix64(seed + (2*layer_number + axis + 1) * SPLITMIX64_GAMMA)
+
+
+def sample_seeded_kept_indices(N, p, seed, layer_number, axis):
+    # Same thing as `sample_kept_indices`, but with the seeded random numbers.
+    if p == 0.0:
+        return np.arange(N, dtype=np.intc)
+    N_kept = N-int(N*p)
+    stream = seeded_stream(seed, layer_number, axis)
+    # np.uint64 arithmetic wraps around like the C version
+    keys = splitmix64(np.uint64(stream) + np.arange(1, N+1, dtype=np.uint64) * np.uint64(SPLITMIX64_GAMMA))
+    kept = np.argsort(keys, kind='mergesort')[:N_kept]
+    return np.sort(kept).astype(np.intc)
+
+
+# Everything that `sample_dropout_indices` needs to know about the parameters,
+# worked out once from `L_params_desc`.
+#
+#    plan = SplitPlan(L_params_desc)
+#    splits_indices = plan.sample(D_dropout_prob_pairs)
+#    L_splits_indices = plan.sample_many(D_dropout_prob_pairs, 100)
+#
+# `plan.sample` uses `np.random` exactly like the original implementation of
+# `sample_dropout_indices` did, so it gives the same splits for the same seed.
+# `plan.sample_seeded(seed, D_dropout_prob_pairs)` depends on `seed` only,
+# and the server can generate that split on its side.
+
+class SplitPlan(object):
+
+    def __init__(self, L_params_desc):
+
+        # The layers that have a "W" (without suffix), in the order of
+        # `L_params_desc`, which is the order in which we sample them.
+        # Contains tuples (layer_name, layer_number, rough_kind, N_in, N_out).
+        #
+        # The convolution layers have shape (OUT, IN, H, W).
+        # The fully-connected layers have shape (IN, OUT, 1, 1).
+        # The dropout pairs are always (IN, OUT).
+        self.L_layers = []
+        rough_kinds = {}
+        shapes = {}
+
+        for e in L_params_desc:
+            (layer_name, layer_number, role, param_extra) = analyze_param_name(e['name'])
+            if param_extra is not None or role != 'W':
+                continue
+            rough_kind = proj_rough_kind(e["kind"])
+            if rough_kind == "CONV_FILTER":
+                (N_in, N_out) = (e['shape'][1], e['shape'][0])
+            elif rough_kind == "FULLY_CONNECTED":
+                (N_in, N_out) = (e['shape'][0], e['shape'][1])
+            else:
+                raise Exception("bug !")
+            self.L_layers.append((layer_name, layer_number, rough_kind, N_in, N_out))
+            rough_kinds[layer_name] = rough_kind
+            shapes[layer_name] = e['shape']
+
+        # How two consecutive layers agree on the splits for "W".
+        # Contains tuples (layer_name, axis, layer_name_next, axis_next, c)
+        # meaning that the indices of `layer_name_next` along `axis_next`
+        # are `index*c + arange(c)` for every index of `layer_name` along `axis`.
+        self.L_junctions = []
+        L_sorted_layers = sorted(self.L_layers, key=lambda layer: layer[1])
+        for (layer, layer_next) in zip(L_sorted_layers, L_sorted_layers[1:]):
+            (layer_name, layer_name_next) = (layer[0], layer_next[0])
+            (kind, kind_next) = (rough_kinds[layer_name], rough_kinds[layer_name_next])
+
+            if kind == "FULLY_CONNECTED" and kind_next == "FULLY_CONNECTED":
+                self.L_junctions.append((layer_name, 1, layer_name_next, 0, 1))
+
+            elif kind == "CONV_FILTER" and kind_next == "CONV_FILTER":
+                self.L_junctions.append((layer_name, 0, layer_name_next, 1, 1))
+
+            elif kind == "CONV_FILTER" and kind_next == "FULLY_CONNECTED":
+                # Every filter coming out of the convolution feeds `c` consecutive
+                # units at the entrance of the fully-connected section.
+                (shape, shape_next) = (shapes[layer_name], shapes[layer_name_next])
+                shape_input = shape[0]
+                shape_output = shape_next[0]
+                c = shape_output/shape_input
+
+                if c * shape_input != shape_output:
+                    print "You have a problem with your configuration of dropout at the junction of the convolution and fully-connected layers."
+                    print "You have %d filters (%d, %d) coming out of the convolution," % (shape_input, shape[2], shape[3])
+                    print "but you then have %d units at the entrance to the fully-connected section." % shape_output
+                    print ""
+                    print "e['shape'] : %s" % str(shape)
+                    print "e_next['shape'] : %s" % str(shape_next)
+                    print ""
+                    raise Exception("Setup for split indices at CONV_FILTER -> FULLY_CONNECTED cannot proceed.")
+
+                self.L_junctions.append((layer_name, 0, layer_name_next, 0, c))
+
+            elif kind == "FULLY_CONNECTED" and kind_next == "CONV_FILTER":
+                raise Exception("FULLY_CONNECTED -> CONV_FILTER not implemented")
+
+        # Every parameter, with its suffix variables (ex : "layer_0_b_momentum")
+        # grouped with the root variable that they follow.
+        # Indexed by (layer_name, role), containing lists of names.
+        self.D_groups = {}
+        for e in L_params_desc:
+            (layer_name, _, role, _) = analyze_param_name(e['name'])
+            if role not in ("W", "b"):
+                raise Exception("bug !")
+            self.D_groups.setdefault((layer_name, role), []).append(e['name'])
+
+        self.rough_kinds = rough_kinds
+
+    def sample(self, D_dropout_prob_pairs):
+        # Returns the `splits_indices`, indexed by parameter name.
+        # All the variables of a group share the same pair of arrays.
+
+        splits_for_W = {}
+        for (layer_name, _, rough_kind, N_in, N_out) in self.L_layers:
+            (p_in, p_out) = D_dropout_prob_pairs[layer_name]
+            index_in = sample_kept_indices(N_in, p_in)
+            index_out = sample_kept_indices(N_out, p_out)
+            if rough_kind == "CONV_FILTER":
+                splits_for_W[layer_name] = [index_out, index_in]
+            else:
+                splits_for_W[layer_name] = [index_in, index_out]
+
+        for (layer_name, axis, layer_name_next, axis_next, c) in self.L_junctions:
+            index = splits_for_W[layer_name][axis]
+            if c != 1:
+                index = (index.reshape((-1, 1)) * c + np.arange(c, dtype=np.intc)).reshape((-1,)).astype(np.intc)
+            splits_for_W[layer_name_next][axis_next] = index
+
+        return self.assemble(splits_for_W)
+
+    def sample_seeded(self, seed, D_dropout_prob_pairs):
+        # Same thing as `sample`, but the split is a function of `seed`
+        # (an integer in [0, 2**64)) and doesn't touch `np.random`.
+        # The server can reproduce it with MSG_TYPE_REGISTER_SEEDED_SPLIT.
+
+        splits_for_W = {}
+        for (layer_name, layer_number, rough_kind, N_in, N_out) in self.L_layers:
+            (p_in, p_out) = D_dropout_prob_pairs[layer_name]
+            index_in = sample_seeded_kept_indices(N_in, p_in, seed, layer_number, 0)
+            index_out = sample_seeded_kept_indices(N_out, p_out, seed, layer_number, 1)
+            if rough_kind == "CONV_FILTER":
+                splits_for_W[layer_name] = [index_out, index_in]
+            else:
+                splits_for_W[layer_name] = [index_in, index_out]
+
+        for (layer_name, axis, layer_name_next, axis_next, c) in self.L_junctions:
+            index = splits_for_W[layer_name][axis]
+            if c != 1:
+                index = (index.reshape((-1, 1)) * c + np.arange(c, dtype=np.intc)).reshape((-1,)).astype(np.intc)
+            splits_for_W[layer_name_next][axis_next] = index
+
+        return self.assemble(splits_for_W)
+
+    def get_seeded_prob_pairs(self, D_dropout_prob_pairs):
+        # The dropout pairs in the form sent to the server,
+        # as a list of (layer_number, p_in, p_out).
+        return [(layer_number,) + tuple(D_dropout_prob_pairs[layer_name])
+                for (layer_name, layer_number, _, _, _) in self.L_layers]
+
+    def sample_many(self, D_dropout_prob_pairs, nbr_splits):
+        # Returns a list of `nbr_splits` independent `splits_indices`.
+        # The indices of every layer are sampled for all the splits at once.
+
+        L_splits_for_W = [{} for _ in range(nbr_splits)]
+        for (layer_name, _, rough_kind, N_in, N_out) in self.L_layers:
+            (p_in, p_out) = D_dropout_prob_pairs[layer_name]
+            many_index_in = sample_many_kept_indices(N_in, p_in, nbr_splits)
+            many_index_out = sample_many_kept_indices(N_out, p_out, nbr_splits)
+            for (splits_for_W, index_in, index_out) in zip(L_splits_for_W, many_index_in, many_index_out):
+                if rough_kind == "CONV_FILTER":
+                    splits_for_W[layer_name] = [index_out, index_in]
+                else:
+                    splits_for_W[layer_name] = [index_in, index_out]
+
+        for (layer_name, axis, layer_name_next, axis_next, c) in self.L_junctions:
+            many_index = np.array([splits_for_W[layer_name][axis] for splits_for_W in L_splits_for_W], dtype=np.intc)
+            if c != 1:
+                many_index = (many_index.reshape((nbr_splits, -1, 1)) * c + np.arange(c, dtype=np.intc)).reshape((nbr_splits, -1)).astype(np.intc)
+            for (splits_for_W, index) in zip(L_splits_for_W, many_index):
+                splits_for_W[layer_name_next][axis_next] = index
+
+        return [self.assemble(splits_for_W) for splits_for_W in L_splits_for_W]
+
+    def assemble(self, splits_for_W):
+        # Goes from the splits for "W" indexed by layer name
+        # to the splits of every parameter indexed by full name.
+
+        splits_indices = {}
+        just_the_zero_index = np.array([0], dtype=np.intc)
+        for ((layer_name, role), names) in self.D_groups.items():
+            if role == "W":
+                split = splits_for_W[layer_name]
+            elif self.rough_kinds[layer_name] == "FULLY_CONNECTED":
+                split = [just_the_zero_index, splits_for_W[layer_name][1]]
+            elif self.rough_kinds[layer_name] == "CONV_FILTER":
+                split = [splits_for_W[layer_name][0], just_the_zero_index]
+            else:
+                raise Exception("bug !")
+            for name in names:
+                splits_indices[name] = split
+
+        return splits_indices
@@ -0,0 +1,57 @@
+import numpy as np
+
+from distdrop.client.messages import INIT_DISTRIBUTION_ZERO, INIT_DISTRIBUTION_UNIFORM, INIT_DISTRIBUTION_FANIN_NORMAL
+from distdrop.client.sample_dropout_indices import splitmix64, SPLITMIX64_GAMMA
+
+# The values that MSG_TYPE_INIT_PARAM puts in a parameter, generated from a seed
+# (see `init_param_seeded` in server/seeded_init.c, and the python server).
+#
+# With the same splitmix64 as the seeded splits, we have
+#    x(j) = splitmix64(stream + (j+1)*SPLITMIX64_GAMMA) with stream = splitmix64(seed + SPLITMIX64_GAMMA)
+#    u(j) = (x(j) >> 11) * 2**-53, which is uniform in [0, 1)
+# and the element `i` of the flattened parameter is
+#    UNIFORM      : scale * (2*u(i) - 1)
+#    FANIN_NORMAL : std * sqrt(-2*log(1 - u(2i))) * cos(2*pi*u(2i+1))    (Box-Muller)
+# with std = scale * sqrt(2/fan_in), like `make_initial_value` in bin/auto_init_server_params.py.
+#
+# The uniform values are bit-identical with the C server. The normal ones go
+# through `log` and `cos`, so they can differ in the last bit from one libm to another.
+
+def get_fan_in(shape, kind):
+    # None for the biases
+    if kind == 'CONV_FILTER_WEIGHTS':
+        return shape[1]
+    elif kind == 'FULLY_CONNECTED_WEIGHTS':
+        return shape[0]
+    else:
+        return None
+
+def seeded_uniform(seed, j):
+    # `j` is an array of np.uint64
+    stream = splitmix64(seed + SPLITMIX64_GAMMA)
+    x = splitmix64(np.uint64(stream) + (j + np.uint64(1)) * np.uint64(SPLITMIX64_GAMMA))
+    return (x >> np.uint64(11)).astype(np.float64) * (1.0 / 2**53)
+
+def sample_seeded_init_values(shape, kind, distribution, scale, seed):
+    # Returns a float32 array of the given `shape`.
+
+    nbr_elements = int(np.prod(shape))
+
+    if distribution == INIT_DISTRIBUTION_ZERO:
+        return np.zeros(shape, dtype=np.float32)
+
+    elif distribution == INIT_DISTRIBUTION_UNIFORM:
+        u = seeded_uniform(seed, np.arange(nbr_elements, dtype=np.uint64))
+        return (scale * (2.0 * u - 1.0)).astype(np.float32).reshape(shape)
+
+    elif distribution == INIT_DISTRIBUTION_FANIN_NORMAL:
+        fan_in = get_fan_in(shape, kind)
+        if fan_in is None:
+            raise ValueError("Parameters of kind %s have no fan-in." % kind)
+        std = scale * np.sqrt(2.0 / fan_in)
+        u = seeded_uniform(seed, np.arange(2 * nbr_elements, dtype=np.uint64))
+        z = np.sqrt(-2.0 * np.log(1.0 - u[0::2])) * np.cos(2.0 * np.pi * u[1::2])
+        return (std * z).astype(np.float32).reshape(shape)
+
+    else:
+        raise ValueError("Unknown distribution %d." % distribution)
@@ -0,0 +1,659 @@
+import os
+import re
+import bisect
+import hashlib
+import threading
+import collections
+import Queue
+
+import numpy as np
+
+from distdrop.client.messages import DTYPE_FLOAT16
+from distdrop.client.client_api import ClientCNNAutoSplitter
+from distdrop.client.client_stats import ClientStats
+from distdrop.client.sample_dropout_indices import SplitPlan
+
+# The parameters of a model spread over many servers (the shards), each with
+# its own json file describing the parameters that it has.
+#
+#    python bin/shard_params_desc.py --model_params_desc=params_desc.json --nbr_shards=3
+#    ... start one server per params_desc_shard_K_of_3.json ...
+#
+#    client = ShardedClient.new_basic_alpha_beta([("127.0.0.1", 5000), ("127.0.0.1", 5001), ("127.0.0.1", 5002)], 1.0, 1.0)
+#    client.connect()
+#    client.perform_split(D_dropout_prob_pairs)
+#    D_values = client.pull_split_params(client.splits_indices.keys())
+#
+# The placement of the parameters only matters when writing the json files.
+# The client asks every server for its parameters and sends everything about
+# a parameter to the server that has it, so it works with any placement,
+# as long as every parameter (or piece of one, see below) is on exactly one server.
+
+
+def get_name_hash(key):
+    # A position on the ring, the same on every machine (unlike `hash`).
+    return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+
+def get_consistent_hash_placement(names, nbr_shards, nbr_virtual_nodes=64):
+    # Returns a dict indexed by name with the shard of every parameter.
+    #
+    # Every shard has `nbr_virtual_nodes` points on a ring of hashes, and
+    # a parameter goes to the shard of the first point after the hash of its name.
+    # When we go from `nbr_shards` to `nbr_shards + 1`, the only parameters that
+    # move are the ones going to the new shard, about 1/(nbr_shards + 1) of them.
+    #
+    # The pieces of a parameter (see `parse_piece_name`) keep going around
+    # the ring until they find a shard without any other piece of it, if there is one.
+
+    assert 1 <= nbr_shards
+    L_ring = sorted((get_name_hash("shard_%d_%d" % (shard, v)), shard)
+                    for shard in range(nbr_shards)
+                    for v in range(nbr_virtual_nodes))
+    L_ring_hashes = [h for (h, _) in L_ring]
+
+    D_placement = {}
+    D_shards_of_param = collections.defaultdict(set)
+    for name in sorted(names):
+        k = bisect.bisect_right(L_ring_hashes, get_name_hash(name)) % len(L_ring)
+        param_name = get_param_name_of_piece(name)
+        if len(D_shards_of_param[param_name]) < nbr_shards:
+            while L_ring[k][1] in D_shards_of_param[param_name]:
+                k = (k + 1) % len(L_ring)
+        D_placement[name] = L_ring[k][1]
+        D_shards_of_param[param_name].add(L_ring[k][1])
+    return D_placement
+
+
+def get_size_balanced_placement(L_param_desc, nbr_shards):
+    # Returns a dict indexed by name with the shard of every parameter.
+    #
+    # The largest parameters go first, each to the shard with the fewest
+    # elements so far, so the shards end up with about the same amount
+    # of memory (and traffic). Changing `nbr_shards` moves almost everything.
+    # The pieces of a parameter go to different shards when there are enough.
+
+    assert 1 <= nbr_shards
+    L_shard_load = [0] * nbr_shards
+    D_placement = {}
+    D_shards_of_param = collections.defaultdict(set)
+    for param_desc in sorted(L_param_desc, key=lambda e: (-np.prod(e['shape']), e['name'])):
+        param_name = get_param_name_of_piece(param_desc['name'])
+        L_candidates = [shard for shard in range(nbr_shards) if shard not in D_shards_of_param[param_name]]
+        if len(L_candidates) == 0:
+            L_candidates = range(nbr_shards)
+        shard = min(L_candidates, key=lambda shard: L_shard_load[shard])
+        D_placement[param_desc['name']] = shard
+        D_shards_of_param[param_name].add(shard)
+        L_shard_load[shard] = L_shard_load[shard] + int(np.prod(param_desc['shape']))
+    return D_placement
+
+
+placement_function_dict = {'hash' : lambda L_param_desc, nbr_shards : get_consistent_hash_placement([e['name'] for e in L_param_desc], nbr_shards),
+                           'size' : get_size_balanced_placement}
+
+
+# A parameter too large for one server can be cut along its first dimension
+# into pieces, which are parameters of their own on the servers, named like
+#     "layer_5_W@rows_0_1024", "layer_5_W@rows_1024_2048", ...
+# for the rows [0, 1024) and [1024, 2048) of "layer_5_W".
+# `ShardedClient` puts the pieces back together, so the users only see "layer_5_W".
+# Since the pieces can be on different servers, the pulls and pushes of
+# the biggest layers then go through many of them at once.
+
+piece_name_pattern = re.compile(r"^(.*)@rows_(\d+)_(\d+)$")
+
+
+def get_piece_name(name, row_start, row_stop):
+    return "%s@rows_%d_%d" % (name, row_start, row_stop)
+
+
+def parse_piece_name(piece_name):
+    # Returns (name, row_start, row_stop), or None when it's not the name of a piece.
+    m = piece_name_pattern.match(piece_name)
+    if m is None:
+        return None
+    return (m.group(1), int(m.group(2)), int(m.group(3)))
+
+
+def get_param_name_of_piece(name):
+    # "layer_5_W" for "layer_5_W@rows_0_1024", and the same name for everything else.
+    parsed = parse_piece_name(name)
+    return name if parsed is None else parsed[0]
+
+
+def get_row_ranges(nbr_rows, nbr_pieces):
+    # `nbr_pieces` ranges (row_start, row_stop) covering `range(nbr_rows)`,
+    # with sizes that differ by at most one.
+    assert 1 <= nbr_pieces <= nbr_rows, "Can't cut %d rows in %d pieces." % (nbr_rows, nbr_pieces)
+    bounds = [(nbr_rows * k) // nbr_pieces for k in range(nbr_pieces + 1)]
+    return zip(bounds[:-1], bounds[1:])
+
+
+def partition_param_desc(param_desc, nbr_pieces):
+    # Returns the descriptions of the pieces of a parameter.
+    # `param_desc` needs its full shape, with 4 dimensions.
+    shape = list(param_desc['shape'])
+    assert len(shape) == 4
+    return [collections.OrderedDict([('name', get_piece_name(param_desc['name'], row_start, row_stop)),
+                                     ('kind', param_desc['kind']),
+                                     ('shape', [row_stop - row_start] + shape[1:])])
+            for (row_start, row_stop) in get_row_ranges(shape[0], nbr_pieces)]
+
+
+def combine_param_digests(L_digests):
+    # The digest of a parameter from the digests of its pieces, in the order of the rows.
+    # The md5 of the whole can't be had from the md5 of the pieces, so 'md5' is None,
+    # and the digests of the pieces are in 'pieces' to be checked one by one.
+    if any(digest is None for digest in L_digests):
+        return None
+    L_min = [digest['min'] for digest in L_digests if not np.isnan(digest['min'])]
+    L_max = [digest['max'] for digest in L_digests if not np.isnan(digest['max'])]
+    return {'md5' : None,
+            'sum' : sum(digest['sum'] for digest in L_digests),
+            'min' : min(L_min) if L_min else float('nan'),
+            'max' : max(L_max) if L_max else float('nan'),
+            'nbr_nan' : sum(digest['nbr_nan'] for digest in L_digests),
+            'nbr_elements' : sum(digest['nbr_elements'] for digest in L_digests),
+            'pieces' : L_digests}
+
+
+def get_shard_path(path, shard, nbr_shards):
+    # "params.h5" becomes "params_shard_1_of_3.h5" for shard 1.
+    # Used for the json files of the shards and for their hdf5 files.
+    (root, extension) = os.path.splitext(path)
+    return "%s_shard_%d_of_%d%s" % (root, shard, nbr_shards, extension)
+
+
+class ShardedClient(object):
+
+    # Has the same methods as `ClientCNNAutoSplitter` for the splits and the
+    # entire parameters, with one `ClientCNNAutoSplitter` per shard behind them.
+    # The shards all record their messages in the same `ClientStats`,
+    # where the parameters cut in pieces have the stats of every piece.
+    #
+    # Every shard has a thread of our own, so that a request touching
+    # many shards gets served by all of them at the same time.
+
+    def __init__(self, L_endpoints, **client_kwargs):
+        # L_endpoints : list of (server_host, port)
+        # client_kwargs : the arguments of `ClientCNNAutoSplitter` after the port
+
+        assert 1 <= len(L_endpoints)
+        self.L_endpoints = list(L_endpoints)
+        self.nbr_shards = len(L_endpoints)
+
+        self.msg_stats = ClientStats()
+        self.L_shards = [ClientCNNAutoSplitter(server_host, port, msg_stats=self.msg_stats, **client_kwargs)
+                         for (server_host, port) in L_endpoints]
+
+        # All the parameters, from all the shards, with the pieces put together.
+        self.L_param_desc = None
+        # indexed by param name, see `get_pieces`
+        self.D_param_desc = {}
+        self.D_pieces = {}
+
+        # Same as for `ClientCNNAutoSplitter`, for all the shards.
+        # Every shard has the part of the split for its own parameters.
+        self.splits_indices = {}
+        self.split_seed = None
+        self.split_plan = None
+        self.split_plan_L_param_desc = None
+        # where every parameter goes for the current split, see `perform_split`
+        self.D_split_layouts = {}
+
+        # The jobs for shard `i` are in `L_jobs[i]`. See `run_on_shards`.
+        self.L_jobs = [Queue.Queue() for _ in range(self.nbr_shards)]
+        self.L_threads = []
+
+    @classmethod
+    def new_basic_alpha_beta(cls, L_endpoints, alpha, beta, **kwargs):
+        assert alpha is not None
+        assert beta is not None
+        return cls(L_endpoints, alpha=alpha, beta=beta, want_delta_updates=False, **kwargs)
+
+    @classmethod
+    def new_float16_alpha_beta(cls, L_endpoints, alpha, beta, want_error_feedback=True):
+        assert alpha is not None
+        assert beta is not None
+        return cls(L_endpoints, alpha=alpha, beta=beta, want_delta_updates=False,
+                   dtype_for_client=DTYPE_FLOAT16, want_error_feedback=want_error_feedback)
+
+    @classmethod
+    def new_delta_updates(cls, L_endpoints, beta=1.0, delta_threshold=None):
+        return cls(L_endpoints, alpha=1.0, beta=beta, want_delta_updates=True,
+                   delta_threshold=delta_threshold)
+
+    def connect(self):
+        for shard in self.L_shards:
+            shard.connect()
+
+        for i in range(self.nbr_shards):
+            thread = threading.Thread(target=self.run_shard, args=(i,))
+            thread.daemon = True
+            thread.start()
+            self.L_threads.append(thread)
+
+    def close(self):
+        for jobs in self.L_jobs:
+            jobs.put(None)
+        for thread in self.L_threads:
+            thread.join()
+        self.L_threads = []
+
+        for shard in self.L_shards:
+            shard.close()
+
+    def quit(self):
+        # call this before calling `close`
+        for shard in self.L_shards:
+            shard.quit()
+
+    def stats(self):
+        return self.msg_stats.snapshot()
+
+    def reset_stats(self):
+        self.msg_stats.reset()
+
+    def set_stats_callback(self, callback):
+        self.msg_stats.set_callback(callback)
+
+    def run_shard(self, i):
+        while True:
+            job = self.L_jobs[i].get()
+            if job is None:
+                return
+
+            (func, args, results, done) = job
+            try:
+                results[i] = func(self.L_shards[i], *args)
+            except Exception as e:
+                results[i] = e
+            done.put(i)
+
+    def run_on_shards(self, L_jobs_args, func):
+        # Calls `func(shard, *args)` for every shard for which `L_jobs_args`
+        # has args that are not None, and waits for all of them.
+        # Returns the list of results, indexed by shard.
+        # When only one shard has something to do, it's done on this thread.
+
+        results = [None] * self.nbr_shards
+        L_busy = [i for (i, args) in enumerate(L_jobs_args) if args is not None]
+
+        if len(L_busy) == 1:
+            i = L_busy[0]
+            results[i] = func(self.L_shards[i], *L_jobs_args[i])
+            return results
+
+        done = Queue.Queue()
+        for i in L_busy:
+            self.L_jobs[i].put((func, L_jobs_args[i], results, done))
+        for _ in L_busy:
+            done.get()
+
+        for res in results:
+            if isinstance(res, Exception):
+                raise res
+        return results
+
+    def read_param_desc_from_server(self):
+        # Every shard reads its own, and we put them together in the order of the shards.
+        # The pieces of a parameter become a single parameter, where the first piece was.
+
+        L_param_desc = []
+        D_param_desc = {}
+        D_pieces = {}
+        D_shard_of_piece = {}
+        for (i, shard) in enumerate(self.L_shards):
+            for piece_desc in shard.read_param_desc_from_server():
+                piece_name = piece_desc['name']
+                if D_shard_of_piece.has_key(piece_name):
+                    raise Exception("Parameter %s is on the servers at %s:%d and %s:%d." % ((piece_name,) + self.L_endpoints[D_shard_of_piece[piece_name]] + self.L_endpoints[i]))
+                D_shard_of_piece[piece_name] = i
+
+                parsed = parse_piece_name(piece_name)
+                if parsed is None:
+                    (name, row_start, row_stop) = (piece_name, 0, piece_desc['shape'][0])
+                else:
+                    (name, row_start, row_stop) = parsed
+                    if row_stop - row_start != piece_desc['shape'][0]:
+                        raise Exception("Parameter %s has %d rows." % (piece_name, piece_desc['shape'][0]))
+
+                if not D_pieces.has_key(name):
+                    param_desc = dict(piece_desc)
+                    param_desc['name'] = name
+                    L_param_desc.append(param_desc)
+                    D_param_desc[name] = param_desc
+                    D_pieces[name] = []
+                elif (list(D_param_desc[name]['shape'][1:]) != list(piece_desc['shape'][1:]) or
+                      D_param_desc[name]['kind'] != piece_desc['kind']):
+                    raise Exception("The pieces of parameter %s don't have the same kind and shape." % name)
+                D_pieces[name].append((i, piece_name, row_start, row_stop))
+
+        for (name, L_pieces) in D_pieces.items():
+            L_pieces.sort(key=lambda piece: piece[2])
+            next_row_start = 0
+            for (_, piece_name, row_start, row_stop) in L_pieces:
+                if row_start != next_row_start:
+                    raise Exception("The pieces of parameter %s are missing rows, or have the same rows, around %s." % (name, piece_name))
+                next_row_start = row_stop
+            D_param_desc[name]['shape'] = [next_row_start] + list(D_param_desc[name]['shape'][1:])
+
+        (self.L_param_desc, self.D_param_desc, self.D_pieces) = (L_param_desc, D_param_desc, D_pieces)
+        return L_param_desc
+
+    def get_param_desc(self, name):
+        if self.L_param_desc is None:
+            self.read_param_desc_from_server()
+        return self.D_param_desc.get(name)
+
+    def get_pieces(self, name):
+        # The list of (shard_index, piece_name, row_start, row_stop) for `name`,
+        # in the order of the rows. A parameter that isn't cut has one piece with its own name.
+        if self.L_param_desc is None:
+            self.read_param_desc_from_server()
+        assert self.D_pieces.has_key(name), "There is no parameter %s on any of the servers." % name
+        return self.D_pieces[name]
+
+    def get_shard_index(self, name):
+        # For the parameters that are not cut in pieces.
+        L_pieces = self.get_pieces(name)
+        assert len(L_pieces) == 1 and L_pieces[0][1] == name, "Parameter %s is cut in pieces on many servers." % name
+        return L_pieces[0][0]
+
+    def get_shard(self, name):
+        return self.L_shards[self.get_shard_index(name)]
+
+    def get_split_plan(self):
+        # The `SplitPlan` of all the parameters. The one of a shard would only see
+        # the layers on that shard, and couldn't link them to their neighbours.
+        if self.L_param_desc is None:
+            self.read_param_desc_from_server()
+        if self.split_plan is None or self.split_plan_L_param_desc is not self.L_param_desc:
+            self.split_plan = SplitPlan(self.L_param_desc)
+            self.split_plan_L_param_desc = self.L_param_desc
+        return self.split_plan
+
+    @staticmethod
+    def get_local_indices(indices, row_start, row_stop):
+        # For the piece with the rows [row_start, row_stop) of a parameter, returns
+        # (local_indices, positions) where `local_indices` are the indices of
+        # the split that fall in the piece, relative to the piece, and `positions`
+        # says which rows of the slice of the whole parameter they are.
+        # The indices of the splits are sorted, so `positions` is a slice,
+        # and a slice of contiguous rows is contiguous.
+        rows = np.asarray(indices[0])
+        kept = np.nonzero((row_start <= rows) & (rows < row_stop))[0]
+        local_indices = ((rows[kept] - row_start).astype(np.intc), indices[1])
+        if 0 < len(kept) and kept[-1] - kept[0] + 1 == len(kept):
+            positions = slice(kept[0], kept[-1] + 1)
+        else:
+            positions = kept
+        return (local_indices, positions)
+
+    def perform_split(self, D_dropout_prob_pairs, seed=None):
+        # Same as `ClientCNNAutoSplitter.perform_split`. We sample the split of the whole
+        # model here, and every shard gets the part for its parameters, so the indices
+        # agree between layers exactly as they would with a single server.
+        # The pieces get the rows of the split that they have, and the pieces
+        # without any aren't pulled or pushed until the next split.
+        #
+        # With `want_registered_splits`, the shards always register the indices
+        # themselves, even with a `seed`, because a server can't generate a seeded
+        # split from the few layers that it has.
+
+        if self.L_param_desc is None:
+            self.read_param_desc_from_server()
+
+        self.split_seed = seed
+        if seed is None:
+            self.splits_indices = self.get_split_plan().sample(D_dropout_prob_pairs)
+        else:
+            self.splits_indices = self.get_split_plan().sample_seeded(seed, D_dropout_prob_pairs)
+
+        # Indexed by name, with lists of (shard_index, piece_name, positions).
+        self.D_split_layouts = {}
+        L_shard_splits_indices = [{} for _ in range(self.nbr_shards)]
+        # The parameters that share their indices (ex : "layer_0_W" and "layer_0_W_momentum")
+        # still share them on the shards, so they get registered once.
+        D_local_indices = {}
+        for (name, indices) in self.splits_indices.items():
+            layout = []
+            for (i, piece_name, row_start, row_stop) in self.get_pieces(name):
+                if piece_name == name:
+                    (local_indices, positions) = (indices, slice(None))
+                else:
+                    key = (id(indices), row_start, row_stop)
+                    if not D_local_indices.has_key(key):
+                        D_local_indices[key] = self.get_local_indices(indices, row_start, row_stop)
+                    (local_indices, positions) = D_local_indices[key]
+                    if len(local_indices[0]) == 0:
+                        continue
+                L_shard_splits_indices[i][piece_name] = local_indices
+                layout.append((i, piece_name, positions))
+            self.D_split_layouts[name] = layout
+
+        def split(shard, splits_indices):
+            shard.split_seed = seed
+            shard.splits_indices = splits_indices
+            if shard.want_registered_splits:
+                shard.register_split()
+
+        self.run_on_shards([(splits_indices,) for splits_indices in L_shard_splits_indices], split)
+
+    def get_split_layout(self, name):
+        return self.D_split_layouts[name]
+
+    def get_split_shape(self, name):
+        indices = self.splits_indices[name]
+        shape = self.get_param_desc(name)['shape']
+        return (len(indices[0]), len(indices[1]), shape[2], shape[3])
+
+    def get_entire_layout(self, name):
+        return [(i, piece_name, slice(None) if piece_name == name else slice(row_start, row_stop))
+                for (i, piece_name, row_start, row_stop) in self.get_pieces(name)]
+
+    def get_entire_shape(self, name):
+        return tuple(self.get_param_desc(name)['shape'])
+
+    def pull_pieces(self, names, get_layout, get_shape, pull, D_out=None):
+        # Calls `pull(shard, piece_names, D_piece_out)` on every shard with pieces of `names`
+        # and puts the pieces together. `pull` returns the values indexed by piece name.
+        # The rows of the pieces go directly into the arrays that we return when they can.
+
+        if D_out is None:
+            D_out = {}
+
+        L_piece_names = [[] for _ in range(self.nbr_shards)]
+        L_piece_out = [{} for _ in range(self.nbr_shards)]
+        D_values = {}
+        for name in names:
+            layout = get_layout(name)
+            out = D_out.get(name)
+            if layout and layout[0][1] == name:
+                (i, piece_name, _) = layout[0]
+                L_piece_names[i].append(piece_name)
+                if out is not None:
+                    L_piece_out[i][piece_name] = out
+                continue
+
+            value = out if out is not None else np.empty(get_shape(name), dtype=np.float32)
+            D_values[name] = value
+            for (i, piece_name, positions) in layout:
+                L_piece_names[i].append(piece_name)
+                if isinstance(positions, slice):
+                    L_piece_out[i][piece_name] = value[positions]
+
+        D_piece_values = self.merge_dicts(self.run_on_shards([(piece_names, piece_out) if piece_names else None
+                                                              for (piece_names, piece_out) in zip(L_piece_names, L_piece_out)],
+                                                             pull))
+
+        for name in names:
+            layout = get_layout(name)
+            if layout and layout[0][1] == name:
+                D_values[name] = D_piece_values[name]
+                continue
+            value = D_values[name]
+            for (_, piece_name, positions) in layout:
+                piece_value = D_piece_values[piece_name]
+                if not np.may_share_memory(piece_value, value):
+                    value[positions] = piece_value
+        return D_values
+
+    def push_pieces(self, D_updated_values, get_layout, push):
+        # Calls `push(shard, D_piece_values)` on every shard with pieces of the parameters
+        # in `D_updated_values`, with the rows of the values for each piece.
+        L_piece_values = [{} for _ in range(self.nbr_shards)]
+        for (name, updated_value) in D_updated_values.items():
+            for (i, piece_name, positions) in get_layout(name):
+                if piece_name == name:
+                    L_piece_values[i][piece_name] = updated_value
+                else:
+                    L_piece_values[i][piece_name] = np.asarray(updated_value)[positions]
+        self.run_on_shards([(piece_values,) if piece_values else None for piece_values in L_piece_values], push)
+
+    def is_whole(self, layout, name):
+        return len(layout) == 1 and layout[0][1] == name
+
+    def pull_split_param(self, name, out=None):
+        layout = self.get_split_layout(name)
+        if self.is_whole(layout, name):
+            return self.L_shards[layout[0][0]].pull_split_param(name, out)
+        return self.pull_split_params([name], D_out={name : out} if out is not None else None)[name]
+
+    def push_split_param(self, name, updated_value):
+        layout = self.get_split_layout(name)
+        if self.is_whole(layout, name):
+            return self.L_shards[layout[0][0]].push_split_param(name, updated_value)
+        self.push_split_params({name : updated_value})
+
+    def exchange_split_param(self, name, updated_value, out=None):
+        # The pieces are exchanged at the same time, each in its own MSG_TYPE_EXCHANGE_PARAM.
+        layout = self.get_split_layout(name)
+        if self.is_whole(layout, name):
+            return self.L_shards[layout[0][0]].exchange_split_param(name, updated_value, out)
+
+        updated_value = np.asarray(updated_value)
+        value = out if out is not None else np.empty(self.get_split_shape(name), dtype=np.float32)
+        L_shard_pieces = [[] for _ in range(self.nbr_shards)]
+        for (i, piece_name, positions) in layout:
+            L_shard_pieces[i].append((piece_name, positions))
+
+        def exchange(shard, L_pieces):
+            # the pieces have different rows, so the shards don't write over each other
+            for (piece_name, positions) in L_pieces:
+                piece_out = value[positions] if isinstance(positions, slice) else None
+                piece_value = shard.exchange_split_param(piece_name, updated_value[positions], piece_out)
+                if not np.may_share_memory(piece_value, value):
+                    value[positions] = piece_value
+
+        self.run_on_shards([(L_pieces,) if L_pieces else None for L_pieces in L_shard_pieces], exchange)
+        return value
+
+    def pull_entire_param(self, name, out=None):
+        layout = self.get_entire_layout(name)
+        if self.is_whole(layout, name):
+            return self.L_shards[layout[0][0]].pull_entire_param(name, out)
+        return self.pull_entire_params([name], {name : out} if out is not None else None)[name]
+
+    def push_entire_param(self, name, updated_value, alpha, beta):
+        layout = self.get_entire_layout(name)
+        if self.is_whole(layout, name):
+            return self.L_shards[layout[0][0]].push_entire_param(name, updated_value, alpha, beta)
+        self.push_entire_params({name : updated_value}, alpha, beta)
+
+    def pull_split_params(self, names, want_pipelined=False, D_out=None):
+        # Every shard pulls its own parameters (and pieces), all at the same time.
+        def pull(shard, piece_names, D_piece_out):
+            return shard.pull_split_params(piece_names, want_pipelined, D_piece_out)
+        return self.pull_pieces(names, self.get_split_layout, self.get_split_shape, pull, D_out)
+
+    def pull_split_params_pipelined(self, names):
+        return self.pull_split_params(names, want_pipelined=True)
+
+    def push_split_params(self, D_updated_values):
+        def push(shard, D_piece_values):
+            shard.push_split_params(D_piece_values)
+        self.push_pieces(D_updated_values, self.get_split_layout, push)
+
+    def pull_entire_params(self, names, D_out=None):
+        def pull(shard, piece_names, D_piece_out):
+            return shard.pull_entire_params(piece_names, D_piece_out)
+        return self.pull_pieces(names, self.get_entire_layout, self.get_entire_shape, pull, D_out)
+
+    def push_entire_params(self, D_updated_values, alpha, beta):
+        def push(shard, D_piece_values):
+            shard.push_entire_params(D_piece_values, alpha, beta)
+        self.push_pieces(D_updated_values, self.get_entire_layout, push)
+
+    def get_param_digests(self, names):
+        # The names that no shard has get None, like with a single server.
+        # The parameters cut in pieces get `combine_param_digests` of their pieces.
+        if self.L_param_desc is None:
+            self.read_param_desc_from_server()
+        known_names = [name for name in names if self.D_pieces.has_key(name)]
+
+        L_piece_names = [[] for _ in range(self.nbr_shards)]
+        for name in known_names:
+            for (i, piece_name, _, _) in self.D_pieces[name]:
+                L_piece_names[i].append(piece_name)
+
+        def digest(shard, piece_names):
+            return shard.get_param_digests(piece_names)
+        D_piece_digests = self.merge_dicts(self.run_on_shards([(piece_names,) if piece_names else None
+                                                               for piece_names in L_piece_names], digest))
+
+        D_digests = dict((name, None) for name in names)
+        for name in known_names:
+            L_pieces = self.D_pieces[name]
+            if self.is_whole(L_pieces, name):
+                D_digests[name] = D_piece_digests[name]
+            else:
+                D_digests[name] = combine_param_digests([D_piece_digests[piece_name] for (_, piece_name, _, _) in L_pieces])
+        return D_digests
+
+    def get_param_lock_stats(self, names):
+        # Each shard has its own locks, so the parameters cut in pieces
+        # get the stats of every piece, indexed by the name of the piece.
+        if self.L_param_desc is None:
+            self.read_param_desc_from_server()
+
+        L_piece_names = [[] for _ in range(self.nbr_shards)]
+        for name in names:
+            for (i, piece_name, _, _) in self.D_pieces.get(name, []):
+                L_piece_names[i].append(piece_name)
+
+        def lock_stats(shard, piece_names):
+            return shard.get_param_lock_stats(piece_names)
+        # None for the names that no shard has, like with a single server
+        D_stats = dict((name, None) for name in names if not self.D_pieces.has_key(name))
+        D_stats.update(self.merge_dicts(self.run_on_shards([(piece_names,) if piece_names else None
+                                                            for piece_names in L_piece_names], lock_stats)))
+        return D_stats
+
+    def save_all_to_hdf5(self, path):
+        # Every server saves its own parameters, to `get_shard_path(path, shard, nbr_shards)`.
+        for (i, shard) in enumerate(self.L_shards):
+            shard.save_all_to_hdf5(get_shard_path(path, i, self.nbr_shards))
+        return True
+
+    def load_all_from_hdf5(self, pathHDF5, pathJSON):
+        # Every server loads its own files, named like in `save_all_to_hdf5`.
+        # The parameters can change with the json, so we read them again next time.
+        for (i, shard) in enumerate(self.L_shards):
+            shard.load_all_from_hdf5(get_shard_path(pathHDF5, i, self.nbr_shards),
+                                     get_shard_path(pathJSON, i, self.nbr_shards))
+        self.L_param_desc = None
+        return True
+
+    def get_stream_stats(self):
+        # The stats of the streams of all the shards, one after the other.
+        return sum((shard.get_stream_stats() for shard in self.L_shards), [])
+
+    @staticmethod
+    def merge_dicts(L_dicts):
+        res = {}
+        for D in L_dicts:
+            if D is not None:
+                res.update(D)
+        return res
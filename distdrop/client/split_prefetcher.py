@@ -0,0 +1,210 @@
+
+import threading
+import Queue
+import time
+import socket
+
+
+# This wraps a `ClientCNNAutoSplitter` so that the communication with the
+# server happens on a background thread while the user trains.
+#
+#    client = ClientCNNAutoSplitter.new_basic_alpha_beta(server_host, port, alpha, beta)
+#    prefetcher = SplitPrefetcher(client, D_dropout_prob_pairs)
+#    prefetcher.start()
+#
+#    while (not done):
+#        (splits_indices, D_values) = prefetcher.next_split()
+#        ... train with D_values ...
+#        prefetcher.push_split_params(D_updated_values)
+#
+#    prefetcher.stop()
+#
+# The `client` given is used only by the background thread, over its own
+# connection, so you should not use it yourself after calling `start`.
+#
+# While you train on split k, the background thread is already pulling
+# split k+1 (and pushing split k-1). This means that the values of split k+1
+# don't contain the update that you're about to push for split k.
+# `max_staleness` is how many splits we are allowed to pull ahead like that.
+#    0 means that we always pull after the previous push is done.
+#      The pushes are still asynchronous, but the pulls are not hidden.
+#    1 is double-buffering.
+# With a client that has `want_registered_splits`, keep `max_staleness`
+# small enough for the server to hold on to every split still in use.
+#
+# With a client that has `want_delta_updates`, the deltas of a split are
+# relative to what was pulled for that split, and not to the split pulled
+# ahead of it. We keep the cached values of every split with it, and put
+# them back in the client before pushing.
+
+class SplitPrefetcher(object):
+
+    def __init__(self, client, D_dropout_prob_pairs, names=None, max_staleness=1):
+
+        assert 0 <= max_staleness
+
+        self.client = client
+        self.D_dropout_prob_pairs = D_dropout_prob_pairs
+        # All the parameters are pulled and pushed by default.
+        self.names = names
+        self.max_staleness = max_staleness
+
+        # The jobs for the background thread are tuples
+        #    ('pull', splits_indices)
+        #    ('push', splits_indices, D_updated_values, D_cached_values)
+        #    ('stop',)
+        # and they are processed in order. `D_cached_values` is None
+        # unless the client has `want_delta_updates`.
+        self.jobs = Queue.Queue()
+        # contains tuples (splits_indices, D_values, D_cached_values),
+        # or None to wake up `next_split` after an error
+        self.pulled_splits = Queue.Queue()
+        # The first exception on the background thread, for a pull or a push.
+        # The thread skips every job after that, because the connection may
+        # be broken, and `next_split`, `flush` and `stop` raise it.
+        self.error = None
+        self.thread = None
+        self.split_plan = None
+
+        self.nbr_pulls_enqueued = 0
+        self.nbr_splits_returned = 0
+        self.current_splits_indices = None
+        self.current_splits_cached_values = None
+
+        # Time that the background thread spent talking to the server,
+        # and time that the user spent blocked waiting for it.
+        # Whatever is not waited for was hidden behind the training.
+        self.total_time_communicating = 0.0
+        self.total_time_waiting = 0.0
+        self.nbr_pulls = 0
+        self.nbr_pushes = 0
+
+    def start(self):
+        self.client.connect()
+        self.client.read_param_desc_from_server()
+        self.split_plan = self.client.get_split_plan()
+        if self.names is None:
+            self.names = [param_desc['name'] for param_desc in self.client.L_param_desc]
+
+        self.thread = threading.Thread(target=self.run_background_thread)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        # Waits for the pushes that are still pending.
+        # The splits that were prefetched but never used are dropped.
+        self.jobs.put(('stop',))
+        tic = time.time()
+        self.thread.join()
+        self.total_time_waiting = self.total_time_waiting + (time.time() - tic)
+        self.thread = None
+
+        try:
+            self.client.quit()
+        except socket.error:
+            # the server closed the connection on an error
+            if self.error is None:
+                raise
+        self.client.close()
+        self.raise_error()
+
+    def flush(self):
+        # Blocks until every job given to the background thread is done.
+        tic = time.time()
+        self.jobs.join()
+        self.total_time_waiting = self.total_time_waiting + (time.time() - tic)
+        self.raise_error()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def enqueue_pull(self):
+        # We sample the split on the calling thread because
+        # the `SplitPlan` uses the global `np.random`.
+        splits_indices = self.split_plan.sample(self.D_dropout_prob_pairs)
+        self.jobs.put(('pull', splits_indices))
+        self.nbr_pulls_enqueued = self.nbr_pulls_enqueued + 1
+
+    def next_split(self):
+        # Returns (splits_indices, D_values) for the next split.
+        # `D_values` is indexed by parameter name, like for `pull_split_params`.
+
+        # the splits pulled before the error are not worth training on
+        self.raise_error()
+        if self.nbr_pulls_enqueued == self.nbr_splits_returned:
+            self.enqueue_pull()
+
+        tic = time.time()
+        res = self.pulled_splits.get()
+        self.total_time_waiting = self.total_time_waiting + (time.time() - tic)
+        self.raise_error()
+
+        (self.current_splits_indices, D_values, self.current_splits_cached_values) = res
+        self.nbr_splits_returned = self.nbr_splits_returned + 1
+
+        # This is where we start pulling ahead, which is what
+        # goes out of date with the push of the current split.
+        while self.nbr_pulls_enqueued - self.nbr_splits_returned < self.max_staleness:
+            self.enqueue_pull()
+
+        return (self.current_splits_indices, D_values)
+
+    def push_split_params(self, D_updated_values):
+        # Returns immediately. The values are pushed for the split
+        # last returned by `next_split`.
+        assert self.current_splits_indices is not None
+        self.jobs.put(('push', self.current_splits_indices, D_updated_values, self.current_splits_cached_values))
+
+    def get_counters(self):
+        return {'total_time_communicating' : self.total_time_communicating,
+                'total_time_waiting' : self.total_time_waiting,
+                'total_time_hidden' : max(0.0, self.total_time_communicating - self.total_time_waiting),
+                'nbr_pulls' : self.nbr_pulls,
+                'nbr_pushes' : self.nbr_pushes}
+
+    def run_background_thread(self):
+
+        while True:
+            job = self.jobs.get()
+            if job[0] == 'stop':
+                self.jobs.task_done()
+                return
+            if self.error is not None:
+                self.jobs.task_done()
+                continue
+
+            tic = time.time()
+            try:
+                self.client.splits_indices = job[1]
+                if job[0] == 'pull':
+                    if self.client.want_registered_splits:
+                        # The pushes for this split use the registered
+                        # indices that we hand to the user.
+                        self.client.splits_indices = self.client.register_split(job[1])
+                    D_values = self.client.pull_split_params(self.names)
+                    if self.client.want_delta_updates:
+                        # The client replaces these arrays instead of changing them,
+                        # so a copy of the dict is enough.
+                        D_cached_values = dict((name, self.client.splits_cached_values[name]) for name in self.names)
+                    else:
+                        D_cached_values = None
+                    self.pulled_splits.put((self.client.splits_indices, D_values, D_cached_values))
+                    self.nbr_pulls = self.nbr_pulls + 1
+                elif job[0] == 'push':
+                    D_cached_values = job[3]
+                    if D_cached_values is not None:
+                        self.client.splits_cached_values.update(D_cached_values)
+                    self.client.push_split_params(job[2])
+                    if D_cached_values is not None:
+                        # in case the same split gets pushed again
+                        for name in D_cached_values.keys():
+                            D_cached_values[name] = self.client.splits_cached_values[name]
+                    self.nbr_pushes = self.nbr_pushes + 1
+            except Exception as e:
+                # The user gets it from the next call, and might be waiting in `next_split`.
+                self.error = e
+                self.pulled_splits.put(None)
+            finally:
+                self.total_time_communicating = self.total_time_communicating + (time.time() - tic)
+                self.jobs.task_done()
@@ -0,0 +1,474 @@
+
+import sys
+import struct
+import socket
+
+import numpy as np
+
+from distdrop.client.messages import *
+from distdrop.client.sample_dropout_indices import SplitPlan
+from distdrop.client.seeded_init import sample_seeded_init_values
+from distdrop.client.param_digest import compute_param_digest, encode_param_digest_record
+from distdrop.server.params import clean_path
+
+# Same as in server/common.h. Registering a new split with handle h
+# replaces the one in slot h % SPLIT_REGISTRY_SIZE.
+SPLIT_REGISTRY_SIZE = 8
+
+dtype_elemsize_dict = {DTYPE_FLOAT16 : 2,
+                       DTYPE_FLOAT32 : 4,
+                       DTYPE_FLOAT64 : 8}
+
+
+class ProtocolError(Exception):
+    # Something that the client sent doesn't make sense.
+    # Like the C server, we close the connection when that happens.
+    pass
+
+
+class SliceMsg(object):
+
+    # What we read from the body of a MSG_TYPE_PULL_PARAM,
+    # or of a MSG_TYPE_PUSH_PARAM, which has `alpha`, `beta` and `data` too.
+
+    def __init__(self):
+        self.name = None
+        self.dtype_for_client = None
+        self.S = None
+        self.D = None
+        self.indices = None
+        # when they come from a registered split
+        self.indices_are_validated = False
+        self.alpha = None
+        self.beta = None
+        self.data = None
+
+
+def read_int32(conn):
+    return struct.unpack("<i", read_bytes_as_string(conn, 4))[0]
+
+
+def read_int32_array(conn, n):
+    A = np.empty((n,), dtype=np.intc)
+    if 0 < n:
+        read_bytes_into(conn, memoryview(A.view(np.uint8)))
+    return A
+
+
+def read_slice_indices(conn, index_encoding, S, D):
+
+    # Same thing as `read_slice_indices` in handler.c.
+    # Returns the S indices sent, whatever the encoding that the client picked.
+    # We check the counts here. The values themselves get checked by `validate_slice`.
+
+    if S < 0 or SLICE_MAX_INDEX < S:
+        raise ProtocolError("Got S:%d, but it should be in [0, %d]." % (S, SLICE_MAX_INDEX))
+
+    if index_encoding == INDEX_ENCODING_LIST:
+        return read_int32_array(conn, S)
+
+    elif index_encoding == INDEX_ENCODING_ALL:
+        if S != D:
+            raise ProtocolError("Got INDEX_ENCODING_ALL with S:%d different from D:%d." % (S, D))
+        return np.arange(D, dtype=np.intc)
+
+    elif index_encoding == INDEX_ENCODING_BITMASK:
+        if D < 0 or SLICE_MAX_INDEX < D:
+            raise ProtocolError("Got INDEX_ENCODING_BITMASK with D:%d." % D)
+        mask = np.fromstring(read_bytes_as_string(conn, (D + 7) // 8), dtype=np.uint8)
+        indices = np.flatnonzero(np.unpackbits(mask)[:D]).astype(np.intc)
+        if len(indices) != S:
+            raise ProtocolError("Got INDEX_ENCODING_BITMASK with %d bits set instead of S:%d." % (len(indices), S))
+        return indices
+
+    elif index_encoding == INDEX_ENCODING_RANGES:
+        nbr_ranges = read_int32(conn)
+        if nbr_ranges < 0 or S < nbr_ranges:
+            raise ProtocolError("Got INDEX_ENCODING_RANGES with %d ranges for S:%d." % (nbr_ranges, S))
+        ranges = read_int32_array(conn, 2*nbr_ranges).reshape((nbr_ranges, 2))
+        lengths = ranges[:, 1] - ranges[:, 0]
+        if np.any(lengths < 0) or np.sum(lengths) != S:
+            raise ProtocolError("Got INDEX_ENCODING_RANGES that don't add up to S:%d." % S)
+        # every index is its position in the slice, shifted by the start of its range
+        offsets = np.cumsum(lengths) - lengths
+        return (np.arange(S, dtype=np.intc) + np.repeat(ranges[:, 0] - offsets, lengths)).astype(np.intc)
+
+    else:
+        raise ProtocolError("Unrecognized index encoding %d." % index_encoding)
+
+
+def validate_slice_indices(indices, D, k, name):
+    # They have to be strictly increasing and within [0, D).
+    if len(indices) == 0:
+        return
+    if indices[0] < 0 or D <= indices[-1] or np.any(indices[1:] <= indices[:-1]):
+        raise ProtocolError("Got a slice for param %s with bad indices along axis %d." % (name, k))
+
+
+def read_registered_split_entry(conn):
+    # One entry of a MSG_TYPE_REGISTER_SPLIT. Returns (indices, S, D).
+    (index_encodings, S0, S1, D0, D1) = struct.unpack("<iiiii", read_bytes_as_string(conn, 20))
+    index_encodings = index_encodings >> 8
+    (S, D) = ((S0, S1), (D0, D1))
+    indices = []
+    for k in range(2):
+        encoding = (index_encodings >> (8*k)) & 0xff
+        if encoding == INDEX_ENCODING_REGISTERED:
+            raise ProtocolError("A registered split can't refer to another one.")
+        if D[k] < S[k]:
+            raise ProtocolError("Entry of the split has S[%d]:%d larger than D[%d]:%d." % (k, S[k], k, D[k]))
+        indices.append(read_slice_indices(conn, encoding, S[k], D[k]))
+        validate_slice_indices(indices[k], D[k], k, "(registered split)")
+    return (tuple(indices), S, D)
+
+
+def get_slice_key(indices, D):
+    # What we index the value of the parameter with.
+    # The validated indices that cover a whole axis are arange(D),
+    # for which we can avoid the fancy indexing.
+    (full0, full1) = (len(indices[0]) == D[0], len(indices[1]) == D[1])
+    if full0 and full1:
+        return Ellipsis
+    elif full0:
+        return (slice(None), indices[1])
+    elif full1:
+        return indices[0]
+    else:
+        return np.ix_(indices[0], indices[1])
+
+
+class ConnectionHandler(object):
+
+    # Serves one client connection, on its own thread.
+    # This is the equivalent of `server_side_handler` in handler.c.
+
+    def __init__(self, server, conn, verbose=False):
+        self.server = server
+        self.conn = conn
+        self.verbose = verbose
+        # The splits registered with MSG_TYPE_REGISTER_SPLIT and
+        # MSG_TYPE_REGISTER_SEEDED_SPLIT on this connection.
+        # Contains pairs (handle, L_entries) where every entry is (indices, S, D).
+        self.split_registry = [None] * SPLIT_REGISTRY_SIZE
+
+    def log(self, text):
+        if self.verbose:
+            print "param_server - %s" % text
+
+    def run(self):
+        try:
+            while self.handle_one_message():
+                pass
+        except RuntimeError:
+            # the client went away
+            self.log("connection broken")
+        except (ProtocolError, socket.error) as e:
+            print >> sys.stderr, "param_server - Closing the connection. Error : %s" % str(e)
+        finally:
+            self.conn.close()
+
+    def handle_one_message(self):
+        # Returns False when the connection is over.
+
+        header = read_bytes_as_string(self.conn, MSG_HEADER_LENGTH)
+        (msg_type,) = struct.unpack("<i", header[:4])
+
+        if msg_type == MSG_TYPE_PULL_PARAM:
+            self.log("MSG_TYPE_PULL_PARAM")
+            self.respond_pull(self.read_pull_param())
+
+        elif msg_type == MSG_TYPE_PUSH_PARAM:
+            self.log("MSG_TYPE_PUSH_PARAM")
+            # no need to respond here
+            self.commit(self.read_push_param())
+
+        elif msg_type == MSG_TYPE_EXCHANGE_PARAM:
+            self.log("MSG_TYPE_EXCHANGE_PARAM")
+            # a push, and the response of a pull of the same slice
+            self.commit(self.read_push_param(), want_response=True)
+
+        elif msg_type == MSG_TYPE_PULL_PARAM_IF_MODIFIED:
+            self.log("MSG_TYPE_PULL_PARAM_IF_MODIFIED")
+            self.respond_pull_if_modified()
+
+        elif msg_type == MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED:
+            self.log("MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED")
+            nbr_entries = self.read_batch_count()
+            write_bytes(self.conn, struct.pack("<i", nbr_entries))
+            for _ in range(nbr_entries):
+                self.respond_pull_if_modified()
+
+        elif msg_type == MSG_TYPE_PULL_PARAMS_BATCH:
+            self.log("MSG_TYPE_PULL_PARAMS_BATCH")
+            nbr_entries = self.read_batch_count()
+            # the response starts by repeating the number of entries
+            write_bytes(self.conn, struct.pack("<i", nbr_entries))
+            for _ in range(nbr_entries):
+                self.respond_pull(self.read_pull_param())
+
+        elif msg_type == MSG_TYPE_PUSH_PARAMS_BATCH:
+            self.log("MSG_TYPE_PUSH_PARAMS_BATCH")
+            nbr_entries = self.read_batch_count()
+            for _ in range(nbr_entries):
+                self.commit(self.read_push_param())
+
+        elif msg_type == MSG_TYPE_REGISTER_SPLIT:
+            self.log("MSG_TYPE_REGISTER_SPLIT")
+            self.respond_register(self.read_register_split)
+
+        elif msg_type == MSG_TYPE_REGISTER_SEEDED_SPLIT:
+            self.log("MSG_TYPE_REGISTER_SEEDED_SPLIT")
+            self.respond_register(self.read_register_seeded_split)
+
+        elif msg_type == MSG_TYPE_INIT_PARAM:
+            self.log("MSG_TYPE_INIT_PARAM")
+            self.respond_init_param()
+
+        elif msg_type == MSG_TYPE_PARAM_DIGEST:
+            self.log("MSG_TYPE_PARAM_DIGEST")
+            self.respond_param_digest()
+
+        elif msg_type == MSG_TYPE_PARAM_LOCK_STATS:
+            self.log("MSG_TYPE_PARAM_LOCK_STATS")
+            self.respond_param_lock_stats()
+
+        elif msg_type == MSG_TYPE_LIST_ALL_PARAMS_DESC:
+            self.log("MSG_TYPE_LIST_ALL_PARAMS_DESC")
+            response = self.server.get_params_desc_json()
+            write_bytes(self.conn, struct.pack("<i", len(response)) + response)
+
+        elif msg_type == MSG_TYPE_SAVE_ALL_TO_HDF5:
+            self.log("MSG_TYPE_SAVE_ALL_TO_HDF5")
+            hdf5_path = read_bytes_as_string(self.conn, read_int32(self.conn))
+            self.server.save_all_to_hdf5(clean_path(hdf5_path, "hdf5"))
+
+        elif msg_type == MSG_TYPE_LOAD_ALL_FROM_HDF5:
+            self.log("MSG_TYPE_LOAD_ALL_FROM_HDF5")
+            json_path = read_bytes_as_string(self.conn, read_int32(self.conn))
+            hdf5_path = read_bytes_as_string(self.conn, read_int32(self.conn))
+            self.server.load_all_from_hdf5(clean_path(json_path, "json"), clean_path(hdf5_path, "hdf5"))
+
+        elif msg_type in (MSG_TYPE_CLIENT_QUITS, MSG_TYPE_DISCONNECT):
+            self.log("MSG_TYPE_CLIENT_QUITS")
+            return False
+
+        else:
+            raise ProtocolError("Received unknown message header: '%d'." % msg_type)
+
+        return True
+
+    def read_batch_count(self):
+        nbr_entries = read_int32(self.conn)
+        if nbr_entries < 0:
+            raise ProtocolError("Got a batch message announcing %d entries." % nbr_entries)
+        return nbr_entries
+
+    def read_pull_param(self):
+
+        msg = SliceMsg()
+        msg.name = read_bytes_as_string(self.conn, PARAM_NAME_LENGTH).split('\0')[0]
+        (dtype_for_client, S0, S1, D0, D1) = struct.unpack("<iiiii", read_bytes_as_string(self.conn, 20))
+        (msg.S, msg.D) = ((S0, S1), (D0, D1))
+
+        # The encodings of the indices are packed above the dtype.
+        index_encodings = dtype_for_client >> 8
+        msg.dtype_for_client = dtype_for_client & 0xff
+        if msg.dtype_for_client not in dtype_elemsize_dict:
+            raise ProtocolError("Illegal dtype_for_client : %d." % msg.dtype_for_client)
+
+        if (index_encodings & 0xff) == INDEX_ENCODING_REGISTERED:
+            msg.indices = self.read_registered_indices(msg)
+            msg.indices_are_validated = True
+        else:
+            msg.indices = (read_slice_indices(self.conn, index_encodings & 0xff, S0, D0),
+                           read_slice_indices(self.conn, (index_encodings >> 8) & 0xff, S1, D1))
+        return msg
+
+    def read_push_param(self):
+        msg = self.read_pull_param()
+        (msg.alpha, msg.beta, nbr_bytes) = struct.unpack("<ffi", read_bytes_as_string(self.conn, 12))
+        if nbr_bytes < 0 or nbr_bytes % dtype_elemsize_dict[msg.dtype_for_client] != 0:
+            raise ProtocolError("Got a push of %d bytes for param %s." % (nbr_bytes, msg.name))
+        data = np.empty((nbr_bytes,), dtype=np.uint8)
+        if 0 < nbr_bytes:
+            read_bytes_into(self.conn, memoryview(data))
+        msg.data = data.view(dtype_int_to_numpy_dict[msg.dtype_for_client])
+        return msg
+
+    def read_registered_indices(self, msg):
+        (handle, entry) = struct.unpack("<ii", read_bytes_as_string(self.conn, 8))
+        if handle < 0:
+            raise ProtocolError("Got INDEX_ENCODING_REGISTERED with handle %d." % handle)
+        registered = self.split_registry[handle % SPLIT_REGISTRY_SIZE]
+        if registered is None or registered[0] != handle:
+            raise ProtocolError("Got INDEX_ENCODING_REGISTERED with handle %d, which isn't registered (anymore)." % handle)
+        L_entries = registered[1]
+        if entry < 0 or len(L_entries) <= entry:
+            raise ProtocolError("Got INDEX_ENCODING_REGISTERED with entry %d, but handle %d has %d entries." % (entry, handle, len(L_entries)))
+        (indices, S, D) = L_entries[entry]
+        if S != msg.S or D != msg.D:
+            raise ProtocolError("The message has (S,D) = (%s,%s) but entry %d of handle %d has (%s,%s)." % (msg.S, msg.D, entry, handle, S, D))
+        return indices
+
+    def respond_register(self, read_split):
+        # `read_split` returns (handle, L_entries). We respond with the handle,
+        # or with -1 when we failed, before closing the connection.
+        try:
+            (handle, L_entries) = read_split()
+        except ProtocolError:
+            write_bytes(self.conn, struct.pack("<i", -1))
+            raise
+        self.split_registry[handle % SPLIT_REGISTRY_SIZE] = (handle, L_entries)
+        write_bytes(self.conn, struct.pack("<i", handle))
+
+    def read_register_split(self):
+        (handle, nbr_entries) = struct.unpack("<ii", read_bytes_as_string(self.conn, 8))
+        if handle < 0 or nbr_entries < 0:
+            raise ProtocolError("Got MSG_TYPE_REGISTER_SPLIT with handle %d and %d entries." % (handle, nbr_entries))
+        return (handle, [read_registered_split_entry(self.conn) for _ in range(nbr_entries)])
+
+    def read_register_seeded_split(self):
+
+        # Same thing as `generate_seeded_split` in seeded_split.c,
+        # except that we can use the `SplitPlan` of the client directly.
+
+        (handle, seed, nbr_pairs) = struct.unpack("<iQi", read_bytes_as_string(self.conn, 16))
+        if handle < 0 or nbr_pairs < 0:
+            raise ProtocolError("Got MSG_TYPE_REGISTER_SEEDED_SPLIT with handle %d and %d layers." % (handle, nbr_pairs))
+        D_pairs_by_number = {}
+        for _ in range(nbr_pairs):
+            (layer_number, p_in, p_out) = struct.unpack("<idd", read_bytes_as_string(self.conn, 20))
+            if not (0.0 <= p_in <= 1.0 and 0.0 <= p_out <= 1.0):
+                raise ProtocolError("Got dropout probabilities (%f, %f) for layer_%d." % (p_in, p_out, layer_number))
+            D_pairs_by_number[layer_number] = (p_in, p_out)
+
+        L_params = self.server.get_params()
+        L_params_desc = [param.get_desc() for param in L_params]
+        try:
+            split_plan = SplitPlan(L_params_desc)
+            D_dropout_prob_pairs = dict((layer_name, D_pairs_by_number[layer_number])
+                                        for (layer_name, layer_number, _, _, _) in split_plan.L_layers)
+            splits_indices = split_plan.sample_seeded(seed, D_dropout_prob_pairs)
+        except (KeyError, TypeError) as e:
+            raise ProtocolError("Failed to generate the seeded split : %s" % str(e))
+
+        L_entries = []
+        for param in L_params:
+            indices = tuple(splits_indices[param.name])
+            L_entries.append((indices, (len(indices[0]), len(indices[1])), param.shape[0:2]))
+        return (handle, L_entries)
+
+    def respond_init_param(self):
+        # We respond with 0 once the parameter is filled, or with -1
+        # when we failed, before closing the connection.
+        name = read_bytes_as_string(self.conn, PARAM_NAME_LENGTH).split('\0')[0]
+        (distribution, seed, scale) = struct.unpack("<iQd", read_bytes_as_string(self.conn, 20))
+
+        param = self.server.get_param(name)
+        try:
+            if param is None:
+                raise ProtocolError("Got MSG_TYPE_INIT_PARAM for parameter %s but there is no such parameter on the server." % name)
+            try:
+                value = sample_seeded_init_values(param.shape, param.kind, distribution, scale, seed)
+            except ValueError as e:
+                raise ProtocolError("Failed to initialize parameter %s : %s" % (name, str(e)))
+        except ProtocolError:
+            write_bytes(self.conn, struct.pack("<i", -1))
+            raise
+
+        with param.locks.hold(want_write=True):
+            param.value[...] = value
+            param.bump_version()
+        write_bytes(self.conn, struct.pack("<i", 0))
+
+    def respond_param_digest(self):
+        # One record for every name. The names that we don't have get a
+        # status of -1 and the connection stays open, since nothing changed.
+        nbr_names = self.read_batch_count()
+        names = [read_bytes_as_string(self.conn, PARAM_NAME_LENGTH).split('\0')[0] for _ in range(nbr_names)]
+
+        L_records = []
+        for name in names:
+            param = self.server.get_param(name)
+            if param is None:
+                L_records.append(encode_param_digest_record(None))
+                continue
+            with param.locks.hold():
+                digest = compute_param_digest(param.value)
+            L_records.append(encode_param_digest_record(digest))
+        write_bytes(self.conn, ''.join(L_records))
+
+    def respond_param_lock_stats(self):
+        # Same as `respond_param_digest`, with the counters of the locks.
+        nbr_names = self.read_batch_count()
+        names = [read_bytes_as_string(self.conn, PARAM_NAME_LENGTH).split('\0')[0] for _ in range(nbr_names)]
+
+        L_records = []
+        for name in names:
+            param = self.server.get_param(name)
+            L_records.append(encode_param_lock_stats_record(None if param is None else param.locks.get_stats()))
+        write_bytes(self.conn, ''.join(L_records))
+
+    def find_param(self, msg, failure_response=struct.pack("<i", 0)):
+        param = self.server.get_param(msg.name)
+        if param is None:
+            # Give the client something to realize that it has made a mistake
+            # (an empty response) before we close the connection.
+            write_bytes(self.conn, failure_response)
+            raise ProtocolError("You asked for parameter %s but there is no such parameter on the server." % msg.name)
+
+        # little check to catch silly mistakes, like `validate_slice`
+        for k in range(2):
+            if param.shape[k] != msg.D[k]:
+                raise ProtocolError("Parameter %s has shape[%d]=%d, but you expected %d." % (param.name, k, param.shape[k], msg.D[k]))
+            if msg.D[k] < msg.S[k]:
+                raise ProtocolError("Query for parameter %s has D[%d]:%d < S[%d]:%d." % (param.name, k, msg.D[k], k, msg.S[k]))
+            if not msg.indices_are_validated:
+                validate_slice_indices(msg.indices[k], msg.D[k], k, param.name)
+        return param
+
+    def respond_pull(self, msg):
+        param = self.find_param(msg)
+        key = get_slice_key(msg.indices, msg.D)
+        with param.locks.hold(msg.indices[0]):
+            # this makes a copy, so we can write it out after releasing the lock
+            values = param.value[key].astype(dtype_int_to_numpy_dict[msg.dtype_for_client])
+        write_buffers(self.conn, [struct.pack("<i", values.nbytes), array_as_buffer(values)])
+
+    def respond_pull_if_modified(self):
+        # The version that the client has (-1 for none), and then a pull.
+        # We respond with the version of the parameter, followed by -1 when
+        # the client has it already, or by the response of a pull otherwise.
+        (known_version,) = struct.unpack("<q", read_bytes_as_string(self.conn, 8))
+        msg = self.read_pull_param()
+        # the version -1 and an empty response
+        param = self.find_param(msg, struct.pack("<qi", -1, 0))
+        key = get_slice_key(msg.indices, msg.D)
+        with param.locks.hold(msg.indices[0]):
+            version = param.version
+            if version != known_version:
+                values = param.value[key].astype(dtype_int_to_numpy_dict[msg.dtype_for_client])
+        if version == known_version:
+            write_bytes(self.conn, struct.pack("<qi", version, -1))
+        else:
+            write_buffers(self.conn, [struct.pack("<qi", version, values.nbytes), array_as_buffer(values)])
+
+    def commit(self, msg, want_response=False):
+        # With `want_response`, we also send back the updated slice, like for a pull.
+        # It's taken under the same locks, so it has our update and nothing after it.
+        param = self.find_param(msg)
+        shape = (msg.S[0], msg.S[1]) + param.shape[2:]
+        if msg.data.size != np.prod(shape):
+            raise ProtocolError("Got %d values for a slice of param %s with shape %s." % (msg.data.size, param.name, str(shape)))
+        new_value = msg.data.reshape(shape).astype(np.float32)
+        (alpha, beta) = (np.float32(msg.alpha), np.float32(msg.beta))
+
+        key = get_slice_key(msg.indices, msg.D)
+        with param.locks.hold(msg.indices[0], want_write=True):
+            updated_value = alpha * param.value[key] + beta * new_value
+            param.value[key] = updated_value
+            param.bump_version()
+            if want_response:
+                values = updated_value.astype(dtype_int_to_numpy_dict[msg.dtype_for_client])
+        if want_response:
+            write_buffers(self.conn, [struct.pack("<i", values.nbytes), array_as_buffer(values)])
@@ -0,0 +1,164 @@
+
+import sys
+import socket
+import threading
+
+from distdrop.server.params import read_params_from_json_file, encode_list_params_to_json
+from distdrop.server.params import save_to_hdf5, load_params_from_hdf5
+from distdrop.server.handler import ConnectionHandler
+
+# A parameter server in python that speaks the same protocol as the
+# C server in server/, for when we can't build that one (tests, benchmarks).
+#
+#    server = ParamServer.from_json_file("server/config_examples/simple_params_desc.json", 6000)
+#    server.start()
+#    ... connect clients to port 6000 ...
+#    server.stop()
+#
+# Every connection is served on its own thread, like with the C server.
+# The parameters are float32 numpy arrays with reader/writer locks on stripes
+# of rows (see `ParamLocks`), so the clients working on different parameters,
+# or on different rows of the same one, don't wait for each other.
+# The heavy lifting (copying the slices, `alpha*old + beta*new`) happens in
+# numpy, which releases the GIL while it works on large arrays.
+#
+# Saving and loading to hdf5 needs h5py, which is optional otherwise.
+
+class ParamServer(object):
+
+    def __init__(self, L_params, port, server_host="", max_nbr_clients=300, verbose=False):
+
+        self.port = port
+        self.server_host = server_host
+        self.max_nbr_clients = max_nbr_clients
+        self.verbose = verbose
+
+        # MSG_TYPE_LOAD_ALL_FROM_HDF5 replaces the whole list,
+        # so we always go through `get_params` and `get_param`.
+        self.params_lock = threading.Lock()
+        self.set_params(L_params)
+
+        self.listening_socket = None
+        self.accept_thread = None
+        self.want_stop = False
+        self.client_slots = threading.BoundedSemaphore(max_nbr_clients)
+        # the connections currently served, so that `stop` can close them,
+        # and the threads serving them, so that `stop` can wait for them
+        self.L_conns = []
+        self.L_conn_threads = []
+        self.L_conns_lock = threading.Lock()
+
+    @classmethod
+    def from_json_file(cls, model_params_desc, port, model_params_data_input=None, **kwargs):
+        # Same arguments as the C server. Without `model_params_data_input`,
+        # the parameters are initialized with zeros.
+        server = cls(read_params_from_json_file(model_params_desc), port, **kwargs)
+        if model_params_data_input is not None:
+            load_params_from_hdf5(server.get_params(), model_params_data_input)
+        return server
+
+    def set_params(self, L_params):
+        D_params = dict((param.name, param) for param in L_params)
+        params_desc_json = encode_list_params_to_json(L_params)
+        with self.params_lock:
+            (self.L_params, self.D_params, self.params_desc_json) = (L_params, D_params, params_desc_json)
+
+    def get_params(self):
+        with self.params_lock:
+            return self.L_params
+
+    def get_param(self, name):
+        # returns None when we don't have that parameter
+        with self.params_lock:
+            return self.D_params.get(name, None)
+
+    def get_params_desc_json(self):
+        with self.params_lock:
+            return self.params_desc_json
+
+    def save_all_to_hdf5(self, hdf5_path):
+        try:
+            save_to_hdf5(self.get_params(), hdf5_path)
+        except (ImportError, IOError) as e:
+            # There is no response to this message, so we can't tell the client.
+            print >> sys.stderr, "param_server - Failed to save to %s : %s" % (hdf5_path, str(e))
+
+    def load_all_from_hdf5(self, json_path, hdf5_path):
+        try:
+            L_params = read_params_from_json_file(json_path)
+            load_params_from_hdf5(L_params, hdf5_path)
+        except (ImportError, IOError, KeyError, ValueError) as e:
+            print >> sys.stderr, "param_server - Failed to load from %s and %s : %s" % (json_path, hdf5_path, str(e))
+            return
+        self.set_params(L_params)
+
+    def start(self):
+        # Returns once we are listening, so the clients can connect right away.
+        # With `port` 0, the system picks a free port and `self.port` gets updated.
+        self.listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listening_socket.bind((self.server_host, self.port))
+        self.listening_socket.listen(10)
+        self.port = self.listening_socket.getsockname()[1]
+
+        self.want_stop = False
+        self.accept_thread = threading.Thread(target=self.accept_connections)
+        self.accept_thread.daemon = True
+        self.accept_thread.start()
+
+    def serve_forever(self):
+        self.start()
+        while self.accept_thread.is_alive():
+            # `join` without a timeout can't be interrupted with ctrl-c in python 2
+            self.accept_thread.join(1.0)
+
+    def stop(self):
+        # Returns once every thread that we started is done.
+        self.want_stop = True
+        # closing the socket alone doesn't wake up the `accept` on linux
+        try:
+            self.listening_socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.listening_socket.close()
+        # after this, no new connection can show up
+        self.accept_thread.join()
+
+        # The threads of the connections see the end of their socket and return.
+        with self.L_conns_lock:
+            for conn in self.L_conns:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+            L_conn_threads = list(self.L_conn_threads)
+        for thread in L_conn_threads:
+            thread.join()
+
+    def accept_connections(self):
+        while not self.want_stop:
+            # wait until we're below `max_nbr_clients`
+            self.client_slots.acquire()
+            try:
+                (conn, _) = self.listening_socket.accept()
+            except socket.error:
+                # `stop` closed the socket
+                self.client_slots.release()
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            thread = threading.Thread(target=self.serve_connection, args=(conn,))
+            thread.daemon = True
+            with self.L_conns_lock:
+                self.L_conns.append(conn)
+                # forget about the threads that are done
+                self.L_conn_threads = [t for t in self.L_conn_threads if t.is_alive()]
+                self.L_conn_threads.append(thread)
+            thread.start()
+
+    def serve_connection(self, conn):
+        try:
+            ConnectionHandler(self, conn, verbose=self.verbose).run()
+        finally:
+            with self.L_conns_lock:
+                self.L_conns.remove(conn)
+            self.client_slots.release()
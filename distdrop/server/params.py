@@ -0,0 +1,251 @@
+
+import re
+import json
+import time
+import threading
+import itertools
+import contextlib
+import collections
+
+import numpy as np
+
+# Same kinds as in server/common.h.
+# The kinds are also accepted as integers in the json files.
+param_kind_dict = {'FULLY_CONNECTED_WEIGHTS' : 1,
+                   'FULLY_CONNECTED_BIASES' : 2,
+                   'CONV_FILTER_WEIGHTS' : 3,
+                   'CONV_FILTER_BIASES' : 4}
+
+param_kind_int_to_str_dict = dict((v, k) for (k, v) in param_kind_dict.items())
+
+
+# Like `next_param_version` in params.c, the versions come from a single
+# counter for all the parameters, so that a parameter never gets a version
+# that it had before, even when it's loaded again from a file.
+param_version_counter = itertools.count(1)
+param_version_lock = threading.Lock()
+
+def next_param_version():
+    with param_version_lock:
+        return next(param_version_counter)
+
+
+# Same as in server/common.h.
+PARAM_LOCK_MAX_STRIPES = 64
+
+
+class StripeLock(object):
+
+    # A reader/writer lock, for one stripe of rows of a parameter.
+    # Like the `pthread_rwlock_t` of the C server, the writers that wait
+    # go before the readers that come after them, so that the pulls
+    # can't keep the pushes waiting forever.
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.nbr_readers = 0
+        self.nbr_waiting_writers = 0
+        self.has_writer = False
+
+    def acquire(self, want_write, blocking=True):
+        # Returns False without waiting when `blocking` is False
+        # and someone else has the lock.
+        with self.cond:
+            if want_write:
+                if not blocking and (self.has_writer or 0 < self.nbr_readers):
+                    return False
+                self.nbr_waiting_writers = self.nbr_waiting_writers + 1
+                while self.has_writer or 0 < self.nbr_readers:
+                    self.cond.wait()
+                self.nbr_waiting_writers = self.nbr_waiting_writers - 1
+                self.has_writer = True
+            else:
+                if not blocking and (self.has_writer or 0 < self.nbr_waiting_writers):
+                    return False
+                while self.has_writer or 0 < self.nbr_waiting_writers:
+                    self.cond.wait()
+                self.nbr_readers = self.nbr_readers + 1
+            return True
+
+    def release(self):
+        with self.cond:
+            if self.has_writer:
+                self.has_writer = False
+            else:
+                self.nbr_readers = self.nbr_readers - 1
+            self.cond.notify_all()
+
+
+class ParamLocks(object):
+
+    # Same thing as the `param_locks_t` of the C server (see param_locks.c).
+    # The rows of the parameter are cut into stripes of `rows_per_stripe`
+    # consecutive rows, each with a `StripeLock`. We take the stripes of the
+    # rows that we touch, always in increasing order, with the read locks
+    # to read the values and the write locks to change them.
+    #
+    # The counters say how often we took a stripe, how often we had to wait
+    # for it and for how long, in nanoseconds (see `get_stats`).
+
+    def __init__(self, nbr_rows):
+        self.nbr_rows = max(nbr_rows, 1)
+        nbr_stripes = min(self.nbr_rows, PARAM_LOCK_MAX_STRIPES)
+        self.rows_per_stripe = (self.nbr_rows + nbr_stripes - 1) // nbr_stripes
+        # after rounding up the rows per stripe, we might not need all of them
+        self.nbr_stripes = (self.nbr_rows + self.rows_per_stripe - 1) // self.rows_per_stripe
+        self.stripes = [StripeLock() for _ in range(self.nbr_stripes)]
+
+        self.counters_lock = threading.Lock()
+        self.counters = dict((key, 0) for key in ['nbr_read_locks', 'nbr_read_waits', 'read_wait_ns',
+                                                  'nbr_write_locks', 'nbr_write_waits', 'write_wait_ns'])
+
+    def get_stripes(self, rows=None):
+        # The sorted stripes of `rows`, or all of them for None.
+        # The rows have been validated already.
+        if rows is None or self.nbr_rows <= len(rows):
+            return range(self.nbr_stripes)
+        return np.unique(np.asarray(rows) // self.rows_per_stripe).tolist()
+
+    def acquire(self, stripes, want_write):
+        # We only look at the clock when we can't get a stripe right away.
+        nbr_waits = 0
+        wait_ns = 0
+        for s in stripes:
+            if not self.stripes[s].acquire(want_write, blocking=False):
+                start = time.time()
+                self.stripes[s].acquire(want_write)
+                nbr_waits = nbr_waits + 1
+                wait_ns = wait_ns + int((time.time() - start) * 1e9)
+
+        kind = 'write' if want_write else 'read'
+        with self.counters_lock:
+            self.counters['nbr_%s_locks' % kind] += len(stripes)
+            self.counters['nbr_%s_waits' % kind] += nbr_waits
+            self.counters['%s_wait_ns' % kind] += wait_ns
+
+    def release(self, stripes):
+        for s in stripes:
+            self.stripes[s].release()
+
+    @contextlib.contextmanager
+    def hold(self, rows=None, want_write=False):
+        # with param.locks.hold(indices[0], want_write=True):
+        #     ...
+        stripes = self.get_stripes(rows)
+        self.acquire(stripes, want_write)
+        try:
+            yield
+        finally:
+            self.release(stripes)
+
+    def get_stats(self):
+        # what MSG_TYPE_PARAM_LOCK_STATS sends
+        with self.counters_lock:
+            stats = dict(self.counters)
+        stats['nbr_stripes'] = self.nbr_stripes
+        stats['rows_per_stripe'] = self.rows_per_stripe
+        return stats
+
+
+class ServerParam(object):
+
+    # One parameter of the server, with the same fields as the `param_t`
+    # of the C server. We store everything as float32, always with 4 dimensions.
+    # The `locks` of the rows have to be held to read or write them in the `value`,
+    # and to change the `version`, which we do every time that the `value` changes.
+
+    def __init__(self, name, shape, kind):
+        assert len(shape) == 4
+        assert kind in param_kind_dict
+        self.name = name
+        self.shape = tuple(shape)
+        self.kind = kind
+        self.value = np.zeros(self.shape, dtype=np.float32)
+        self.locks = ParamLocks(self.shape[0])
+        self.version = next_param_version()
+
+    def bump_version(self):
+        # call this with the write locks of the rows, after changing them in the `value`
+        self.version = next_param_version()
+
+    def get_desc(self):
+        # same thing as `encode_param_to_json_t` in params.c, keys in the same order
+        return collections.OrderedDict([('name', self.name),
+                                        ('kind', self.kind),
+                                        ('shape', list(self.shape))])
+
+
+def new_param_from_json_desc(e):
+
+    # Same rules as `new_param_from_json_t` in params.c.
+    # When less than 4 values are specified for the shape,
+    # where they go depends on the kind of parameter.
+
+    name = str(e['name'])
+    kind = e['kind']
+    if isinstance(kind, int):
+        kind = param_kind_int_to_str_dict[kind]
+    kind = str(kind)
+    if kind not in param_kind_dict:
+        raise Exception("Unrecognized kind %s for param %s." % (kind, name))
+
+    shape = [int(s) for s in e['shape']]
+    full_shape = [1, 1, 1, 1]
+    if len(shape) == 4:
+        full_shape = shape
+    elif len(shape) == 3 and kind == 'CONV_FILTER_BIASES':
+        full_shape[1:] = shape
+    elif len(shape) == 2 and kind == 'FULLY_CONNECTED_WEIGHTS':
+        full_shape[:2] = shape
+    elif len(shape) == 1 and kind == 'FULLY_CONNECTED_BIASES':
+        full_shape[1] = shape[0]
+    else:
+        raise Exception("Invalid shape %s for param %s of kind %s." % (str(shape), name, kind))
+
+    return ServerParam(name, full_shape, kind)
+
+
+def read_params_from_json_file(filename):
+    # Returns the list of `ServerParam`, in the order of the file.
+    contents = json.load(open(filename, "r"))
+    if not isinstance(contents, list):
+        raise Exception("Expected json contained in file %s to be a list of elements." % filename)
+    return [new_param_from_json_desc(e) for e in contents]
+
+
+def encode_list_params_to_json(L_params):
+    # what MSG_TYPE_LIST_ALL_PARAMS_DESC sends
+    return json.dumps([param.get_desc() for param in L_params])
+
+
+# We store the parameters in the same hdf5 layout as server_hdf5_io.c,
+# with one float32 dataset of 4 dimensions per parameter in the group
+# "model_params". h5py is only needed to save and load.
+
+def save_to_hdf5(L_params, hdf5_path):
+    import h5py
+    f = h5py.File(hdf5_path, "w")
+    group = f.create_group("model_params")
+    for param in L_params:
+        with param.locks.hold():
+            group.create_dataset(param.name, data=param.value)
+    f.close()
+
+
+def load_params_from_hdf5(L_params, hdf5_path):
+    import h5py
+    f = h5py.File(hdf5_path, "r")
+    group = f["model_params"]
+    for param in L_params:
+        with param.locks.hold(want_write=True):
+            param.value[...] = group[param.name][...]
+            param.bump_version()
+    f.close()
+
+
+# the C server keeps only the alphanumeric characters of the paths that
+# the clients send, and puts the files in its working directory
+path_cleaning_prog = re.compile(r"[^\w]")
+
+def clean_path(path, extension):
+    return "%s.%s" % (path_cleaning_prog.sub("", path), extension)
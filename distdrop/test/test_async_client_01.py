@@ -0,0 +1,57 @@
+import numpy as np
+
+import trollius as asyncio
+from trollius import From
+
+from distdrop.client.async_client import AsyncClientCNNAutoSplitter
+
+
+@asyncio.coroutine
+def test_slice(client):
+
+    D_dropout_probs = {'layer_0' : [0.5, 0.0],
+                       'layer_1' : [0.5, 0.5], 
+                       'layer_2' : [0.5, 0.5], 
+                       'layer_3' : [0.5, 0.0]}
+
+    client.perform_split(D_dropout_probs)
+    names = client.splits_indices.keys()
+
+    # all those pulls are in flight at the same time
+    L_A = yield From(asyncio.gather(*[client.pull_split_param(name) for name in names]))
+    D_A = yield From(client.pull_split_params(names))
+    for (name, A) in zip(names, L_A):
+        assert np.all(A == D_A[name])
+
+    D_B = dict((name, np.random.rand(*A.shape)) for (name, A) in D_A.items())
+    yield From(asyncio.gather(*[client.push_split_param(name, B) for (name, B) in D_B.items()]))
+
+    D_C = yield From(client.pull_split_params(names))
+    diff = max(np.max(np.abs(D_C[name] - (client.alpha*D_A[name] + client.beta*D_B[name]))) for name in names)
+    print "Maximum abs difference is %f." % diff
+
+
+@asyncio.coroutine
+def run_async():
+
+    server_host = "127.0.0.1"
+    port = 6000
+
+    (alpha, beta) = (0.0, 1.0)
+    client = AsyncClientCNNAutoSplitter.new_basic_alpha_beta(server_host, port, alpha, beta)
+
+    yield From(client.connect())
+    print (yield From(client.read_param_desc_from_server()))
+
+    yield From(test_slice(client))
+
+    yield From(client.quit())
+    client.close()
+
+
+def run():
+    asyncio.get_event_loop().run_until_complete(run_async())
+
+
+if __name__ == "__main__":
+    run()
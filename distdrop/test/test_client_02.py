@@ -4,6 +4,7 @@ import numpy as np
 
 from distdrop.client.client_api import ClientCNNAutoSplitter
 from distdrop.client import messages
+from distdrop.client.split_prefetcher import SplitPrefetcher
 
 
 def mini_training(client):
@@ -138,6 +139,215 @@ def test_slice2(client):
     #print "Maximum abs difference is %f." % diff
 
 
+def test_slice_batch(client):
+
+    D_dropout_probs = {'layer_0' : [0.5, 0.0],
+                       'layer_1' : [0.5, 0.5], 
+                       'layer_2' : [0.5, 0.5], 
+                       'layer_3' : [0.5, 0.0]}
+
+    client.perform_split(D_dropout_probs)
+    names = client.splits_indices.keys()
+
+    D_A = client.pull_split_params(names)
+    for name in names:
+        assert D_A[name].shape == client.pull_split_param(name).shape
+
+    D_B = dict((name, np.random.rand(*A.shape)) for (name, A) in D_A.items())
+    client.push_split_params(D_B)
+
+    D_C = client.pull_split_params(names)
+    D_C_pipelined = client.pull_split_params_pipelined(names)
+    for name in names:
+        assert np.all(D_C[name] == D_C_pipelined[name])
+
+    diff = max(np.max(np.abs(D_C[name] - (client.alpha*D_A[name] + client.beta*D_B[name]))) for name in names)
+    print "Maximum abs difference is %f." % diff
+
+
+def test_slice_float16(client):
+
+    name = "layer_0_W"
+    client.push_entire_param(name, np.random.rand(40, 1, 5, 5), 0.0, 1.0)
+    A = client.pull_entire_param(name)
+
+    client.set_dtype_for_client(messages.DTYPE_FLOAT16, [name])
+    A16 = client.pull_entire_param(name)
+    client.set_dtype_for_client(messages.DTYPE_FLOAT32, [name])
+
+    assert A16.dtype == np.float32
+    assert np.all(A16 == A.astype(np.float16).astype(np.float32))
+
+
+def test_slice_index_encodings(client):
+
+    # The same slices pulled with the indices sent as lists
+    # and with the indices sent in their most compact encoding.
+
+    name = "layer_0_W"
+    param_desc = client.get_param_desc(name)
+    D = (param_desc['shape'][0], param_desc['shape'][1])
+
+    L_indices = [(np.arange(D[0], dtype=np.intc), np.arange(D[1], dtype=np.intc)),
+                 (np.arange(2, D[0] - 3, dtype=np.intc), np.arange(D[1], dtype=np.intc)),
+                 (np.sort(np.random.permutation(D[0])[:D[0]/2]).astype(np.intc), np.arange(D[1], dtype=np.intc))]
+
+    for indices in L_indices:
+        S = (len(indices[0]), len(indices[1]))
+        L_values = []
+        for want_compact_indices in [False, True]:
+            header = messages.MsgHeader('MSG_TYPE_PULL_PARAM')
+            msg = messages.MsgPullParams(name, S, D, indices, messages.DTYPE_FLOAT32, want_compact_indices)
+            header.send(client.conn)
+            msg.send(client.conn)
+            L_values.append(msg.read_decode_response(client.conn))
+        assert np.all(L_values[0] == L_values[1])
+
+
+def test_registered_split(server_host, port):
+
+    D_dropout_probs = {'layer_0' : [0.5, 0.0],
+                       'layer_1' : [0.5, 0.5], 
+                       'layer_2' : [0.5, 0.5], 
+                       'layer_3' : [0.5, 0.0]}
+
+    client = ClientCNNAutoSplitter.new_basic_alpha_beta(server_host, port, 0.0, 1.0, want_registered_splits=True)
+    client.connect()
+    client.read_param_desc_from_server()
+
+    for _ in range(3):
+        client.perform_split(D_dropout_probs)
+        names = client.splits_indices.keys()
+
+        D_A = client.pull_split_params(names)
+        D_B = dict((name, np.random.rand(*A.shape).astype(np.float32)) for (name, A) in D_A.items())
+        client.push_split_params(D_B)
+
+        # compare with what we get when sending the indices themselves
+        for name in names:
+            (param_desc, S, D, indices) = client.get_split_slice_args(name)
+            C = client.get_param_slice_from_server(name, S, D, (indices[0], indices[1]), messages.DTYPE_FLOAT32)
+            assert np.all(C.reshape(D_B[name].shape) == D_B[name])
+
+    client.quit()
+    client.close()
+
+
+def test_evicted_split(server_host, port):
+
+    # The server keeps only the last 8 splits registered on a connection.
+    # A pull with the handle of an older split gets an empty response,
+    # and not the data at the indices of some other message.
+    D_dropout_probs = {'layer_0' : [0.5, 0.0],
+                       'layer_1' : [0.5, 0.5], 
+                       'layer_2' : [0.5, 0.5], 
+                       'layer_3' : [0.5, 0.0]}
+
+    client = ClientCNNAutoSplitter.new_basic_alpha_beta(server_host, port, 0.0, 1.0, want_registered_splits=True)
+    client.connect()
+    client.read_param_desc_from_server()
+
+    client.perform_split(D_dropout_probs)
+    evicted_splits_indices = client.splits_indices
+    for _ in range(8):
+        client.perform_split(D_dropout_probs)
+    names = client.splits_indices.keys()
+    client.pull_split_params(names)
+
+    client.splits_indices = evicted_splits_indices
+    try:
+        value = client.pull_split_param(names[0])
+    except Exception:
+        value = None
+    assert value is None, "Got data for a split that isn't registered anymore."
+    # the server closed the connection
+    client.close()
+
+
+def test_seeded_split(server_host, port):
+
+    D_dropout_probs = {'layer_0' : [0.5, 0.0],
+                       'layer_1' : [0.5, 0.5], 
+                       'layer_2' : [0.5, 0.5], 
+                       'layer_3' : [0.5, 0.0]}
+
+    client = ClientCNNAutoSplitter.new_basic_alpha_beta(server_host, port, 0.0, 1.0, want_registered_splits=True)
+    client.connect()
+    client.read_param_desc_from_server()
+
+    for seed in [0, 1234, 2**64-1]:
+        # the same seed gives the same split, without touching np.random
+        client.perform_split(D_dropout_probs, seed=seed)
+        again = client.get_split_plan().sample_seeded(seed, D_dropout_probs)
+        names = client.splits_indices.keys()
+        for name in names:
+            assert np.all(client.splits_indices[name][0] == again[name][0])
+            assert np.all(client.splits_indices[name][1] == again[name][1])
+
+        # the server generated that same split from the seed
+        D_A = client.pull_split_params(names)
+        D_B = dict((name, np.random.rand(*A.shape).astype(np.float32)) for (name, A) in D_A.items())
+        client.push_split_params(D_B)
+
+        for name in names:
+            (param_desc, S, D, indices) = client.get_split_slice_args(name)
+            C = client.get_param_slice_from_server(name, S, D, (indices[0], indices[1]), messages.DTYPE_FLOAT32)
+            assert np.all(C.reshape(D_B[name].shape) == D_B[name])
+
+    client.quit()
+    client.close()
+
+
+def test_split_prefetcher(server_host, port):
+
+    D_dropout_probs = {'layer_0' : [0.5, 0.0],
+                       'layer_1' : [0.5, 0.5], 
+                       'layer_2' : [0.5, 0.5], 
+                       'layer_3' : [0.5, 0.0]}
+
+    client = ClientCNNAutoSplitter.new_basic_alpha_beta(server_host, port, 0.0, 1.0)
+    prefetcher = SplitPrefetcher(client, D_dropout_probs, max_staleness=1)
+    prefetcher.start()
+
+    for _ in range(10):
+        (splits_indices, D_values) = prefetcher.next_split()
+        for (name, value) in D_values.items():
+            assert value.shape[0] == len(splits_indices[name][0])
+        prefetcher.push_split_params(D_values)
+
+    prefetcher.stop()
+    print prefetcher.get_counters()
+
+
+def test_client_pool(server_host, port):
+
+    D_dropout_probs = {'layer_0' : [0.5, 0.0],
+                       'layer_1' : [0.5, 0.5], 
+                       'layer_2' : [0.5, 0.5], 
+                       'layer_3' : [0.5, 0.0]}
+
+    client = ClientCNNAutoSplitter.new_basic_alpha_beta(server_host, port, 0.0, 1.0, nbr_streams=4)
+    client.connect()
+    client.read_param_desc_from_server()
+
+    client.perform_split(D_dropout_probs)
+    names = client.splits_indices.keys()
+
+    D_A = client.pull_split_params(names)
+    D_B = dict((name, np.random.rand(*A.shape).astype(np.float32)) for (name, A) in D_A.items())
+    client.push_split_params(D_B)
+
+    # every parameter goes through the same stream, so we see our push
+    D_C = client.pull_split_params(names)
+    for name in names:
+        assert np.all(D_C[name] == D_B[name])
+
+    print client.get_stream_stats()
+
+    client.quit()
+    client.close()
+
+
 def run():
 
     server_host = "127.0.0.1"
@@ -153,10 +363,19 @@ def run():
     # mini_training()
     
     test_slice(client)
+    test_slice_batch(client)
+    test_slice_float16(client)
+    test_slice_index_encodings(client)
 
     client.quit()
     client.close()
 
+    test_registered_split(server_host, port)
+    test_evicted_split(server_host, port)
+    test_seeded_split(server_host, port)
+    test_split_prefetcher(server_host, port)
+    test_client_pool(server_host, port)
+
 
 if __name__ == "__main__":
     run()
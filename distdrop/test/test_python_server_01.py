@@ -0,0 +1,507 @@
+
+import time
+import threading
+
+import numpy as np
+
+from distdrop.client.client_api import Client, ClientCNNAutoSplitter
+from distdrop.client.split_prefetcher import SplitPrefetcher
+from distdrop.client import messages
+from distdrop.server.param_server import ParamServer
+from distdrop.server.params import ServerParam, ParamLocks
+from distdrop.client.seeded_init import sample_seeded_init_values
+from distdrop.client.param_digest import compute_param_digest
+
+
+# This one doesn't need a server running.
+# We start the python server in the same process, on a free port.
+
+def make_server():
+    L_params = [ServerParam("layer_0_W", (32, 16, 3, 3), "CONV_FILTER_WEIGHTS"),
+                ServerParam("layer_0_b", (32, 1, 4, 4), "CONV_FILTER_BIASES"),
+                ServerParam("layer_1_W", (512, 64, 1, 1), "FULLY_CONNECTED_WEIGHTS"),
+                ServerParam("layer_1_b", (1, 64, 1, 1), "FULLY_CONNECTED_BIASES")]
+    server = ParamServer(L_params, 0, server_host="127.0.0.1")
+    server.start()
+    return server
+
+
+def test_slices(server):
+
+    client = Client("127.0.0.1", server.port)
+    client.connect()
+    client.read_param_desc_from_server()
+
+    # the indices as lists, and in every kind of index encoding
+    for want_compact_indices in [False, True]:
+        client.want_compact_indices = want_compact_indices
+        for param in server.get_params():
+            D = param.shape[0:2]
+            # including the whole axis
+            for S in [(1, 1), (D[0], D[1]), (D[0] // 2 + 1, D[1]), (D[0], max(1, D[1] // 3))]:
+                indices = (np.sort(np.random.permutation(D[0])[:S[0]]).astype(np.intc),
+                           np.sort(np.random.permutation(D[1])[:S[1]]).astype(np.intc))
+                ix = np.ix_(indices[0], indices[1])
+
+                expected = param.value[ix].copy()
+                A = client.get_param_slice_from_server(param.name, S, D, indices, messages.DTYPE_FLOAT32)
+                assert np.all(A.reshape(expected.shape) == expected)
+
+                B = np.random.rand(*expected.shape).astype(np.float32)
+                (alpha, beta) = (0.9, 1.2)
+                client.update_param_slice_to_server(B, alpha, beta, param.name, S, D, indices, messages.DTYPE_FLOAT32)
+                expected = np.float32(alpha) * expected + np.float32(beta) * B
+
+                C = client.get_param_slice_from_server(param.name, S, D, indices, messages.DTYPE_FLOAT16)
+                assert C.dtype == np.float16
+                assert np.all(C.reshape(expected.shape) == expected.astype(np.float16))
+
+    client.quit()
+    client.close()
+
+
+def test_concurrent_splits(server):
+
+    # Many clients pushing on the same parameters. With alpha=1.0 the
+    # contributions add up, so we can tell if some of them got lost.
+
+    D_dropout_probs = {'layer_0' : [0.0, 0.5],
+                       'layer_1' : [0.5, 0.5]}
+    nbr_clients = 4
+    nbr_splits = 10
+
+    # starting from zero, the sums are exact in float32
+    for param in server.get_params():
+        param.value[...] = 0.0
+    L_expected_deltas = []
+
+    def run_client():
+        deltas = dict((param.name, np.zeros(param.shape, dtype=np.float32)) for param in server.get_params())
+        client = ClientCNNAutoSplitter.new_basic_alpha_beta("127.0.0.1", server.port, 1.0, 1.0)
+        client.connect()
+        for _ in range(nbr_splits):
+            client.perform_split(D_dropout_probs)
+            D_values = client.pull_split_params(client.splits_indices.keys())
+            D_ones = dict((name, np.ones(value.shape, dtype=np.float32)) for (name, value) in D_values.items())
+            client.push_split_params(D_ones)
+            for (name, indices) in client.splits_indices.items():
+                deltas[name][np.ix_(indices[0], indices[1])] += 1.0
+        # The pushes get no response, so we wait for one to a message that
+        # comes after them. Otherwise we could check before the server is done.
+        client.get_param_digests(client.splits_indices.keys())
+        client.quit()
+        client.close()
+        L_expected_deltas.append(deltas)
+
+    threads = [threading.Thread(target=run_client) for _ in range(nbr_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(L_expected_deltas) == nbr_clients
+    for param in server.get_params():
+        expected = sum(deltas[param.name] for deltas in L_expected_deltas)
+        assert np.all(param.value == expected), param.name
+
+
+def test_delta_updates(server):
+
+    # Pushing back what we pulled doesn't change anything, even though
+    # the client caches the values in float16.
+    for param in server.get_params():
+        with param.locks.hold(want_write=True):
+            param.value[...] = np.random.rand(*param.shape)
+            param.bump_version()
+    D_before = dict((param.name, param.value.copy()) for param in server.get_params())
+
+    client = ClientCNNAutoSplitter.new_delta_updates("127.0.0.1", server.port)
+    client.connect()
+    client.perform_split({'layer_0' : [0.0, 0.5], 'layer_1' : [0.5, 0.5]})
+    names = client.splits_indices.keys()
+    for _ in range(3):
+        D_values = client.pull_split_params(names)
+        client.push_split_params(D_values)
+        client.push_split_param(names[0], client.pull_split_param(names[0]))
+    client.get_param_digests(names)
+    for param in server.get_params():
+        assert np.all(param.value == D_before[param.name]), param.name
+
+    # and two pushes in a row add up to the second one
+    value = client.pull_split_param(names[0])
+    client.push_split_param(names[0], value + np.float32(1.0))
+    client.push_split_param(names[0], value + np.float32(2.0))
+    client.get_param_digests(names)
+    ix = np.ix_(*client.splits_indices[names[0]])
+    assert np.allclose(server.get_param(names[0]).value[ix], D_before[names[0]][ix] + 2.0, atol=1e-5)
+    client.quit()
+    client.close()
+
+
+def test_evicted_split(server):
+
+    # The server keeps only the last few splits registered on a connection.
+    # Pulling with a handle that was replaced since is an error, and the
+    # server closes the connection instead of using some other indices.
+    client = ClientCNNAutoSplitter.new_basic_alpha_beta("127.0.0.1", server.port, 0.0, 1.0, want_registered_splits=True)
+    client.connect()
+    client.perform_split({'layer_0' : [0.0, 0.5], 'layer_1' : [0.5, 0.5]})
+    evicted_splits_indices = client.splits_indices
+    for _ in range(8):
+        client.perform_split({'layer_0' : [0.0, 0.5], 'layer_1' : [0.5, 0.5]})
+    client.pull_split_params(client.splits_indices.keys())
+
+    client.splits_indices = evicted_splits_indices
+    try:
+        value = client.pull_split_param('layer_1_W')
+    except Exception:
+        value = None
+    assert value is None, "Got data for a split that isn't registered anymore."
+    client.close()
+
+
+def test_split_prefetcher_delta_updates(server):
+
+    # The split k+1 is pulled before the push of split k, and the deltas
+    # of split k still have to be relative to what was pulled for it.
+    # Multiples of 1/64 go through float16 untouched, and adding 1.0 to
+    # them is exact, so the sums don't depend on the order of the pushes.
+    for param in server.get_params():
+        with param.locks.hold(want_write=True):
+            param.value[...] = np.random.randint(0, 64, size=param.shape) / 64.0
+            param.bump_version()
+    D_expected = dict((param.name, param.value.copy()) for param in server.get_params())
+
+    client = ClientCNNAutoSplitter.new_delta_updates("127.0.0.1", server.port)
+    prefetcher = SplitPrefetcher(client, {'layer_0' : [0.0, 0.5], 'layer_1' : [0.5, 0.5]}, max_staleness=1)
+    prefetcher.start()
+    for _ in range(5):
+        (splits_indices, D_values) = prefetcher.next_split()
+        prefetcher.push_split_params(dict((name, value + np.float32(1.0)) for (name, value) in D_values.items()))
+        for (name, indices) in splits_indices.items():
+            D_expected[name][np.ix_(indices[0], indices[1])] += 1.0
+    # The pushes get no response, so we wait for the server to answer
+    # on the same connection before we look at the values.
+    prefetcher.flush()
+    client.get_param_digests(D_expected.keys())
+    prefetcher.stop()
+
+    for param in server.get_params():
+        assert np.all(param.value == D_expected[param.name]), param.name
+
+
+def test_split_prefetcher_push_error(server):
+
+    # A push that fails after the last `next_split` is still reported, by `stop`.
+    client = ClientCNNAutoSplitter.new_basic_alpha_beta("127.0.0.1", server.port, 0.0, 1.0)
+    prefetcher = SplitPrefetcher(client, {'layer_0' : [0.0, 0.5], 'layer_1' : [0.5, 0.5]}, max_staleness=1)
+    prefetcher.start()
+    (splits_indices, D_values) = prefetcher.next_split()
+    prefetcher.push_split_params(D_values)
+    (splits_indices, D_values) = prefetcher.next_split()
+    # there is no such parameter in the split
+    D_values['layer_7_W'] = D_values['layer_1_W']
+    prefetcher.push_split_params(D_values)
+
+    L_raised = []
+    for func in [prefetcher.flush, prefetcher.next_split, prefetcher.stop]:
+        try:
+            func()
+        except KeyError:
+            L_raised.append(func)
+    assert L_raised == [prefetcher.flush, prefetcher.next_split, prefetcher.stop], L_raised
+
+
+def test_stats(server):
+
+    L_events = []
+    client = ClientCNNAutoSplitter.new_basic_alpha_beta("127.0.0.1", server.port, 1.0, 1.0, nbr_streams=2)
+    client.set_stats_callback(L_events.append)
+    client.connect()
+    client.perform_split({'layer_0' : [0.0, 0.5], 'layer_1' : [0.5, 0.5]})
+    D_values = client.pull_split_params(client.splits_indices.keys())
+    client.push_split_params(D_values)
+    client.quit()
+    client.close()
+
+    stats = client.stats()
+    D_msg_types = stats['msg_types']
+    # the streams pull and push their share of the parameters in one batch each
+    assert D_msg_types['MSG_TYPE_PULL_PARAMS_BATCH']['count'] == 2
+    assert D_msg_types['MSG_TYPE_PUSH_PARAMS_BATCH']['count'] == 2
+    assert D_msg_types['MSG_TYPE_PULL_PARAMS_BATCH']['wait']['count'] == 2
+    assert D_msg_types['MSG_TYPE_PULL_PARAMS_BATCH']['decode']['count'] == 1
+    assert D_msg_types['MSG_TYPE_PUSH_PARAMS_BATCH']['decode']['count'] == 0
+
+    for (name, value) in D_values.items():
+        param_stats = stats['params'][name]
+        assert param_stats['nbr_pulls'] == 1 and param_stats['nbr_pushes'] == 1
+        assert param_stats['nbr_bytes_pulled'] == value.nbytes
+        assert param_stats['nbr_bytes_pushed'] == value.nbytes
+
+    nbr_bytes_pulled = sum(value.nbytes for value in D_values.values())
+    assert nbr_bytes_pulled < D_msg_types['MSG_TYPE_PULL_PARAMS_BATCH']['nbr_bytes_received']
+    assert nbr_bytes_pulled < D_msg_types['MSG_TYPE_PUSH_PARAMS_BATCH']['nbr_bytes_sent']
+    # one event per message, and one for the decoding of the pull
+    assert len(L_events) == 1 + 2 + 2 + 1
+
+
+def test_streams_ordering(server):
+
+    # With streams, the methods for a single parameter go through the stream
+    # of that parameter, so the batches that follow them see their pushes.
+    for param in server.get_params():
+        with param.locks.hold(want_write=True):
+            param.value[...] = np.random.randint(0, 64, size=param.shape) / 64.0
+            param.bump_version()
+
+    client = ClientCNNAutoSplitter.new_basic_alpha_beta("127.0.0.1", server.port, 1.0, 1.0, nbr_streams=2)
+    client.connect()
+    client.perform_split({'layer_0' : [0.0, 0.5], 'layer_1' : [0.5, 0.5]})
+    names = client.splits_indices.keys()
+    D_values = client.pull_split_params(names)
+    for _ in range(3):
+        for name in names:
+            client.push_split_param(name, np.ones_like(D_values[name]))
+        D_pulled = client.pull_split_params(names)
+        for name in names:
+            D_values[name] = D_values[name] + np.float32(1.0)
+            assert np.all(D_pulled[name] == D_values[name]), name
+
+    for name in names:
+        value = client.exchange_split_param(name, np.ones_like(D_values[name]))
+        assert np.all(value == D_values[name] + np.float32(1.0)), name
+        assert np.all(client.pull_split_param(name) == value), name
+
+    # and our own connection was never used for those
+    assert sum(stream_stats['nbr_bytes_pushed'] for stream_stats in client.get_stream_stats()) == \
+           4 * sum(value.nbytes for value in D_values.values())
+    client.quit()
+    client.close()
+
+
+def test_exchange(server):
+
+    D_dropout_probs = {'layer_0' : [0.0, 0.5], 'layer_1' : [0.5, 0.5]}
+    for client in [ClientCNNAutoSplitter.new_basic_alpha_beta("127.0.0.1", server.port, 0.5, 2.0),
+                   ClientCNNAutoSplitter.new_float16_alpha_beta("127.0.0.1", server.port, 0.5, 2.0, want_error_feedback=False),
+                   ClientCNNAutoSplitter.new_delta_updates("127.0.0.1", server.port)]:
+        client.connect()
+        client.perform_split(D_dropout_probs)
+        for (name, value) in client.pull_split_params(client.splits_indices.keys()).items():
+            param = server.get_param(name)
+            ix = np.ix_(*client.splits_indices[name])
+            # what the server has before, in float32
+            old_value = param.value[ix].copy()
+            updated_value = np.random.rand(*value.shape).astype(np.float32)
+
+            res = client.exchange_split_param(name, updated_value)
+            if client.want_delta_updates:
+                # we pushed `updated_value - value` with (alpha, beta) = (1.0, 1.0),
+                # where `value` is what we cached as float16, and we get back
+                # the new value of the server as we cache it
+                expected = old_value + (updated_value - value)
+                assert np.allclose(param.value[ix], expected, atol=1e-6), name
+                assert np.all(res == param.value[ix].astype(client.delta_cache_dtype).astype(np.float32)), name
+            elif client.get_dtype_for_client(name) == messages.DTYPE_FLOAT32:
+                expected = np.float32(0.5) * old_value + np.float32(2.0) * updated_value
+                assert np.all(res == expected), name
+                assert np.all(res == param.value[ix]), name
+            else:
+                expected = np.float32(0.5) * old_value + np.float32(2.0) * updated_value.astype(np.float16).astype(np.float32)
+                assert np.all(param.value[ix] == expected), name
+                assert np.all(res == expected.astype(np.float16).astype(np.float32)), name
+
+        msg_type_stats = client.stats()['msg_types']['MSG_TYPE_EXCHANGE_PARAM']
+        assert msg_type_stats['count'] == len(client.splits_indices)
+        assert msg_type_stats['decode']['count'] == len(client.splits_indices)
+        client.quit()
+        client.close()
+
+
+def test_init_param(server):
+
+    client = Client("127.0.0.1", server.port)
+    client.connect()
+    for (k, param) in enumerate(server.get_params()):
+        L_distributions = [messages.INIT_DISTRIBUTION_ZERO, messages.INIT_DISTRIBUTION_UNIFORM]
+        # the biases have no fan-in
+        if param.kind.endswith('WEIGHTS'):
+            L_distributions.append(messages.INIT_DISTRIBUTION_FANIN_NORMAL)
+        for distribution in L_distributions:
+            client.init_param_seeded(param.name, distribution, 0.5, 1000 + k)
+            expected = sample_seeded_init_values(param.shape, param.kind, distribution, 0.5, 1000 + k)
+            assert np.all(param.value == expected), param.name
+    client.quit()
+    client.close()
+
+
+def test_param_digest(server):
+
+    client = Client("127.0.0.1", server.port)
+    client.connect()
+    names = [param.name for param in server.get_params()]
+    server.get_param(names[0]).value[0, 0, 0, 0] = np.nan
+    D_digests = client.get_param_digests(names + ["no_such_param"])
+    assert D_digests["no_such_param"] is None
+    for param in server.get_params():
+        digest = D_digests[param.name]
+        assert digest == compute_param_digest(param.value)
+        assert digest['nbr_nan'] == np.count_nonzero(np.isnan(param.value))
+    # the connection is still good after asking for a parameter that doesn't exist
+    assert client.get_param_digests(names[1:2])[names[1]]['nbr_elements'] == server.get_param(names[1]).value.size
+    client.quit()
+    client.close()
+
+
+def test_versioned_pulls(server):
+
+    # no NaN from the previous tests, so that we can compare the values
+    for param in server.get_params():
+        with param.locks.hold(want_write=True):
+            param.value[...] = np.random.rand(*param.shape)
+            param.bump_version()
+
+    names = [param.name for param in server.get_params()]
+    client = ClientCNNAutoSplitter.new_basic_alpha_beta("127.0.0.1", server.port, 1.0, 1.0, want_versioned_cache=True)
+    client.connect()
+
+    D_values = client.pull_entire_params(names)
+    # nothing changed, so nothing comes back but the versions
+    D_values_again = client.pull_entire_params(names)
+    for param in server.get_params():
+        assert np.all(D_values[param.name] == param.value), param.name
+        assert np.all(D_values_again[param.name] == param.value), param.name
+        assert D_values_again[param.name] is not D_values[param.name]
+    stats = client.stats()
+    assert stats['msg_types']['MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED']['count'] == 2
+    for name in names:
+        assert stats['params'][name]['nbr_pulls'] == 1
+
+    # a push from another client changes the version of one parameter only
+    other = Client("127.0.0.1", server.port)
+    other.connect()
+    param = server.get_param(names[0])
+    D = param.shape[0:2]
+    indices = (np.arange(D[0], dtype=np.intc), np.arange(D[1], dtype=np.intc))
+    (version, value) = other.get_param_slice_if_modified(-1, param.name, D, D, indices, messages.DTYPE_FLOAT32)
+    assert other.get_param_slice_if_modified(version, param.name, D, D, indices, messages.DTYPE_FLOAT32) == (version, None)
+    other.update_param_slice_to_server(np.ones(param.shape, dtype=np.float32), 1.0, 1.0, param.name, D, D, indices, messages.DTYPE_FLOAT32)
+    (new_version, value) = other.get_param_slice_if_modified(version, param.name, D, D, indices, messages.DTYPE_FLOAT32)
+    assert new_version != version and np.all(value.reshape(param.shape) == param.value)
+    other.quit()
+    other.close()
+
+    out = np.empty(param.shape, dtype=np.float32)
+    assert np.may_share_memory(client.pull_entire_param(param.name, out), out)
+    assert np.all(out == param.value)
+    for name in names[1:]:
+        assert np.all(client.pull_entire_param(name) == server.get_param(name).value), name
+    stats = client.stats()
+    assert stats['params'][names[0]]['nbr_pulls'] == 2
+    for name in names[1:]:
+        assert stats['params'][name]['nbr_pulls'] == 1
+    client.quit()
+    client.close()
+
+
+def test_param_locks(server):
+
+    # the stripes of rows
+    locks = ParamLocks(512)
+    assert (locks.nbr_stripes, locks.rows_per_stripe) == (64, 8)
+    assert locks.get_stripes([0, 7, 8, 511]) == [0, 1, 63]
+    assert list(locks.get_stripes(range(512))) == range(64)
+    locks = ParamLocks(100)
+    assert (locks.nbr_stripes, locks.rows_per_stripe) == (50, 2)
+    locks = ParamLocks(1)
+    assert (locks.nbr_stripes, locks.rows_per_stripe) == (1, 1)
+
+    # the readers don't wait for each other, but the writers wait for them
+    locks.acquire([0], want_write=False)
+    assert locks.stripes[0].acquire(False, blocking=False)
+    assert not locks.stripes[0].acquire(True, blocking=False)
+    locks.release([0, 0])
+    assert locks.stripes[0].acquire(True, blocking=False)
+    locks.release([0])
+
+    param = server.get_param("layer_1_W")
+    with param.locks.hold(want_write=True):
+        param.value[...] = 0.0
+        param.bump_version()
+
+    client = Client("127.0.0.1", server.port)
+    client.connect()
+    before = client.get_param_lock_stats([param.name, "no_such_param"])
+    assert before["no_such_param"] is None
+    assert (before[param.name]['nbr_stripes'], before[param.name]['rows_per_stripe']) == (64, 8)
+
+    # Clients pushing to different stripes never wait for each other,
+    # and nothing gets lost. Each one has the rows of 4 stripes.
+    nbr_clients = 4
+    nbr_pushes = 20
+    D = param.shape[0:2]
+    def run_client(k):
+        rows = np.arange(32 * k, 32 * (k + 1), 2).astype(np.intc)
+        indices = (rows, np.arange(D[1]).astype(np.intc))
+        ones = np.ones((len(rows), D[1]) + param.shape[2:], dtype=np.float32)
+        pusher = Client("127.0.0.1", server.port)
+        pusher.connect()
+        for _ in range(nbr_pushes):
+            pusher.update_param_slice_to_server(ones, 1.0, 1.0, param.name, (len(rows), D[1]), D, indices, messages.DTYPE_FLOAT32)
+        # to wait for the pushes to be done
+        pusher.get_param_lock_stats([param.name])
+        pusher.quit()
+        pusher.close()
+
+    threads = [threading.Thread(target=run_client, args=(k,)) for k in range(nbr_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert np.all(param.value[0:32*nbr_clients:2] == nbr_pushes)
+    assert np.all(param.value[1:32*nbr_clients:2] == 0.0)
+    after = client.get_param_lock_stats([param.name])[param.name]
+    assert after['nbr_write_locks'] - before[param.name]['nbr_write_locks'] == nbr_clients * nbr_pushes * 4
+    assert after['nbr_write_waits'] == before[param.name]['nbr_write_waits']
+
+    # a pull of a row that someone is writing has to wait, and we see it
+    indices = (np.array([3], dtype=np.intc), np.arange(D[1]).astype(np.intc))
+    param.locks.acquire([0], want_write=True)
+    thread = threading.Thread(target=client.get_param_slice_from_server,
+                              args=(param.name, (1, D[1]), D, indices, messages.DTYPE_FLOAT32))
+    thread.start()
+    time.sleep(0.2)
+    param.locks.release([0])
+    thread.join()
+
+    stats = client.get_param_lock_stats([param.name])[param.name]
+    assert stats['nbr_read_waits'] == after['nbr_read_waits'] + 1
+    assert 0.1e9 < stats['read_wait_ns'] - after['read_wait_ns']
+    client.quit()
+    client.close()
+
+
+def run():
+
+    server = make_server()
+    test_slices(server)
+    test_concurrent_splits(server)
+    test_delta_updates(server)
+    test_evicted_split(server)
+    test_split_prefetcher_delta_updates(server)
+    test_split_prefetcher_push_error(server)
+    test_stats(server)
+    test_streams_ordering(server)
+    test_exchange(server)
+    test_init_param(server)
+    test_param_digest(server)
+    test_versioned_pulls(server)
+    test_param_locks(server)
+    server.stop()
+    print "Done."
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,218 @@
+
+import numpy as np
+
+from distdrop.client.sample_dropout_indices import SplitPlan
+from distdrop.client.sharded_client import ShardedClient
+from distdrop.client.sharded_client import get_consistent_hash_placement, get_size_balanced_placement
+from distdrop.client.sharded_client import partition_param_desc, parse_piece_name
+from distdrop.client.param_digest import compute_param_digest
+from distdrop.server.param_server import ParamServer
+from distdrop.server.params import ServerParam
+
+
+# This one doesn't need a server running.
+# We start a few python servers in the same process, on free ports,
+# and spread the parameters over them.
+
+def make_params():
+    return [ServerParam("layer_0_W", (32, 16, 3, 3), "CONV_FILTER_WEIGHTS"),
+            ServerParam("layer_0_W_momentum", (32, 16, 3, 3), "CONV_FILTER_WEIGHTS"),
+            ServerParam("layer_0_b", (32, 1, 4, 4), "CONV_FILTER_BIASES"),
+            ServerParam("layer_1_W", (32, 64, 3, 3), "CONV_FILTER_WEIGHTS"),
+            ServerParam("layer_1_b", (64, 1, 2, 2), "CONV_FILTER_BIASES"),
+            ServerParam("layer_2_W", (256, 10, 1, 1), "FULLY_CONNECTED_WEIGHTS"),
+            ServerParam("layer_2_W_momentum", (256, 10, 1, 1), "FULLY_CONNECTED_WEIGHTS"),
+            ServerParam("layer_2_b", (1, 10, 1, 1), "FULLY_CONNECTED_BIASES")]
+
+
+def make_servers(nbr_shards, D_nbr_pieces=None):
+    # `D_nbr_pieces` has the number of pieces of the parameters that we cut
+
+    D_nbr_pieces = dict(D_nbr_pieces or {})
+
+    L_param_desc = []
+    for param in make_params():
+        if D_nbr_pieces.has_key(param.name):
+            L_param_desc.extend(partition_param_desc(param.get_desc(), D_nbr_pieces.pop(param.name)))
+        else:
+            L_param_desc.append(param.get_desc())
+    # like in bin/shard_params_desc.py
+    assert len(D_nbr_pieces) == 0, "There is no parameter %s to partition." % ", ".join(D_nbr_pieces.keys())
+    L_params = [ServerParam(e['name'], e['shape'], e['kind']) for e in L_param_desc]
+    for param in L_params:
+        param.value[...] = np.random.rand(*param.shape)
+
+    D_placement = get_size_balanced_placement(L_param_desc, nbr_shards)
+    L_servers = []
+    for shard in range(nbr_shards):
+        server = ParamServer([param for param in L_params if D_placement[param.name] == shard], 0, server_host="127.0.0.1")
+        server.start()
+        L_servers.append(server)
+    return L_servers
+
+
+def get_server_value(L_servers, name):
+    # A copy of the values of `name` on the servers, with the pieces put together.
+    L_pieces = []
+    for server in L_servers:
+        for param in server.get_params():
+            parsed = parse_piece_name(param.name)
+            if param.name == name:
+                return param.value.copy()
+            elif parsed is not None and parsed[0] == name:
+                L_pieces.append((parsed[1], param.value.copy()))
+    return np.concatenate([value for (_, value) in sorted(L_pieces)], axis=0)
+
+
+def test_placement():
+
+    names = ["layer_%d_%s" % (k, role) for k in range(100) for role in ["W", "b", "W_momentum"]]
+    D_before = get_consistent_hash_placement(names, 4)
+    D_after = get_consistent_hash_placement(names, 5)
+    # adding a shard only moves parameters to it
+    L_moved = [name for name in names if D_before[name] != D_after[name]]
+    assert all(D_after[name] == 4 for name in L_moved)
+    assert 0 < len(L_moved) < len(names) / 2
+
+    L_param_desc = [param.get_desc() for param in make_params()]
+    D_placement = get_size_balanced_placement(L_param_desc, 3)
+    L_load = [0, 0, 0]
+    for e in L_param_desc:
+        L_load[D_placement[e['name']]] += int(np.prod(e['shape']))
+    # the shards differ by at most the largest parameter
+    assert max(L_load) - min(L_load) <= max(int(np.prod(e['shape'])) for e in L_param_desc)
+
+    # the pieces of a parameter go to different shards
+    L_piece_desc = partition_param_desc(L_param_desc[3], 3)
+    L_param_desc = L_param_desc[:3] + L_piece_desc + L_param_desc[4:]
+    for D_placement in [get_size_balanced_placement(L_param_desc, 3),
+                        get_consistent_hash_placement([e['name'] for e in L_param_desc], 3)]:
+        assert sorted(D_placement[e['name']] for e in L_piece_desc) == [0, 1, 2]
+
+
+def test_splits(L_servers):
+
+    L_endpoints = [("127.0.0.1", server.port) for server in L_servers]
+    D_dropout_probs = {'layer_0' : [0.0, 0.5], 'layer_1' : [0.5, 0.5], 'layer_2' : [0.5, 0.0]}
+
+    for client in [ShardedClient.new_basic_alpha_beta(L_endpoints, 0.5, 2.0),
+                   ShardedClient.new_basic_alpha_beta(L_endpoints, 0.5, 2.0, nbr_streams=2, want_registered_splits=True),
+                   ShardedClient.new_delta_updates(L_endpoints)]:
+        client.connect()
+        L_param_desc = client.read_param_desc_from_server()
+        assert sorted(e['name'] for e in L_param_desc) == sorted(param.name for param in make_params())
+        for (i, server) in enumerate(L_servers):
+            for param in server.get_params():
+                parsed = parse_piece_name(param.name)
+                name = param.name if parsed is None else parsed[0]
+                assert i in [piece[0] for piece in client.get_pieces(name)]
+            assert client.L_shards[i].port == server.port
+
+        # the same split as with all the parameters on one server
+        client.perform_split(D_dropout_probs, seed=1234)
+        expected_splits_indices = SplitPlan(L_param_desc).sample_seeded(1234, D_dropout_probs)
+        for (name, indices) in expected_splits_indices.items():
+            assert np.all(client.splits_indices[name][0] == indices[0]), name
+            assert np.all(client.splits_indices[name][1] == indices[1]), name
+
+        # and every shard has the part for its parameters
+        names = client.splits_indices.keys()
+        for (i, shard) in enumerate(client.L_shards):
+            for (piece_name, local_indices) in shard.splits_indices.items():
+                parsed = parse_piece_name(piece_name)
+                if parsed is None:
+                    assert np.all(local_indices[0] == client.splits_indices[piece_name][0])
+                else:
+                    (name, row_start, row_stop) = parsed
+                    rows = client.splits_indices[name][0]
+                    assert np.all(local_indices[0] + row_start == rows[(row_start <= rows) & (rows < row_stop)])
+
+        # "layer_2_W_momentum" has the indices of "layer_2_W", and when they are
+        # cut in the same pieces, the pieces share their local indices too
+        (L_layout, L_momentum_layout) = (client.D_split_layouts["layer_2_W"], client.D_split_layouts["layer_2_W_momentum"])
+        if len(client.get_pieces("layer_2_W")) == len(client.get_pieces("layer_2_W_momentum")) > 1:
+            assert len(L_layout) == len(L_momentum_layout)
+            for ((_, _, positions), (_, _, momentum_positions)) in zip(L_layout, L_momentum_layout):
+                assert positions is momentum_positions
+
+        D_values = client.pull_split_params(names)
+        D_old_values = {}
+        for name in names:
+            ix = np.ix_(*client.splits_indices[name])
+            D_old_values[name] = get_server_value(L_servers, name)[ix]
+            if client.L_shards[0].want_delta_updates:
+                # we get the values that are cached, in float16
+                expected = D_old_values[name].astype(np.float16).astype(np.float32)
+            else:
+                expected = D_old_values[name]
+            assert np.all(D_values[name] == expected), name
+            assert np.all(client.pull_split_param(name) == expected), name
+
+        D_updated_values = dict((name, np.random.rand(*value.shape).astype(np.float32)) for (name, value) in D_values.items())
+        client.push_split_params(D_updated_values)
+        # the pushes get no response, so we wait for one to a message that comes after them
+        D_digests = client.get_param_digests(names + ["no_such_param"])
+        assert D_digests["no_such_param"] is None
+
+        for name in names:
+            value = get_server_value(L_servers, name)
+            digest = compute_param_digest(value)
+            if D_digests[name]['md5'] is None:
+                # cut in pieces
+                assert D_digests[name]['nbr_elements'] == digest['nbr_elements']
+                assert np.allclose(D_digests[name]['sum'], digest['sum'])
+                assert (D_digests[name]['min'], D_digests[name]['max']) == (digest['min'], digest['max'])
+            else:
+                assert D_digests[name] == digest
+            ix = np.ix_(*client.splits_indices[name])
+            if client.L_shards[0].want_delta_updates:
+                expected = D_old_values[name] + (D_updated_values[name] - D_values[name])
+                assert np.allclose(value[ix], expected, atol=1e-6), name
+            else:
+                expected = np.float32(0.5) * D_old_values[name] + np.float32(2.0) * D_updated_values[name]
+                assert np.all(value[ix] == expected), name
+
+        # into arrays of our own
+        D_out = dict((name, np.empty(get_server_value(L_servers, name).shape, dtype=np.float32)) for name in names)
+        D_entire_values = client.pull_entire_params(names, D_out)
+        for name in names:
+            assert np.may_share_memory(D_entire_values[name], D_out[name])
+            assert np.all(D_entire_values[name] == get_server_value(L_servers, name)), name
+            assert np.all(client.pull_entire_param(name) == get_server_value(L_servers, name)), name
+
+        if not client.L_shards[0].want_delta_updates:
+            for name in names:
+                ix = np.ix_(*client.splits_indices[name])
+                old_value = get_server_value(L_servers, name)[ix]
+                updated_value = np.random.rand(*old_value.shape).astype(np.float32)
+                res = client.exchange_split_param(name, updated_value)
+                expected = np.float32(0.5) * old_value + np.float32(2.0) * updated_value
+                assert np.all(res == expected), name
+                assert np.all(get_server_value(L_servers, name)[ix] == expected), name
+
+        stats = client.stats()
+        D_lock_stats = client.get_param_lock_stats(names + ["no_such_param"])
+        assert D_lock_stats["no_such_param"] is None
+        for name in names:
+            for (_, piece_name, _, _) in client.get_pieces(name):
+                assert 1 <= stats['params'][piece_name]['nbr_pulls']
+                assert 1 <= D_lock_stats[piece_name]['nbr_write_locks']
+        client.quit()
+        client.close()
+
+
+def run():
+
+    test_placement()
+    # every parameter on one server, and then the largest ones
+    # cut in pieces spread over the servers
+    for D_nbr_pieces in [None, {'layer_1_W' : 3, 'layer_2_W' : 4, 'layer_2_W_momentum' : 4}]:
+        L_servers = make_servers(3, D_nbr_pieces)
+        test_splits(L_servers)
+        for server in L_servers:
+            server.stop()
+    print "Done."
+
+
+if __name__ == "__main__":
+    run()
@@ -11,7 +11,9 @@ from distdrop.client.client_api import ClientCNNAutoSplitter
 #from distdrop.client import messages
 
 def usage():
-    print "python test_soak_server_split_params.py --server=127.0.0.1 --port=5000 --nclients=5 --nreps=1 --nsplits=2"
+    print "python test_soak_server_split_params.py --server=127.0.0.1 --port=5000 --nclients=5 --nreps=1 --nsplits=2 [--exchange]"
+    print ""
+    print "With --exchange, every push is followed by its pull in one MSG_TYPE_EXCHANGE_PARAM."
 
 
 def extract_layer_names(L_params):
@@ -29,7 +31,7 @@ def extract_layer_names(L_params):
 
 
 
-def run(server, port, nclients, nreps, nsplits):
+def run(server, port, nclients, nreps, nsplits, want_exchange=False):
 
     # we're not doing the clients in parallel or it'll be an insane mess
 
@@ -44,7 +46,7 @@ def run(server, port, nclients, nreps, nsplits):
 
         print "    Starting soak."
         for __ in range(nreps):
-            soak(client, alpha, beta, nsplits)
+            soak(client, alpha, beta, nsplits, want_exchange)
         print "   Done with soak."
 
         client.quit()
@@ -52,7 +54,7 @@ def run(server, port, nclients, nreps, nsplits):
         print "Done with client."
 
 
-def soak(client, alpha, beta, nsplits):
+def soak(client, alpha, beta, nsplits, want_exchange=False):
 
     L_params = client.read_param_desc_from_server()
     layer_names = extract_layer_names(L_params)
@@ -85,9 +87,11 @@ def soak(client, alpha, beta, nsplits):
             del subE
 
             v_update = np.random.randn(*v_current.shape).astype(np.float32)
-            client.push_split_param(name, v_update)
-
-            v_resulting = client.pull_split_param(name)
+            if want_exchange:
+                v_resulting = client.exchange_split_param(name, v_update)
+            else:
+                client.push_split_param(name, v_update)
+                v_resulting = client.pull_split_param(name)
 
             npt.assert_allclose(v_resulting, alpha*v_current + beta*v_update, atol=1e-8)
             
@@ -104,7 +108,7 @@ def main(argv):
 
     try:
         opts, args = getopt.getopt(sys.argv[1:], "hv", ["server=", "port=",
-                                                        "nclients=", "nreps=", "nsplits="])
+                                                        "nclients=", "nreps=", "nsplits=", "exchange"])
     except getopt.GetoptError as err:
         # print help information and exit:
         print str(err) # will print something like "option -a not recognized"
@@ -116,6 +120,7 @@ def main(argv):
     nclients = 5
     nreps = 1
     nsplits = 2
+    want_exchange = False
 
     verbose = False
     for o, a in opts:
@@ -134,12 +139,14 @@ def main(argv):
             nreps = int(a)
         elif o in ("--nsplits"):
             nsplits = int(a)
+        elif o in ("--exchange"):
+            want_exchange = True
         else:
             assert False, "unhandled option"
 
     assert port
 
-    run(server, port, nclients, nreps, nsplits)
+    run(server, port, nclients, nreps, nsplits, want_exchange)
 
 
 if __name__ == "__main__":
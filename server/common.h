@@ -11,6 +11,7 @@
 #include <stdio.h>
 #include <pthread.h>
 #include <stdbool.h>
+#include <stdint.h>
 #include <glib.h>
 
 #define MSG_HEADER_LENGTH 16
@@ -21,21 +22,56 @@
 #define DTYPE_FLOAT32 32
 #define DTYPE_FLOAT64 64
 
+/* How the indices of each axis of a slice are sent.
+   The client packs them in the dtype of the message as
+       dtype_for_client | (encoding[0] << 8) | (encoding[1] << 16)
+   so the clients that always send lists of ints are unaffected. */
+#define INDEX_ENCODING_LIST 0     /* S ints */
+#define INDEX_ENCODING_ALL 1      /* nothing, requires S == D */
+#define INDEX_ENCODING_BITMASK 2  /* (D+7)/8 bytes, most significant bit first */
+#define INDEX_ENCODING_RANGES 3   /* one int R followed by R pairs of ints (start, stop) */
+#define INDEX_ENCODING_REGISTERED 4 /* for both axes, two ints (handle, entry) of a registered split */
+
+/* How many splits registered with MSG_TYPE_REGISTER_SPLIT (or MSG_TYPE_REGISTER_SEEDED_SPLIT) we keep per connection.
+   Registering a new split with handle h replaces the one in slot h % SPLIT_REGISTRY_SIZE. */
+#define SPLIT_REGISTRY_SIZE 8
+
 #define FULLY_CONNECTED_WEIGHTS 1
 #define FULLY_CONNECTED_BIASES 2
 #define CONV_FILTER_WEIGHTS 3
 #define CONV_FILTER_BIASES 4
 
+/* The rows of a parameter (its first dimension, the one that dropout picks from)
+   are cut into at most PARAM_LOCK_MAX_STRIPES blocks of consecutive rows,
+   each with its own reader/writer lock. Pushes to disjoint rows don't wait
+   for each other, and pulls never wait for other pulls. See param_locks.c. */
+#define PARAM_LOCK_MAX_STRIPES 64
+
+typedef struct _param_locks_t {
+	pthread_rwlock_t stripes[PARAM_LOCK_MAX_STRIPES];
+	int nbr_stripes;
+	int rows_per_stripe;
+	/* How often we took a stripe, how often we had to wait for it,
+	   and for how long in total. Only changed with __sync_fetch_and_add. */
+	int64_t nbr_read_locks, nbr_read_waits, read_wait_ns;
+	int64_t nbr_write_locks, nbr_write_waits, write_wait_ns;
+} param_locks_t;
+
 struct _param_t;
 
 typedef struct _param_t {
 	char name[PARAM_NAME_LENGTH];
 	int shape[4];
 	int kind; // conv weights, bias, full weights, bias
-	pthread_mutex_t mutex;
+	/* Hold the stripes of the rows to read or write `data`
+	   (see `lock_param_slice` and `lock_param_all` in param_locks.c). */
+	param_locks_t locks;
 	void * data;
 	int data_length_bytes; // redundant but nice to have
 	int dtype;
+	/* Changes every time that the data changes, and never goes back to a previous value,
+	   even when the parameters are loaded again (see `bump_param_version` in params.c). */
+	int64_t version;
 	struct _param_t * next;
 } param_t;
 
@@ -46,8 +82,23 @@ typedef struct _slice_t {
 	int indices[2][SLICE_MAX_INDEX];
 	int S[2]; // the number of indices represented in the slice
 	int D[2]; // the total number of indices in the original array
+	bool indices_are_validated; // when they come from a registered split
 } slice_t;
 
+// The indices of one entry of a registered split, allocated
+// with only the space that they need, unlike the slice_t.
+typedef struct _registered_slice_t {
+	int * indices[2];
+	int S[2];
+	int D[2];
+} registered_slice_t;
+
+typedef struct _registered_split_t {
+	int handle;
+	int nbr_entries;
+	registered_slice_t * entries; // NULL when nothing is registered in that slot
+} registered_split_t;
+
 
 typedef struct _msg_header_t {
 	int msg_type;
@@ -64,6 +115,8 @@ typedef struct _msg_param_t {
 	void * data;
 	int current_data_length_bytes;
 	int max_data_length_bytes;
+	// the split registry of the connection, used for INDEX_ENCODING_REGISTERED
+	registered_split_t * split_registry;
 	// int msg_type; //optional, to track what's stored in there
 } msg_param_t;
 
@@ -76,6 +129,16 @@ typedef struct _msg_param_t {
 #define MSG_TYPE_LIST_ALL_PARAMS_DESC 5
 #define MSG_TYPE_SAVE_ALL_TO_HDF5 6
 #define MSG_TYPE_LOAD_ALL_FROM_HDF5 7
+#define MSG_TYPE_PULL_PARAMS_BATCH 8
+#define MSG_TYPE_PUSH_PARAMS_BATCH 9
+#define MSG_TYPE_REGISTER_SPLIT 10
+#define MSG_TYPE_REGISTER_SEEDED_SPLIT 11
+#define MSG_TYPE_INIT_PARAM 12
+#define MSG_TYPE_PARAM_DIGEST 13
+#define MSG_TYPE_EXCHANGE_PARAM 14
+#define MSG_TYPE_PULL_PARAM_IF_MODIFIED 15
+#define MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED 16
+#define MSG_TYPE_PARAM_LOCK_STATS 17
 
 typedef struct _thread_liveness_t{
     pthread_t thread_id;
@@ -101,6 +164,9 @@ typedef struct _client_conn_t {
 
 	int max_data_length_bytes;
 
+	/* the splits registered with MSG_TYPE_REGISTER_SPLIT on this connection */
+	registered_split_t split_registry[SPLIT_REGISTRY_SIZE];
+
 } client_conn_t;
 
 void thread_printf(char * format, ...);
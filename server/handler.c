@@ -13,6 +13,10 @@
 #include "handler.h"
 #include "params.h"
 #include "server_hdf5_io.h"
+#include "seeded_split.h"
+#include "seeded_init.h"
+#include "param_digest.h"
+#include "param_locks.h"
 
 #include <jansson.h>
 #include <glib.h>
@@ -55,6 +59,8 @@ void cleanup(msg_param_t * msg, msg_header_t * header, client_conn_t * conn) {
 			}
 		}
 
+		clear_split_registry(conn->split_registry);
+
     	if (msg->data) {
     		free(msg->data);
     	}
@@ -161,6 +167,7 @@ void * server_side_handler(void * void_conn_ptr) {
 	}
 
 	msg->max_data_length_bytes = conn->max_data_length_bytes;
+	msg->split_registry = conn->split_registry;
 
 	// matched_param is never allocated, never deallocated, always a pointing to something
 	// that is found through exploring the `global_param_list`
@@ -271,7 +278,17 @@ void * server_side_handler(void * void_conn_ptr) {
 			case MSG_TYPE_PULL_PARAM: 
 				printf("handler.c - pthread #%lu: read header for MSG_TYPE_PULL_PARAM\n", (size_t)pthread_self());
 				// extract the body of the message
-				read_MSG_PULL_PARAM(msg, conn->socket_fd);
+				if (read_MSG_PULL_PARAM(msg, conn->socket_fd) == -1) {
+					// The indices in `msg` are not those of this message, and what is left
+					// of it is still on the socket. The client gets an empty array.
+					int zero = 0;
+					write(conn->socket_fd, (void *)&zero, sizeof(int));
+
+					const char * error_text = "Error for MSG_TYPE_PULL_PARAM.\nFailed to read the message, or its indices (maybe a split that isn't registered anymore).";
+					fail(error_text, strlen(error_text));
+	    			cleanup(msg, header, conn);
+					return NULL;
+				}
 				// fetch the param by name. 
 				matched_param = get_matching_param_entry(global_param_list, msg->name);
 				if (matched_param == NULL) {
@@ -310,7 +327,17 @@ void * server_side_handler(void * void_conn_ptr) {
 			case MSG_TYPE_PUSH_PARAM:
 				printf("handler.c - pthread #%lu: read header for MSG_TYPE_PUSH_PARAM\n", (size_t)pthread_self());
 				// Read the body of the message
-				read_MSG_PUSH_PARAM(msg, conn->socket_fd);
+				if (read_MSG_PUSH_PARAM(msg, conn->socket_fd) == -1) {
+					// Same as when the parameter is missing. We can't tell where
+					// the next message starts, so the connection is over.
+					int zero = 0;
+					write(conn->socket_fd, (void *)&zero, sizeof(int));
+
+					const char * error_text = "Error for MSG_TYPE_PUSH_PARAM.\nFailed to read the message, or its indices (maybe a split that isn't registered anymore).";
+					fail(error_text, strlen(error_text));
+	    			cleanup(msg, header, conn);
+					return NULL;
+				}
 				// Find the param by name
 				matched_param = get_matching_param_entry(global_param_list, msg->name);
 				if (matched_param == NULL) {
@@ -335,12 +362,291 @@ void * server_side_handler(void * void_conn_ptr) {
 				}
 
 				// Update the server's corresponding param slice 
-				commit_slice_to_param(matched_param, msg);
+				if (commit_slice_to_param(matched_param, msg) == -1) {
+					const char * error_text = "Error for MSG_TYPE_PUSH_PARAM.\nCommitting the slice to the parameter failed.";
+					fail(error_text, strlen(error_text));
+	    			cleanup(msg, header, conn);
+					return NULL;
+				}
 
 				// no need to respond here (this can be changed later if we tweak the protocol)
 				
 				printf("handler.c - pthread #%lu: done with MSG_TYPE_PUSH_PARAM;\n", (size_t)pthread_self());
 			break;
+			// The client has a slice with some version, and wants it again only if
+			// the parameter has changed since. The response has the version in front.
+			case MSG_TYPE_PULL_PARAM_IF_MODIFIED:
+				printf("handler.c - pthread #%lu: read header for MSG_TYPE_PULL_PARAM_IF_MODIFIED\n", (size_t)pthread_self());
+				if (read_and_respond_MSG_PULL_PARAM_IF_MODIFIED(global_param_list, msg, conn->socket_fd) == -1) {
+					const char * error_text = "Error for MSG_TYPE_PULL_PARAM_IF_MODIFIED.\nEither there is no such parameter on the server, or the slice is invalid.";
+					fail(error_text, strlen(error_text));
+	    			cleanup(msg, header, conn);
+					return NULL;
+				}
+				printf("handler.c - pthread #%lu: done with MSG_TYPE_PULL_PARAM_IF_MODIFIED;\n", (size_t)pthread_self());
+			break;
+			// Same thing for many slices, framed like MSG_TYPE_PULL_PARAMS_BATCH.
+			case MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED:
+				printf("handler.c - pthread #%lu: read header for MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED\n", (size_t)pthread_self());
+				{
+				int nbr_entries = 0;
+				if (read_MSG_BATCH_COUNT(&nbr_entries, conn->socket_fd) == -1) {
+					const char * error_text = "Error for MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED.\nFailed to read a valid number of entries.";
+					fail(error_text, strlen(error_text));
+	    			cleanup(msg, header, conn);
+					return NULL;
+				}
+
+				write(conn->socket_fd, (void *)&nbr_entries, sizeof(int));
+
+				for (int e = 0; e < nbr_entries; e++) {
+					clean_msg_param(msg);
+					if (read_and_respond_MSG_PULL_PARAM_IF_MODIFIED(global_param_list, msg, conn->socket_fd) == -1) {
+						const char * error_text = "Error for MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED.\nEither there is no such parameter on the server, or the slice is invalid.";
+						fail(error_text, strlen(error_text));
+		    			cleanup(msg, header, conn);
+						return NULL;
+					}
+				}
+				}
+				printf("handler.c - pthread #%lu: done with MSG_TYPE_PULL_PARAMS_BATCH_IF_MODIFIED;\n", (size_t)pthread_self());
+			break;
+			// The client pushes a slice and wants it back right after, with its update.
+			// This is the body of a MSG_TYPE_PUSH_PARAM, with the response of a MSG_TYPE_PULL_PARAM.
+			case MSG_TYPE_EXCHANGE_PARAM:
+				printf("handler.c - pthread #%lu: read header for MSG_TYPE_EXCHANGE_PARAM\n", (size_t)pthread_self());
+				if (read_MSG_PUSH_PARAM(msg, conn->socket_fd) == -1) {
+					// before we lock or commit anything
+					int zero = 0;
+					write(conn->socket_fd, (void *)&zero, sizeof(int));
+
+					const char * error_text = "Error for MSG_TYPE_EXCHANGE_PARAM.\nFailed to read the message, or its indices (maybe a split that isn't registered anymore).";
+					fail(error_text, strlen(error_text));
+	    			cleanup(msg, header, conn);
+					return NULL;
+				}
+				matched_param = get_matching_param_entry(global_param_list, msg->name);
+				if (matched_param == NULL || exchange_slice_with_param(matched_param, msg) == -1) {
+					// the client is waiting for a response, so we send an empty one
+					int zero = 0;
+					write(conn->socket_fd, (void *)&zero, sizeof(int));
+
+					char * error_text = g_strdup_printf(
+									"Error for MSG_TYPE_EXCHANGE_PARAM.\n"
+									"Either there is no parameter %s on the server, or the slice is invalid.\n"
+									"Therefore, we terminate the connection on the server side."
+									, msg->name);
+
+					fail(error_text, strlen(error_text));
+					free(error_text);
+	    			cleanup(msg, header, conn);
+					return NULL;
+				}
+				respond_MSG_PULL_PARAM(msg, conn->socket_fd);
+
+				printf("handler.c - pthread #%lu: done with MSG_TYPE_EXCHANGE_PARAM;\n", (size_t)pthread_self());
+			break;
+			// The client wants many slices at once (usually all the variables of a split).
+			// This is the same thing as a sequence of MSG_TYPE_PULL_PARAM, but framed as
+			// one request followed by one response, so we only pay the latency once.
+			case MSG_TYPE_PULL_PARAMS_BATCH:
+				printf("handler.c - pthread #%lu: read header for MSG_TYPE_PULL_PARAMS_BATCH\n", (size_t)pthread_self());
+				{
+				int nbr_entries = 0;
+				if (read_MSG_BATCH_COUNT(&nbr_entries, conn->socket_fd) == -1) {
+					const char * error_text = "Error for MSG_TYPE_PULL_PARAMS_BATCH.\nFailed to read a valid number of entries.";
+					fail(error_text, strlen(error_text));
+	    			cleanup(msg, header, conn);
+					return NULL;
+				}
+
+				// The response starts by repeating the number of entries,
+				// and then we have one MSG_TYPE_PULL_PARAM response per entry.
+				write(conn->socket_fd, (void *)&nbr_entries, sizeof(int));
+
+				for (int e = 0; e < nbr_entries; e++) {
+					clean_msg_param(msg);
+					if (read_MSG_PULL_PARAM(msg, conn->socket_fd) == -1) {
+						int zero = 0;
+						write(conn->socket_fd, (void *)&zero, sizeof(int));
+
+						char * error_text = g_strdup_printf(
+										"Error for MSG_TYPE_PULL_PARAMS_BATCH.\n"
+										"Failed to read entry %d, or its indices (maybe a split that isn't registered anymore).\n"
+										"Therefore, we terminate the connection on the server side."
+										, e);
+
+						fail(error_text, strlen(error_text));
+						free(error_text);
+		    			cleanup(msg, header, conn);
+						return NULL;
+					}
+					matched_param = get_matching_param_entry(global_param_list, msg->name);
+					if (matched_param == NULL) {
+						int zero = 0;
+						write(conn->socket_fd, (void *)&zero, sizeof(int));
+
+						char * error_text = g_strdup_printf(
+										"Error for MSG_TYPE_PULL_PARAMS_BATCH.\n"
+										"Entry %d asked for parameter %s but there is no such parameter on the server.\n"
+										"Therefore, we terminate the connection on the server side."
+										, e, msg->name);
+
+						fail(error_text, strlen(error_text));
+						free(error_text);
+		    			cleanup(msg, header, conn);
+						return NULL;
+					}
+					if (extract_slice_from_param(matched_param, msg) == -1) {
+						const char * error_text = "Extracting a slice from the parameter struct failed in MSG_TYPE_PULL_PARAMS_BATCH.";
+						fail(error_text, strlen(error_text));
+		    			cleanup(msg, header, conn);
+						return NULL;
+					}
+					respond_MSG_PULL_PARAM(msg, conn->socket_fd);
+				}
+				}
+				printf("handler.c - pthread #%lu: done with MSG_TYPE_PULL_PARAMS_BATCH;\n", (size_t)pthread_self());
+			break;
+			// The client has many updated slices to push to the server.
+			case MSG_TYPE_PUSH_PARAMS_BATCH:
+				printf("handler.c - pthread #%lu: read header for MSG_TYPE_PUSH_PARAMS_BATCH\n", (size_t)pthread_self());
+				{
+				int nbr_entries = 0;
+				if (read_MSG_BATCH_COUNT(&nbr_entries, conn->socket_fd) == -1) {
+					const char * error_text = "Error for MSG_TYPE_PUSH_PARAMS_BATCH.\nFailed to read a valid number of entries.";
+					fail(error_text, strlen(error_text));
+	    			cleanup(msg, header, conn);
+					return NULL;
+				}
+
+				for (int e = 0; e < nbr_entries; e++) {
+					clean_msg_param(msg);
+					if (read_MSG_PUSH_PARAM(msg, conn->socket_fd) == -1) {
+						// nothing to respond, just like for a missing parameter
+						char * error_text = g_strdup_printf(
+										"Error for MSG_TYPE_PUSH_PARAMS_BATCH.\n"
+										"Failed to read entry %d, or its indices (maybe a split that isn't registered anymore).\n"
+										"Therefore, we terminate the connection on the server side."
+										, e);
+
+						fail(error_text, strlen(error_text));
+						free(error_text);
+		    			cleanup(msg, header, conn);
+						return NULL;
+					}
+					matched_param = get_matching_param_entry(global_param_list, msg->name);
+					if (matched_param == NULL) {
+						char * error_text = g_strdup_printf(
+										"Error for MSG_TYPE_PUSH_PARAMS_BATCH.\n"
+										"Entry %d asked for parameter %s but there is no such parameter on the server.\n"
+										"Therefore, we terminate the connection on the server side."
+										, e, msg->name);
+
+						fail(error_text, strlen(error_text));
+						free(error_text);
+		    			cleanup(msg, header, conn);
+						return NULL;
+					}
+					if (commit_slice_to_param(matched_param, msg) == -1) {
+						char * error_text = g_strdup_printf(
+										"Error for MSG_TYPE_PUSH_PARAMS_BATCH.\n"
+										"Committing entry %d to parameter %s failed.\n"
+										"Therefore, we terminate the connection on the server side."
+										, e, msg->name);
+
+						fail(error_text, strlen(error_text));
+						free(error_text);
+		    			cleanup(msg, header, conn);
+						return NULL;
+					}
+				}
+				}
+				// no need to respond here, just like with MSG_TYPE_PUSH_PARAM
+				printf("handler.c - pthread #%lu: done with MSG_TYPE_PUSH_PARAMS_BATCH;\n", (size_t)pthread_self());
+			break;
+			// The client sends the indices of a split once, so that the following
+			// pulls and pushes can refer to them with INDEX_ENCODING_REGISTERED.
+			case MSG_TYPE_REGISTER_SPLIT:
+				printf("handler.c - pthread #%lu: read header for MSG_TYPE_REGISTER_SPLIT\n", (size_t)pthread_self());
+				{
+				int handle = -1;
+				if (read_MSG_REGISTER_SPLIT(conn->split_registry, &msg->slice, &handle, conn->socket_fd) == -1) {
+					// let the client know before we close the connection
+					int failed = -1;
+					write(conn->socket_fd, (void *)&failed, sizeof(int));
+
+					const char * error_text = "Error for MSG_TYPE_REGISTER_SPLIT.\nFailed to read a valid split.";
+					fail(error_text, strlen(error_text));
+	    			cleanup(msg, header, conn);
+					return NULL;
+				}
+				// respond with the handle to confirm
+				write(conn->socket_fd, (void *)&handle, sizeof(int));
+				}
+				printf("handler.c - pthread #%lu: done with MSG_TYPE_REGISTER_SPLIT;\n", (size_t)pthread_self());
+			break;
+			// Same thing, but the server generates the split from a seed
+			// like `SplitPlan.sample_seeded` does on the client.
+			case MSG_TYPE_REGISTER_SEEDED_SPLIT:
+				printf("handler.c - pthread #%lu: read header for MSG_TYPE_REGISTER_SEEDED_SPLIT\n", (size_t)pthread_self());
+				{
+				int handle = -1;
+				if (read_MSG_REGISTER_SEEDED_SPLIT(global_param_list, conn->split_registry, &handle, conn->socket_fd) == -1) {
+					// let the client know before we close the connection
+					int failed = -1;
+					write(conn->socket_fd, (void *)&failed, sizeof(int));
+
+					const char * error_text = "Error for MSG_TYPE_REGISTER_SEEDED_SPLIT.\nFailed to generate the split.";
+					fail(error_text, strlen(error_text));
+	    			cleanup(msg, header, conn);
+					return NULL;
+				}
+				// respond with the handle to confirm
+				write(conn->socket_fd, (void *)&handle, sizeof(int));
+				}
+				printf("handler.c - pthread #%lu: done with MSG_TYPE_REGISTER_SEEDED_SPLIT;\n", (size_t)pthread_self());
+			break;
+			// The client wants a parameter filled with random values from a seed,
+			// instead of generating them and pushing them.
+			case MSG_TYPE_INIT_PARAM:
+				printf("handler.c - pthread #%lu: read header for MSG_TYPE_INIT_PARAM\n", (size_t)pthread_self());
+				{
+				int status = read_MSG_INIT_PARAM(global_param_list, conn->socket_fd);
+				// respond with 0 when it's done, or -1 before we close the connection
+				write(conn->socket_fd, (void *)&status, sizeof(int));
+				if (status == -1) {
+					const char * error_text = "Error for MSG_TYPE_INIT_PARAM.\nFailed to initialize the parameter.";
+					fail(error_text, strlen(error_text));
+	    			cleanup(msg, header, conn);
+					return NULL;
+				}
+				}
+				printf("handler.c - pthread #%lu: done with MSG_TYPE_INIT_PARAM;\n", (size_t)pthread_self());
+			break;
+			// The client wants the md5 and a few statistics of some parameters,
+			// to check them without pulling them.
+			case MSG_TYPE_PARAM_DIGEST:
+				printf("handler.c - pthread #%lu: read header for MSG_TYPE_PARAM_DIGEST\n", (size_t)pthread_self());
+				if (respond_MSG_PARAM_DIGEST(global_param_list, conn->socket_fd) == -1) {
+					const char * error_text = "Error for MSG_TYPE_PARAM_DIGEST.\nFailed to read the names or to send the digests.";
+					fail(error_text, strlen(error_text));
+	    			cleanup(msg, header, conn);
+					return NULL;
+				}
+				printf("handler.c - pthread #%lu: done with MSG_TYPE_PARAM_DIGEST;\n", (size_t)pthread_self());
+			break;
+			// The client wants to know how much waiting there was on the locks of some parameters.
+			case MSG_TYPE_PARAM_LOCK_STATS:
+				printf("handler.c - pthread #%lu: read header for MSG_TYPE_PARAM_LOCK_STATS\n", (size_t)pthread_self());
+				if (respond_MSG_PARAM_LOCK_STATS(global_param_list, conn->socket_fd) == -1) {
+					const char * error_text = "Error for MSG_TYPE_PARAM_LOCK_STATS.\nFailed to read the names or to send the stats.";
+					fail(error_text, strlen(error_text));
+	    			cleanup(msg, header, conn);
+					return NULL;
+				}
+				printf("handler.c - pthread #%lu: done with MSG_TYPE_PARAM_LOCK_STATS;\n", (size_t)pthread_self());
+			break;
 			// The client wants all of the parameters
 			case MSG_TYPE_LIST_ALL_PARAMS_DESC:
 				printf("handler.c - pthread #%lu: read header for MSG_TYPE_LIST_ALL_PARAMS_DESC\n", (size_t)pthread_self());
@@ -412,6 +718,21 @@ int validate_slice(slice_t * slice_ptr, int shape[4], char * name) {
 			return -1;
 		}
 
+		/* The indices of a registered split were checked once when it was registered. */
+		if (slice_ptr->indices_are_validated) {
+			continue;
+		}
+
+		if (validate_slice_indices(slice_ptr->indices[k], slice_ptr->S[k], slice_ptr->D[k], k, name) == -1) {
+			return -1;
+		}
+	}
+
+	return 0;
+}
+
+int validate_slice_indices(int * indices, int S, int D, int k, char * name) {
+
         /*
           We can perform the more expensive check to insure that the indices are ordered
           and within the bounds that we expect. We don't really need them to be ordered,
@@ -420,14 +741,14 @@ int validate_slice(slice_t * slice_ptr, int shape[4], char * name) {
           of using the cartesian product of the indices.
         */
 
-        for (int i = 0; i < slice_ptr->S[k]; i++) {
+        for (int i = 0; i < S; i++) {
 
             // test if we're within the bounds
-            if (0 <= slice_ptr->indices[k][i] && slice_ptr->indices[k][i] < slice_ptr->D[k]) {
+            if (0 <= indices[i] && indices[i] < D) {
 
                 // test if we have a strictly increasing ordered list of indices
                 if (0 < i) {
-                    if (slice_ptr->indices[k][i-1] < slice_ptr->indices[k][i]) {
+                    if (indices[i-1] < indices[i]) {
                         // all ok
                         continue;
                     } else {
@@ -436,12 +757,11 @@ int validate_slice(slice_t * slice_ptr, int shape[4], char * name) {
                     }
                 }
             } else {
-              fprintf(stderr, "handler.c - pthread #%lu: Got a slice for param %s that has indices that are out of bounds ! indices[%d][%d] is %d but should be limited to %d.\n", (size_t)pthread_self(), name, k, i, slice_ptr->indices[k][i], slice_ptr->D[k]);
+              fprintf(stderr, "handler.c - pthread #%lu: Got a slice for param %s that has indices that are out of bounds ! indices[%d][%d] is %d but should be limited to %d.\n", (size_t)pthread_self(), name, k, i, indices[i], D);
                 return -1;
             }
 
         }
-	}
 
 	return 0;
 }
@@ -456,14 +776,36 @@ int extract_slice_from_param(param_t * matched_param, msg_param_t * msg) {
 	// declarations inside the switch
 	float * dst = (float *)msg->data;
 	float * src = (float *)matched_param->data;
+	// the stripes of the rows that we read (see param_locks.c)
+	stripe_mask_t mask = 0;
 
 	int nbr_subelements = matched_param->shape[2]*matched_param->shape[3];
 
 	switch (msg->dtype_for_client) {
 
 		case DTYPE_FLOAT16:
-			fprintf(stderr, "handler.c - pthread #%lu: Error. The FLOAT16 case for dtype_for_client is not implemented yet.\n", (size_t)pthread_self());
-			return -1;
+
+			/* The parameter is stored as float32, but the client wants float16
+			   to save bandwidth. This is the same as the FLOAT32 case below,
+			   except that we always go through the conversion kernel. */
+			msg->current_data_length_bytes = msg->slice.S[0] * msg->slice.S[1] * nbr_subelements * sizeof(uint16_t);
+			if (msg->max_data_length_bytes < msg->current_data_length_bytes) {
+			 	printf(	"handler.c - pthread #%lu: Error. The MSG_PULL_PARAM announced that it wants to retrieve %d bytes,"
+			 			"but with the current buffers set up, we can at most deal with %d bytes.\n",
+			 			(size_t)pthread_self(),
+			 			msg->current_data_length_bytes,
+			 			msg->max_data_length_bytes);
+			 	return -1;
+			}
+
+			mask = lock_param_slice(matched_param, &msg->slice, false);
+			extract_slice_to_param_float32_to_float16(
+				&msg->slice,
+				src,
+				(uint16_t *)msg->data,
+				nbr_subelements);
+			unlock_param_stripes(matched_param, mask);
+			break;
 			
 		case DTYPE_FLOAT64:
 			fprintf(stderr, "handler.c - pthread #%lu: Error. The FLOAT64 case for dtype_for_client is not implemented (and probably will never be).\n", (size_t)pthread_self());
@@ -485,6 +827,7 @@ int extract_slice_from_param(param_t * matched_param, msg_param_t * msg) {
 			 	return -1;
 			}
 
+			mask = lock_param_slice(matched_param, &msg->slice, false);
 			if ((msg->slice.D[0] == msg->slice.S[0]) && (msg->slice.D[1] == msg->slice.S[1])) {
 
 				/* if we're not REALLY doing slices, then we might as well use memcpy */
@@ -493,12 +836,12 @@ int extract_slice_from_param(param_t * matched_param, msg_param_t * msg) {
 
 				// TODO : add error-checking here
 				extract_slice_to_param_float32_to_float32(
-					matched_param->mutex,
 					&msg->slice,
 					src,
 					dst,
 					nbr_subelements);
 			}
+			unlock_param_stripes(matched_param, mask);
 			break;
 	}
 
@@ -517,14 +860,36 @@ int commit_slice_to_param(param_t * matched_param, msg_param_t * msg) {
 	// declarations inside the switch
 	float * dst = (float *)matched_param->data;
 	float * src = (float *)msg->data;
+	// the stripes of the rows that we write (see param_locks.c)
+	stripe_mask_t mask = 0;
 
 	int nbr_subelements = matched_param->shape[2]*matched_param->shape[3];
 
 	switch (msg->dtype_for_client) {
 
 		case DTYPE_FLOAT16:
-			fprintf(stderr, "handler.c - pthread #%lu: Error. The FLOAT16 case for dtype_for_client is not implemented yet.\n", (size_t)pthread_self());
-			return -1;
+
+			/* Same double-check as in the FLOAT32 case below. */
+			if ( msg->current_data_length_bytes != msg->slice.S[0] * msg->slice.S[1] * nbr_subelements * sizeof(uint16_t)) {
+				fprintf(stderr, "handler.c - pthread #%lu: Error in commit_slice_to_param.\n"
+								"We were told by the client that the float16 slice of parameter %s would take %d bytes.\n"
+								"Instead of that, the server-side calculates that it should take %zu bytes.\n",
+								(size_t)pthread_self(),
+								matched_param->name, msg->current_data_length_bytes,
+								msg->slice.S[0] * msg->slice.S[1] * nbr_subelements * sizeof(uint16_t)	);
+				return -1;
+			}
+
+			/* The parameter stays in float32 on the server. */
+			mask = lock_param_slice(matched_param, &msg->slice, true);
+			commit_slice_to_param_float16_to_float32(
+				&msg->slice,
+				(uint16_t *)msg->data,
+				dst,
+				nbr_subelements,
+				msg->alpha, msg->beta );
+			unlock_param_stripes(matched_param, mask);
+			break;
 			
 		case DTYPE_FLOAT64:
 			fprintf(stderr, "handler.c - pthread #%lu: Error. The FLOAT64 case for dtype_for_client is not implemented (and probably will never be).\n", (size_t)pthread_self());
@@ -547,6 +912,7 @@ int commit_slice_to_param(param_t * matched_param, msg_param_t * msg) {
 			}
 
 
+			mask = lock_param_slice(matched_param, &msg->slice, true);
 			if ((msg->slice.D[0] == msg->slice.S[0]) && (msg->slice.D[1] == msg->slice.S[1]) && (msg->alpha==1.0) && (msg->beta==0.0)) {
 
 				/* if we're not REALLY doing slices, and we have (alpha=1.0, beta=0.0),
@@ -556,7 +922,6 @@ int commit_slice_to_param(param_t * matched_param, msg_param_t * msg) {
 
 				// TODO : add error-checking here
 				commit_slice_to_param_float32_to_float32(
-					matched_param->mutex,
 					&msg->slice,
 					src,
 					dst,
@@ -564,10 +929,123 @@ int commit_slice_to_param(param_t * matched_param, msg_param_t * msg) {
 					msg->alpha, msg->beta );
 
 			}
+			unlock_param_stripes(matched_param, mask);
+			break;
+	}
+
+	bump_param_version(matched_param);
+
+	return 0;
+}
+
+int read_and_respond_MSG_PULL_PARAM_IF_MODIFIED(param_t * global_param_list, msg_param_t * msg, int socket_fd) {
+
+	/* The message is the version that the client has (int64, -1 for none),
+	   followed by the body of a MSG_TYPE_PULL_PARAM.
+
+	   We respond with the current version of the parameter (int64), and then
+	       -1 (int) when it's the version of the client, and nothing else,
+	   or otherwise the usual response of a MSG_TYPE_PULL_PARAM.
+	   When we return -1, the client gets the version -1 and an empty response.
+	*/
+
+	int64_t known_version = 0;
+	if (block_on_recv(socket_fd, (void *)&known_version, sizeof(int64_t)) != sizeof(int64_t)) { return -1; }
+
+	int64_t failed_version = -1;
+	int zero = 0;
+
+	/* Without this check, we would answer with the version of the parameter
+	   and the indices left over from the previous message. */
+	if (read_MSG_PULL_PARAM(msg, socket_fd) == -1) {
+		printf("handler.c - pthread #%lu: Error. Failed to read the slice of a MSG_TYPE_PULL_PARAM_IF_MODIFIED.\n", (size_t)pthread_self());
+		write(socket_fd, (void *)&failed_version, sizeof(int64_t));
+		write(socket_fd, (void *)&zero, sizeof(int));
+		return -1;
+	}
+
+	param_t * matched_param = get_matching_param_entry(global_param_list, msg->name);
+	if (matched_param == NULL) {
+		printf("handler.c - pthread #%lu: Error. You asked for parameter %s but there is no such parameter on the server.\n", (size_t)pthread_self(), msg->name);
+		write(socket_fd, (void *)&failed_version, sizeof(int64_t));
+		write(socket_fd, (void *)&zero, sizeof(int));
+		return -1;
+	}
+
+	// before we read the data, see `read_param_version`
+	int64_t version = read_param_version(matched_param);
+
+	if (version == known_version) {
+		int unchanged = -1;
+		if (write(socket_fd, (void *)&version, sizeof(int64_t)) != sizeof(int64_t)) { return -1; }
+		if (write(socket_fd, (void *)&unchanged, sizeof(int)) != sizeof(int)) { return -1; }
+		return 0;
+	}
+
+	if (extract_slice_from_param(matched_param, msg) == -1) {
+		write(socket_fd, (void *)&failed_version, sizeof(int64_t));
+		write(socket_fd, (void *)&zero, sizeof(int));
+		return -1;
+	}
+
+	if (write(socket_fd, (void *)&version, sizeof(int64_t)) != sizeof(int64_t)) { return -1; }
+	return respond_MSG_PULL_PARAM(msg, socket_fd);
+}
+
+int exchange_slice_with_param(param_t * matched_param, msg_param_t * msg) {
+
+	/* Same checks as `commit_slice_to_param`. The updated slice goes back into `msg->data`,
+	   in the dtype of the client, so `msg` is then ready for `respond_MSG_PULL_PARAM`. */
+
+	if (validate_slice(&msg->slice, matched_param->shape, matched_param->name) == -1) {
+		return -1;
+	}
+
+	int nbr_subelements = matched_param->shape[2]*matched_param->shape[3];
+	int expected_elemsize = 0;
+
+	switch (msg->dtype_for_client) {
+		case DTYPE_FLOAT16:
+			expected_elemsize = sizeof(uint16_t);
 			break;
+		case DTYPE_FLOAT32:
+			expected_elemsize = sizeof(float);
+			break;
+		default:
+			fprintf(stderr, "handler.c - pthread #%lu: Error. MSG_TYPE_EXCHANGE_PARAM doesn't support dtype_for_client %d.\n", (size_t)pthread_self(), msg->dtype_for_client);
+			return -1;
 	}
 
+	if ( msg->current_data_length_bytes != msg->slice.S[0] * msg->slice.S[1] * nbr_subelements * expected_elemsize) {
+		fprintf(stderr, "handler.c - pthread #%lu: Error in exchange_slice_with_param.\n"
+						"We were told by the client that the slice of parameter %s would take %d bytes.\n"
+						"Instead of that, the server-side calculates that it should take %d bytes.\n",
+						(size_t)pthread_self(),
+						matched_param->name, msg->current_data_length_bytes,
+						msg->slice.S[0] * msg->slice.S[1] * nbr_subelements * expected_elemsize);
+		return -1;
+	}
+
+	// the write locks for the commit and the read back, so that nothing gets in between
+	stripe_mask_t mask = lock_param_slice(matched_param, &msg->slice, true);
+	if (msg->dtype_for_client == DTYPE_FLOAT16) {
+		exchange_slice_with_param_float16(
+			&msg->slice,
+			(uint16_t *)msg->data,
+			(float *)matched_param->data,
+			nbr_subelements,
+			msg->alpha, msg->beta );
+	} else {
+		exchange_slice_with_param_float32(
+			&msg->slice,
+			(float *)msg->data,
+			(float *)matched_param->data,
+			nbr_subelements,
+			msg->alpha, msg->beta );
+	}
+	unlock_param_stripes(matched_param, mask);
 
+	bump_param_version(matched_param);
 
 	return 0;
 }
@@ -595,6 +1073,7 @@ void clean_msg_header(msg_header_t * header) {
 
 void clean_msg_param(msg_param_t * msg) {
 	msg->name[0] = '\0';
+	msg->slice.indices_are_validated = false;
 	msg->dtype_for_client = 0;
 	msg->alpha = 1.0;
 	msg->beta = 0.0;
@@ -646,6 +1125,9 @@ int read_MSG_PULL_PARAM(msg_param_t * msg, int socket_fd) {
 	if (block_on_recv(socket_fd, (void *)msg->slice.S, 2*sizeof(int)) != 2*sizeof(int)) { return -1; }
 	if (block_on_recv(socket_fd, (void *)msg->slice.D, 2*sizeof(int)) != 2*sizeof(int)) { return -1; }
 
+	/* The encodings of the indices are packed above the dtype. See common.h. */
+	int index_encodings = msg->dtype_for_client >> 8;
+	msg->dtype_for_client = msg->dtype_for_client & 0xff;
 
 	int elemsize = 0;
 	switch (msg->dtype_for_client) {
@@ -680,20 +1162,380 @@ int read_MSG_PULL_PARAM(msg_param_t * msg, int socket_fd) {
 	// 	return -1;
 	// }
 
+	if ((index_encodings & 0xff) == INDEX_ENCODING_REGISTERED) {
+		return read_registered_slice(msg, socket_fd);
+	}
+
 	/* the goal here isn't to populate the whole msg->slice.indices[0][:],
 	   but only to read as many elements as we have elements waiting
 	*/
-	if (block_on_recv(socket_fd, (void *)msg->slice.indices[0], sizeof(int) * msg->slice.S[0]) != sizeof(int) * msg->slice.S[0]) { return -1; }
-	if (block_on_recv(socket_fd, (void *)msg->slice.indices[1], sizeof(int) * msg->slice.S[1]) != sizeof(int) * msg->slice.S[1]) { return -1; }
+	if (read_slice_indices(&msg->slice, 0, index_encodings & 0xff, socket_fd) != 0) { return -1; }
+	if (read_slice_indices(&msg->slice, 1, (index_encodings >> 8) & 0xff, socket_fd) != 0) { return -1; }
 
 	return 0;
 }
 
+/* Used to read the INDEX_ENCODING_RANGES in chunks instead of one by one. */
+#define RANGES_READ_CHUNK 512
+
+int read_slice_indices(slice_t * slice_ptr, int k, int index_encoding, int socket_fd) {
+
+	/* Fills slice_ptr->indices[k] with the slice_ptr->S[k] indices sent,
+	   whatever the encoding that the client picked. We check the counts here.
+	   The values themselves get checked later by validate_slice.
+	*/
+
+	int S = slice_ptr->S[k];
+	int D = slice_ptr->D[k];
+	int n = 0;
+
+	if (S < 0 || SLICE_MAX_INDEX < S) {
+		printf("handler.c - pthread #%lu: Error. Got a slice with S[%d] = %d, but we support at most %d indices.\n", (size_t)pthread_self(), k, S, SLICE_MAX_INDEX);
+		return -1;
+	}
+
+	switch (index_encoding) {
+	case INDEX_ENCODING_LIST:
+		if (block_on_recv(socket_fd, (void *)slice_ptr->indices[k], sizeof(int) * S) != sizeof(int) * S) { return -1; }
+		break;
+
+	case INDEX_ENCODING_ALL:
+		if (S != D) {
+			printf("handler.c - pthread #%lu: Error. Got INDEX_ENCODING_ALL with S[%d] = %d and D[%d] = %d.\n", (size_t)pthread_self(), k, S, k, D);
+			return -1;
+		}
+		for (int i = 0; i < S; i++) {
+			slice_ptr->indices[k][i] = i;
+		}
+		break;
+
+	case INDEX_ENCODING_BITMASK: {
+		if (D < 0 || SLICE_MAX_INDEX < D) {
+			printf("handler.c - pthread #%lu: Error. Got INDEX_ENCODING_BITMASK with D[%d] = %d, but we support at most %d.\n", (size_t)pthread_self(), k, D, SLICE_MAX_INDEX);
+			return -1;
+		}
+		unsigned char bitmask[SLICE_MAX_INDEX / 8];
+		int nbr_bytes = (D + 7) / 8;
+		if (block_on_recv(socket_fd, (void *)bitmask, nbr_bytes) != nbr_bytes) { return -1; }
+
+		for (int i = 0; i < D; i++) {
+			if (bitmask[i / 8] & (0x80 >> (i % 8))) {
+				if (n == S) {
+					printf("handler.c - pthread #%lu: Error. Got INDEX_ENCODING_BITMASK with more than S[%d] = %d bits set.\n", (size_t)pthread_self(), k, S);
+					return -1;
+				}
+				slice_ptr->indices[k][n++] = i;
+			}
+		}
+		break;
+	}
+
+	case INDEX_ENCODING_RANGES: {
+		int nbr_ranges = 0;
+		if (block_on_recv(socket_fd, (void *)&nbr_ranges, sizeof(int)) != sizeof(int)) { return -1; }
+		if (nbr_ranges < 0 || S < nbr_ranges) {
+			printf("handler.c - pthread #%lu: Error. Got INDEX_ENCODING_RANGES with %d ranges for S[%d] = %d.\n", (size_t)pthread_self(), nbr_ranges, k, S);
+			return -1;
+		}
+
+		int ranges[2 * RANGES_READ_CHUNK];
+		while (0 < nbr_ranges) {
+			int m = (nbr_ranges < RANGES_READ_CHUNK) ? nbr_ranges : RANGES_READ_CHUNK;
+			if (block_on_recv(socket_fd, (void *)ranges, 2 * m * sizeof(int)) != 2 * m * sizeof(int)) { return -1; }
+
+			for (int j = 0; j < m; j++) {
+				int start = ranges[2*j];
+				int stop = ranges[2*j + 1];
+				if (start < 0 || stop < start || S - n < stop - start) {
+					printf("handler.c - pthread #%lu: Error. Got INDEX_ENCODING_RANGES with an invalid range [%d, %d) for S[%d] = %d.\n", (size_t)pthread_self(), start, stop, k, S);
+					return -1;
+				}
+				for (int i = start; i < stop; i++) {
+					slice_ptr->indices[k][n++] = i;
+				}
+			}
+			nbr_ranges -= m;
+		}
+		break;
+	}
+
+	default:
+		printf("handler.c - pthread #%lu: Error. Illegal index encoding : %d.\n", (size_t)pthread_self(), index_encoding);
+		return -1;
+	}
+
+	if ((index_encoding == INDEX_ENCODING_BITMASK || index_encoding == INDEX_ENCODING_RANGES) && n != S) {
+		printf("handler.c - pthread #%lu: Error. Got %d indices but S[%d] = %d.\n", (size_t)pthread_self(), n, k, S);
+		return -1;
+	}
+
+	return 0;
+}
+
+int read_registered_slice(msg_param_t * msg, int socket_fd) {
+
+	/* Instead of the indices, we get (handle, entry) for a split registered
+	   earlier on this connection. We copy its indices into msg->slice so
+	   that everything else works as usual, minus the validation.
+	*/
+
+	int handle_and_entry[2];
+	if (block_on_recv(socket_fd, (void *)handle_and_entry, 2*sizeof(int)) != 2*sizeof(int)) { return -1; }
+	int handle = handle_and_entry[0];
+	int entry = handle_and_entry[1];
+
+	if (handle < 0) {
+		printf("handler.c - pthread #%lu: Error. Got INDEX_ENCODING_REGISTERED with handle %d.\n", (size_t)pthread_self(), handle);
+		return -1;
+	}
+	registered_split_t * split = &msg->split_registry[handle % SPLIT_REGISTRY_SIZE];
+	if (split->entries == NULL || split->handle != handle) {
+		printf("handler.c - pthread #%lu: Error. Got INDEX_ENCODING_REGISTERED with handle %d, which isn't registered (anymore).\n", (size_t)pthread_self(), handle);
+		return -1;
+	}
+	if (entry < 0 || split->nbr_entries <= entry) {
+		printf("handler.c - pthread #%lu: Error. Got INDEX_ENCODING_REGISTERED with entry %d, but handle %d has %d entries.\n", (size_t)pthread_self(), entry, handle, split->nbr_entries);
+		return -1;
+	}
+
+	registered_slice_t * registered = &split->entries[entry];
+	for (int k = 0; k < 2; k++) {
+		if (registered->S[k] != msg->slice.S[k] || registered->D[k] != msg->slice.D[k]) {
+			printf("handler.c - pthread #%lu: Error. The message has (S[%d],D[%d]) = (%d,%d) but entry %d of handle %d has (%d,%d).\n",
+				(size_t)pthread_self(), k, k, msg->slice.S[k], msg->slice.D[k], entry, handle, registered->S[k], registered->D[k]);
+			return -1;
+		}
+		memcpy(msg->slice.indices[k], registered->indices[k], registered->S[k] * sizeof(int));
+	}
+	msg->slice.indices_are_validated = true;
+
+	return 0;
+}
+
+int read_MSG_REGISTER_SPLIT(registered_split_t * split_registry, slice_t * scratch_slice, int * handle, int socket_fd) {
+
+	/* The message is the handle chosen by the client, the number of entries,
+	   and then every entry is encoded like the end of a MSG_TYPE_PULL_PARAM :
+	       index_encodings << 8, S[0], S[1], D[0], D[1], indices
+	   We validate the indices here once and for all, and keep only the space
+	   that they need. The client chooses the handle so that it can register
+	   the same split with the same handle on many connections.
+	*/
+
+	int nbr_entries = 0;
+	if (block_on_recv(socket_fd, (void *)handle, sizeof(int)) != sizeof(int)) { return -1; }
+	if (read_MSG_BATCH_COUNT(&nbr_entries, socket_fd) == -1) { return -1; }
+	if (*handle < 0) {
+		printf("handler.c - pthread #%lu: Error. Got MSG_TYPE_REGISTER_SPLIT with handle %d.\n", (size_t)pthread_self(), *handle);
+		return -1;
+	}
+
+	registered_split_t * split = &split_registry[*handle % SPLIT_REGISTRY_SIZE];
+	free_registered_split(split);
+	split->handle = *handle;
+	split->nbr_entries = nbr_entries;
+	split->entries = (registered_slice_t *)calloc(nbr_entries + 1, sizeof(registered_slice_t));
+	if (split->entries == NULL) { return -1; }
+
+	for (int e = 0; e < nbr_entries; e++) {
+		registered_slice_t * registered = &split->entries[e];
+		int index_encodings = 0;
+
+		if (block_on_recv(socket_fd, (void *)&index_encodings, sizeof(int)) != sizeof(int)) { return -1; }
+		if (block_on_recv(socket_fd, (void *)scratch_slice->S, 2*sizeof(int)) != 2*sizeof(int)) { return -1; }
+		if (block_on_recv(socket_fd, (void *)scratch_slice->D, 2*sizeof(int)) != 2*sizeof(int)) { return -1; }
+		index_encodings = index_encodings >> 8;
+
+		for (int k = 0; k < 2; k++) {
+			int encoding = (index_encodings >> (8*k)) & 0xff;
+			if (encoding == INDEX_ENCODING_REGISTERED) {
+				printf("handler.c - pthread #%lu: Error. A registered split can't refer to another one.\n", (size_t)pthread_self());
+				return -1;
+			}
+			if (read_slice_indices(scratch_slice, k, encoding, socket_fd) != 0) { return -1; }
+			if (scratch_slice->D[k] < scratch_slice->S[k]) {
+				printf("handler.c - pthread #%lu: Error. Entry %d of the split has S[%d]:%d larger than D[%d]:%d.\n", (size_t)pthread_self(), e, k, scratch_slice->S[k], k, scratch_slice->D[k]);
+				return -1;
+			}
+			if (validate_slice_indices(scratch_slice->indices[k], scratch_slice->S[k], scratch_slice->D[k], k, "(registered split)") == -1) { return -1; }
+
+			registered->S[k] = scratch_slice->S[k];
+			registered->D[k] = scratch_slice->D[k];
+			// one more int so that we never malloc 0 bytes
+			registered->indices[k] = (int *)malloc((scratch_slice->S[k] + 1) * sizeof(int));
+			if (registered->indices[k] == NULL) { return -1; }
+			memcpy(registered->indices[k], scratch_slice->indices[k], scratch_slice->S[k] * sizeof(int));
+		}
+	}
+
+	return 0;
+}
+
+int read_MSG_REGISTER_SEEDED_SPLIT(param_t * global_param_list, registered_split_t * split_registry, int * handle, int socket_fd) {
+
+	/* The message is the handle chosen by the client, a 64-bit seed,
+	   the number of layers, and then for every layer
+	       layer_number (int), p_in (double), p_out (double)
+	   with no padding. The split registered has one entry for every
+	   parameter, in the order of `global_param_list`.
+	*/
+
+	uint64_t seed = 0;
+	int nbr_pairs = 0;
+	if (block_on_recv(socket_fd, (void *)handle, sizeof(int)) != sizeof(int)) { return -1; }
+	if (block_on_recv(socket_fd, (void *)&seed, sizeof(uint64_t)) != sizeof(uint64_t)) { return -1; }
+	if (read_MSG_BATCH_COUNT(&nbr_pairs, socket_fd) == -1) { return -1; }
+	if (*handle < 0) {
+		printf("handler.c - pthread #%lu: Error. Got MSG_TYPE_REGISTER_SEEDED_SPLIT with handle %d.\n", (size_t)pthread_self(), *handle);
+		return -1;
+	}
+
+	seeded_prob_pair_t * pairs = (seeded_prob_pair_t *)calloc(nbr_pairs + 1, sizeof(seeded_prob_pair_t));
+	if (pairs == NULL) { return -1; }
+	for (int i = 0; i < nbr_pairs; i++) {
+		if (block_on_recv(socket_fd, (void *)&pairs[i].layer_number, sizeof(int)) != sizeof(int) ||
+			block_on_recv(socket_fd, (void *)pairs[i].p, 2*sizeof(double)) != 2*sizeof(double)) {
+			free(pairs);
+			return -1;
+		}
+	}
+
+	registered_split_t * split = &split_registry[*handle % SPLIT_REGISTRY_SIZE];
+	free_registered_split(split);
+	split->handle = *handle;
+	int status = generate_seeded_split(global_param_list, seed, pairs, nbr_pairs, split);
+	free(pairs);
+
+	return status;
+}
+
+int read_MSG_INIT_PARAM(param_t * global_param_list, int socket_fd) {
+
+	/* The message is the name of the parameter, and then
+	       distribution (int), seed (uint64), scale (double)
+	   with no padding. See seeded_init.c for the distributions.
+	*/
+
+	char name[PARAM_NAME_LENGTH];
+	int distribution = 0;
+	uint64_t seed = 0;
+	double scale = 0.0;
+	if (block_on_recv(socket_fd, (void *)name, PARAM_NAME_LENGTH) != PARAM_NAME_LENGTH) { return -1; }
+	if (block_on_recv(socket_fd, (void *)&distribution, sizeof(int)) != sizeof(int)) { return -1; }
+	if (block_on_recv(socket_fd, (void *)&seed, sizeof(uint64_t)) != sizeof(uint64_t)) { return -1; }
+	if (block_on_recv(socket_fd, (void *)&scale, sizeof(double)) != sizeof(double)) { return -1; }
+	name[PARAM_NAME_LENGTH - 1] = '\0';
+
+	param_t * matched_param = get_matching_param_entry(global_param_list, name);
+	if (matched_param == NULL) {
+		printf("handler.c - pthread #%lu: Error. Got MSG_TYPE_INIT_PARAM for parameter %s but there is no such parameter on the server.\n", (size_t)pthread_self(), name);
+		return -1;
+	}
+
+	return init_param_seeded(matched_param, distribution, scale, seed);
+}
+
+void free_registered_split(registered_split_t * split) {
+	if (split->entries != NULL) {
+		for (int e = 0; e < split->nbr_entries; e++) {
+			// those are NULL when we failed halfway through reading them
+			free(split->entries[e].indices[0]);
+			free(split->entries[e].indices[1]);
+		}
+		free(split->entries);
+	}
+	split->entries = NULL;
+	split->nbr_entries = 0;
+	split->handle = -1;
+}
+
+void clear_split_registry(registered_split_t * split_registry) {
+	for (int i = 0; i < SPLIT_REGISTRY_SIZE; i++) {
+		free_registered_split(&split_registry[i]);
+	}
+}
+
+int respond_MSG_PARAM_DIGEST(param_t * global_param_list, int socket_fd) {
+
+	/* The message is the number of names, and then the names.
+	   We respond with one record of PARAM_DIGEST_RECORD_LENGTH bytes for every name,
+	   all in one write. The names that we don't have get a status of -1
+	   in their record, and that's not a reason to close the connection.
+	*/
+
+	int nbr_names = 0;
+	if (read_MSG_BATCH_COUNT(&nbr_names, socket_fd) == -1) { return -1; }
+
+	char * response = malloc(PARAM_DIGEST_RECORD_LENGTH * (size_t)nbr_names + 1);
+	if (response == NULL) {
+		printf("handler.c - pthread #%lu: Error. Failed to allocate the digests of %d parameters.\n", (size_t)pthread_self(), nbr_names);
+		return -1;
+	}
+
+	char name[PARAM_NAME_LENGTH];
+	param_digest_t digest;
+	for (int n = 0; n < nbr_names; n++) {
+		if (block_on_recv(socket_fd, (void *)name, PARAM_NAME_LENGTH) != PARAM_NAME_LENGTH) { free(response); return -1; }
+		name[PARAM_NAME_LENGTH - 1] = '\0';
+
+		param_t * matched_param = get_matching_param_entry(global_param_list, name);
+		if (matched_param == NULL || compute_param_digest(matched_param, &digest) == -1) {
+			memset(&digest, 0, sizeof(param_digest_t));
+			digest.status = -1;
+		}
+		encode_param_digest_record(&digest, response + n * PARAM_DIGEST_RECORD_LENGTH);
+	}
+
+	int response_length = PARAM_DIGEST_RECORD_LENGTH * nbr_names;
+	int status = 0;
+	if (write(socket_fd, (void *)response, response_length) != response_length) { status = -1; }
+	free(response);
+	return status;
+}
+
+int respond_MSG_PARAM_LOCK_STATS(param_t * global_param_list, int socket_fd) {
+
+	/* Same as MSG_TYPE_PARAM_DIGEST, but with records of PARAM_LOCK_STATS_RECORD_LENGTH bytes
+	   that have the counters of `read_param_lock_stats`.
+	*/
+
+	int nbr_names = 0;
+	if (read_MSG_BATCH_COUNT(&nbr_names, socket_fd) == -1) { return -1; }
+
+	char * response = malloc(PARAM_LOCK_STATS_RECORD_LENGTH * (size_t)nbr_names + 1);
+	if (response == NULL) {
+		printf("handler.c - pthread #%lu: Error. Failed to allocate the lock stats of %d parameters.\n", (size_t)pthread_self(), nbr_names);
+		return -1;
+	}
+
+	char name[PARAM_NAME_LENGTH];
+	param_lock_stats_t stats;
+	for (int n = 0; n < nbr_names; n++) {
+		if (block_on_recv(socket_fd, (void *)name, PARAM_NAME_LENGTH) != PARAM_NAME_LENGTH) { free(response); return -1; }
+		name[PARAM_NAME_LENGTH - 1] = '\0';
+
+		param_t * matched_param = get_matching_param_entry(global_param_list, name);
+		if (matched_param == NULL) {
+			memset(&stats, 0, sizeof(param_lock_stats_t));
+			stats.status = -1;
+		} else {
+			read_param_lock_stats(matched_param, &stats);
+		}
+		encode_param_lock_stats_record(&stats, response + n * PARAM_LOCK_STATS_RECORD_LENGTH);
+	}
+
+	int response_length = PARAM_LOCK_STATS_RECORD_LENGTH * nbr_names;
+	int status = 0;
+	if (write(socket_fd, (void *)response, response_length) != response_length) { status = -1; }
+	free(response);
+	return status;
+}
+
 int read_MSG_PUSH_PARAM(msg_param_t * msg, int socket_fd) {
 
 	// Both methods start the same, so we might as well reuse the code.
 	// Be careful about adding more stuff to read_MSG_PULL_PARAM, now.
-	read_MSG_PULL_PARAM(msg, socket_fd);
+	if (read_MSG_PULL_PARAM(msg, socket_fd) != 0) { return -1; }
 
 	if (block_on_recv(socket_fd, (void *)&(msg->alpha), sizeof(float)) != sizeof(float)) { return -1; }
 	if (block_on_recv(socket_fd, (void *)&(msg->beta),  sizeof(float)) != sizeof(float)) { return -1; }
@@ -721,6 +1563,22 @@ int read_MSG_PUSH_PARAM(msg_param_t * msg, int socket_fd) {
 	return 0;
 }
 
+int read_MSG_BATCH_COUNT(int * nbr_entries, int socket_fd) {
+
+	/* The batched messages start with the number of entries that follow.
+	   Every entry is then read exactly like a MSG_TYPE_PULL_PARAM
+	   (or a MSG_TYPE_PUSH_PARAM) body.
+	*/
+	if (block_on_recv(socket_fd, (void *)nbr_entries, sizeof(int)) != sizeof(int)) { return -1; }
+
+	if (*nbr_entries < 0) {
+		printf("handler.c - pthread #%lu: Error. Got a batch message announcing %d entries.\n", (size_t)pthread_self(), *nbr_entries);
+		return -1;
+	}
+
+	return 0;
+}
+
 int respond_MSG_PULL_PARAM(msg_param_t * msg, int socket_fd) {
 
 	/*  We would keep the header the same and resend it,
@@ -1,11 +1,25 @@
 int extract_slice_from_param(param_t * matched_param, msg_param_t * msg);		
 int commit_slice_to_param(param_t * matched_param, msg_param_t * msg);
+int exchange_slice_with_param(param_t * matched_param, msg_param_t * msg);
 param_t * get_matching_param_entry(param_t * global_param_list, char * name);
 
 int read_MSG_HEADER(msg_header_t * header, int socket_fd);
 int read_MSG_PULL_PARAM(msg_param_t * msg, int socket_fd);
 int read_MSG_PUSH_PARAM(msg_param_t * msg, int socket_fd);
+int read_slice_indices(slice_t * slice_ptr, int k, int index_encoding, int socket_fd);
+int read_registered_slice(msg_param_t * msg, int socket_fd);
+int read_MSG_REGISTER_SPLIT(registered_split_t * split_registry, slice_t * scratch_slice, int * handle, int socket_fd);
+int read_MSG_REGISTER_SEEDED_SPLIT(param_t * global_param_list, registered_split_t * split_registry, int * handle, int socket_fd);
+int read_MSG_INIT_PARAM(param_t * global_param_list, int socket_fd);
+int respond_MSG_PARAM_DIGEST(param_t * global_param_list, int socket_fd);
+int respond_MSG_PARAM_LOCK_STATS(param_t * global_param_list, int socket_fd);
+int read_and_respond_MSG_PULL_PARAM_IF_MODIFIED(param_t * global_param_list, msg_param_t * msg, int socket_fd);
+void free_registered_split(registered_split_t * split);
+void clear_split_registry(registered_split_t * split_registry);
+int validate_slice(slice_t * slice_ptr, int shape[4], char * name);
+int validate_slice_indices(int * indices, int S, int D, int k, char * name);
 int respond_MSG_PULL_PARAM(msg_param_t * msg, int socket_fd);
+int read_MSG_BATCH_COUNT(int * nbr_entries, int socket_fd);
 int respond_MSG_LIST_ALL_PARAMS_DESC(param_t * global_param_list, int socket_fd);
 int block_on_recv(int socket_fd, void * buffer, int len);
 int read_MSG_TYPE_LOAD_ALL_FROM_HDF5(param_t ** global_param_list, int socket_fd);
@@ -20,6 +34,7 @@ None of those methods have to be shared with the outside world.
 
 int extract_slice_from_param(param_t * matched_param, msg_param_t * msg);		
 int commit_slice_to_param(param_t * matched_param, msg_param_t * msg);
+int exchange_slice_with_param(param_t * matched_param, msg_param_t * msg);
 param_t * get_matching_param_entry(param_t * global_param_list, char * name);
 
 int read_MSG_HEADER(msg_header_t * header, int socket_fd);
@@ -0,0 +1,77 @@
+
+#include <string.h>
+#include <stdlib.h>
+#include <stdio.h>
+#include <stdint.h>
+#include <math.h>
+
+#include "common.h"
+#include "param_digest.h"
+#include "param_locks.h"
+
+/* The digest of a parameter for MSG_TYPE_PARAM_DIGEST, so that the clients
+   can check what they pushed without pulling it back.
+   See `compute_param_digest` in distdrop/client/param_digest.py, which does the same thing.
+
+   The md5 is computed on the bytes of the float32 values, which are little-endian
+   on all the machines that we run on. The sum is accumulated in double, one value
+   after the other, so it can differ in the last bits from the one of numpy.
+*/
+
+int compute_param_digest(param_t * param, param_digest_t * digest) {
+
+	memset(digest, 0, sizeof(param_digest_t));
+
+	int nbr_elements = param->shape[0] * param->shape[1] * param->shape[2] * param->shape[3];
+	float * data = (float *)param->data;
+
+	GChecksum * checksum = g_checksum_new(G_CHECKSUM_MD5);
+	if (checksum == NULL) {
+		return -1;
+	}
+
+	double sum = 0.0;
+	float min = NAN;
+	float max = NAN;
+	int64_t nbr_nan = 0;
+
+	// We hold the read locks of all the rows while we read everything so that the md5
+	// and the statistics all describe the same values.
+	stripe_mask_t mask = lock_param_all(param, false);
+	g_checksum_update(checksum, (const guchar *)data, (gssize)nbr_elements * sizeof(float));
+	for (int i = 0; i < nbr_elements; i++) {
+		float x = data[i];
+		if (isnan(x)) {
+			nbr_nan++;
+			continue;
+		}
+		sum += x;
+		// the first value that is not NaN replaces the NaN of min and max
+		if (!(min <= x)) { min = x; }
+		if (!(x <= max)) { max = x; }
+	}
+	unlock_param_stripes(param, mask);
+
+	gsize digest_length = 16;
+	g_checksum_get_digest(checksum, digest->md5, &digest_length);
+	g_checksum_free(checksum);
+
+	digest->status = 0;
+	digest->sum = sum;
+	digest->min = min;
+	digest->max = max;
+	digest->nbr_nan = nbr_nan;
+	digest->nbr_elements = nbr_elements;
+	return 0;
+}
+
+// Writes PARAM_DIGEST_RECORD_LENGTH bytes to `dst`, without the padding of the struct.
+void encode_param_digest_record(param_digest_t * digest, char * dst) {
+	memcpy(dst, &digest->status, sizeof(int));                 dst += sizeof(int);
+	memcpy(dst, digest->md5, 16);                              dst += 16;
+	memcpy(dst, &digest->sum, sizeof(double));                 dst += sizeof(double);
+	memcpy(dst, &digest->min, sizeof(float));                  dst += sizeof(float);
+	memcpy(dst, &digest->max, sizeof(float));                  dst += sizeof(float);
+	memcpy(dst, &digest->nbr_nan, sizeof(int64_t));            dst += sizeof(int64_t);
+	memcpy(dst, &digest->nbr_elements, sizeof(int64_t));
+}
@@ -0,0 +1,23 @@
+#ifndef __PARAM_DIGEST_H__
+#define __PARAM_DIGEST_H__
+
+#include <stdint.h>
+#include "common.h"
+
+/* What MSG_TYPE_PARAM_DIGEST sends back for every parameter, in that order with no padding.
+   See distdrop/client/param_digest.py. */
+typedef struct _param_digest_t {
+	int status;               /* 0, or -1 when there is no such parameter (and the rest is zeros) */
+	unsigned char md5[16];    /* of the float32 values, as they are in memory */
+	double sum;               /* of the values that are not NaN */
+	float min, max;           /* of the values that are not NaN, or NaN when they all are */
+	int64_t nbr_nan;
+	int64_t nbr_elements;
+} param_digest_t;
+
+#define PARAM_DIGEST_RECORD_LENGTH (sizeof(int) + 16 + sizeof(double) + 2*sizeof(float) + 2*sizeof(int64_t))
+
+int compute_param_digest(param_t * param, param_digest_t * digest);
+void encode_param_digest_record(param_digest_t * digest, char * dst);
+
+#endif
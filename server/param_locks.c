@@ -0,0 +1,180 @@
+
+#include <string.h>
+#include <errno.h>
+#include <time.h>
+
+#include "common.h"
+#include "param_locks.h"
+
+/* The locks of a parameter.
+
+   With one lock per parameter, every pull and every push of that parameter would
+   wait for all the others. With dropout, the workers mostly touch different rows, so we cut
+   the rows (the first dimension of the shape) into stripes of `rows_per_stripe`
+   consecutive rows, each with a reader/writer lock.
+
+   A pull takes the read lock of every stripe that has one of its rows,
+   and a push (or an exchange) takes their write lock. To avoid deadlocks,
+   the stripes are always locked in increasing order. Anything that reads or writes
+   all the values (the digests, the seeded initialization, the hdf5 files)
+   takes all the stripes, in that same order.
+
+   We try the lock first, and only when someone else has it do we look at the clock
+   and count a wait, so the counters cost nothing when there is no contention.
+   They are sent to the clients with MSG_TYPE_PARAM_LOCK_STATS.
+*/
+
+void init_param_locks(param_t * param) {
+
+	param_locks_t * locks = &param->locks;
+	memset(locks, 0, sizeof(param_locks_t));
+
+	int nbr_rows = 1 <= param->shape[0] ? param->shape[0] : 1;
+	int nbr_stripes = nbr_rows < PARAM_LOCK_MAX_STRIPES ? nbr_rows : PARAM_LOCK_MAX_STRIPES;
+	locks->rows_per_stripe = (nbr_rows + nbr_stripes - 1) / nbr_stripes;
+	// after rounding up the rows per stripe, we might not need all of them
+	locks->nbr_stripes = (nbr_rows + locks->rows_per_stripe - 1) / locks->rows_per_stripe;
+
+	pthread_rwlockattr_t attr;
+	pthread_rwlockattr_init(&attr);
+#ifdef __GLIBC__
+	/* By default, glibc lets the readers in as long as there are readers,
+	   so a steady stream of pulls would keep the pushes waiting forever. */
+	pthread_rwlockattr_setkind_np(&attr, PTHREAD_RWLOCK_PREFER_WRITER_NONRECURSIVE_NP);
+#endif
+	for (int s = 0; s < locks->nbr_stripes; s++) {
+		pthread_rwlock_init(&locks->stripes[s], &attr);
+	}
+	pthread_rwlockattr_destroy(&attr);
+}
+
+void destroy_param_locks(param_t * param) {
+	for (int s = 0; s < param->locks.nbr_stripes; s++) {
+		pthread_rwlock_destroy(&param->locks.stripes[s]);
+	}
+	param->locks.nbr_stripes = 0;
+}
+
+stripe_mask_t get_slice_stripe_mask(param_t * param, slice_t * slice_ptr) {
+
+	// The indices have been validated, so they are all in [0, shape[0]).
+	if (slice_ptr->S[0] == slice_ptr->D[0]) {
+		return get_all_stripes_mask(param);
+	}
+
+	stripe_mask_t mask = 0;
+	int rows_per_stripe = param->locks.rows_per_stripe;
+	for (int i = 0; i < slice_ptr->S[0]; i++) {
+		mask |= ((stripe_mask_t)1) << (slice_ptr->indices[0][i] / rows_per_stripe);
+	}
+	return mask;
+}
+
+stripe_mask_t get_all_stripes_mask(param_t * param) {
+	int nbr_stripes = param->locks.nbr_stripes;
+	if (64 <= nbr_stripes) {
+		return ~((stripe_mask_t)0);
+	}
+	return (((stripe_mask_t)1) << nbr_stripes) - 1;
+}
+
+static int64_t elapsed_ns(struct timespec * start, struct timespec * stop) {
+	return ((int64_t)(stop->tv_sec - start->tv_sec)) * 1000000000 + (stop->tv_nsec - start->tv_nsec);
+}
+
+void lock_param_stripes(param_t * param, stripe_mask_t mask, bool want_write) {
+
+	param_locks_t * locks = &param->locks;
+	int64_t nbr_locks = 0;
+	int64_t nbr_waits = 0;
+	int64_t wait_ns = 0;
+
+	for (int s = 0; s < locks->nbr_stripes; s++) {
+		if (!(mask & (((stripe_mask_t)1) << s))) {
+			continue;
+		}
+		pthread_rwlock_t * stripe = &locks->stripes[s];
+		nbr_locks++;
+
+		int status = want_write ? pthread_rwlock_trywrlock(stripe) : pthread_rwlock_tryrdlock(stripe);
+		if (status == 0) {
+			continue;
+		}
+
+		struct timespec start, stop;
+		clock_gettime(CLOCK_MONOTONIC, &start);
+		if (want_write) {
+			pthread_rwlock_wrlock(stripe);
+		} else {
+			pthread_rwlock_rdlock(stripe);
+		}
+		clock_gettime(CLOCK_MONOTONIC, &stop);
+		nbr_waits++;
+		wait_ns += elapsed_ns(&start, &stop);
+	}
+
+	if (want_write) {
+		__sync_fetch_and_add(&locks->nbr_write_locks, nbr_locks);
+		if (0 < nbr_waits) {
+			__sync_fetch_and_add(&locks->nbr_write_waits, nbr_waits);
+			__sync_fetch_and_add(&locks->write_wait_ns, wait_ns);
+		}
+	} else {
+		__sync_fetch_and_add(&locks->nbr_read_locks, nbr_locks);
+		if (0 < nbr_waits) {
+			__sync_fetch_and_add(&locks->nbr_read_waits, nbr_waits);
+			__sync_fetch_and_add(&locks->read_wait_ns, wait_ns);
+		}
+	}
+}
+
+void unlock_param_stripes(param_t * param, stripe_mask_t mask) {
+	for (int s = 0; s < param->locks.nbr_stripes; s++) {
+		if (mask & (((stripe_mask_t)1) << s)) {
+			pthread_rwlock_unlock(&param->locks.stripes[s]);
+		}
+	}
+}
+
+/* Locks the stripes of the rows of the slice, and returns them
+   for `unlock_param_stripes`. */
+stripe_mask_t lock_param_slice(param_t * param, slice_t * slice_ptr, bool want_write) {
+	stripe_mask_t mask = get_slice_stripe_mask(param, slice_ptr);
+	lock_param_stripes(param, mask, want_write);
+	return mask;
+}
+
+stripe_mask_t lock_param_all(param_t * param, bool want_write) {
+	stripe_mask_t mask = get_all_stripes_mask(param);
+	lock_param_stripes(param, mask, want_write);
+	return mask;
+}
+
+void read_param_lock_stats(param_t * param, param_lock_stats_t * stats) {
+	// The counters are read one after the other, so they can be a little
+	// out of step with each other under load, but each one is exact.
+	param_locks_t * locks = &param->locks;
+	memset(stats, 0, sizeof(param_lock_stats_t));
+	stats->status = 0;
+	stats->nbr_stripes = locks->nbr_stripes;
+	stats->rows_per_stripe = locks->rows_per_stripe;
+	stats->nbr_read_locks = __sync_fetch_and_add(&locks->nbr_read_locks, 0);
+	stats->nbr_read_waits = __sync_fetch_and_add(&locks->nbr_read_waits, 0);
+	stats->read_wait_ns = __sync_fetch_and_add(&locks->read_wait_ns, 0);
+	stats->nbr_write_locks = __sync_fetch_and_add(&locks->nbr_write_locks, 0);
+	stats->nbr_write_waits = __sync_fetch_and_add(&locks->nbr_write_waits, 0);
+	stats->write_wait_ns = __sync_fetch_and_add(&locks->write_wait_ns, 0);
+}
+
+// Writes PARAM_LOCK_STATS_RECORD_LENGTH bytes to `dst`, without the padding of the struct.
+void encode_param_lock_stats_record(param_lock_stats_t * stats, char * dst) {
+	memcpy(dst, &stats->status, sizeof(int));                  dst += sizeof(int);
+	memcpy(dst, &stats->nbr_stripes, sizeof(int));             dst += sizeof(int);
+	memcpy(dst, &stats->rows_per_stripe, sizeof(int));         dst += sizeof(int);
+	memcpy(dst, &stats->nbr_read_locks, sizeof(int64_t));      dst += sizeof(int64_t);
+	memcpy(dst, &stats->nbr_read_waits, sizeof(int64_t));      dst += sizeof(int64_t);
+	memcpy(dst, &stats->read_wait_ns, sizeof(int64_t));        dst += sizeof(int64_t);
+	memcpy(dst, &stats->nbr_write_locks, sizeof(int64_t));     dst += sizeof(int64_t);
+	memcpy(dst, &stats->nbr_write_waits, sizeof(int64_t));     dst += sizeof(int64_t);
+	memcpy(dst, &stats->write_wait_ns, sizeof(int64_t));
+}
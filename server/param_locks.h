@@ -0,0 +1,42 @@
+#ifndef __PARAM_LOCKS_H__
+#define __PARAM_LOCKS_H__
+
+#include <stdint.h>
+#include <stdbool.h>
+#include "common.h"
+
+/* What MSG_TYPE_PARAM_LOCK_STATS sends back for every parameter, in that order with no padding.
+   See `ParamLocks` in distdrop/server/params.py. */
+typedef struct _param_lock_stats_t {
+	int status;               /* 0, or -1 when there is no such parameter (and the rest is zeros) */
+	int nbr_stripes;
+	int rows_per_stripe;
+	int64_t nbr_read_locks, nbr_read_waits, read_wait_ns;
+	int64_t nbr_write_locks, nbr_write_waits, write_wait_ns;
+} param_lock_stats_t;
+
+#define PARAM_LOCK_STATS_RECORD_LENGTH (3*sizeof(int) + 6*sizeof(int64_t))
+
+/* One bit for every stripe, with stripe 0 as the least significant bit. */
+typedef uint64_t stripe_mask_t;
+
+#if PARAM_LOCK_MAX_STRIPES > 64
+#error "PARAM_LOCK_MAX_STRIPES has to fit in the bits of stripe_mask_t."
+#endif
+
+void init_param_locks(param_t * param);
+void destroy_param_locks(param_t * param);
+
+stripe_mask_t get_slice_stripe_mask(param_t * param, slice_t * slice_ptr);
+stripe_mask_t get_all_stripes_mask(param_t * param);
+
+void lock_param_stripes(param_t * param, stripe_mask_t mask, bool want_write);
+void unlock_param_stripes(param_t * param, stripe_mask_t mask);
+
+stripe_mask_t lock_param_slice(param_t * param, slice_t * slice_ptr, bool want_write);
+stripe_mask_t lock_param_all(param_t * param, bool want_write);
+
+void read_param_lock_stats(param_t * param, param_lock_stats_t * stats);
+void encode_param_lock_stats_record(param_lock_stats_t * stats, char * dst);
+
+#endif
@@ -4,6 +4,7 @@
 
 #include "params.h"
 #include "common.h"
+#include "param_locks.h"
 #include "template_commit_slice_to_parameter.c"
 
 
@@ -11,6 +12,38 @@ param_t * new_param_from_json_t(json_t * e);
 param_t * new_param_float32(char * name, int shape[4], int kind);
 
 
+/* The versions of all the parameters come from this one counter, so a parameter
+   never gets a version that it had before, even when we load all the parameters
+   again (which creates new ones). The clients can then cache a slice with its
+   version and ask for it again only if the version changed
+   (MSG_TYPE_PULL_PARAM_IF_MODIFIED).
+
+   The writers bump the version after they are done with the data,
+   and the readers read the version before they start with the data.
+   Whatever happens in between, the version that a client gets is never newer
+   than the data that it gets, so the worst that can happen is that it
+   pulls the same thing twice.
+*/
+static int64_t global_param_version = 0;
+
+int64_t next_param_version(void) {
+	return __sync_add_and_fetch(&global_param_version, 1);
+}
+
+void bump_param_version(param_t * p) {
+	// the writes to the data happen before this
+	__sync_synchronize();
+	p->version = next_param_version();
+}
+
+int64_t read_param_version(param_t * p) {
+	int64_t version = p->version;
+	// the reads of the data happen after this
+	__sync_synchronize();
+	return version;
+}
+
+
 int param_kind_str_to_kind_int(const char * kind_str) {
 	if (strcmp(kind_str, "FULLY_CONNECTED_WEIGHTS") == 0) { return FULLY_CONNECTED_WEIGHTS; }
 	if (strcmp(kind_str, "FULLY_CONNECTED_BIASES") == 0) { return FULLY_CONNECTED_BIASES; }
@@ -222,12 +255,12 @@ param_t * new_param_float32(char * name, int shape[4], int kind) {
 	p0->shape[2] = shape[2];
 	p0->shape[3] = shape[3];
 	p0->kind = kind;
-	//p0->mutex = PTHREAD_MUTEX_INITIALIZER;
-	pthread_mutex_init(&p0->mutex, NULL);
+	init_param_locks(p0);
 	p0->data_length_bytes = p0->shape[0] * p0->shape[1] * p0->shape[2] * p0->shape[3] * sizeof(float);
 	p0->data = malloc(p0->data_length_bytes);
 	memset(p0->data, 0, p0->data_length_bytes);
 	p0->dtype = DTYPE_FLOAT32;
+	p0->version = next_param_version();
 	p0->next = NULL;
 
 	for (size_t i = 0u, e = shape[0] * shape[1] * shape[2] * shape[3]; i < e; ++i) {
@@ -240,7 +273,7 @@ param_t * new_param_float32(char * name, int shape[4], int kind) {
 void free_param(param_t * p) {
 	g_free(p->data);
 	p->data = NULL;
-	// TODO : anything required to clean up the mutex ?
+	destroy_param_locks(p);
 }
 
 json_t * encode_param_to_json_t(param_t * p) {
@@ -292,12 +325,12 @@ param_t * make_test_param_list()
 	p0->shape[2] = 7;
 	p0->shape[3] = 7;
 	p0->kind = CONV_FILTER_WEIGHTS;
-	//p0->mutex = PTHREAD_MUTEX_INITIALIZER;
-	pthread_mutex_init(&p0->mutex, NULL);
+	init_param_locks(p0);
 	p0->data_length_bytes = p0->shape[0] * p0->shape[1] * p0->shape[2] * p0->shape[3] * sizeof(float);
 	p0->data = malloc(p0->data_length_bytes);
 	memset(p0->data, 0, p0->data_length_bytes);
 	p0->dtype = DTYPE_FLOAT32;
+	p0->version = next_param_version();
 	p0->next = NULL;
 
 	/* populate with something more fun */
@@ -313,12 +346,12 @@ param_t * make_test_param_list()
 	p1->shape[2] = 7;
 	p1->shape[3] = 7;
 	p1->kind = CONV_FILTER_BIASES;
-	//p0->mutex = PTHREAD_MUTEX_INITIALIZER;	
-	pthread_mutex_init(&p1->mutex, NULL);
+	init_param_locks(p1);
 	p1->data_length_bytes = p1->shape[0] * p1->shape[1] * p1->shape[2] * p1->shape[3] * sizeof(float);
 	p1->data = malloc(p1->data_length_bytes);
 	memset(p1->data, 0, p1->data_length_bytes);
 	p1->dtype = DTYPE_FLOAT32;
+	p1->version = next_param_version();
 	p1->next = NULL;
 
 	/* populate with something more fun */
@@ -3,6 +3,7 @@
 #define __PARAMS_H__
 
 #include "common.h"
+#include <stdint.h>
 #include <jansson.h>
 
 int param_kind_str_to_kind_int(const char * kind_str);
@@ -14,9 +15,12 @@ param_t * read_params_from_json_file(const char * filename);
 
 void free_param(param_t * p);
 
+int64_t next_param_version(void);
+void bump_param_version(param_t * p);
+int64_t read_param_version(param_t * p);
+
 
 int commit_slice_to_param_float32_to_float32(
-	pthread_mutex_t mutex,
 	slice_t * slice_ptr,
 	float * src,
 	float * dst,
@@ -24,12 +28,38 @@ int commit_slice_to_param_float32_to_float32(
 	float alpha, float beta );
 
 int extract_slice_to_param_float32_to_float32(
-	pthread_mutex_t mutex,
 	slice_t * slice_ptr,
 	float * src,
 	float * dst,
 	int nbr_subelements);
 
+int commit_slice_to_param_float16_to_float32(
+	slice_t * slice_ptr,
+	uint16_t * src,
+	float * dst,
+	int nbr_subelements,
+	float alpha, float beta );
+
+int extract_slice_to_param_float32_to_float16(
+	slice_t * slice_ptr,
+	float * src,
+	uint16_t * dst,
+	int nbr_subelements);
+
+int exchange_slice_with_param_float32(
+	slice_t * slice_ptr,
+	float * values,
+	float * param_data,
+	int nbr_subelements,
+	float alpha, float beta );
+
+int exchange_slice_with_param_float16(
+	slice_t * slice_ptr,
+	uint16_t * values,
+	float * param_data,
+	int nbr_subelements,
+	float alpha, float beta );
+
 param_t * make_test_param_list();
 
 #endif
\ No newline at end of file
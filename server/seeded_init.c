@@ -0,0 +1,96 @@
+
+#include <string.h>
+#include <stdlib.h>
+#include <stdio.h>
+#include <stdint.h>
+#include <math.h>
+
+#include "common.h"
+#include "seeded_split.h"
+#include "seeded_init.h"
+#include "params.h"
+#include "param_locks.h"
+
+/* Fills a parameter with random values generated from a seed, for MSG_TYPE_INIT_PARAM.
+   See `sample_seeded_init_values` in distdrop/client/seeded_init.py, which does the same thing.
+
+   With the same splitmix64 as the seeded splits, every element i of the
+   flattened parameter gets
+       x(j) = splitmix64(stream + (j+1)*SPLITMIX64_GAMMA) with stream = splitmix64(seed + SPLITMIX64_GAMMA)
+       u(j) = (x(j) >> 11) * 2^-53, which is uniform in [0, 1)
+   and then
+       UNIFORM      : scale * (2*u(i) - 1)
+       FANIN_NORMAL : std * sqrt(-2*log(1 - u(2i))) * cos(2*pi*u(2i+1))   (Box-Muller)
+*/
+
+#define SPLITMIX64_GAMMA 0x9e3779b97f4a7c15ULL
+
+static inline double seeded_uniform(uint64_t stream, uint64_t j) {
+	return (double)(splitmix64(stream + (j + 1) * SPLITMIX64_GAMMA) >> 11) * (1.0 / 9007199254740992.0);
+}
+
+// Returns the fan-in used by INIT_DISTRIBUTION_FANIN_NORMAL, like
+// `make_initial_value` in bin/auto_init_server_params.py, or -1 for the biases.
+int get_param_fan_in(param_t * param) {
+	switch (param->kind) {
+		case CONV_FILTER_WEIGHTS:
+			return param->shape[1];
+		case FULLY_CONNECTED_WEIGHTS:
+			return param->shape[0];
+		default:
+			return -1;
+	}
+}
+
+int fill_seeded_init_values(float * dst, int nbr_elements, int distribution, double scale, double std, uint64_t seed) {
+
+	uint64_t stream = splitmix64(seed + SPLITMIX64_GAMMA);
+
+	switch (distribution) {
+		case INIT_DISTRIBUTION_ZERO:
+			memset(dst, 0, nbr_elements * sizeof(float));
+			return 0;
+
+		case INIT_DISTRIBUTION_UNIFORM:
+			for (int i = 0; i < nbr_elements; i++) {
+				dst[i] = (float)(scale * (2.0 * seeded_uniform(stream, (uint64_t)i) - 1.0));
+			}
+			return 0;
+
+		case INIT_DISTRIBUTION_FANIN_NORMAL:
+			for (int i = 0; i < nbr_elements; i++) {
+				double u1 = seeded_uniform(stream, 2*(uint64_t)i);
+				double u2 = seeded_uniform(stream, 2*(uint64_t)i + 1);
+				dst[i] = (float)(std * sqrt(-2.0 * log(1.0 - u1)) * cos(2.0 * M_PI * u2));
+			}
+			return 0;
+
+		default:
+			return -1;
+	}
+}
+
+int init_param_seeded(param_t * param, int distribution, double scale, uint64_t seed) {
+
+	double std = 0.0;
+	if (distribution == INIT_DISTRIBUTION_FANIN_NORMAL) {
+		int fan_in = get_param_fan_in(param);
+		if (fan_in <= 0) {
+			printf("seeded_init.c - pthread #%lu: Error. Param %s doesn't have the kind of a W, so it has no fan-in.\n", (size_t)pthread_self(), param->name);
+			return -1;
+		}
+		std = scale * sqrt(2.0 / fan_in);
+	} else if (distribution != INIT_DISTRIBUTION_ZERO && distribution != INIT_DISTRIBUTION_UNIFORM) {
+		printf("seeded_init.c - pthread #%lu: Error. Unknown distribution %d for param %s.\n", (size_t)pthread_self(), distribution, param->name);
+		return -1;
+	}
+
+	int nbr_elements = param->shape[0] * param->shape[1] * param->shape[2] * param->shape[3];
+
+	stripe_mask_t mask = lock_param_all(param, true);
+	int status = fill_seeded_init_values((float *)param->data, nbr_elements, distribution, scale, std, seed);
+	bump_param_version(param);
+	unlock_param_stripes(param, mask);
+
+	return status;
+}
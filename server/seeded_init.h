@@ -0,0 +1,16 @@
+#ifndef __SEEDED_INIT_H__
+#define __SEEDED_INIT_H__
+
+#include <stdint.h>
+#include "common.h"
+
+/* The distributions of MSG_TYPE_INIT_PARAM. */
+#define INIT_DISTRIBUTION_ZERO 0         /* all zeros, `scale` is ignored */
+#define INIT_DISTRIBUTION_UNIFORM 1      /* uniform in [-scale, scale) */
+#define INIT_DISTRIBUTION_FANIN_NORMAL 2 /* normal with std scale*sqrt(2/fan_in), only for weights */
+
+int get_param_fan_in(param_t * param);
+int fill_seeded_init_values(float * dst, int nbr_elements, int distribution, double scale, double std, uint64_t seed);
+int init_param_seeded(param_t * param, int distribution, double scale, uint64_t seed);
+
+#endif
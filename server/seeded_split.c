@@ -0,0 +1,278 @@
+
+#include <string.h>
+#include <stdlib.h>
+#include <stdio.h>
+#include <stdint.h>
+
+#include "common.h"
+#include "handler.h"
+#include "seeded_split.h"
+
+/* Generates the splits of `SplitPlan.sample_seeded` on the server,
+   from the seed and the dropout probabilities alone.
+   See distdrop/client/sample_dropout_indices.py, which has to stay
+   bit-identical with this.
+
+   Every (seed, layer_number, axis) has its own stream, with axis 0 for IN
+   and axis 1 for OUT. Every unit i of that axis gets a 64-bit key
+       key_i = splitmix64(stream + (i+1)*SPLITMIX64_GAMMA)
+   and we keep the N_kept units with the smallest keys (ties going to the
+   smallest i), sorted in increasing order.
+*/
+
+#define SPLITMIX64_GAMMA 0x9e3779b97f4a7c15ULL
+
+uint64_t splitmix64(uint64_t z) {
+	z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+	z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+	return z ^ (z >> 31);
+}
+
+typedef struct _keyed_index_t {
+	uint64_t key;
+	int index;
+} keyed_index_t;
+
+static int compare_keyed_index(const void * a, const void * b) {
+	const keyed_index_t * x = (const keyed_index_t *)a;
+	const keyed_index_t * y = (const keyed_index_t *)b;
+	if (x->key != y->key) { return (x->key < y->key) ? -1 : 1; }
+	return (x->index < y->index) ? -1 : (x->index > y->index);
+}
+
+static int compare_int(const void * a, const void * b) {
+	int x = *(const int *)a;
+	int y = *(const int *)b;
+	return (x < y) ? -1 : (x > y);
+}
+
+// Writes the kept indices into `kept`, which has room for N of them.
+// Returns how many were kept, or -1.
+int sample_seeded_kept_indices(int N, double p, uint64_t seed, int layer_number, int axis, int * kept) {
+
+	if (p <= 0.0) {
+		for (int i = 0; i < N; i++) { kept[i] = i; }
+		return N;
+	}
+
+	// same rounding as N-int(N*p) in python
+	int N_kept = N - (int)(N * p);
+
+	keyed_index_t * keyed = (keyed_index_t *)malloc((N + 1) * sizeof(keyed_index_t));
+	if (keyed == NULL) { return -1; }
+
+	uint64_t stream = splitmix64(seed + (uint64_t)(2*layer_number + axis + 1) * SPLITMIX64_GAMMA);
+	for (int i = 0; i < N; i++) {
+		keyed[i].key = splitmix64(stream + (uint64_t)(i + 1) * SPLITMIX64_GAMMA);
+		keyed[i].index = i;
+	}
+	qsort(keyed, N, sizeof(keyed_index_t), compare_keyed_index);
+
+	for (int i = 0; i < N_kept; i++) { kept[i] = keyed[i].index; }
+	qsort(kept, N_kept, sizeof(int), compare_int);
+
+	free(keyed);
+	return N_kept;
+}
+
+/* The "W" without suffix of every layer, like in `SplitPlan.L_layers`. */
+typedef struct _seeded_layer_t {
+	int layer_number;
+	int kind;
+	int N[2];        // (IN, OUT)
+	int S[2];
+	int * indices[2];
+} seeded_layer_t;
+
+static int compare_seeded_layer(const void * a, const void * b) {
+	const seeded_layer_t * x = (const seeded_layer_t *)a;
+	const seeded_layer_t * y = (const seeded_layer_t *)b;
+	return (x->layer_number < y->layer_number) ? -1 : (x->layer_number > y->layer_number);
+}
+
+// Same thing as `analyze_param_name` in python.
+// Parses "layer_17_W_momentum" into (17, "W", true).
+static int analyze_param_name(const char * name, int * layer_number, char * role, bool * has_extra) {
+	int pos = 0;
+	if (sscanf(name, "layer_%d_%n", layer_number, &pos) != 1 || pos == 0) { return -1; }
+
+	int len = strcspn(name + pos, "_");
+	if (PARAM_NAME_LENGTH <= len) { return -1; }
+	memcpy(role, name + pos, len);
+	role[len] = '\0';
+	*has_extra = (name[pos + len] == '_');
+	return 0;
+}
+
+static seeded_layer_t * find_seeded_layer(seeded_layer_t * layers, int nbr_layers, int layer_number) {
+	for (int i = 0; i < nbr_layers; i++) {
+		if (layers[i].layer_number == layer_number) { return &layers[i]; }
+	}
+	return NULL;
+}
+
+static int * copy_indices(int * indices, int S) {
+	// one more int so that we never malloc 0 bytes
+	int * copy = (int *)malloc((S + 1) * sizeof(int));
+	if (copy != NULL) { memcpy(copy, indices, S * sizeof(int)); }
+	return copy;
+}
+
+/* Fills `split` with one entry for every parameter, in the order of
+   `global_param_list` (which is the order of MSG_TYPE_LIST_ALL_PARAMS_DESC).
+   The suffix variables (ex : "layer_0_W_momentum") get the same indices
+   as their root variable, like with `SplitPlan.assemble`.
+   Returns 0, or -1 with `split` left for `free_registered_split`.
+*/
+int generate_seeded_split(param_t * global_param_list, uint64_t seed, seeded_prob_pair_t * pairs, int nbr_pairs, registered_split_t * split) {
+
+	int nbr_params = 0;
+	for (param_t * param = global_param_list; param != NULL; param = param->next) { nbr_params++; }
+
+	int status = -1;
+	int nbr_layers = 0;
+	int layer_number = 0;
+	char role[PARAM_NAME_LENGTH];
+	bool has_extra = false;
+	int just_the_zero_index[1] = {0};
+
+	seeded_layer_t * layers = (seeded_layer_t *)calloc(nbr_params + 1, sizeof(seeded_layer_t));
+	split->nbr_entries = nbr_params;
+	split->entries = (registered_slice_t *)calloc(nbr_params + 1, sizeof(registered_slice_t));
+	if (layers == NULL || split->entries == NULL) { goto done; }
+
+	for (param_t * param = global_param_list; param != NULL; param = param->next) {
+		if (analyze_param_name(param->name, &layer_number, role, &has_extra) != 0) {
+			printf("seeded_split.c - pthread #%lu: Error. Failed to get the layer number from %s.\n", (size_t)pthread_self(), param->name);
+			goto done;
+		}
+		if (has_extra || strcmp(role, "W") != 0) { continue; }
+
+		seeded_layer_t * layer = &layers[nbr_layers++];
+		layer->layer_number = layer_number;
+		layer->kind = param->kind;
+		if (param->kind == CONV_FILTER_WEIGHTS) {
+			// (OUT, IN, H, W)
+			layer->N[0] = param->shape[1];
+			layer->N[1] = param->shape[0];
+		} else if (param->kind == FULLY_CONNECTED_WEIGHTS) {
+			// (IN, OUT, 1, 1)
+			layer->N[0] = param->shape[0];
+			layer->N[1] = param->shape[1];
+		} else {
+			printf("seeded_split.c - pthread #%lu: Error. Param %s doesn't have the kind of a W.\n", (size_t)pthread_self(), param->name);
+			goto done;
+		}
+
+		seeded_prob_pair_t * pair = NULL;
+		for (int i = 0; i < nbr_pairs; i++) {
+			if (pairs[i].layer_number == layer_number) { pair = &pairs[i]; }
+		}
+		if (pair == NULL) {
+			printf("seeded_split.c - pthread #%lu: Error. Missing the dropout probabilities for layer_%d.\n", (size_t)pthread_self(), layer_number);
+			goto done;
+		}
+
+		for (int k = 0; k < 2; k++) {
+			if (pair->p[k] < 0.0 || 1.0 < pair->p[k]) {
+				printf("seeded_split.c - pthread #%lu: Error. Got dropout probability %f for layer_%d.\n", (size_t)pthread_self(), pair->p[k], layer_number);
+				goto done;
+			}
+			layer->indices[k] = (int *)malloc((layer->N[k] + 1) * sizeof(int));
+			if (layer->indices[k] == NULL) { goto done; }
+			layer->S[k] = sample_seeded_kept_indices(layer->N[k], pair->p[k], seed, layer_number, k, layer->indices[k]);
+			if (layer->S[k] < 0) { goto done; }
+		}
+	}
+
+	// The junctions between consecutive layers, like in `SplitPlan`.
+	// The units coming OUT of a layer are the units going IN the next one.
+	qsort(layers, nbr_layers, sizeof(seeded_layer_t), compare_seeded_layer);
+	for (int i = 0; i + 1 < nbr_layers; i++) {
+		seeded_layer_t * layer = &layers[i];
+		seeded_layer_t * layer_next = &layers[i+1];
+		int c = 1;
+
+		if (layer->kind == FULLY_CONNECTED_WEIGHTS && layer_next->kind == CONV_FILTER_WEIGHTS) {
+			printf("seeded_split.c - pthread #%lu: Error. FULLY_CONNECTED -> CONV_FILTER not implemented.\n", (size_t)pthread_self());
+			goto done;
+		}
+		if (layer->kind == CONV_FILTER_WEIGHTS && layer_next->kind == FULLY_CONNECTED_WEIGHTS) {
+			// Every filter coming out of the convolution feeds `c` consecutive
+			// units at the entrance of the fully-connected section.
+			c = layer_next->N[0] / layer->N[1];
+			if (c * layer->N[1] != layer_next->N[0]) {
+				printf("seeded_split.c - pthread #%lu: Error. Layer_%d has %d filters coming out but layer_%d has %d units coming in.\n",
+					(size_t)pthread_self(), layer->layer_number, layer->N[1], layer_next->layer_number, layer_next->N[0]);
+				goto done;
+			}
+		}
+
+		free(layer_next->indices[0]);
+		layer_next->indices[0] = (int *)malloc((layer->S[1] * c + 1) * sizeof(int));
+		if (layer_next->indices[0] == NULL) { goto done; }
+		for (int s = 0; s < layer->S[1]; s++) {
+			for (int j = 0; j < c; j++) {
+				layer_next->indices[0][s*c + j] = layer->indices[1][s]*c + j;
+			}
+		}
+		layer_next->S[0] = layer->S[1] * c;
+	}
+
+	int e = 0;
+	for (param_t * param = global_param_list; param != NULL; param = param->next, e++) {
+		registered_slice_t * registered = &split->entries[e];
+		analyze_param_name(param->name, &layer_number, role, &has_extra);
+
+		seeded_layer_t * layer = find_seeded_layer(layers, nbr_layers, layer_number);
+		if (layer == NULL) {
+			printf("seeded_split.c - pthread #%lu: Error. Param %s has no W for its layer.\n", (size_t)pthread_self(), param->name);
+			goto done;
+		}
+
+		// Pointers to the indices for the axes 0 and 1 of the parameter,
+		// before we copy them into the entry.
+		int * indices[2];
+		int S[2];
+		if (strcmp(role, "W") == 0 && layer->kind == CONV_FILTER_WEIGHTS) {
+			indices[0] = layer->indices[1]; S[0] = layer->S[1];
+			indices[1] = layer->indices[0]; S[1] = layer->S[0];
+		} else if (strcmp(role, "W") == 0) {
+			indices[0] = layer->indices[0]; S[0] = layer->S[0];
+			indices[1] = layer->indices[1]; S[1] = layer->S[1];
+		} else if (strcmp(role, "b") == 0 && layer->kind == CONV_FILTER_WEIGHTS) {
+			indices[0] = layer->indices[1]; S[0] = layer->S[1];
+			indices[1] = just_the_zero_index; S[1] = 1;
+		} else if (strcmp(role, "b") == 0) {
+			indices[0] = just_the_zero_index; S[0] = 1;
+			indices[1] = layer->indices[1]; S[1] = layer->S[1];
+		} else {
+			printf("seeded_split.c - pthread #%lu: Error. Param %s is neither a W nor a b.\n", (size_t)pthread_self(), param->name);
+			goto done;
+		}
+
+		for (int k = 0; k < 2; k++) {
+			registered->S[k] = S[k];
+			registered->D[k] = param->shape[k];
+			if (SLICE_MAX_INDEX < S[k] || param->shape[k] < S[k]) {
+				printf("seeded_split.c - pthread #%lu: Error. The split for param %s has S[%d]:%d for D[%d]:%d.\n", (size_t)pthread_self(), param->name, k, S[k], k, param->shape[k]);
+				goto done;
+			}
+			if (validate_slice_indices(indices[k], S[k], param->shape[k], k, param->name) == -1) { goto done; }
+			registered->indices[k] = copy_indices(indices[k], S[k]);
+			if (registered->indices[k] == NULL) { goto done; }
+		}
+	}
+
+	status = 0;
+
+done:
+	if (layers != NULL) {
+		for (int i = 0; i < nbr_layers; i++) {
+			free(layers[i].indices[0]);
+			free(layers[i].indices[1]);
+		}
+		free(layers);
+	}
+	return status;
+}
@@ -0,0 +1,17 @@
+#ifndef __SEEDED_SPLIT_H__
+#define __SEEDED_SPLIT_H__
+
+#include <stdint.h>
+#include "common.h"
+
+/* The dropout probabilities of one layer, as sent with MSG_TYPE_REGISTER_SEEDED_SPLIT. */
+typedef struct _seeded_prob_pair_t {
+	int layer_number;
+	double p[2]; // (IN, OUT)
+} seeded_prob_pair_t;
+
+uint64_t splitmix64(uint64_t z);
+int sample_seeded_kept_indices(int N, double p, uint64_t seed, int layer_number, int axis, int * kept);
+int generate_seeded_split(param_t * global_param_list, uint64_t seed, seeded_prob_pair_t * pairs, int nbr_pairs, registered_split_t * split);
+
+#endif
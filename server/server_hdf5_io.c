@@ -2,6 +2,7 @@
 #include <assert.h>
 #include "server_hdf5_io.h"
 #include "common.h"
+#include "param_locks.h"
 
 /* Based on
    https://www.hdfgroup.org/HDF5/examples/api18-c.html
@@ -14,7 +15,7 @@
 
 
 
-// Same as save_to_hdf5, but locks a parameter's mutex before reading it.
+// Same as save_to_hdf5, but takes the read locks of all the rows of a parameter before reading it.
 herr_t locking_save_to_hdf5(param_t * head, char * hdf5_path) {
 
     /* takes a linked list that starts with `head`
@@ -34,7 +35,7 @@ herr_t locking_save_to_hdf5(param_t * head, char * hdf5_path) {
     hsize_t dims[4];
     param_t * p = head; // better name for traveling pointer
     while(p) {
-        pthread_mutex_lock (&p->mutex);
+        stripe_mask_t mask = lock_param_all(p, false);
         for (int k=0; k < 4; k++) {
             dims[k] = p->shape[k];
         }
@@ -57,7 +58,7 @@ herr_t locking_save_to_hdf5(param_t * head, char * hdf5_path) {
         status = H5Pclose(dcpl);
         status = H5Dclose(dset);
         status = H5Sclose(space);
-        pthread_mutex_unlock (&p->mutex);
+        unlock_param_stripes(p, mask);
         p = p->next;
     }
 
@@ -94,9 +95,10 @@ void locking_hdf5_load_params(param_t ** params, const char * path_to_json, cons
     printf("number of objects in the root group: %llu\n", numInGrp);
     while(*params) {
         printf("locking_hdf5_load_params : trying param %s.\n", (*params)->name);
-        pthread_mutex_lock(&(*params)->mutex);
+        stripe_mask_t mask = lock_param_all(*params, true);
         param_from_hdf5_dataset(main_group, *params);
-        pthread_mutex_unlock(&(*params)->mutex);
+        bump_param_version(*params);
+        unlock_param_stripes(*params, mask);
         (*params) = (*params)->next;
     }
 
@@ -1,5 +1,7 @@
 
 #include <pthread.h>
+#include <stdint.h>
+#include <string.h>
 
 #include "common.h"
 
@@ -7,18 +9,100 @@
     Note that you'll have problem when it comes to float16
     because it's not supported in C.
     http://stackoverflow.com/questions/3026441/float32-to-float16
+
+    We store everything as float32 on the server, and float16 only
+    exists on the wire. The two functions below do the conversion
+    on the bits directly. They round to nearest even, just like numpy
+    does with `astype(np.float16)`, so the client and the server agree.
 */
 
+static inline uint16_t float32_to_float16(float value) {
+
+	uint32_t f;
+	memcpy(&f, &value, sizeof(f));
+
+	uint32_t sign = (f >> 16) & 0x8000;
+	uint32_t abs_f = f & 0x7fffffff;
+
+	if (0x7f800000 <= abs_f) {
+		/* inf stays inf, and nan stays nan */
+		return sign | 0x7c00 | (0x7f800000 < abs_f ? 0x0200 : 0);
+	}
+
+	if (0x477ff000 <= abs_f) {
+		/* 65520 and above rounds to inf in float16 */
+		return sign | 0x7c00;
+	}
+
+	if (abs_f < 0x38800000) {
+		/* smaller than the smallest normal float16, so we get a subnormal (or zero) */
+		if (abs_f < 0x33000000) {
+			return sign;
+		}
+		uint32_t mantissa = (abs_f & 0x007fffff) | 0x00800000;
+		int shift = 126 - (int)(abs_f >> 23);
+		uint32_t half = mantissa >> shift;
+		uint32_t remainder = mantissa & ((1u << shift) - 1);
+		uint32_t halfway = 1u << (shift - 1);
+		if (halfway < remainder || (remainder == halfway && (half & 1))) {
+			half++;
+		}
+		return sign | half;
+	}
+
+	/* normal case : rebias the exponent and round the mantissa from 23 to 10 bits */
+	uint32_t half = (abs_f - 0x38000000) >> 13;
+	uint32_t remainder = abs_f & 0x1fff;
+	if (0x1000 < remainder || (remainder == 0x1000 && (half & 1))) {
+		half++;
+	}
+	return sign | half;
+}
+
+static inline float float16_to_float32(uint16_t h) {
+
+	uint32_t sign = ((uint32_t)h & 0x8000) << 16;
+	uint32_t exponent = (h >> 10) & 0x1f;
+	uint32_t mantissa = h & 0x3ff;
+	uint32_t f;
+
+	if (exponent == 0) {
+		if (mantissa == 0) {
+			f = sign;
+		} else {
+			/* subnormal float16 becomes a normal float32 */
+			exponent = 113;
+			while (!(mantissa & 0x400)) {
+				mantissa <<= 1;
+				exponent--;
+			}
+			mantissa &= 0x3ff;
+			f = sign | (exponent << 23) | (mantissa << 13);
+		}
+	} else if (exponent == 0x1f) {
+		f = sign | 0x7f800000 | (mantissa << 13);
+	} else {
+		f = sign | ((exponent + 112) << 23) | (mantissa << 13);
+	}
+
+	float value;
+	memcpy(&value, &f, sizeof(value));
+	return value;
+}
+
 /*  This is one version of out many.
     It's not clear that we want to spend time
     to copy/paste (or something more clever)
     so as to have all the variations in types
     as well as the variations where `nbr_subelements==1`
     allows us to skip one level of looping.
+
+    None of them lock anything. The caller holds the locks of the rows
+    of the slice (see `lock_param_slice` in param_locks.c), with the
+    read locks to extract and the write locks to commit.
    */
 
 int commit_slice_to_param_float32_to_float32(
-	pthread_mutex_t mutex,
 	slice_t * slice_ptr,
 	float * src,
 	float * dst,
@@ -27,9 +111,6 @@ int commit_slice_to_param_float32_to_float32(
 
 	//printf("Received call to commit_slice_to_param_float32_to_float32 with (alpha=%f, beta=%f).\n", alpha, beta);
 
-	// acquire mutex
-	pthread_mutex_lock(&mutex);
-
 	// TODO : decide whether you even want the possibility of
 	//        specifying 0 as dimensions. Why not use 1 at
 	//        every dimension that we don't care about ?
@@ -71,25 +152,17 @@ int commit_slice_to_param_float32_to_float32(
 		}
 	}
 
-	// release mutex
-	pthread_mutex_unlock(&mutex);
-
 	return 0;
 }
 
 
 
 int extract_slice_to_param_float32_to_float32(
-	pthread_mutex_t mutex,
 	slice_t * slice_ptr,
 	float * src,
 	float * dst,
 	int nbr_subelements) {
 
-	// acquire mutex
-	// (because we don't want someone to write to this param while we read its value)
-	pthread_mutex_lock(&mutex);
-
 	//printf("In extract_slice_to_param_float32_to_float32, nbr_subelements : %d\n", nbr_subelements);
 
 	for (int i = 0; i < slice_ptr->S[0]; i++) {
@@ -111,11 +184,130 @@ int extract_slice_to_param_float32_to_float32(
 		}
 	}
 
-	// release mutex
-	pthread_mutex_unlock(&mutex);
+	return 0;
+}
+
+
+
+/*  Same as `commit_slice_to_param_float32_to_float32`,
+    but the values sent by the client are float16.
+    The parameter itself is still stored as float32.
+*/
+int commit_slice_to_param_float16_to_float32(
+	slice_t * slice_ptr,
+	uint16_t * src,
+	float * dst,
+	int nbr_subelements,
+	float alpha, float beta ) {
+
+	for (int i = 0; i < slice_ptr->S[0]; i++) {
+		int indi = slice_ptr->indices[0][i];
+
+		for (int j = 0; j < slice_ptr->S[1]; j++) {
+			int indj = slice_ptr->indices[1][j];
+
+			int offset_dst = (indi*slice_ptr->D[1] + indj)*nbr_subelements;
+			int offset_src = (i*slice_ptr->S[1] + j)*nbr_subelements;
+
+			for (int k=0; k < nbr_subelements; k++) {
+				dst[offset_dst + k] = (float)(alpha * dst[offset_dst + k] + beta * float16_to_float32(src[offset_src + k]));
+			}
+		}
+	}
+
+	return 0;
+}
+
+
+
+/*  Same as `extract_slice_to_param_float32_to_float32`,
+    but the values sent back to the client are float16.
+*/
+int extract_slice_to_param_float32_to_float16(
+	slice_t * slice_ptr,
+	float * src,
+	uint16_t * dst,
+	int nbr_subelements) {
+
+	for (int i = 0; i < slice_ptr->S[0]; i++) {
+		int indi = slice_ptr->indices[0][i];
+
+		for (int j = 0; j < slice_ptr->S[1]; j++) {
+			int indj = slice_ptr->indices[1][j];
+
+			uint16_t * sub_dst = &dst[(i * slice_ptr->S[1] + j) * nbr_subelements];
+			float * sub_src = &src[(indi * slice_ptr->D[1] + indj) * nbr_subelements];
+			for (int s = 0; s < nbr_subelements; s++) {
+				sub_dst[s] = float32_to_float16(sub_src[s]);
+			}
+		}
+	}
+
+	return 0;
+}
+
+
+
+/*  For MSG_TYPE_EXCHANGE_PARAM. Does what `commit_slice_to_param_float32_to_float32`
+    does, and then writes the updated values of the slice back into `values`,
+    in place of what the client sent. The caller holds the write locks of the rows
+    for the whole thing, so the client gets its own update and nothing that came after it.
+*/
+int exchange_slice_with_param_float32(
+	slice_t * slice_ptr,
+	float * values,
+	float * param_data,
+	int nbr_subelements,
+	float alpha, float beta ) {
+
+	for (int i = 0; i < slice_ptr->S[0]; i++) {
+		int indi = slice_ptr->indices[0][i];
+
+		for (int j = 0; j < slice_ptr->S[1]; j++) {
+			int indj = slice_ptr->indices[1][j];
+
+			float * sub_param = &param_data[(indi * slice_ptr->D[1] + indj) * nbr_subelements];
+			float * sub_values = &values[(i * slice_ptr->S[1] + j) * nbr_subelements];
+
+			for (int k = 0; k < nbr_subelements; k++) {
+				float updated = (float)(alpha * sub_param[k] + beta * sub_values[k]);
+				sub_param[k] = updated;
+				sub_values[k] = updated;
+			}
+		}
+	}
 
 	return 0;
 }
 
 
 
+/*  Same as `exchange_slice_with_param_float32`, with float16 on the wire
+    in both directions.
+*/
+int exchange_slice_with_param_float16(
+	slice_t * slice_ptr,
+	uint16_t * values,
+	float * param_data,
+	int nbr_subelements,
+	float alpha, float beta ) {
+
+	for (int i = 0; i < slice_ptr->S[0]; i++) {
+		int indi = slice_ptr->indices[0][i];
+
+		for (int j = 0; j < slice_ptr->S[1]; j++) {
+			int indj = slice_ptr->indices[1][j];
+
+			float * sub_param = &param_data[(indi * slice_ptr->D[1] + indj) * nbr_subelements];
+			uint16_t * sub_values = &values[(i * slice_ptr->S[1] + j) * nbr_subelements];
+
+			for (int k = 0; k < nbr_subelements; k++) {
+				float updated = (float)(alpha * sub_param[k] + beta * float16_to_float32(sub_values[k]));
+				sub_param[k] = updated;
+				sub_values[k] = float32_to_float16(updated);
+			}
+		}
+	}
+
+	return 0;
+}